@@ -0,0 +1,200 @@
+'''
+Synthetic, seeded inputs for the benchmarks, so every run measures the same work.
+Also stubs for every host probe, so the full component test can be benchmarked
+without SEV hardware, root or the external tools installed.
+'''
+import contextlib
+import ctypes
+import random
+import cpuid_table
+import command_runner
+import component_tests
+import host_probes
+import ioctl
+import msr_reader
+import ovmf_functions
+import sev_emulator
+
+# Seed used for every generated input
+SEED = 0x5EC
+# Size of one page of guest memory
+PAGE_SIZE = 4096
+
+# Package manager lines the OVMF version parser sees on the supported distros
+OVMF_PACKAGE_LINES = [
+    "ii  ovmf           2022.02-3ubuntu0.22.04.1  all  UEFI firmware for 64-bit x86 virtual machines",
+    "ii  ovmf           2023.11-6ubuntu3          all  UEFI firmware for 64-bit x86 virtual machines",
+    "ii  ovmf           0~20191122.bd85bf54-2ubuntu3.5 all  UEFI firmware for 64-bit x86 VMs",
+    "ii  ovmf           2020.11-2+deb11u1         all  UEFI firmware for 64-bit x86 virtual machines",
+    "edk2-ovmf-20230524-3.fc38.noarch",
+    "edk2-ovmf-20220126gitbb1bba3d77-6.el9_2.noarch",
+    "ovmf-202308-1.1.noarch",
+    "qemu-ovmf-x86_64-202202-150400.5.5.1.noarch",
+]
+
+# Version lines the kernel, libvirt and QEMU version parser sees
+VERSION_LINES = [
+    "6.8.0-45-generic", "5.15.0-122-generic", "6.11.0-0.rc5.20240830git20371ba12063.47.fc42.x86_64",
+    "4.18.0-553.16.1.el8_10.x86_64", "5.14.0-427.33.1.el9_4.x86_64", "6.10.7-1-default",
+    "8.0.0", "9.0.0", "10.6.0", "4.5", "6.2.0 (Debian 1:6.2+dfsg-2ubuntu6.22)",
+    "8.2.2 (Debian 1:8.2.2+ds-0ubuntu1.2)", "7.2.0 (qemu-kvm-7.2.0-14.el9_2.11)",
+]
+
+
+def get_random_bytes(size:int) -> bytes:
+    '''
+    Get size bytes of seeded random data, like a page of encrypted guest memory.
+    '''
+    return random.Random(SEED).randbytes(size)
+
+
+def get_mapped_pages(pages:int):
+    '''
+    Get a buffer of pages of random data standing in for guest RAM in this process,
+    and the address of every page. Keep the buffer alive while the addresses are used.
+    '''
+    memory = bytearray(get_random_bytes(pages * PAGE_SIZE))
+    base = ctypes.addressof((ctypes.c_char * len(memory)).from_buffer(memory))
+    return memory, [base + index * PAGE_SIZE for index in range(pages)]
+
+
+def get_maps_lines(entries:int, machine_memory:int) -> list:
+    '''
+    Get the lines of a /proc/PID/maps file with the given number of mappings.
+    The guest RAM mapping is the last one, so the whole file has to be scanned.
+    '''
+    generator = random.Random(SEED)
+    lines = []
+    address = 0x55d0c0000000
+    for index in range(entries - 1):
+        size = generator.choice((0x1000, 0x2000, 0x21000, 0x200000, 0x400000))
+        lines.append(f"{address:x}-{address + size:x} rw-p 00000000 00:00 0 "
+                     f"{'/usr/lib/x86_64-linux-gnu/libc.so.6' if index % 7 == 0 else ''}")
+        address += size + 0x1000
+    lines.append(f"{address:x}-{address + machine_memory:x} rw-s 00000000 00:01 2050 "
+                 "/memfd:pc.ram (deleted)")
+    lines.append('')
+    return lines
+
+
+def get_numa_guest(entries:int, nodes:int, node_memory:int):
+    '''
+    Get the QEMU arguments and /proc/PID/maps lines of a guest with one memfd backend per
+    NUMA node. The backends are mapped after entries other mappings.
+    '''
+    argv = ['qemu-system-x86_64', '-m', f'{nodes * node_memory // 1048576}M']
+    lines = get_maps_lines(entries + 1, node_memory)[:-2]
+    address = 0x7f0000000000
+    for node in range(nodes):
+        argv += ['-object', f'memory-backend-memfd,id=mem{node},size={node_memory}',
+                 '-numa', f'node,nodeid={node},memdev=mem{node}']
+        lines.append(f"{address:x}-{address + node_memory:x} rw-s 00000000 00:01 {2050 + node} "
+                     "/memfd:memory-backend-memfd (deleted)")
+        address += node_memory + 0x200000
+    lines.append('')
+    return argv, lines
+
+
+def get_vm_command(index:int) -> str:
+    '''
+    Get the command line of a running QEMU guest.
+    '''
+    return (f"qemu-system-x86_64 -enable-kvm -cpu EPYC-v4 -machine q35 -smp 4 -m {2048 + index} "
+            f"-machine memory-encryption=sev0 -object sev-guest,id=sev0,cbitpos=51,"
+            f"reduced-phys-bits=1 -drive if=pflash,format=raw,unit=0,file=/vms/{index}/OVMF_CODE.fd "
+            f"-drive file=/vms/{index}/disk.qcow2,if=none,id=disk0,format=qcow2 -nographic")
+
+
+def get_ps_lines(vms:int) -> list:
+    '''
+    Get the qemu lines of ps axo pid,command for the given number of running guests.
+    '''
+    return [f"{10000 + index} {get_vm_command(index)}" for index in range(vms)]
+
+
+class FakeMsrReader(msr_reader.MsrReader):
+    '''
+    MSR reader answering from fixed values, the same on every cpu.
+    '''
+    def __init__(self, values:dict, cpus:list):
+        super().__init__()
+        self.values = values
+        self.cpus = cpus
+
+    def read(self, msr:int, cpu:int = 0) -> int:
+        if msr not in self.values:
+            raise OSError("MSR not available")
+        return self.values[msr]
+
+    def read_matrix(self, msrs, cpus=None) -> dict:
+        msrs = tuple(msrs)
+        return {cpu: tuple(self.read(msr, cpu) for msr in msrs) for cpu in cpus or self.cpus}
+
+
+def get_milan_cpuid_table(cpus:int = 64) -> cpuid_table.CpuidTable:
+    '''
+    Get a cpuid snapshot of a two socket EPYC Milan host with every SEV feature.
+    '''
+    leaves = [
+        (0x10, 0x68747541, 0x444d4163, 0x69746e65),
+        (0x00A00F11, 0x00000800, 0x7ED8320B, 0x178BFBFF),
+        (0x80000023, 0x68747541, 0x444d4163, 0x69746e65),
+        (0x00A00F11, 0x40000000, 0x75C237FF, 0x2FD3FBFF),
+        (0x00003030, 0x111EF657, 0x0000707F, 0x00010000),
+        (0x0001B7FF, 0x0000416F, 0x000001FD, 0x00000064),
+    ]
+    rows = {cpu: leaves for cpu in range(cpus)}
+    return cpuid_table.CpuidTable(range(cpus), [cpu * 2 // cpus for cpu in range(cpus)], rows)
+
+
+@contextlib.contextmanager
+def stubbed_probes(system_os:str = 'fedora', cpus:int = 64):
+    '''
+    Answer every host probe the component test uses from synthetic values:
+    the cpuid snapshot, MSRs, /dev/sev (emulated), procfs and the external commands.
+    Everything is put back when the block ends.
+    '''
+    saved_table = cpuid_table._table # pylint: disable=protected-access
+    saved_reader = msr_reader._reader # pylint: disable=protected-access
+    saved_device = ioctl.get_sev_device()
+    saved_probes = {name: getattr(host_probes, name) for name in (
+        'read_kernel_messages', 'read_kernel_events', 'read_kernel_config',
+        'get_virtualization_type', 'get_kernel_release', 'read_os_release')}
+    cpuid_table._table = get_milan_cpuid_table(cpus) # pylint: disable=protected-access
+    msr_reader._reader = FakeMsrReader({ # pylint: disable=protected-access
+        msr_reader.MSR_SYSCFG: (1 << 23) | (1 << 24),
+        msr_reader.MSR_RMP_BASE: 0x3EE00000,
+        msr_reader.MSR_RMP_END: 0x3F5FFFFF}, list(range(cpus)))
+    sev_emulator.install_emulated_device(api_major=1, api_minor=55)
+    host_probes.read_kernel_messages = lambda: [
+        "Linux version 6.8.0", "AMD Memory Encryption Features active: SME SEV SEV-ES SEV-SNP"]
+    host_probes.read_kernel_events = lambda: []
+    host_probes.read_kernel_config = lambda names: {name: 'y' for name in names}
+    host_probes.get_virtualization_type = lambda: 'AMD-V'
+    host_probes.get_kernel_release = lambda: '6.8.0-45-generic'
+    host_probes.read_os_release = lambda: {'ID': system_os, 'VERSION_ID': '38'}
+    try:
+        yield
+    finally:
+        cpuid_table._table = saved_table # pylint: disable=protected-access
+        msr_reader._reader = saved_reader # pylint: disable=protected-access
+        ioctl.set_sev_device(saved_device)
+        for name, probe in saved_probes.items():
+            setattr(host_probes, name, probe)
+
+
+def preload_command_results(system_os:str = 'fedora'):
+    '''
+    Put the output of every external version probe in the command runner results,
+    so the package checks don't start any process.
+    '''
+    outputs = {
+        tuple(component_tests.LIBVIRT_VERSION_COMMAND): "9.0.0\n",
+        tuple(component_tests.get_qemu_version_command(system_os).split()):
+            "QEMU emulator version 8.2.2 (qemu-8.2.2-1.fc38)\n",
+        tuple(ovmf_functions.get_default_ovmf_command(system_os).split()):
+            "edk2-ovmf-20230524-3.fc38.noarch\n",
+        tuple(ovmf_functions.FIND_FV_COMMAND): "",
+    }
+    command_runner.add_results(command_runner.CommandResult(argv, 0, stdout, '', None)
+                               for argv, stdout in outputs.items())
@@ -0,0 +1,213 @@
+'''
+Benchmarks for the tool's hot paths. Each benchmark prepares its input once and
+returns the function to time with the amount of work one call does, so the runner
+can report a throughput (bytes, lines or runs per second).
+'''
+import contextlib
+import ctypes
+import io
+import mmap
+import os
+import zlib
+import command_runner
+import component_tests
+import encryption_test
+import guest_memory
+import local_vm_test
+import memory_reader
+import ovmf_functions
+import fixtures
+
+
+class Benchmark:
+    '''
+    One benchmark: a name, the unit of work and a setup function returning
+    (function to time, units of work per call).
+    full benchmarks only run with --full, they take too long for every change.
+    '''
+    def __init__(self, name:str, unit:str, setup, full:bool = False):
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+        self.full = full
+
+
+def entropy(size:int):
+    '''
+    Entropy test on size bytes of random (encrypted looking) memory.
+    '''
+    memory = fixtures.get_random_bytes(size)
+    return lambda: encryption_test.entropy_encryption_test(memory), size
+
+
+def sampled_read(pages:int, readv:bool):
+    '''
+    Read pages scattered over 64 MiB of this process into one reused buffer,
+    with process_vm_readv or with pread on /proc/PID/mem.
+    '''
+    memory, addresses = fixtures.get_mapped_pages(16384)
+    sample = addresses[::len(addresses) // pages][:pages]
+    buffer = bytearray(pages * fixtures.PAGE_SIZE)
+    process_memory = memory_reader.ProcessMemory(os.getpid())
+    process_memory.use_readv = readv
+
+    def run():
+        process_memory.read_pages(sample, buffer=buffer)
+        assert memory
+    return run, pages
+
+
+def residency_scan(size:int):
+    '''
+    Build the residency map of a size bytes mapping of this process with a quarter of
+    its pages touched, and sample the resident pages.
+    '''
+    memory = mmap.mmap(-1, size)
+    for offset in range(0, size, 4 * fixtures.PAGE_SIZE):
+        memory[offset] = 1
+    base = ctypes.addressof(ctypes.c_char.from_buffer(memory))
+    top_address, bot_address = f"{base:x}", f"{base + size:x}"
+
+    def run():
+        residency = memory_reader.read_residency(os.getpid(), top_address, bot_address)
+        # The mapping is kept alive by the closure
+        assert len(residency.sample(memory_reader.SAMPLE_PAGES)) == memory_reader.SAMPLE_PAGES
+        assert not memory.closed
+    return run, size // fixtures.PAGE_SIZE
+
+
+def probe_sample(size:int):
+    '''
+    Sample the resident pages of a size bytes mapping of this process with a quarter of
+    its pages touched, reading only the pagemap entries of the candidate pages.
+    '''
+    memory = mmap.mmap(-1, size)
+    for offset in range(0, size, 4 * fixtures.PAGE_SIZE):
+        memory[offset] = 1
+    base = ctypes.addressof(ctypes.c_char.from_buffer(memory))
+
+    def run():
+        sample = memory_reader.probe_resident_pages(os.getpid(), [(base, base + size)])
+        # The mapping is kept alive by the closure
+        assert len(sample) == memory_reader.SAMPLE_PAGES
+        assert not memory.closed
+    return run, size // fixtures.PAGE_SIZE
+
+
+def sharded_scan(size:int, regions:int):
+    '''
+    Checksum all the resident memory of a fully touched size bytes mapping of this
+    process, split in regions scanned by workers pinned to their NUMA node.
+    '''
+    memory = mmap.mmap(-1, size)
+    for offset in range(0, size, fixtures.PAGE_SIZE):
+        memory[offset] = 1
+    base = ctypes.addressof(ctypes.c_char.from_buffer(memory))
+    region_size = size // regions
+    guest = guest_memory.GuestMemory(
+        guest_memory.GuestRegion(f'mem{index}', base + index * region_size,
+                                 base + (index + 1) * region_size, '') for index in range(regions))
+    guest_memory.locate_nodes(os.getpid(), guest)
+
+    def scan(_, chunks):
+        # crc32 drops the GIL, the workers checksum in parallel
+        return sum(zlib.crc32(chunk) & 1 for chunk in chunks)
+
+    def run():
+        assert len(guest_memory.scan_guest_memory(os.getpid(), guest, scan,
+                                                  shard_size=region_size)) == regions
+        # The mapping is kept alive by the closure
+        assert not memory.closed
+    return run, size
+
+
+def maps_scan(entries:int):
+    '''
+    Find the guest RAM mapping at the end of a maps file.
+    '''
+    machine_memory = 8 * 1024 ** 3
+    lines = fixtures.get_maps_lines(entries, machine_memory)
+
+    def run():
+        top_address, _ = memory_reader.find_ram_in_maps(lines, str(machine_memory))
+        assert top_address, "guest RAM mapping not found"
+    return run, entries
+
+
+def guest_ram_scan(entries:int, nodes:int):
+    '''
+    Parse a maps file and find the RAM regions of a NUMA guest in it.
+    '''
+    node_memory = 4 * 1024 ** 3
+    argv, lines = fixtures.get_numa_guest(entries, nodes, node_memory)
+
+    def run():
+        entries = memory_reader.parse_maps(lines)
+        guest = guest_memory.match_regions(entries, guest_memory.get_memory_backends(argv))
+        assert guest.size == nodes * node_memory, "guest RAM regions not found"
+    return run, len(lines)
+
+
+def vm_lookup(vms:int):
+    '''
+    Build the running VM dictionary from ps output and look up every VM by its command.
+    '''
+    ps_lines = fixtures.get_ps_lines(vms)
+    commands = [fixtures.get_vm_command(index) for index in range(0, vms, max(vms // 100, 1))]
+
+    def run():
+        available_vms = local_vm_test.create_vm_dictionary(ps_lines)
+        for vm_command in commands:
+            assert local_vm_test.find_virtual_machine(vm_command, available_vms)
+    return run, vms
+
+
+def version_parsing(repeat:int):
+    '''
+    Parse the OVMF package and component version corpora.
+    '''
+    ovmf_lines = fixtures.OVMF_PACKAGE_LINES * repeat
+    version_lines = fixtures.VERSION_LINES * repeat
+
+    def run():
+        for line in ovmf_lines:
+            ovmf_functions.get_ovmf_version(line)
+        for line in version_lines:
+            component_tests.get_version_num(line)
+    return run, len(ovmf_lines) + len(version_lines)
+
+
+def component_test_run():
+    '''
+    Full component test for every feature against stubbed probes, with the
+    command results preloaded so no process is started.
+    '''
+    # Imported here, the tool module parses nothing at import but pulls in every check
+    import sev_component_test # pylint: disable=import-outside-toplevel
+
+    def run():
+        command_runner.clear_results()
+        fixtures.preload_command_results('fedora')
+        with fixtures.stubbed_probes('fedora'), contextlib.redirect_stdout(io.StringIO()):
+            sev_component_test.run_component_tests(
+                True, 'fedora', False, ['sev', 'sev-es', 'sev-snp', 'sme'], False, False)
+    return run, 1
+
+
+BENCHMARKS = [
+    Benchmark('entropy_4KiB', 'B', lambda: entropy(fixtures.PAGE_SIZE)),
+    Benchmark('entropy_1MiB', 'B', lambda: entropy(1024 ** 2)),
+    Benchmark('entropy_16MiB', 'B', lambda: entropy(16 * 1024 ** 2)),
+    Benchmark('entropy_256MiB', 'B', lambda: entropy(256 * 1024 ** 2), full=True),
+    Benchmark('entropy_1GiB', 'B', lambda: entropy(1024 ** 3), full=True),
+    Benchmark('sampled_read_256', 'pages', lambda: sampled_read(256, True)),
+    Benchmark('sampled_pread_256', 'pages', lambda: sampled_read(256, False)),
+    Benchmark('pagemap_1GiB', 'pages', lambda: residency_scan(1024 ** 3)),
+    Benchmark('pagemap_probe_1GiB', 'pages', lambda: probe_sample(1024 ** 3)),
+    Benchmark('numa_scan_256MiB', 'B', lambda: sharded_scan(256 * 1024 ** 2, 4)),
+    Benchmark('find_ram_in_maps_10k', 'lines', lambda: maps_scan(10000)),
+    Benchmark('guest_ram_10k', 'lines', lambda: guest_ram_scan(10000, 8)),
+    Benchmark('vm_lookup_1000', 'VMs', lambda: vm_lookup(1000)),
+    Benchmark('version_parsing', 'lines', lambda: version_parsing(100)),
+    Benchmark('run_component_tests', 'runs', component_test_run),
+]
@@ -0,0 +1,157 @@
+'''
+Run the hot path benchmarks and compare them to a baseline.
+Each benchmark is timed several times and the best time is kept, the throughput
+is compared to the one recorded in the baseline file and the run fails if a benchmark
+got slower than the threshold allows. Baselines are only meaningful on the machine
+they were recorded on, record a new one with --update-baseline.
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# The tool's modules import each other by their flat names
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIRECTORY), 'sev_component_test'))
+sys.path.insert(0, BENCHMARK_DIRECTORY)
+
+import hot_paths # pylint: disable=wrong-import-position
+
+# Default baseline file
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIRECTORY, 'baseline.json')
+# Fraction of the baseline throughput a benchmark may lose before it counts as a regression
+DEFAULT_THRESHOLD = 0.25
+# Number of timed runs of each benchmark, the best one is kept
+DEFAULT_REPEAT = 5
+
+
+def time_benchmark(function, repeat:int) -> float:
+    '''
+    Run a function repeat times after one warm up call, return the best time in seconds.
+    '''
+    function()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(benchmarks:list, repeat:int) -> dict:
+    '''
+    Run the benchmarks, return a dictionary of name: {seconds, unit, throughput}.
+    '''
+    measurements = {}
+    for benchmark in benchmarks:
+        function, units = benchmark.setup()
+        seconds = time_benchmark(function, repeat)
+        measurements[benchmark.name] = {
+            'seconds': seconds,
+            'unit': benchmark.unit,
+            'throughput': units / seconds if seconds else float('inf')
+        }
+    return measurements
+
+
+def format_throughput(throughput:float, unit:str) -> str:
+    '''
+    Format a throughput with a binary prefix for bytes and a decimal one otherwise.
+    '''
+    base, prefixes = (1024, ('', 'Ki', 'Mi', 'Gi')) if unit == 'B' else (1000, ('', 'k', 'M', 'G'))
+    for prefix in prefixes:
+        if throughput < base or prefix == prefixes[-1]:
+            return f"{throughput:.2f} {prefix}{unit}/s"
+        throughput /= base
+    return ''
+
+
+def compare(measurements:dict, baseline:dict, threshold:float) -> list:
+    '''
+    Print every measurement next to its baseline, return the names of the benchmarks
+    whose throughput fell below (1 - threshold) times the baseline throughput.
+    '''
+    regressions = []
+    print(f"{'Benchmark':<24} {'Best ms':>10} {'Throughput':>18} {'Baseline':>18} {'Change':>8}")
+    for name, measurement in measurements.items():
+        throughput = measurement['throughput']
+        line = (f"{name:<24} {measurement['seconds'] * 1000:>10.3f} "
+                f"{format_throughput(throughput, measurement['unit']):>18}")
+        reference = baseline.get(name)
+        if reference:
+            change = throughput / reference['throughput'] - 1
+            line += (f" {format_throughput(reference['throughput'], measurement['unit']):>18} "
+                     f"{change:>+8.1%}")
+            if change < -threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def read_baseline(path:str) -> dict:
+    '''
+    Read the benchmarks of a baseline file, empty if there is none yet.
+    '''
+    try:
+        with open(path, encoding='utf-8') as baseline_file:
+            return json.load(baseline_file)['benchmarks']
+    except FileNotFoundError:
+        return {}
+
+
+def write_baseline(path:str, measurements:dict, baseline:dict):
+    '''
+    Write the measurements to the baseline file, benchmarks that did not run keep their values.
+    '''
+    benchmarks = dict(baseline)
+    benchmarks.update({name: {'seconds': round(measurement['seconds'], 9),
+                              'unit': measurement['unit'],
+                              'throughput': round(measurement['throughput'], 3)}
+                       for name, measurement in measurements.items()})
+    with open(path, 'w', encoding='utf-8') as baseline_file:
+        json.dump({'machine': platform.machine(), 'processor': platform.processor(),
+                   'python': platform.python_version(), 'benchmarks': benchmarks},
+                  baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
+
+
+def main():
+    '''
+    Parse the arguments, run the benchmarks and compare them to the baseline.
+    Exits with 1 if a benchmark regressed.
+    '''
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of the SEV component test.")
+    parser.add_argument("-b", "--baseline", default=DEFAULT_BASELINE,
+                        help="Baseline file to compare to (default: %(default)s).")
+    parser.add_argument("-u", "--update-baseline", action="store_true",
+                        help="Write the measurements to the baseline file instead of failing on regressions.")
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Fraction of the baseline throughput a benchmark may lose (default: %(default)s).")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="Timed runs of each benchmark, the best is kept (default: %(default)s).")
+    parser.add_argument("-k", "--filter", default='',
+                        help="Only run the benchmarks whose name contains this text.")
+    parser.add_argument("-f", "--full", action="store_true",
+                        help="Also run the slow benchmarks (entropy of 256 MiB and 1 GiB).")
+    args = parser.parse_args()
+
+    benchmarks = [benchmark for benchmark in hot_paths.BENCHMARKS
+                  if args.filter in benchmark.name and (args.full or not benchmark.full)]
+    measurements = run_benchmarks(benchmarks, args.repeat)
+    baseline = read_baseline(args.baseline)
+    regressions = compare(measurements, baseline, args.threshold)
+
+    if args.update_baseline:
+        write_baseline(args.baseline, measurements, baseline)
+        print(f"Baseline written to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: "
+              + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,48 @@
-'''init for program'''
+'''init for program
+The library entry point is loaded on first use, importing the package stays cheap:
+    from sev_component_test import run_checks
+'''
+import importlib
+import importlib.util
+import os
+import sys
+
+# Names loaded from the sev_api module when they are first used
+_API_NAMES = ('run_checks', 'CheckRun', 'DEFAULT_FEATURES', 'FEATURES')
+
+
+def _get_colliding_modules(package_directory:str) -> list:
+    '''
+    Get the flat module names of the package that the importing program already
+    has or finds first elsewhere, they would replace the package's own modules.
+    '''
+    colliding = []
+    for file_name in sorted(os.listdir(package_directory)):
+        module_name, extension = os.path.splitext(file_name)
+        if extension != '.py' or module_name == '__init__':
+            continue
+        module = sys.modules.get(module_name)
+        if module is not None:
+            origin = getattr(module, '__file__', None)
+        else:
+            spec = importlib.util.find_spec(module_name)
+            origin = spec.origin if spec is not None else None
+        if origin is None or os.path.dirname(os.path.abspath(origin)) != package_directory:
+            colliding.append(module_name)
+    return colliding
+
+
+def __getattr__(name):
+    if name not in _API_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # The modules import each other by their flat names, like when the tool is run.
+    # The directory goes last on the path, so the program's own modules are never shadowed
+    package_directory = os.path.dirname(os.path.abspath(__file__))
+    if package_directory not in sys.path:
+        sys.path.append(package_directory)
+    # Mixing in a module of the same name from the program would break the checks
+    colliding = _get_colliding_modules(package_directory)
+    if colliding:
+        raise ImportError(f"{__name__} can't load its modules {', '.join(colliding)}, "
+                          "modules of the same name are imported or found first on sys.path")
+    return getattr(importlib.import_module('sev_api'), name)
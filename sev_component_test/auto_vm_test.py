@@ -2,6 +2,7 @@
 import os
 import string
 import subprocess
+import tracing
 import re
 from time import sleep
 import signal
@@ -9,6 +10,7 @@ import encryption_test
 import ovmf_functions
 import local_vm_test
 import component_tests
+import cpuid_table
 from message_printing import print_warning_message
 
 def grab_cbit_from_cpuid() -> str:
@@ -19,8 +21,7 @@ def grab_cbit_from_cpuid() -> str:
     # read ebx
     ebx = component_tests.get_cpuid(0x8000001f, 'ebx')
     if ebx:
-        bin_value = bin(ebx)[::-1][0:6]
-        return int(bin_value,2)
+        return cpuid_table.decode_cbit_position(ebx)
     else:
         print_warning_message(
             "Grabbing C-Bit for VM launch", "Could not read cpuid for ebx")
@@ -84,7 +85,7 @@ def launch_vm(system_os:string, current_directory:string,vm_type:str):
 
     # Launch the VM
     try:
-        subprocess.run(command.strip(), shell=True, check=True, capture_output=True)
+        tracing.run(command.strip(), shell=True, check=True, capture_output=True)
     # Error when launching VM
     except (subprocess.CalledProcessError) as err:
         if err.stderr.decode("utf-8").strip():
@@ -172,7 +173,8 @@ def automatic_vm_test(system_os:string, non_verbose:bool, vm_type:string):
     vm_command = launch_vm(system_os, current_directory,vm_type)
     vm_command = re.sub('\\s+', ' ', vm_command)
     # Wait for machine to finish booting (for best results)
-    sleep(15)
+    with tracing.span('wait for VM boot', 'wait'):
+        sleep(15)
 
     # Get current VMs being run in the system
     available_vms = local_vm_test.get_virtual_machines(system_os)
@@ -0,0 +1,312 @@
+'''
+Change driven re-checks. inotify watches on the sources of the facts the checks read
+(package databases, OVMF directories, kvm_amd parameters, /dev/sev) tell which inputs
+changed, only the checks reading those inputs run again and the others keep their outcome.
+The boot id and the kvm_amd parameters, which sysfs doesn't report through inotify,
+are read again every poll interval. New kernel messages about SEV, the PSP or the RMP
+are read from /dev/kmsg as they are logged, see kernel_log. Waiting for changes blocks
+in poll, an idle watcher costs close to no CPU.
+'''
+import ctypes
+import os
+import select
+import struct
+import time
+import sev_api
+import command_runner
+import cpuid_table
+import host_probes
+import ioctl
+import kernel_log
+import msr_reader
+import ovmf_functions
+from check_results import TtySink
+
+# inotify event bits, from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+# Events that mean something in a watched directory changed
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+# Header of an inotify event: watch descriptor, mask, cookie, length of the name
+EVENT_HEADER = struct.Struct('iIII')
+
+# rpm database files, reading the database touches the other files in its directory
+RPM_DATABASE_FILES = ('rpmdb.sqlite', 'rpmdb.sqlite-wal', 'Packages')
+# (input, directory watched, names in the directory that matter or None for any)
+WATCHES = [
+    ('packages', '/var/lib/dpkg', ('status',)),
+    ('packages', '/var/lib/rpm', RPM_DATABASE_FILES),
+    ('packages', '/usr/lib/sysimage/rpm', RPM_DATABASE_FILES),
+    ('ovmf', '/usr/share/OVMF', None),
+    ('ovmf', '/usr/share/qemu', None),
+    ('kvm_amd', '/sys/module/kvm_amd/parameters', None),
+    ('sev_device', '/dev', ('sev',)),
+]
+# kvm_amd parameters read every poll interval
+KVM_AMD_PARAMETERS = ('sev', 'sev_es', 'sev_snp')
+# Seconds between two reads of the polled inputs
+POLL_INTERVAL = 30.0
+# Seconds without events before a burst of changes (a package upgrade) is reported
+SETTLE_TIME = 1.0
+
+# Checks using the SEV platform state, they change when /dev/sev or kvm_amd change
+SEV_STATE_CHECKS = ('check_if_sev_init', 'check_if_sev_es_init', 'check_fw_version_for_snp',
+                    'check_snp_init', 'check_rmp_init', 'compare_tcb_versions')
+# Check functions that read each input, every check reads the boot
+INPUT_CHECKS = {
+    'packages': ('check_linux_distribution', 'find_libvirt_support', 'find_qemu_support',
+                 'test_all_ovmf_paths'),
+    'ovmf': ('test_all_ovmf_paths',),
+    'sev_device': SEV_STATE_CHECKS,
+    'kvm_amd': SEV_STATE_CHECKS + ('check_virtualization',),
+    'kernel_log': ('check_kernel_messages', 'find_tsme_enablement'),
+}
+
+
+def get_stale_keys(outcomes:dict, inputs) -> set:
+    '''
+    Get the keys of the checks that read any of the changed inputs.
+    '''
+    if 'boot' in inputs:
+        return set(outcomes)
+    names = {name for changed in inputs for name in INPUT_CHECKS.get(changed, ())}
+    return {key for key in outcomes if key[0].__name__ in names}
+
+
+def get_reusable_outcomes(outcomes:dict, inputs) -> dict:
+    '''
+    Get the outcomes of the checks that don't read any of the changed inputs.
+    '''
+    stale = get_stale_keys(outcomes, inputs)
+    return {key: outcome for key, outcome in outcomes.items() if key not in stale}
+
+
+def invalidate(inputs):
+    '''
+    Forget the facts read from the changed inputs, so the checks read them again.
+    '''
+    if 'boot' in inputs:
+        command_runner.clear_results()
+        cpuid_table.set_cpuid_table(None)
+        msr_reader.set_msr_reader(None)
+    elif 'packages' in inputs:
+        # Keep the filesystem scan for built OVMF, packages don't change it
+        scan = command_runner.get_results().get(tuple(ovmf_functions.FIND_FV_COMMAND))
+        command_runner.clear_results()
+        if scan is not None:
+            command_runner.add_results([scan])
+    if inputs & {'boot', 'sev_device', 'kvm_amd'}:
+        # Closing the session drops the cached platform status, the next command reopens it
+        ioctl.get_sev_device().close()
+
+
+class ChangeWatcher:
+    '''
+    Watches the inputs of the checks. wait returns the set of inputs that changed:
+    packages, ovmf, kvm_amd, sev_device, kernel_log or boot.
+    Directories that don't exist yet are watched once they appear.
+    The kernel log is the shared reader of kernel_log unless another one is given,
+    kernel_events are the classified messages read since the last wait.
+    '''
+    def __init__(self, watches = None, poll_interval:float = POLL_INTERVAL,
+                 settle_time:float = SETTLE_TIME, log:kernel_log.KernelLog = None):
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.kernel_events = []
+        self._kernel_log = log or kernel_log.get_kernel_log()
+        try:
+            self._kernel_log.fileno()
+        # Not allowed to read the kernel log, watch the other inputs
+        except OSError:
+            self._kernel_log = None
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watch descriptor: (input, directory, names)
+        self._watches = {}
+        self._missing = list(watches if watches is not None else WATCHES)
+        self._add_missing_watches()
+        self._polled = self.read_polled()
+        self._last_poll = time.monotonic()
+
+    def _add_missing_watches(self):
+        '''
+        Watch the directories that didn't exist when they were last tried.
+        '''
+        missing = []
+        for input_name, path, names in self._missing:
+            descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if descriptor < 0:
+                missing.append((input_name, path, names))
+            else:
+                self._watches[descriptor] = (input_name, path, names)
+        self._missing = missing
+
+    def fileno(self) -> int:
+        '''
+        inotify file descriptor, readable when events are waiting.
+        '''
+        return self._fd
+
+    def kernel_log_fileno(self) -> int:
+        '''
+        /dev/kmsg file descriptor, readable when the kernel logged new messages.
+        None if the kernel log isn't watched.
+        '''
+        return None if self._kernel_log is None else self._kernel_log.fileno()
+
+    def read_kernel_log(self) -> set:
+        '''
+        Read the new kernel log records, get {'kernel_log'} if any of them was classified.
+        '''
+        try:
+            events = self._kernel_log.read_new()
+        except OSError:
+            return set()
+        self.kernel_events += events
+        return {'kernel_log'} if events else set()
+
+    @staticmethod
+    def read_polled() -> dict:
+        '''
+        Read the inputs inotify can't watch.
+        '''
+        try:
+            boot_id = host_probes.read_boot_id()
+        except OSError:
+            boot_id = None
+        return {'boot': boot_id,
+                'kvm_amd': tuple(host_probes.read_kvm_amd_parameter(parameter)
+                                 for parameter in KVM_AMD_PARAMETERS)}
+
+    def poll_changes(self) -> set:
+        '''
+        Get the polled inputs that changed since they were last read.
+        Directories that were missing are tried again.
+        '''
+        self._add_missing_watches()
+        polled = self.read_polled()
+        changed = {name for name, value in polled.items() if self._polled[name] != value}
+        self._polled = polled
+        self._last_poll = time.monotonic()
+        return changed
+
+    def read_events(self) -> set:
+        '''
+        Read the waiting inotify events, get the inputs they belong to.
+        '''
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:
+                            offset + EVENT_HEADER.size + length].rstrip(b'\0').decode(
+                                'utf-8', errors='replace')
+                offset += EVENT_HEADER.size + length
+                # Events were lost, anything could have changed
+                if mask & IN_Q_OVERFLOW:
+                    changed |= {watch[0] for watch in self._watches.values()}
+                    continue
+                if descriptor not in self._watches:
+                    continue
+                input_name, _, names = self._watches[descriptor]
+                # Events without a name are about the directory itself
+                if names is None or not name or name in names:
+                    changed.add(input_name)
+                # The directory went away, watch it again once it's back
+                if mask & IN_IGNORED:
+                    self._missing.append(self._watches.pop(descriptor))
+        self._add_missing_watches()
+        return changed
+
+    def wait(self, timeout:float = None) -> set:
+        '''
+        Wait until an input changes or timeout seconds passed, get the inputs that changed.
+        Bursts of events are collected until settle_time passes without one.
+        '''
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        if self._kernel_log is not None:
+            poller.register(self._kernel_log.fileno(), select.POLLIN)
+        end = None if timeout is None else time.monotonic() + timeout
+        self.kernel_events = []
+        changed = set()
+        while True:
+            now = time.monotonic()
+            wake = self._last_poll + self.poll_interval
+            if end is not None:
+                wake = min(wake, end)
+            if changed:
+                wake = min(wake, now + self.settle_time)
+            ready = {descriptor for descriptor, _ in poller.poll(max(wake - now, 0) * 1000)}
+            if ready:
+                if self._fd in ready:
+                    changed |= self.read_events()
+                if self._kernel_log is not None and self._kernel_log.fileno() in ready:
+                    changed |= self.read_kernel_log()
+                continue
+            if time.monotonic() >= self._last_poll + self.poll_interval:
+                changed |= self.poll_changes()
+            if changed or (end is not None and time.monotonic() >= end):
+                return changed
+
+    def close(self):
+        '''
+        Stop watching.
+        '''
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def watch_checks(features, system_os:str, enablement:bool, test_cpu:bool,
+                 check_timeout:float, non_verbose:bool) -> int:
+    '''
+    Run the checks, then run again the ones whose inputs changed every time something
+    changes, until interrupted. Returns the program exit code of the last run.
+    '''
+    arguments = {'features': features, 'system_os': system_os, 'enablement': enablement,
+                 'test_cpu': test_cpu, 'check_timeout': check_timeout}
+    check_run = sev_api.run_checks(sinks=[TtySink(non_verbose)], **arguments)
+    kernel_log.save_kernel_log()
+    try:
+        watcher = ChangeWatcher()
+    except OSError as err:
+        print(f"Could not watch for changes: {err}")
+        return 1
+    try:
+        while True:
+            inputs = watcher.wait()
+            invalidate(inputs)
+            reuse = get_reusable_outcomes(check_run.outcomes, inputs)
+            if not non_verbose:
+                print(f"\n{time.strftime('%Y-%m-%d %H:%M:%S')} {', '.join(sorted(inputs))} changed, "
+                      f"checking {len(check_run.outcomes) - len(reuse)} checks again.")
+                for event in watcher.kernel_events:
+                    print(f"[{event.timestamp / 1e6:12.6f}] {event.category} {event.severity}: "
+                          f"{event.message}")
+            check_run = sev_api.run_checks(sinks=[TtySink(non_verbose)], reuse=reuse, **arguments)
+            kernel_log.save_kernel_log()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    if check_run.passed is None:
+        return 2
+    return 0 if check_run.passed else 1
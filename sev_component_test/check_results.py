@@ -0,0 +1,351 @@
+'''
+Typed check results and the sinks they are reported to.
+Checks still return (component, command, found_result, expectation, test_result) tuples,
+the scheduler turns them into CheckResult objects and hands them to every sink in order:
+colored terminal output, JSON Lines, JUnit XML or a compact binary record stream.
+'''
+import enum
+import json
+import struct
+from message_printing import (print_overall_result, print_test_result,
+                              print_timeout_result, print_warning_message)
+
+
+class Status(enum.Enum):
+    '''
+    Outcome of a check.
+    '''
+    PASS = 0
+    FAIL = 1
+    # Did not finish in its time budget or before the deadline
+    TIMEOUT = 2
+    # Not run because a check it depends on did not pass
+    SKIPPED = 3
+
+
+class CheckResult:
+    '''
+    Result of one check. found and expected keep the values the check reported,
+    duration is the number of seconds the check took.
+    '''
+    __slots__ = ('component', 'command', 'found', 'expected', 'status',
+                 'duration', 'feature', 'group')
+
+    def __init__(self, component:str, command:str, found, expected, status:Status,
+                 duration:float = 0.0, feature:str = '', group:str = ''):
+        self.component = component
+        self.command = command
+        self.found = found
+        self.expected = expected
+        self.status = status
+        self.duration = duration
+        self.feature = feature
+        self.group = group
+
+    @classmethod
+    def from_tuple(cls, result:tuple, duration:float = 0.0, feature:str = '', group:str = ''):
+        '''
+        Build a result from the (component, command, found_result, expectation, test_result)
+        tuple returned by a check function.
+        '''
+        component, command, found, expected, passed = result
+        return cls(component, command, found, expected,
+                   Status.PASS if passed else Status.FAIL, duration, feature, group)
+
+    @property
+    def passed(self) -> bool:
+        '''
+        True if the check passed.
+        '''
+        return self.status == Status.PASS
+
+    def as_tuple(self) -> tuple:
+        '''
+        Get the result in the (component, command, found_result, expectation, test_result) form.
+        '''
+        return (self.component, self.command, self.found, self.expected, self.passed)
+
+    def as_dict(self) -> dict:
+        '''
+        Get the result as a dictionary of JSON compatible values.
+        '''
+        return {
+            'feature': self.feature,
+            'group': self.group,
+            'component': self.component,
+            'command': self.command,
+            'found': self.found,
+            'expected': self.expected,
+            'status': self.status.name,
+            'duration': round(self.duration, 6)
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, CheckResult):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return (f"CheckResult({self.component!r}, {self.command!r}, {self.found!r}, "
+                f"{self.expected!r}, {self.status.name}, {self.duration:.3f})")
+
+
+class ResultSink:
+    '''
+    Receiver of check results. Groups are reported one after another, results in order.
+    '''
+    def start_group(self, group):
+        '''
+        A group of checks is about to be reported.
+        '''
+
+    def add_warning(self, group, component:str, warning:str):
+        '''
+        A check could not be performed properly.
+        '''
+
+    def add_result(self, result:CheckResult):
+        '''
+        One check result.
+        '''
+
+    def end_group(self, group, passed):
+        '''
+        Every result of the group was reported. passed is None if checks timed out.
+        '''
+
+    def close(self):
+        '''
+        No more results will be reported.
+        '''
+
+
+class TtySink(ResultSink):
+    '''
+    Colored terminal output, the tool's regular output.
+    Warnings are printed even in non verbose mode.
+    '''
+    def __init__(self, non_verbose:bool = False, print_overall:bool = True):
+        self.non_verbose = non_verbose
+        self.print_overall = print_overall
+
+    def start_group(self, group):
+        if not self.non_verbose and group.header:
+            print(group.header)
+
+    def add_warning(self, group, component:str, warning:str):
+        print_warning_message(component, warning)
+
+    def add_result(self, result:CheckResult):
+        if self.non_verbose or result.status == Status.SKIPPED:
+            return
+        if result.status == Status.TIMEOUT:
+            print_timeout_result(result.component, result.duration)
+        else:
+            print_test_result(*result.as_tuple())
+
+    def end_group(self, group, passed):
+        if self.print_overall and not self.non_verbose:
+            print_overall_result(group.name, passed)
+
+
+class JsonLinesSink(ResultSink):
+    '''
+    One JSON object per line, flushed as soon as it's written so the stream can be
+    followed while the checks run. Every object has a type: result, warning or group.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _write(self, record:dict):
+        # Values checks report that are not JSON types (dates, versions) are written as text
+        self.stream.write(json.dumps(record, default=str) + '\n')
+        self.stream.flush()
+
+    def add_warning(self, group, component:str, warning:str):
+        self._write({'type': 'warning', 'feature': group.feature, 'group': group.name,
+                     'component': component, 'warning': warning})
+
+    def add_result(self, result:CheckResult):
+        self._write(dict(type='result', **result.as_dict()))
+
+    def end_group(self, group, passed):
+        status = Status.TIMEOUT if passed is None else Status.PASS if passed else Status.FAIL
+        self._write({'type': 'group', 'feature': group.feature, 'group': group.name,
+                     'status': status.name})
+
+
+class JUnitSink(ResultSink):
+    '''
+    JUnit XML report, one testsuite per group and one testcase per result.
+    Each testsuite is written when its group ends.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.testcases = []
+        self.warnings = []
+        self.stream.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n')
+
+    def start_group(self, group):
+        self.testcases = []
+        self.warnings = []
+
+    def add_warning(self, group, component:str, warning:str):
+        self.warnings.append(f"{component}: {warning}")
+
+    def add_result(self, result:CheckResult):
+        self.testcases.append(result)
+
+    def end_group(self, group, passed):
+        # Loaded here, it pulls in urllib and the runs without a JUnit report don't need it
+        from xml.sax.saxutils import escape, quoteattr # pylint: disable=import-outside-toplevel
+        counts = {status: 0 for status in Status}
+        for result in self.testcases:
+            counts[result.status] += 1
+        self.stream.write(
+            f'  <testsuite name={quoteattr(group.name)} tests="{len(self.testcases)}" '
+            f'failures="{counts[Status.FAIL]}" errors="{counts[Status.TIMEOUT]}" '
+            f'skipped="{counts[Status.SKIPPED]}" '
+            f'time="{sum(result.duration for result in self.testcases):.6f}">\n')
+        for result in self.testcases:
+            self.stream.write(
+                f'    <testcase classname={quoteattr(group.feature)} '
+                f'name={quoteattr(result.component)} time="{result.duration:.6f}"')
+            message = quoteattr(f"Found: {result.found} Expected: {result.expected}")
+            if result.status == Status.FAIL:
+                self.stream.write(f'>\n      <failure message={message}/>\n    </testcase>\n')
+            elif result.status == Status.TIMEOUT:
+                self.stream.write(f'>\n      <error type="timeout" message='
+                                  f'"did not finish after {result.duration:.1f} seconds"/>'
+                                  '\n    </testcase>\n')
+            elif result.status == Status.SKIPPED:
+                self.stream.write('>\n      <skipped/>\n    </testcase>\n')
+            else:
+                self.stream.write('/>\n')
+        if self.warnings:
+            self.stream.write('    <system-err>' + escape('\n'.join(self.warnings))
+                              + '</system-err>\n')
+        self.stream.write('  </testsuite>\n')
+        self.stream.flush()
+
+    def close(self):
+        self.stream.write('</testsuites>\n')
+        self.stream.flush()
+
+
+# Start of a binary result stream
+BINARY_MAGIC = b'SCTR\x02'
+# Record header: status and duration in seconds
+BINARY_RECORD = struct.Struct('<Bf')
+# Length of a string added to the string table
+BINARY_STRING_LENGTH = struct.Struct('<I')
+# Text fields of a record, in the order they are written
+BINARY_FIELDS = ('feature', 'group', 'component', 'command', 'found', 'expected')
+# Fields holding the values the check reported, kept as their JSON text to read back their type
+BINARY_VALUE_FIELDS = ('found', 'expected')
+
+
+def _pack_varint(value:int) -> bytes:
+    '''
+    Encode a non negative integer in 7 bit groups, low group first (LEB128).
+    '''
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+class BinarySink(ResultSink):
+    '''
+    Compact binary result stream. Every record is the status, the duration as a float
+    and the text fields as indexes in a string table built along the stream: a string
+    seen for the first time is written once after its new index, repeated feature,
+    component and command names only take the bytes of their index (one byte for the
+    first 128 strings, there is no limit). found and expected are kept as JSON text
+    so they are read back with their type. Read it back with read_binary_results.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.strings = {}
+        self.stream.write(BINARY_MAGIC)
+
+    def _string(self, value:str) -> bytes:
+        index = self.strings.get(value)
+        if index is not None:
+            return _pack_varint(index)
+        index = len(self.strings)
+        self.strings[value] = index
+        encoded = value.encode('utf-8')
+        return _pack_varint(index) + BINARY_STRING_LENGTH.pack(len(encoded)) + encoded
+
+    def add_result(self, result:CheckResult):
+        record = [BINARY_RECORD.pack(result.status.value, result.duration)]
+        for field in BINARY_FIELDS:
+            value = getattr(result, field)
+            # Values that are not JSON types (dates, versions) are kept as text
+            value = (json.dumps(value, default=str) if field in BINARY_VALUE_FIELDS
+                     else str(value))
+            record.append(self._string(value))
+        self.stream.write(b''.join(record))
+
+    def close(self):
+        self.stream.flush()
+
+
+def _read_exactly(stream, size:int) -> bytes:
+    '''
+    Read size bytes from a stream, raise ValueError if it ends before.
+    '''
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("truncated binary result stream")
+    return data
+
+
+def _read_varint(stream) -> int:
+    '''
+    Read an integer written by _pack_varint, raise ValueError if the stream ends before.
+    '''
+    value = 0
+    shift = 0
+    while True:
+        byte = _read_exactly(stream, 1)[0]
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value
+        shift += 7
+
+
+def read_binary_results(stream):
+    '''
+    Read back the results written by a BinarySink, yields CheckResult objects.
+    found and expected keep their JSON type, the other fields are returned as strings.
+    '''
+    if stream.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("not a binary result stream")
+    strings = []
+    while True:
+        header = stream.read(BINARY_RECORD.size)
+        if not header:
+            return
+        if len(header) != BINARY_RECORD.size:
+            raise ValueError("truncated binary result stream")
+        status, duration = BINARY_RECORD.unpack(header)
+        fields = {}
+        for field in BINARY_FIELDS:
+            index = _read_varint(stream)
+            # First time the string is seen, it follows its index
+            if index == len(strings):
+                length, = BINARY_STRING_LENGTH.unpack(
+                    _read_exactly(stream, BINARY_STRING_LENGTH.size))
+                strings.append(_read_exactly(stream, length).decode('utf-8'))
+            if index >= len(strings):
+                raise ValueError("invalid string index in binary result stream")
+            fields[field] = strings[index]
+        for field in BINARY_VALUE_FIELDS:
+            fields[field] = json.loads(fields[field])
+        yield CheckResult(fields['component'], fields['command'], fields['found'],
+                          fields['expected'], Status(status), duration,
+                          fields['feature'], fields['group'])
@@ -0,0 +1,437 @@
+'''
+Dependency aware scheduler for the component checks.
+Every check requested by the feature groups is collected into one graph, checks shared
+by several groups only run once and independent checks run concurrently on a pool of
+worker threads. Results are still printed in group order, the same way as running
+each group one check at a time.
+Every check runs under a time budget, and the whole run can be given a deadline.
+Checks that don't finish in time are reported as TIMEOUT instead of PASS or FAIL.
+'''
+import queue
+import threading
+import time
+from collections import namedtuple
+from message_printing import capture_warnings
+from check_results import CheckResult, Status, TtySink
+import host_probes
+import tracing
+
+# States a check goes through
+PENDING = 'PENDING'
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+# Not run because a check it depends on failed
+SKIPPED = 'SKIPPED'
+# Not run because nothing needs its result anymore (stop at failure)
+CANCELLED = 'CANCELLED'
+# Did not finish in its time budget or before the deadline, or depends on one that didn't
+TIMED_OUT = 'TIMED_OUT'
+
+# Default number of checks running at the same time
+DEFAULT_WORKERS = 8
+# Default number of seconds a check can run before it's reported as a timeout
+DEFAULT_CHECK_TIMEOUT = 60
+
+
+# Outcome of a finished check, can be given back to a later scheduler to reuse it
+CheckOutcome = namedtuple('CheckOutcome', ['passed', 'results', 'warnings', 'duration'])
+
+
+class Check:
+    '''
+    One check function with its arguments, and the checks that have to pass before it runs.
+    Checks with the same function and arguments are the same check.
+    timeout is the number of seconds the check can run, None for the scheduler default.
+    '''
+    def __init__(self, function, args = (), depends_on = (), timeout = None):
+        self.function = function
+        self.args = tuple(args)
+        self.depends_on = list(depends_on)
+        self.timeout = timeout
+
+    @property
+    def name(self) -> str:
+        '''
+        Name of the check used when it has no result to print.
+        '''
+        return ' '.join([self.function.__name__] + [str(arg) for arg in self.args])
+
+    @property
+    def key(self):
+        '''
+        Identity of the check, used to run shared checks only once.
+        '''
+        return (self.function, self.args)
+
+
+class CheckGroup:
+    '''
+    Ordered list of checks for one feature, printed under a header.
+    '''
+    def __init__(self, name:str, header:str, checks:list, feature:str = None):
+        self.name = name
+        self.header = header
+        self.checks = list(checks)
+        self.feature = feature or name
+
+
+class _Node:
+    '''
+    Scheduling state of one unique check.
+    '''
+    def __init__(self, check:Check):
+        self.check = check
+        self.dependencies = []
+        self.dependents = []
+        self.state = PENDING
+        # Number of group entries and dependents that still need this check
+        self.references = 0
+        # Result tuples returned by the check
+        self.results = []
+        self.passed = False
+        self.warnings = []
+        # time.monotonic() when the check started running
+        self.started = None
+        self.duration = 0.0
+        self.error = None
+
+    def get_duration(self) -> float:
+        '''
+        Seconds the check took, or has been running for if it didn't finish.
+        '''
+        if self.state == TIMED_OUT and self.started is not None:
+            return time.monotonic() - self.started
+        return self.duration
+
+
+def normalize_check_output(output):
+    '''
+    Turn the output of a check function into (passed, list of result tuples).
+    Most checks return one (component, command, found, expectation, result) tuple,
+    test_all_ovmf_paths returns if any path passed and a list of path results.
+    '''
+    if len(output) == 2 and isinstance(output[1], list):
+        passed, paths = output
+        return passed, [tuple(path) for path in paths]
+    return output[4], [tuple(output)]
+
+
+def get_error_text(error:Exception) -> str:
+    '''
+    Describe the error a check raised.
+    '''
+    return f"{type(error).__name__}: {error}"
+
+
+class CheckScheduler:
+    '''
+    Runs the checks of a list of groups on a pool of worker threads.
+    check_timeout is the default time budget of a check in seconds and deadline
+    the time.monotonic() value after which every unfinished check times out.
+    reuse maps check keys to the CheckOutcome of an earlier run, those checks are
+    not run again and their outcome is reported as if they just finished.
+    probes are the host_probes.Probes every check runs with, the module functions if None.
+    '''
+    def __init__(self, groups:list, max_workers:int = DEFAULT_WORKERS,
+                 check_timeout:float = DEFAULT_CHECK_TIMEOUT, deadline = None, reuse = None,
+                 probes:host_probes.Probes = None):
+        self.groups = list(groups)
+        self.probes = probes
+        self.max_workers = max_workers
+        self.check_timeout = check_timeout
+        self.deadline = deadline
+        self.reuse = dict(reuse or {})
+        self.nodes = {}
+        self._workers = []
+        # CheckResult for every result in the order they were reported
+        self.results = []
+        self._ready = queue.Queue()
+        self._condition = threading.Condition()
+        for group in self.groups:
+            for check in group.checks:
+                self._add_check(check).references += 1
+
+    def _add_check(self, check:Check) -> _Node:
+        '''
+        Add a check and the checks it depends on to the graph.
+        '''
+        if check.key in self.nodes:
+            return self.nodes[check.key]
+        node = _Node(check)
+        self.nodes[check.key] = node
+        for dependency in check.depends_on:
+            dependency_node = self._add_check(dependency)
+            if dependency_node not in node.dependencies:
+                node.dependencies.append(dependency_node)
+                dependency_node.dependents.append(node)
+                dependency_node.references += 1
+        return node
+
+    def _reusable(self, node:_Node) -> bool:
+        '''
+        True if the outcome of an earlier run can be used for a check.
+        A check runs again when a check it depends on runs again.
+        '''
+        return node.check.key in self.reuse and all(self._reusable(dependency)
+                                                    for dependency in node.dependencies)
+
+    def _queue(self, node:_Node):
+        '''
+        Hand a check to the workers. Must be called with the condition held.
+        '''
+        node.state = QUEUED
+        self._ready.put(node)
+
+    def _skip(self, node:_Node, state:str = SKIPPED):
+        '''
+        Mark a check and everything depending on it as skipped, or timed out.
+        Must be called with the condition held.
+        '''
+        if node.state != PENDING:
+            return
+        node.state = state
+        for dependent in node.dependents:
+            self._skip(dependent, state)
+
+    def _time_out(self, node:_Node):
+        '''
+        Give up on an unfinished check and on the checks depending on it.
+        A running check keeps its worker busy, so another worker replaces it.
+        Must be called with the condition held.
+        '''
+        was_running = node.state == RUNNING
+        node.state = TIMED_OUT
+        for dependent in node.dependents:
+            self._skip(dependent, TIMED_OUT)
+        if was_running:
+            self._start_worker()
+        self._condition.notify_all()
+
+    def _release(self, node:_Node):
+        '''
+        Drop one reference to a check, cancel it if nothing needs it and it didn't start.
+        Must be called with the condition held.
+        '''
+        node.references -= 1
+        if node.references > 0 or node.state not in (PENDING, QUEUED):
+            return
+        node.state = CANCELLED
+        for dependency in node.dependencies:
+            self._release(dependency)
+
+    def _finish(self, node:_Node):
+        '''
+        Record a finished check and queue or skip the checks depending on it.
+        Must be called with the condition held.
+        '''
+        # Result arrived too late, the check was already reported as a timeout
+        if node.state == TIMED_OUT:
+            return
+        node.state = DONE
+        for dependent in node.dependents:
+            if dependent.state != PENDING:
+                continue
+            if any(dependency.state == DONE and not dependency.passed
+                   for dependency in dependent.dependencies):
+                self._skip(dependent)
+            elif all(dependency.state == DONE for dependency in dependent.dependencies):
+                self._queue(dependent)
+        self._condition.notify_all()
+
+    def _worker(self):
+        '''
+        Run checks from the ready queue until told to stop.
+        '''
+        while True:
+            node = self._ready.get()
+            if node is None:
+                return
+            with self._condition:
+                if node.state != QUEUED:
+                    continue
+                node.state = RUNNING
+                node.started = time.monotonic()
+                # Let the main thread start counting this check's time budget
+                self._condition.notify_all()
+            passed, results, error = False, [], None
+            # The probes are set for this thread only, a worker left behind by a timeout
+            # keeps them and no other caller sees them
+            with capture_warnings() as warnings, tracing.span(node.check.name, 'check'),\
+                    host_probes.using_probes(self.probes):
+                try:
+                    passed, results = normalize_check_output(
+                        node.check.function(*node.check.args))
+                # Reported as a failure of this check, the checks depending on it are skipped
+                except Exception as err: # pylint: disable=broad-except
+                    error = err
+            with self._condition:
+                if node.state == TIMED_OUT:
+                    # Nobody waits for this worker anymore, a replacement was started
+                    return
+                node.passed, node.results, node.error = passed, results, error
+                node.duration = time.monotonic() - node.started
+                node.warnings = warnings
+                self._finish(node)
+
+    def _start_worker(self):
+        '''
+        Start one more worker thread.
+        '''
+        worker = threading.Thread(target=self._worker, daemon=True, name='check-worker')
+        self._workers.append(worker)
+        worker.start()
+
+    def _expiry(self, node:_Node):
+        '''
+        Get the time.monotonic() value when a running check runs out of its time budget.
+        '''
+        timeout = node.check.timeout if node.check.timeout is not None else self.check_timeout
+        if timeout is None:
+            return None
+        return node.started + timeout
+
+    def _expire_checks(self):
+        '''
+        Time out every check past its budget, or every unfinished check if the deadline passed.
+        Returns the time.monotonic() value when the next check can time out, None if none can.
+        Must be called with the condition held.
+        '''
+        now = time.monotonic()
+        deadline_passed = self.deadline is not None and now >= self.deadline
+        expiries = [self.deadline] if self.deadline is not None else []
+        for node in self.nodes.values():
+            if deadline_passed and node.state in (PENDING, QUEUED, RUNNING):
+                self._time_out(node)
+            elif node.state == RUNNING:
+                expiry = self._expiry(node)
+                if expiry is None:
+                    continue
+                if expiry <= now:
+                    self._time_out(node)
+                else:
+                    expiries.append(expiry)
+        return min(expiries) if expiries else None
+
+    def _wait(self, node:_Node):
+        '''
+        Wait until a check is finished, skipped, cancelled or timed out.
+        Checks running past their time budget are timed out while waiting.
+        '''
+        finished = (DONE, SKIPPED, CANCELLED, TIMED_OUT)
+        with self._condition:
+            while node.state not in finished:
+                next_expiry = self._expire_checks()
+                if node.state in finished:
+                    break
+                # Woken up when any check starts or ends, recheck the expiries then
+                if next_expiry is None:
+                    self._condition.wait()
+                else:
+                    self._condition.wait(max(next_expiry - time.monotonic(), 0))
+
+    def run(self, non_verbose:bool, stop_failure:bool, print_overall:bool = False,
+            sinks = (), tty:bool = True) -> dict:
+        '''
+        Run every check and print the results group by group.
+        The results are also reported to every sink given, in the same order.
+        Without tty nothing is printed, not even warnings, the sinks get everything.
+        With stop_failure a group stops at its first failing check and the checks
+        only that group still needed are cancelled.
+        Returns a dictionary of group name: True if every check in the group passed,
+        False if any check failed and None if no check failed but some timed out.
+        '''
+        with self._condition:
+            reused = [node for node in self.nodes.values() if self._reusable(node)]
+            for node in reused:
+                node.passed, node.results, node.warnings, node.duration = self.reuse[node.check.key]
+                node.state = DONE
+            # Queue or skip the checks depending on them, like when they finish
+            for node in reused:
+                self._finish(node)
+            for _ in range(min(self.max_workers, len(self.nodes) - len(reused)) or 1):
+                self._start_worker()
+            for node in self.nodes.values():
+                if not node.dependencies and node.state == PENDING:
+                    self._queue(node)
+
+        sinks = ([TtySink(non_verbose, print_overall)] if tty else []) + list(sinks)
+        group_results = {}
+        try:
+            for group in self.groups:
+                for sink in sinks:
+                    sink.start_group(group)
+                group_results[group.name] = self._report_group(group, stop_failure, sinks)
+                for sink in sinks:
+                    sink.end_group(group, group_results[group.name])
+        finally:
+            with self._condition:
+                for _ in self._workers:
+                    self._ready.put(None)
+        return group_results
+
+    def get_outcomes(self) -> dict:
+        '''
+        Get the outcome of every check that finished, as check key: CheckOutcome.
+        Checks that raised an error are left out.
+        '''
+        with self._condition:
+            return {key: CheckOutcome(node.passed, node.results, node.warnings, node.duration)
+                    for key, node in self.nodes.items()
+                    if node.state == DONE and node.error is None}
+
+    def _report(self, result:CheckResult, sinks:list):
+        '''
+        Keep a result and hand it to every sink.
+        '''
+        self.results.append(result)
+        for sink in sinks:
+            sink.add_result(result)
+
+    def _report_group(self, group:CheckGroup, stop_failure:bool, sinks:list) -> bool:
+        '''
+        Report the results of one group in order as they become available.
+        '''
+        # Will turn false if any check fails
+        pass_check = True
+        # Will turn true if any check times out
+        timed_out = False
+        for index, check in enumerate(group.checks):
+            node = self.nodes[check.key]
+            self._wait(node)
+            with self._condition:
+                self._release(node)
+            # Ran out of time, neither a pass nor a failure
+            if node.state == TIMED_OUT:
+                timed_out = True
+                self._report(CheckResult(check.name, '', '', '', Status.TIMEOUT,
+                                         node.get_duration(), group.feature, group.name), sinks)
+                continue
+            # A check this one depends on failed, it was not run
+            if node.state != DONE:
+                pass_check = False
+                self._report(CheckResult(check.name, '', '', '', Status.SKIPPED,
+                                         0.0, group.feature, group.name), sinks)
+                continue
+            for component, warning in node.warnings:
+                for sink in sinks:
+                    sink.add_warning(group, component, warning)
+            # The check raised an error, it failed with the error as what it found
+            if node.error is not None:
+                self._report(CheckResult(check.name, '', get_error_text(node.error), '',
+                                         Status.FAIL, node.duration, group.feature,
+                                         group.name), sinks)
+            for result in node.results:
+                self._report(CheckResult.from_tuple(result, node.duration, group.feature,
+                                                    group.name), sinks)
+            # Stop running checks immediately if the test fails and the stopfailure flag is enabled.
+            if not node.passed:
+                pass_check = False
+                if stop_failure:
+                    with self._condition:
+                        for remaining in group.checks[index + 1:]:
+                            self._release(self.nodes[remaining.key])
+                    break
+        if pass_check and timed_out:
+            return None
+        return pass_check
@@ -0,0 +1,366 @@
+'''
+Check server: keeps the component check results and the SEV platform facts in memory
+and answers queries over a local Unix socket, so a scheduler can ask a hypervisor if an
+encrypted guest can be placed without starting the tool for every question.
+Requests and responses are one JSON object per line, a connection can send any number
+of requests. /dev/sev stays open and the volatile facts (guest count, platform states)
+are refreshed on a timer, answers come from memory. With watch, the checks whose inputs
+change (packages, OVMF files, kvm_amd parameters, /dev/sev, SEV kernel messages)
+run again on their own.
+    {"query": "placement", "feature": "sev-snp"}
+    {"ok": true, "feature": "sev-snp", "can_place": true, "asids_free": 508, ...}
+'''
+import asyncio
+import json
+import os
+import signal
+import socket
+import stat
+import threading
+import time
+import sev_api
+import change_watcher
+import component_tests
+import ioctl
+from message_printing import print_warning_message
+
+# Socket the server listens on by default
+DEFAULT_SOCKET_PATH = '/run/sev-component-test.sock'
+# Seconds between two refreshes of the volatile facts
+DEFAULT_REFRESH_INTERVAL = 5.0
+# Longest request line accepted
+MAX_REQUEST_SIZE = 64 * 1024
+# Queries the server answers
+QUERIES = ('ping', 'status', 'placement', 'checks', 'refresh', 'recheck')
+# Check feature and ASID pool used by the guests of each feature
+PLACEMENT_FEATURES = {'sev': ('SEV', 'sev'), 'sev-es': ('SEV-ES', 'sev-es'),
+                      'sev-snp': ('SEV-SNP', 'sev-es')}
+
+
+class CheckServer:
+    '''
+    Server answering check and placement queries from the facts it keeps.
+    The component checks run when the server starts and on a recheck query,
+    the platform status is read again every refresh_interval seconds.
+    watch runs the checks again when their inputs change, see change_watcher.
+    '''
+    def __init__(self, socket_path:str = DEFAULT_SOCKET_PATH,
+                 refresh_interval:float = DEFAULT_REFRESH_INTERVAL,
+                 features = sev_api.DEFAULT_FEATURES, enablement:bool = False,
+                 test_cpu:bool = False, check_timeout:float = None, probes:dict = None,
+                 watch:bool = False):
+        self.socket_path = socket_path
+        self.refresh_interval = refresh_interval
+        # Arguments of every run_checks call
+        self.check_arguments = {'features': features, 'enablement': enablement,
+                                'test_cpu': test_cpu, 'probes': probes}
+        if check_timeout is not None:
+            self.check_arguments['check_timeout'] = check_timeout
+        self.check_run = None
+        self.checked_at = None
+        # Held while the checks run, so a run reuses the outcomes of the run before it
+        self._check_lock = threading.Lock()
+        # Facts read from the firmware and cpuid, see refresh_platform
+        self.platform = {}
+        self.refreshed_at = None
+        self.device = ioctl.get_sev_device()
+        self.watch = watch
+        self._watcher = None
+        # Inputs changed since the last recheck
+        self._changed = set()
+        self._loop = None
+        self._stop = None
+
+    def run_checks(self, refresh:bool = False, changed = None):
+        '''
+        Run the component checks and keep their results.
+        changed is a set of inputs that changed since the last run, only the checks
+        reading them run again. Overlapping calls (a recheck query while watched inputs
+        change) run one after the other, each from the results of the one before.
+        '''
+        with self._check_lock:
+            reuse = None
+            if changed and self.check_run is not None:
+                change_watcher.invalidate(changed)
+                reuse = change_watcher.get_reusable_outcomes(self.check_run.outcomes, changed)
+            self.check_run = sev_api.run_checks(refresh=refresh, reuse=reuse, **self.check_arguments)
+            self.checked_at = time.time()
+
+    def refresh_platform(self):
+        '''
+        Read the volatile platform facts again: guest count and platform states.
+        Facts whose command fails are None.
+        '''
+        platform = {'asids': None, 'sev': None, 'snp': None}
+        asid_counts = component_tests.get_asid_counts()
+        if asid_counts:
+            platform['asids'] = {'sev': asid_counts[0], 'sev-es': asid_counts[1]}
+        try:
+            status = self.device.platform_status(refresh=True)
+            platform['sev'] = {'state': status.state, 'guest_count': status.guest_count,
+                               'api_version': f"{status.api_major}.{status.api_minor}",
+                               'build': status.build}
+        except OSError:
+            pass
+        try:
+            snp_status = self.device.snp_platform_status(refresh=True)
+            platform['snp'] = {'state': snp_status.state,
+                               'rmp_initialized': bool(snp_status.is_rmp_init),
+                               'tcb_version': snp_status.tcb_version,
+                               'reported_tcb': snp_status.reported_tcb}
+        except OSError:
+            pass
+        self.platform = platform
+        self.refreshed_at = time.time()
+
+    def get_free_asids(self, pool:str = None):
+        '''
+        Number of ASIDs not used by a running guest, in one pool (sev or sev-es) or in total.
+        The firmware only reports the total guest count, so a pool's number is the most
+        that can be free in it. None if the counts are unknown.
+        '''
+        asids, sev = self.platform.get('asids'), self.platform.get('sev')
+        if not asids or not sev:
+            return None
+        total_free = max(sum(asids.values()) - sev['guest_count'], 0)
+        if pool is None:
+            return total_free
+        return min(asids[pool], total_free)
+
+    def get_placement(self, feature:str) -> dict:
+        '''
+        Answer if a guest of the feature (sev, sev-es or sev-snp) can be started now,
+        with the reasons it can't.
+        '''
+        check_feature, pool = PLACEMENT_FEATURES[feature]
+        reasons = []
+        checks_passed = self.check_run.features.get(check_feature) if self.check_run else None
+        if checks_passed is not True:
+            reasons.append(f"{check_feature} checks did not pass")
+        sev = self.platform.get('sev')
+        if not sev or sev['state'] == 0:
+            reasons.append("SEV platform not initialized")
+        if feature == 'sev-snp':
+            snp = self.platform.get('snp')
+            if not snp or snp['state'] == 0 or not snp['rmp_initialized']:
+                reasons.append("SNP platform not initialized")
+        asids_free = self.get_free_asids(pool)
+        if not asids_free:
+            reasons.append("No free ASID")
+        return {'feature': feature, 'can_place': not reasons, 'reasons': reasons,
+                'checks_passed': checks_passed, 'asids_free': asids_free,
+                'guest_count': sev['guest_count'] if sev else None,
+                'age': round(time.time() - self.refreshed_at, 3) if self.refreshed_at else None}
+
+    def get_status(self) -> dict:
+        '''
+        Every fact the server keeps.
+        '''
+        return {'platform': self.platform, 'asids_free': self.get_free_asids(),
+                'features': self.check_run.features if self.check_run else {},
+                'checked_at': self.checked_at, 'refreshed_at': self.refreshed_at}
+
+    async def handle_request(self, request) -> dict:
+        '''
+        Answer one decoded request.
+        '''
+        if not isinstance(request, dict) or request.get('query') not in QUERIES:
+            return {'ok': False, 'error': f"query must be one of {', '.join(QUERIES)}"}
+        query_name = request['query']
+        loop = asyncio.get_running_loop()
+        if query_name == 'ping':
+            return {'ok': True}
+        # Features are accepted in any case, placement names them sev-snp, the checks SEV-SNP
+        if query_name == 'placement':
+            feature = str(request.get('feature', 'sev')).lower()
+            if feature not in PLACEMENT_FEATURES:
+                return {'ok': False,
+                        'error': f"feature must be one of {', '.join(PLACEMENT_FEATURES)}"}
+            return dict(ok=True, **self.get_placement(feature))
+        if query_name == 'checks':
+            results = self.check_run.results if self.check_run else []
+            feature = request.get('feature')
+            if feature is not None:
+                feature = str(feature).upper()
+            return {'ok': True, 'results': [result.as_dict() for result in results
+                                            if feature in (None, result.feature)]}
+        # Reading the firmware or running the checks blocks, keep answering the other clients
+        if query_name == 'refresh':
+            await loop.run_in_executor(None, self.refresh_platform)
+        elif query_name == 'recheck':
+            await loop.run_in_executor(None, self.run_checks, True)
+        return dict(ok=True, **self.get_status())
+
+    async def _handle_client(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        '''
+        Answer the requests of one connection until it's closed.
+        '''
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"ok": false, "error": "request too long"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except json.JSONDecodeError as err:
+                    response = {'ok': False, 'error': f"invalid JSON: {err}"}
+                writer.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _refresh_periodically(self):
+        '''
+        Read the volatile facts again every refresh_interval seconds.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            if self._watcher is not None:
+                self._add_changes(self._watcher.poll_changes())
+            await loop.run_in_executor(None, self.refresh_platform)
+
+    def _read_watch_events(self):
+        '''
+        Collect the inputs of the waiting inotify events.
+        '''
+        self._add_changes(self._watcher.read_events())
+
+    def _read_kernel_log(self):
+        '''
+        Collect the kernel messages logged since the last read.
+        '''
+        self._add_changes(self._watcher.read_kernel_log())
+
+    def _add_changes(self, changed:set):
+        '''
+        Remember changed inputs, the checks run again once the changes settle.
+        '''
+        if not changed:
+            return
+        if not self._changed:
+            self._loop.call_later(self._watcher.settle_time,
+                                  lambda: asyncio.ensure_future(self._recheck_changes()))
+        self._changed |= changed
+
+    async def _recheck_changes(self):
+        '''
+        Run the checks reading the inputs that changed, then the platform status.
+        '''
+        changed, self._changed = self._changed, set()
+        await self._loop.run_in_executor(None, self.run_checks, False, changed)
+        await self._loop.run_in_executor(None, self.refresh_platform)
+
+    async def serve(self, ready = None):
+        '''
+        Run the checks, then answer queries until stop is called or SIGTERM/SIGINT is received.
+        ready is called once the socket accepts connections.
+        '''
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        await self._loop.run_in_executor(None, self.run_checks)
+        await self._loop.run_in_executor(None, self.refresh_platform)
+
+        remove_stale_socket(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle_client, self.socket_path,
+                                                 limit=MAX_REQUEST_SIZE)
+        # Local clients of the same group (the scheduler) can connect
+        os.chmod(self.socket_path, 0o660)
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self._loop.add_signal_handler(signal_number, self._stop.set)
+            # Not the main thread
+            except (RuntimeError, ValueError):
+                pass
+        refresher = asyncio.ensure_future(self._refresh_periodically())
+        if self.watch:
+            self._watcher = change_watcher.ChangeWatcher(poll_interval=self.refresh_interval)
+            self._loop.add_reader(self._watcher.fileno(), self._read_watch_events)
+            if self._watcher.kernel_log_fileno() is not None:
+                self._loop.add_reader(self._watcher.kernel_log_fileno(), self._read_kernel_log)
+        if ready is not None:
+            ready()
+        try:
+            async with server:
+                await self._stop.wait()
+        finally:
+            refresher.cancel()
+            if self._watcher is not None:
+                self._loop.remove_reader(self._watcher.fileno())
+                if self._watcher.kernel_log_fileno() is not None:
+                    self._loop.remove_reader(self._watcher.kernel_log_fileno())
+                self._watcher.close()
+                self._watcher = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def stop(self):
+        '''
+        Stop the server, can be called from any thread.
+        '''
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+
+def remove_stale_socket(path:str):
+    '''
+    Remove a socket left by a server that is not running anymore.
+    Raises OSError if a server still answers on it or if the path is not a socket.
+    '''
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise OSError(f"a server is already listening on {path}")
+
+
+def query(request:dict, socket_path:str = DEFAULT_SOCKET_PATH, timeout:float = 5.0) -> dict:
+    '''
+    Send one request to a running server and return its response.
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        response = b''
+        while not response.endswith(b'\n'):
+            data = client.recv(65536)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            response += data
+    return json.loads(response)
+
+
+def serve(socket_path:str = DEFAULT_SOCKET_PATH, refresh_interval:float = DEFAULT_REFRESH_INTERVAL,
+          features = sev_api.DEFAULT_FEATURES, enablement:bool = False, test_cpu:bool = False,
+          check_timeout:float = None, non_verbose:bool = False, watch:bool = False) -> int:
+    '''
+    Run a check server until it's stopped. Returns the program exit code.
+    '''
+    server = CheckServer(socket_path, refresh_interval, features, enablement, test_cpu,
+                         check_timeout, watch=watch)
+    ready = None
+    if not non_verbose:
+        ready = lambda: print(f"Answering check queries on {socket_path}", flush=True)
+    try:
+        asyncio.run(server.serve(ready))
+    except OSError as err:
+        print_warning_message("Check server", str(err))
+        return 1
+    return 0
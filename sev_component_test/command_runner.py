@@ -0,0 +1,201 @@
+'''
+Runner for the external commands the checks still need (virsh, qemu, rpm, dpkg, git, find).
+Commands are executed directly from an argv list, without a shell, and independent
+commands can be started concurrently. Results are kept for the rest of the run.
+'''
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+import tracing
+
+# Default number of seconds a command can run before it's killed
+DEFAULT_TIMEOUT = 30
+# Default number of commands running at the same time
+DEFAULT_CONCURRENCY = 8
+
+# Result of one command. error is set when the command could not be started or timed out.
+CommandResult = namedtuple('CommandResult', ['argv', 'returncode', 'stdout', 'stderr', 'error'])
+
+_results = {}
+_results_lock = threading.Lock()
+# Commands another thread is running, as argv tuple: Future set when its result is kept
+_in_flight = {}
+# time.monotonic() value after which no command is allowed to run
+_deadline = None
+# When set, only results already kept are returned and no command is started
+_offline = False
+
+
+def set_deadline(deadline):
+    '''
+    Stop every command at the given time.monotonic() value, or never if None.
+    Commands that would start after the deadline fail without running.
+    '''
+    global _deadline # pylint: disable=global-statement
+    _deadline = deadline
+
+
+def get_deadline():
+    '''
+    Get the time.monotonic() value at which every command is stopped, None if there is none.
+    '''
+    return _deadline
+
+
+def set_offline(offline:bool):
+    '''
+    Stop starting commands, for example when replaying the facts of another host.
+    Commands without a kept result fail without running.
+    '''
+    global _offline # pylint: disable=global-statement
+    _offline = offline
+
+
+def format_command(argv) -> str:
+    '''
+    Format an argv list for printing.
+    '''
+    return ' '.join(argv)
+
+
+def get_error_message(result:CommandResult) -> str:
+    '''
+    Get the best message explaining why a command failed.
+    '''
+    if result.error:
+        return result.error
+    return result.stderr.strip()
+
+
+async def _run_command(argv:tuple, timeout, semaphore) -> CommandResult:
+    '''
+    Run one command once a slot in the asyncio semaphore is free.
+    '''
+    import asyncio # pylint: disable=import-outside-toplevel
+    async with semaphore:
+        # Commands run concurrently on the event loop thread
+        with tracing.span(format_command(argv), 'subprocess', overlapping=True) as command_span:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *argv, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            # Binary not installed or not executable
+            except OSError as err:
+                return CommandResult(argv, None, '', '', f"{argv[0]}: {err.strerror}")
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                command_span.set('timeout', True)
+                return CommandResult(argv, None, '', '',
+                                     f"{format_command(argv)} timed out after {timeout:.3g} seconds")
+            command_span.set('bytes', len(stdout) + len(stderr))
+            return CommandResult(argv, process.returncode,
+                                 stdout.decode('utf-8', errors='replace'),
+                                 stderr.decode('utf-8', errors='replace'), None)
+
+
+async def _run_all(commands:list, timeouts:dict, concurrency:int) -> list:
+    '''
+    Run every command concurrently, at most concurrency at a time.
+    '''
+    import asyncio # pylint: disable=import-outside-toplevel
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(_run_command(argv, timeouts[argv], semaphore)
+                                  for argv in commands))
+
+
+def run_commands(commands, timeout = DEFAULT_TIMEOUT,
+                 concurrency:int = DEFAULT_CONCURRENCY, timeouts = None) -> dict:
+    '''
+    Run a list of independent commands concurrently, so the wall time is the one of the
+    slowest command. Commands already run in this process are not run again, and
+    commands another thread is running are waited for.
+    timeouts can give a different timeout for some commands, as argv tuple: seconds.
+    Returns a dictionary of argv tuple: CommandResult.
+    '''
+    commands = [tuple(argv) for argv in commands]
+    # Results are collected here, clear_results can run while the commands do
+    with _results_lock:
+        found = {argv: _results[argv] for argv in commands if argv in _results}
+    pending = list(dict.fromkeys(argv for argv in commands if argv not in found))
+    # Commands that can't run before the deadline, their result is not kept
+    if pending and _offline:
+        found.update({argv: CommandResult(argv, None, '', '',
+                                          f"{format_command(argv)} not run, offline")
+                      for argv in pending})
+        pending = []
+    if pending and _deadline is not None:
+        remaining = _deadline - time.monotonic()
+        if remaining <= 0:
+            found.update({argv: CommandResult(argv, None, '', '',
+                                              f"{format_command(argv)} not run, deadline reached")
+                          for argv in pending})
+            pending = []
+    # Commands already started by another thread are waited for instead of run again
+    with _results_lock:
+        found.update({argv: _results[argv] for argv in pending if argv in _results})
+        waiting = {argv: _in_flight[argv] for argv in pending if argv in _in_flight}
+        owned = [argv for argv in pending if argv not in found and argv not in waiting]
+        for argv in owned:
+            _in_flight[argv] = Future()
+    if owned:
+        try:
+            command_timeouts = {argv: (timeouts or {}).get(argv, timeout) for argv in owned}
+            # Commands can't run past the deadline
+            if _deadline is not None:
+                command_timeouts = {argv: min(command_timeout, remaining)
+                                    for argv, command_timeout in command_timeouts.items()}
+            # asyncio is only loaded when a command has to run, cached results don't need it
+            import asyncio # pylint: disable=import-outside-toplevel
+            for result in asyncio.run(_run_all(owned, command_timeouts, concurrency)):
+                found[result.argv] = result
+        # The threads waiting for these commands get the same error
+        except BaseException as err:
+            with _results_lock:
+                for argv in owned:
+                    _in_flight.pop(argv).set_exception(err)
+            raise
+        with _results_lock:
+            for argv in owned:
+                _results[argv] = found[argv]
+                _in_flight.pop(argv).set_result(found[argv])
+    # The waiting threads get the result from the run, even if it was cleared since
+    for argv, future in waiting.items():
+        found[argv] = future.result()
+    return {argv: found[argv] for argv in commands}
+
+
+def run_command(argv, timeout = DEFAULT_TIMEOUT) -> CommandResult:
+    '''
+    Run one command, or get its result if it already ran in this process.
+    '''
+    return run_commands([argv], timeout)[tuple(argv)]
+
+
+def clear_results():
+    '''
+    Forget every command result, the next calls will run the commands again.
+    '''
+    with _results_lock:
+        _results.clear()
+
+
+def get_results() -> dict:
+    '''
+    Get a copy of every command result kept in this process, as argv tuple: CommandResult.
+    '''
+    with _results_lock:
+        return dict(_results)
+
+
+def add_results(results):
+    '''
+    Keep command results obtained elsewhere (for example the fact cache),
+    the commands won't be run again in this process.
+    '''
+    with _results_lock:
+        for result in results:
+            _results[tuple(result.argv)] = result._replace(argv=tuple(result.argv))
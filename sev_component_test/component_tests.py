@@ -2,14 +2,16 @@
 Component tests to check basic requirements to run SEV and SEV-ES.
 '''
 import string
-import subprocess
 import re
-import os
-import struct
+import shlex
 from packaging import version
-from cpuid import cpuid
 import ovmf_functions
+import command_runner
+import cpuid_table
+import msr_reader
+import host_probes
 import ioctl
+import kernel_config
 from message_printing import print_warning_message
 
 def get_sme_string(dmesg_string:string) -> string:
@@ -50,66 +52,58 @@ def find_tsme_enablement():
     # Expectation
     expectation = "AMD Memory Encrtyption Features active: SME"
     
-    # Grep command for SME
-    grep_command = "grep SME"
-
     # Complete command
-    command = "dmesg | grep SME"
+    command = "/dev/kmsg | grep SME"
     # Test findings
     found_result = "EMPTY"
 
     try:
-        # Read using dmesg
-        dmesg_read = subprocess.run(
-            "dmesg", shell=True, check=True, capture_output=True)
-        # Grep for sme
-        test_string_raw = subprocess.run(grep_command, shell=True,
-                                         input=dmesg_read.stdout, check=True, capture_output=True)
-        test_string = test_string_raw.stdout.decode('utf-8').strip()
-        # Call to get formatted TSME enablement
-        found_result = get_sme_string(test_string)
-        test_result = True
+        # Read the kernel ring buffer directly and look for the SME message
+        sme_messages = [message for message in host_probes.get_probes().read_kernel_messages()
+                        if 'SME' in message]
+        if sme_messages:
+            # Call to get formatted TSME enablement
+            found_result = get_sme_string(sme_messages[0])
+            test_result = True
 
         return component, command, found_result, expectation, test_result
-    
-    # Error when reading dmesg
-    except (subprocess.CalledProcessError) as err:
-        if err.stderr.decode("utf-8").strip():
-            print_warning_message(
-                component, err.stderr.decode("utf-8").strip())
+
+    # Error when reading the kernel messages
+    except OSError as err:
+        print_warning_message(component, str(err))
         return component, command, found_result, expectation, test_result
 
-def get_cpuid(function, register) -> int:
+def get_cpuid(function, register, cpu = None) -> int:
     '''
-    Get register value for a cpuid funtion
+    Get register value for a cpuid funtion from the cpuid snapshot table.
     '''
-    registers = ['eax', 'ebx', 'ecx', 'edx']
-
-    try:
-        # read the cpuid function
-        register_values = cpuid(function)
-    # If some value error, then return none (cpuid failed)
-    except ValueError:
-        return None
-
-    # Create a dict of the register name matched with the value
-    reg_dict = dict(zip(registers, register_values))
-
-    # Return the desired registerss
-    return reg_dict[register]
+    return cpuid_table.get_cpuid_table().get(function, register, cpu)
 
 def readmsr(msr, cpu = 0):
     '''
     Read contents of dev cpu msr to get the desired msr value.
     '''
-    # Open MSR file
-    msr_file = os.open(f'/dev/cpu/{cpu}/msr', os.O_RDONLY)
-    os.lseek(msr_file, msr, os.SEEK_SET)
-    # Read value
-    val = struct.unpack('Q', os.read(msr_file, 8))[0]
-    os.close(msr_file)
-    # Return val
-    return val
+    # Read value with the shared reader, msr files stay open for the run
+    return msr_reader.get_msr_reader().read(msr, cpu)
+
+def check_msr_bit_on_all_cpus(msr, bit):
+    '''
+    Read an MSR on every cpu and check that the given bit is set everywhere.
+    Returns if the bit is set on all cpus and a formatted result string.
+    Raises OSError if the MSR can't be read on every cpu (msr_reader.MsrReadError).
+    '''
+    matrix = msr_reader.get_msr_reader().read_matrix([msr])
+    bit_groups = msr_reader.group_cpus_by_value(matrix, 0, 1 << bit)
+    msr_name = "MSR " + hex(msr).upper().replace("0X", "0x")
+    # Same value on every cpu
+    if len(bit_groups) == 1:
+        bit_value = int(bool(next(iter(bit_groups))))
+        return bit_value == 1, msr_name + " bit " + str(bit) + " is " + str(bit_value)
+    # Bit is not consistent across cpus, probably a misconfigured socket
+    cpu_values = ", ".join(
+        str(int(bool(value))) + " on cpus " + host_probes.format_cpu_list(cpus)
+        for value, cpus in bit_groups.items())
+    return False, msr_name + " bit " + str(bit) + " differs across cpus: " + cpu_values
 
 def find_cpuid_support(feature: str):
     '''
@@ -137,22 +131,42 @@ def find_cpuid_support(feature: str):
     # Command being used
     command = "cpuid 0x8000001f"
 
-    # Read eax register from cpuid function
+    # Read eax register from cpuid function for every cpu
+    table = cpuid_table.get_cpuid_table()
+    eax_values = table.values_by_cpu(0x8000001f, 'eax')
     eax = get_cpuid(0x8000001f, 'eax')
 
     # If eax has a value, read the desired bit and return result
     if eax:
-        bin_value = bin(eax)[2:][::-1]
-        enabled_bit = bin_value[int(test_bit)]
-        if int(enabled_bit) == 1:
+        bit_values = {cpuid_table.is_bit_set(value or 0, int(test_bit))
+                      for value in eax_values.values()}
+        # Bit has to be set on every cpu in the system
+        if bit_values == {True}:
             test_result = True
         found_result = "EAX bit " + test_bit + " is " + str(test_result)
+        if len(bit_values) > 1:
+            found_result = "EAX bit " + test_bit + " differs across cpus"
+            print_warning_message(component, "cpuid values differ across cpus: "
+                                  + describe_cpuid_heterogeneity(table))
     # eax has no value, cpuid read failed, print warning return failure
     else:
         print_warning_message(component, "Could not read cpuid for eax")
         found_result = "Could not read cpuid"
     return component, command, found_result, expectation, test_result
 
+def describe_cpuid_heterogeneity(table) -> str:
+    '''
+    Format the cpuid registers that differ across sockets for printing.
+    '''
+    differences = []
+    for leaf, register, values in table.find_heterogeneity():
+        sockets = ", ".join(
+            "socket " + "/".join(str(socket) for socket in value_sockets) + " "
+            + (hex(value) if value is not None else "unread")
+            for value, value_sockets in values.items())
+        differences.append(hex(leaf) + " " + register + " (" + sockets + ")")
+    return "; ".join(differences)
+
 def get_processor_model():
     '''
     Get the processor model name from the cpuid.
@@ -164,23 +178,8 @@ def get_processor_model():
     if eax is None:
         return None
 
-    # Generate bin value
-    bin_value = bin(eax)[2:][::-1]
-
-    # Base family bits [11:8]
-    base_family = int(bin_value[8:12][::-1],2)
-    # Extended family bits [27:20]
-    extended_family = int(bin_value[20:28][::-1],2)
-
-    # Base model bits [7:4]
-    base_model = bin_value[4:8][::-1]
-    # Extended model bits [19:16]
-    extended_model = bin_value[16:20][::-1]
-
-    # Family = base family + extended family
-    family = base_family + extended_family
-    # Model = extended_model:base model
-    model = int(extended_model + base_model, 2)
+    # Family = base family + extended family, Model = extended_model:base model
+    family, model = cpuid_table.decode_family_model(eax)
 
     # Match family and model to known values
     if family == 23 and ( 0 <= model <= 15) :
@@ -216,12 +215,11 @@ def get_socket_type():
     '''
     # Read ebx register from cpuid function
     ebx = get_cpuid(0x80000001, 'ebx')
-    bin_value = bin(ebx)[2:][::-1]
+    if ebx is None:
+        return None
 
     # Bits 28:31 gives us socket type
-    socket_bin = bin_value[28:32][::-1]
-    # Return Socket Type
-    return int(socket_bin, 2)
+    return cpuid_table.decode_socket_type(ebx)
 
 def validate_cpu_model(feature: str):
     '''
@@ -279,22 +277,14 @@ def check_virtualization():
     found_result = "EMPTY"
 
     # Complete command used to find virtualization
-    command = "lscpu | grep Virtualization"
+    command = "/proc/cpuinfo flags"
     try:
-        # Get lscpu
-        lscpu_read = subprocess.run(
-            "lscpu", shell=True, check=True, capture_output=True)
-        # Get virtualization feature
-        virtualization_feature = subprocess.run("grep Virtualization", shell=True,
-                                                input=lscpu_read.stdout, check=True,
-                                                capture_output=True)
-        # Format virtualization string
-        virt_string = re.sub(
-            ' +', ' ', virtualization_feature.stdout.decode('utf-8').strip())
-
-        # Virtualization string found, grab value
-        if virt_string:
-            found_result = virt_string
+        # Get virtualization feature from the cpu flags
+        virtualization_type = host_probes.get_probes().get_virtualization_type()
+
+        # Virtualization found, grab value
+        if virtualization_type:
+            found_result = "Virtualization: " + virtualization_type
 
         # Vitualization available is AMD
         if 'AMD-V' in found_result:
@@ -303,13 +293,43 @@ def check_virtualization():
         # Return test results
         return component, command, found_result, expectation, test_result
 
-    except (subprocess.CalledProcessError) as err:
-        # Error with subprocess, print error, return failure
-        if err.stderr.decode("utf-8").strip():
-            print_warning_message(
-                component, err.stderr.decode("utf-8").strip())
+    except OSError as err:
+        # Error reading cpuinfo, print error, return failure
+        print_warning_message(component, str(err))
         return component, command, found_result, expectation, test_result
 
+# Command used to get the libvirt version
+LIBVIRT_VERSION_COMMAND = ['virsh', '-V']
+
+# List of knonw working commands to get the QEMU version in the system depending on the distro
+QEMU_VERSION_COMMANDS = {
+    'ubuntu': 'qemu-system-x86_64 --version', 'debian': 'qemu-system-x86_64 --version',
+    'fedora': 'qemu-system-x86_64 --version', 'rhel': '/usr/libexec/qemu-kvm --version',
+    'opensuse-tumbleweed': 'qemu-system-x86_64 --version',
+    'opensuse-leap': 'qemu-system-x86_64 --version',
+    'centos': '/usr/libexec/qemu-kvm --version', 'oracle': '/usr/libexec/qemu-kvm --version'
+}
+
+def get_qemu_version_command(system_os:string) -> str:
+    '''
+    Get the command used to find the QEMU version for the given distro.
+    '''
+    return QEMU_VERSION_COMMANDS.get(system_os, "kvm --version")
+
+def prefetch_version_probes(system_os:string):
+    '''
+    Run every external version probe the package checks need at the same time,
+    so the package checks only have to read the results.
+    '''
+    command_runner.run_commands([
+        LIBVIRT_VERSION_COMMAND,
+        shlex.split(get_qemu_version_command(system_os)),
+        shlex.split(ovmf_functions.get_default_ovmf_command(system_os)),
+        ovmf_functions.FIND_FV_COMMAND
+    ], timeouts={tuple(ovmf_functions.FIND_FV_COMMAND): ovmf_functions.FIND_FV_TIMEOUT})
+    # Commit dates depend on the build paths found above
+    ovmf_functions.prefetch_commit_dates(ovmf_functions.get_built_ovmf_paths())
+
 def get_version_num(line:str) -> str:
     '''
     Get version number for given feature (Kernel, libvirt, qemu,ASIDs).
@@ -345,22 +365,14 @@ def get_kernel_version():
     '''
     Get the system's kernel version number.
     '''
-    try:
-        # Grab kernel from uname -r
-        kernel = subprocess.run("uname -r", shell=True,
-                                check=True, capture_output=True)
-        kernel_string = kernel.stdout.decode('utf-8').strip()
-        # Return version and string
-        return get_version_num(kernel_string), kernel_string
-    # Error with subprocess
-    except (subprocess.CalledProcessError) as err:
-        if err.stderr.decode("utf-8").strip():
-            print_warning_message(
-                "Kernel version", err.stderr.decode("utf-8").strip())
-        else:
-            print_warning_message(
-                "Kernel version", 'kernel version not found')
+    # Grab kernel release, same as uname -r
+    kernel_string = host_probes.get_probes().get_kernel_release()
+    if not kernel_string:
+        print_warning_message(
+            "Kernel version", 'kernel version not found')
         return False, False
+    # Return version and string
+    return get_version_num(kernel_string), kernel_string
 
 
 def find_asid_count(feature:string):
@@ -413,47 +425,41 @@ def find_asid_count(feature:string):
 
     return component, command, found_result, expectation, test_result
 
+def get_asid_counts():
+    '''
+    Get the number of SEV and SEV-ES ASIDs the processor provides, from cpuid 0x8000001f.
+    ecx is the number of encrypted guests supported, ASIDs below the minimum SEV ASID in edx
+    are the SEV-ES ones. Returns None if cpuid can't be read.
+    '''
+    ecx = get_cpuid(0x8000001f, 'ecx')
+    edx = get_cpuid(0x8000001f, 'edx')
+    if ecx is None or edx is None:
+        return None
+    # Without SEV-ES every ASID can be used by SEV
+    min_sev_asid = max(edx, 1)
+    return max(ecx - (min_sev_asid - 1), 0), min_sev_asid - 1
+
 def get_linux_distro():
     '''
     Get the distribution and version of the linux system.
     '''
     try:
-        # cat to get os-release
-        cat_read = subprocess.run("cat /etc/os-release", shell=True,
-                                  check=True, capture_output=True)
-        # grep to get the desired fields
-        grep_read_version = subprocess.run("grep -w 'VERSION_ID'", shell=True,
-                                           input=cat_read.stdout, check=True, capture_output=True)
-        grep_read_name = subprocess.run("grep ID=", shell=True,
-                                        input=cat_read.stdout, check=True, capture_output=True)
-        # sed to cut down the result
-        distro_version_read = subprocess.run("sed 's/.*VERSION_ID=//'", shell=True,
-                                             input=grep_read_version.stdout, check=True, capture_output=True)
-        distro_name_read = subprocess.run("sed 's/.*ID=//'", shell=True,
-                                          input=grep_read_name.stdout, check=True, capture_output=True)
-
-        # Format in to grap the distro version number
-        linux_version = distro_version_read.stdout.decode(
-            'UTF-8').strip().replace("\"", "")
-       # Format to get the distro name
-        id_read = distro_name_read.stdout.decode(
-            'UTF-8').split('\n')
-        for read in id_read:
-            read = read.replace("\"", "")
-            if not True in [char.isdigit() for char in read]:
-                linux_os = read
-                break
-
-        return linux_os, linux_version
-    except (subprocess.CalledProcessError) as err:
-        if err.stderr.decode("utf-8").strip():
-            print_warning_message("Getting linux distribution error: ",
-                                  err.stderr.decode("utf-8").strip())
-        else:
-            print_warning_message("Getting linux distribution error: ",
-                                  "Distro can't be found")
+        # Parse os-release
+        os_release = host_probes.get_probes().read_os_release()
+    except OSError as err:
+        print_warning_message("Getting linux distribution error: ", str(err))
         return False, False
 
+    # Distro name and version number
+    linux_os = os_release.get('ID')
+    linux_version = os_release.get('VERSION_ID')
+    if not linux_os or not linux_version:
+        print_warning_message("Getting linux distribution error: ",
+                              "Distro can't be found")
+        return False, False
+
+    return linux_os, linux_version
+
 
 def check_linux_distribution():
     '''
@@ -469,7 +475,7 @@ def check_linux_distribution():
     # Will change to what the test finds
     found_result = "EMPTY"
     # Command being used
-    command = "cat /etc/os-release"
+    command = "/etc/os-release"
 
     # List of known minimum distro versions that support SEV
     min_distro_versions = {
@@ -534,6 +540,89 @@ def check_kernel(feature:str):
 
     return component, command, found_result, expectation, test_result
 
+def check_kernel_config(feature:str):
+    '''
+    Check the running kernel was built with the options a feature needs,
+    either built in or as modules. Works for distro kernels with backported
+    support, where the kernel version alone says nothing.
+    '''
+    # Turns true if test passes
+    test_result = False
+    # Name of component being tested
+    component = "Kernel config " + feature
+    # Will change to what the test finds
+    found_result = "EMPTY"
+    # Command being used
+    command = "/proc/config.gz or /boot/config-$(uname -r)"
+
+    if feature not in kernel_config.REQUIRED_OPTIONS:
+        expectation = 'NONE'
+        print_warning_message(component, "Invalid feature")
+        return component, command, found_result, expectation, test_result
+
+    # Expected test result according to the feature presented
+    expectation = ", ".join(kernel_config.REQUIRED_OPTIONS[feature]) + " set to y or m"
+
+    try:
+        options = host_probes.get_probes().read_kernel_config(
+            kernel_config.REQUIRED_OPTIONS[feature])
+    # No kernel config could be read
+    except OSError as err:
+        print_warning_message(component, str(err))
+        return component, command, found_result, expectation, test_result
+
+    # Options turned off or unknown to this kernel
+    missing = [name for name in kernel_config.REQUIRED_OPTIONS[feature]
+               if options[name] not in ('y', 'm')]
+    if missing:
+        found_result = ", ".join(f"{name}={options[name] or 'missing'}" for name in missing)
+    else:
+        found_result = "all set"
+        test_result = True
+
+    return component, command, found_result, expectation, test_result
+
+# Kernel message categories that mean a feature can't be used, see kernel_log
+KERNEL_ERROR_CATEGORIES = {'SEV': ('firmware',), 'SEV-SNP': ('snp', 'rmp')}
+
+def check_kernel_messages(feature:str):
+    '''
+    Look for kernel errors about a feature logged in this boot:
+    ccp/PSP firmware init failures for SEV, SNP_INIT errors and RMP faults for SEV-SNP.
+    '''
+    # Turns true if test passes
+    test_result = False
+    # Name of component being tested
+    component = "Kernel Log " + feature + " Errors"
+    # Will change to what the test finds
+    found_result = "EMPTY"
+    # Command being used
+    command = "/dev/kmsg | classify"
+    # Expected test result
+    expectation = "NONE"
+
+    if feature not in KERNEL_ERROR_CATEGORIES:
+        print_warning_message(component, "Invalid feature")
+        return component, command, found_result, expectation, test_result
+
+    try:
+        # Error messages of the categories of this feature, in the order they were logged
+        events = host_probes.get_probes().read_kernel_events()
+        errors = [message for _, _, category, severity, message in events
+                  if category in KERNEL_ERROR_CATEGORIES[feature] and severity == 'error']
+    # Error when reading the kernel messages
+    except OSError as err:
+        print_warning_message(component, str(err))
+        return component, command, found_result, expectation, test_result
+
+    if errors:
+        found_result = f"{len(errors)} errors, last: {errors[-1]}"
+    else:
+        found_result = "NONE"
+        test_result = True
+
+    return component, command, found_result, expectation, test_result
+
 def check_if_sev_init():
     '''
     Use SEV_PLATFORM_STATUS ioctl to see if PSTATE is valid (INIT or WORKING)
@@ -587,32 +676,28 @@ def find_libvirt_support():
     found_result = "EMPTY"
     # Command being used
     command = "virsh -V"
-    try:
-        # Get the libvirt version, will return error if not installed
-        libvirt_version_read = subprocess.run(
-            "virsh -V", shell=True, check=True, capture_output=True)
-        sed_read = subprocess.run("sed 's/.*libvirt //'", shell=True,
-                                  input=libvirt_version_read.stdout, check=True, capture_output=True)
-
-        # Call to get the formatted version number
-        if sed_read.stdout:
-            found_result = sed_read.stdout.decode("utf-8").split('\n')[0]
-            lib_virt_version = get_version_num(found_result)
-            if version.parse(lib_virt_version) >= version.parse('4.5'):
-                test_result = True
-
-        # Return test result
-        return component, command, found_result, expectation, test_result
+    # Get the libvirt version, will return error if not installed
+    libvirt_version_read = command_runner.run_command(LIBVIRT_VERSION_COMMAND)
 
-    except (subprocess.CalledProcessError) as err:
-        if err.stderr.decode("utf-8").strip():
+    if libvirt_version_read.returncode != 0:
+        if command_runner.get_error_message(libvirt_version_read):
             print_warning_message(component,
-                                  err.stderr.decode("utf-8").strip())
+                                  command_runner.get_error_message(libvirt_version_read))
         else:
             print_warning_message(component,
                                   "Grabbing libvirt version failed.")
         return component, command, found_result, expectation, test_result
 
+    # Call to get the formatted version number
+    if libvirt_version_read.stdout:
+        found_result = re.sub('.*libvirt ', '', libvirt_version_read.stdout.split('\n')[0])
+        lib_virt_version = get_version_num(found_result)
+        if version.parse(lib_virt_version) >= version.parse('4.5'):
+            test_result = True
+
+    # Return test result
+    return component, command, found_result, expectation, test_result
+
 
 def find_qemu_support(system_os:string, feature:string):
     '''
@@ -626,16 +711,8 @@ def find_qemu_support(system_os:string, feature:string):
     # Will change to what the test finds
     found_result = "EMPTY"
 
-    # List of knonw working commands to get the QEMU version in the system depending on the distro
-    qemu_command_list = {
-        'ubuntu': 'qemu-system-x86_64 --version', 'debian': 'qemu-system-x86_64 --version',
-        'fedora': 'qemu-system-x86_64 --version', 'rhel': '/usr/libexec/qemu-kvm --version',
-        'opensuse-tumbleweed': 'qemu-system-x86_64 --version',
-        'opensuse-leap': 'qemu-system-x86_64 --version',
-        'centos': '/usr/libexec/qemu-kvm --version', 'oracle': '/usr/libexec/qemu-kvm --version'
-    }
     # Command being used
-    command = qemu_command_list.get(system_os, "kvm --version")
+    command = get_qemu_version_command(system_os)
 
     # Expected test result
     if feature == 'SEV':
@@ -649,32 +726,31 @@ def find_qemu_support(system_os:string, feature:string):
         print_warning_message(component, "Invalid feature provided")
         return component, command, found_result, expectation, test_result
 
-    try:
-        # Get QEMU version
-        qemu_version_read = subprocess.run(
-            command, shell=True, check=True, capture_output=True)
-        sed_read = subprocess.run("sed 's/.*version //'", shell=True,
-                                  input=qemu_version_read.stdout, check=True, capture_output=True)
-        # Grab call result
-        if sed_read:
-            found_result = sed_read.stdout.decode("utf-8").split('\n')[0]
-            qemu_version = get_version_num(found_result)
-            # If minimum version is met, test passes
-            if version.parse(qemu_version) >= version.parse(min_version):
-                test_result = True
-        # Return results
-        return component, command, found_result, expectation, test_result
-    except (subprocess.CalledProcessError) as err:
-        if err.stderr.decode("utf-8").strip():
+    # Get QEMU version
+    qemu_version_read = command_runner.run_command(shlex.split(command))
+
+    if qemu_version_read.returncode != 0:
+        if command_runner.get_error_message(qemu_version_read):
             print_warning_message("Getting QEMU version error: ",
-                                  err.stderr.decode("utf-8").strip())
+                                  command_runner.get_error_message(qemu_version_read))
         return component, command, found_result, expectation, test_result
 
+    # Grab call result
+    if qemu_version_read.stdout:
+        found_result = re.sub('.*version ', '', qemu_version_read.stdout.split('\n')[0])
+        qemu_version = get_version_num(found_result)
+        # If minimum version is met, test passes
+        if version.parse(qemu_version) >= version.parse(min_version):
+            test_result = True
+    # Return results
+    return component, command, found_result, expectation, test_result
+
 def test_all_ovmf_paths(system_os:string, min_commit_date):
     '''
     Function to get and print all of the found OVMF paths, whether default or manually built.
     If at least one meets the minimum, test passes.
-    Will return a list of paths for printing.
+    Will return a list of (component, command, found_result, expectation, test_result)
+    tuples, one for each path.
     '''
     # At least one path meets the minimum
     one_path_true = False
@@ -696,13 +772,8 @@ def test_all_ovmf_paths(system_os:string, min_commit_date):
 
     # No paths found
     if not is_default_pkg_install and not built_ovmf_paths:
-        paths_found.append({
-                'component': component,
-                'command': ovmf_default_command,
-                'found_result': "NO PATHS FOUND!",
-                'expectation': min_commit_date.strftime("%Y-%m-%d "),
-                'test_result': one_path_true
-            })
+        paths_found.append((component, ovmf_default_command, "NO PATHS FOUND!",
+                            min_commit_date.strftime("%Y-%m-%d "), one_path_true))
         return one_path_true, paths_found
 
     # Path to default package in most distros
@@ -712,23 +783,14 @@ def test_all_ovmf_paths(system_os:string, min_commit_date):
             one_path_true = True
             curr_path_true = True
         # Add default path results to the list.
-        path_components = {
-            'component': component,
-            'command': ovmf_default_command,
-            'found_result': default_ovmf_path + ' ' + default_pkg_date.strftime("%Y-%m-%d "),
-            'expectation': min_commit_date.strftime("%Y-%m-%d "),
-            'test_result': curr_path_true
-        }
-        paths_found.append(path_components)
+        paths_found.append((component, ovmf_default_command,
+                            default_ovmf_path + ' ' + default_pkg_date.strftime("%Y-%m-%d "),
+                            min_commit_date.strftime("%Y-%m-%d "), curr_path_true))
     elif is_default_pkg_install and not default_ovmf_path:
-        paths_found.append(path_components = {
-            'component': component,
-            'command': ovmf_default_command,
-            'found_result': "Could not find default installation path",
-            'expectation': min_commit_date.strftime("%Y-%m-%d "),
-            'test_result': curr_path_true
-        })
-   
+        paths_found.append((component, ovmf_default_command,
+                            "Could not find default installation path",
+                            min_commit_date.strftime("%Y-%m-%d "), curr_path_true))
+
     if built_ovmf_paths:
         for path in built_ovmf_paths:
             curr_path_true = False
@@ -741,14 +803,9 @@ def test_all_ovmf_paths(system_os:string, min_commit_date):
                 one_path_true = True
                 curr_path_true = True
             # Add current path results to the list
-            path_components = {
-                'component': component,
-                'command': built_command,
-                'found_result': path + ' ' + built_ovmf_date.strftime("%Y-%m-%d "),
-                'expectation': min_commit_date.strftime("%Y-%m-%d "),
-                'test_result': curr_path_true
-            }
-            paths_found.append(path_components)
+            paths_found.append((component, built_command,
+                                path + ' ' + built_ovmf_date.strftime("%Y-%m-%d "),
+                                min_commit_date.strftime("%Y-%m-%d "), curr_path_true))
 
     return one_path_true, paths_found
 
@@ -770,13 +827,7 @@ def check_sme_enablement():
 
     # Read MSR and check bit 23 for enablement
     try:
-        msr_value = readmsr(0xC0010010)
-        bin_value = bin(msr_value)[2:][::-1]
-        bin_value = bin_value.ljust(64, "0")
-        meme_val = bin_value[23]
-        if int(meme_val) == 1:
-            test_result = True
-        found_result = "MSR 0xC0010010 bit 23 is " + str(meme_val)
+        test_result, found_result = check_msr_bit_on_all_cpus(msr_reader.MSR_SYSCFG, 23)
         return component, command, found_result, expectation, test_result
     # If OSerror, MSR failed, print warning and return failure
     except OSError as err:
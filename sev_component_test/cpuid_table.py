@@ -0,0 +1,253 @@
+'''
+CPUID snapshot engine. Read every leaf the tool needs once for every logical cpu
+and keep the values in a compact array backed table, so cpuid checks become lookups.
+'''
+import os
+import struct
+import threading
+from array import array
+import host_probes
+import tracing
+
+# Leaves read for every cpu
+CPUID_LEAVES = (0x0, 0x1, 0x80000000, 0x80000001, 0x80000008, 0x8000001f)
+# Register names in the order cpuid returns them
+REGISTERS = ('eax', 'ebx', 'ecx', 'edx')
+
+# Bits that are expected to be the same on every cpu of a healthy system.
+# Per cpu fields (APIC IDs, core counts) are masked out.
+UNIFORM_MASKS = {
+    (0x1, 'eax'): 0xFFFFFFFF,
+    (0x1, 'ecx'): 0xFFFFFFFF,
+    (0x1, 'edx'): 0xFFFFFFFF,
+    (0x80000001, 'eax'): 0xFFFFFFFF,
+    (0x80000001, 'ebx'): 0xF0000000,
+    (0x80000001, 'ecx'): 0xFFFFFFFF,
+    (0x80000001, 'edx'): 0xFFFFFFFF,
+    (0x8000001f, 'eax'): 0xFFFFFFFF,
+    (0x8000001f, 'ebx'): 0xFFFFFFFF,
+    (0x8000001f, 'ecx'): 0xFFFFFFFF,
+    (0x8000001f, 'edx'): 0xFFFFFFFF,
+}
+
+
+def get_bits(value:int, low:int, high:int) -> int:
+    '''
+    Get bits [high:low] (inclusive) out of a register value.
+    '''
+    return (value >> low) & ((1 << (high - low + 1)) - 1)
+
+
+def is_bit_set(value:int, bit:int) -> bool:
+    '''
+    Check if a single bit is set in a register value.
+    '''
+    return bool((value >> bit) & 1)
+
+
+def decode_family_model(eax:int):
+    '''
+    Decode the cpu family and model from cpuid function 0x80000001 eax.
+    Family = base family [11:8] + extended family [27:20]
+    Model = extended model [19:16] : base model [7:4]
+    '''
+    family = get_bits(eax, 8, 11) + get_bits(eax, 20, 27)
+    model = (get_bits(eax, 16, 19) << 4) | get_bits(eax, 4, 7)
+    return family, model
+
+
+def decode_socket_type(ebx:int) -> int:
+    '''
+    Decode the package (socket) type from cpuid function 0x80000001 ebx bits [31:28].
+    '''
+    return get_bits(ebx, 28, 31)
+
+
+def decode_cbit_position(ebx:int) -> int:
+    '''
+    Decode the C-bit position from cpuid function 0x8000001f ebx bits [5:0].
+    '''
+    return get_bits(ebx, 0, 5)
+
+
+def read_leaves_from_device(cpu:int):
+    '''
+    Read all the leaves for one cpu through /dev/cpu/N/cpuid.
+    Returns a list of register tuples (None for leaves that could not be read).
+    Raises OSError if the device can't be opened.
+    '''
+    leaves = []
+    with tracing.span(f'cpuid cpu {cpu}', 'cpuid', bytes=16 * len(CPUID_LEAVES)):
+        cpuid_file = os.open(f'/dev/cpu/{cpu}/cpuid', os.O_RDONLY)
+        try:
+            for leaf in CPUID_LEAVES:
+                # The file offset selects the leaf (low 32 bits) and subleaf (high 32 bits)
+                try:
+                    leaves.append(struct.unpack('4I', os.pread(cpuid_file, 16, leaf)))
+                except OSError:
+                    leaves.append(None)
+        finally:
+            os.close(cpuid_file)
+    return leaves
+
+
+def read_leaves_pinned(cpus:list) -> dict:
+    '''
+    Read all the leaves for the given cpus with the cpuid extension,
+    from a helper thread pinned to each cpu in turn.
+    '''
+    # Imported here so the native extension is only needed for this fallback
+    from cpuid import cpuid
+
+    results = {}
+
+    def pinned_reader():
+        for cpu in cpus:
+            try:
+                os.sched_setaffinity(0, {cpu})
+            except OSError:
+                continue
+            leaves = []
+            with tracing.span(f'cpuid pinned cpu {cpu}', 'cpuid'):
+                for leaf in CPUID_LEAVES:
+                    try:
+                        leaves.append(tuple(cpuid(leaf)))
+                    except ValueError:
+                        leaves.append(None)
+            results[cpu] = leaves
+
+    reader = threading.Thread(target=pinned_reader, name='cpuid-reader')
+    reader.start()
+    reader.join()
+    return results
+
+
+def get_cpu_socket(cpu:int) -> int:
+    '''
+    Get the physical package (socket) a logical cpu belongs to.
+    '''
+    try:
+        with open(f'/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id',
+                  'r', encoding='utf-8') as package_id:
+            return int(package_id.read())
+    except (OSError, ValueError):
+        return 0
+
+
+class CpuidTable:
+    '''
+    Table with the cpuid registers of every leaf in CPUID_LEAVES for every cpu.
+    Values are stored in a flat unsigned int array, 4 registers per leaf per cpu.
+    '''
+    def __init__(self, cpus:list, sockets:list, rows:dict):
+        self.cpus = list(cpus)
+        self.sockets = list(sockets)
+        self._cpu_index = {cpu: index for index, cpu in enumerate(self.cpus)}
+        self._leaf_index = {leaf: index for index, leaf in enumerate(CPUID_LEAVES)}
+        self._values = array('I', bytes(4 * 4 * len(CPUID_LEAVES) * len(self.cpus)))
+        # One flag per (cpu, leaf), turns 1 if the leaf was read
+        self._valid = bytearray(len(CPUID_LEAVES) * len(self.cpus))
+        for cpu, leaves in rows.items():
+            for leaf_index, registers in enumerate(leaves):
+                if registers is None:
+                    continue
+                slot = self._cpu_index[cpu] * len(CPUID_LEAVES) + leaf_index
+                self._valid[slot] = 1
+                self._values[slot * 4:slot * 4 + 4] = array('I', registers)
+
+    def get(self, leaf:int, register:str, cpu=None):
+        '''
+        Get a register value for a leaf. Uses the first cpu if none is given.
+        Returns None if the value was not read.
+        '''
+        if cpu is None:
+            if not self.cpus:
+                return None
+            cpu = self.cpus[0]
+        if cpu not in self._cpu_index or leaf not in self._leaf_index:
+            return None
+        slot = self._cpu_index[cpu] * len(CPUID_LEAVES) + self._leaf_index[leaf]
+        if not self._valid[slot]:
+            return None
+        return self._values[slot * 4 + REGISTERS.index(register)]
+
+    def get_rows(self) -> dict:
+        '''
+        Get the registers of every leaf for every cpu, as cpu: list of (eax, ebx, ecx, edx)
+        or None for leaves that were not read. The rows can rebuild the same table.
+        '''
+        rows = {}
+        for index, cpu in enumerate(self.cpus):
+            rows[cpu] = []
+            for leaf_index in range(len(CPUID_LEAVES)):
+                slot = index * len(CPUID_LEAVES) + leaf_index
+                rows[cpu].append(tuple(self._values[slot * 4:slot * 4 + 4])
+                                 if self._valid[slot] else None)
+        return rows
+
+    def values_by_cpu(self, leaf:int, register:str) -> dict:
+        '''
+        Get a register value for a leaf for every cpu, as cpu: value.
+        '''
+        return {cpu: self.get(leaf, register, cpu) for cpu in self.cpus}
+
+    def find_heterogeneity(self) -> list:
+        '''
+        Compare the registers that should be uniform across every cpu.
+        Returns a list of (leaf, register, {value: [sockets]}) for every mismatch found.
+        '''
+        mismatches = []
+        for (leaf, register), mask in UNIFORM_MASKS.items():
+            seen = {}
+            for cpu, socket in zip(self.cpus, self.sockets):
+                value = self.get(leaf, register, cpu)
+                masked = value & mask if value is not None else None
+                sockets = seen.setdefault(masked, [])
+                if socket not in sockets:
+                    sockets.append(socket)
+            if len(seen) > 1:
+                mismatches.append((leaf, register, seen))
+        return mismatches
+
+
+def build_cpuid_table(cpus=None) -> CpuidTable:
+    '''
+    Read the cpuid snapshot for every online cpu.
+    Use /dev/cpu/N/cpuid when available, otherwise pin a thread to each cpu.
+    '''
+    if cpus is None:
+        cpus = host_probes.get_probes().get_online_cpus()
+    rows = {}
+    try:
+        for cpu in cpus:
+            rows[cpu] = read_leaves_from_device(cpu)
+    # cpuid device not available (module not loaded or no permissions)
+    except OSError:
+        rows = read_leaves_pinned(cpus)
+    cpus = [cpu for cpu in cpus if cpu in rows]
+    return CpuidTable(cpus, [get_cpu_socket(cpu) for cpu in cpus], rows)
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_cpuid_table() -> CpuidTable:
+    '''
+    Get the cpuid snapshot for this run, reading it the first time it's needed.
+    '''
+    global _table
+    with _table_lock:
+        if _table is None:
+            _table = build_cpuid_table()
+        return _table
+
+
+def set_cpuid_table(table:CpuidTable):
+    '''
+    Replace the cpuid snapshot for this run, for example with one from the fact cache.
+    Passing None reads it again the next time it's needed.
+    '''
+    global _table
+    with _table_lock:
+        _table = table
@@ -1,6 +1,9 @@
 '''Functions used to calculate entropy of given data'''
 import math
 
+# Entropy in bits per byte from which a page of guest memory is considered encrypted
+ENCRYPTED_ENTROPY = 7
+
 def shannon_entropy(seen:dict, length:int) -> int:
     '''
     Performs Shannon entropy analysis on given data
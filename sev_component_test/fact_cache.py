@@ -0,0 +1,151 @@
+'''
+Fact cache kept on disk between runs. Most facts the checks look at only change at
+reboot or when packages change: the cpuid snapshot, the MSR values, the SME kernel
+messages and the output of the external commands (libvirt, QEMU and OVMF package
+versions, the filesystem scan for built OVMF and the git commit dates).
+The cache is valid for the boot it was written in, as long as the package databases,
+the binaries of the commands and the scanned directories keep their modification time.
+The kernel config options are kept by kernel build ID instead, they stay valid across
+reboots into the same kernel even when the rest of the cache is stale.
+Volatile state (SEV platform status, guest count) is never cached.
+'''
+import json
+import os
+import shutil
+import command_runner
+import cpuid_table
+import host_probes
+import kernel_config
+import msr_reader
+import ovmf_functions
+
+# Changes when the format of the cache file changes
+CACHE_VERSION = 1
+# Default cache file
+DEFAULT_CACHE_PATH = '/var/cache/sev-component-test/facts.json'
+# Package databases of the supported distros, their modification time changes with any package
+PACKAGE_DATABASES = ['/var/lib/dpkg/status', '/var/lib/rpm/rpmdb.sqlite', '/var/lib/rpm/Packages',
+                     '/usr/lib/sysimage/rpm/rpmdb.sqlite', '/usr/lib/sysimage/rpm/Packages']
+# Kernel messages kept in the cache, the only ones a check looks at
+KERNEL_MESSAGE_FILTER = 'SME'
+
+
+def get_source_paths(results:dict) -> list:
+    '''
+    Get the paths whose modification time the cached facts depend on:
+    package databases, binaries of the commands run, directories found by the
+    built OVMF scan and git directories the commit dates were read from.
+    '''
+    paths = list(PACKAGE_DATABASES)
+    for argv, result in results.items():
+        binary = shutil.which(argv[0])
+        if binary:
+            paths.append(binary)
+        if argv == tuple(ovmf_functions.FIND_FV_COMMAND):
+            paths += [path for path in result.stdout.split('\n') if path]
+        elif argv[0] == 'git' and '--git-dir' in argv:
+            paths.append(argv[argv.index('--git-dir') + 1])
+    return sorted(set(paths))
+
+
+def get_modification_times(paths) -> dict:
+    '''
+    Get the modification time in nanoseconds of every path, None for missing paths.
+    '''
+    times = {}
+    for path in paths:
+        try:
+            times[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            times[path] = None
+    return times
+
+
+def load_facts(path:str = DEFAULT_CACHE_PATH) -> bool:
+    '''
+    Use the facts cached by an earlier run if they are still valid.
+    Returns True if they were loaded, False if the probes have to run again.
+    Either way the MSR values read from now on are kept for save_facts.
+    '''
+    facts = None
+    try:
+        with open(path, 'r', encoding='utf-8') as cache_file:
+            facts = json.load(cache_file)
+        # Keyed by kernel build, valid whatever else changed
+        kernel_config.add_cached_configs(facts.get('kernel_configs', {}))
+        if (facts.get('version') != CACHE_VERSION
+                or facts.get('boot_id') != host_probes.read_boot_id()
+                or get_modification_times(facts['sources']) != facts['sources']):
+            facts = None
+    # No cache yet, unreadable or from an older version of the tool
+    except (OSError, ValueError, KeyError, AttributeError):
+        facts = None
+
+    if facts is None:
+        msr_reader.set_msr_reader(msr_reader.CachingMsrReader())
+        return False
+
+    command_runner.add_results(command_runner.CommandResult(*result)
+                               for result in facts['commands'])
+    if facts['cpuid'] is not None:
+        rows = {int(cpu): [tuple(registers) if registers else None for registers in leaves]
+                for cpu, leaves in facts['cpuid']['rows'].items()}
+        cpuid_table.set_cpuid_table(cpuid_table.CpuidTable(
+            facts['cpuid']['cpus'], facts['cpuid']['sockets'], rows))
+    msr_reader.set_msr_reader(msr_reader.CachingMsrReader(
+        {(msr, cpu): value for msr, cpu, value in facts['msrs']}))
+    if facts['kernel_messages'] is not None:
+        host_probes.set_kernel_messages(facts['kernel_messages'])
+    return True
+
+
+def get_facts() -> dict:
+    '''
+    Collect the facts of this run that can be cached.
+    Commands that could not run or timed out are left out, they are tried again next time.
+    '''
+    results = {argv: result for argv, result in command_runner.get_results().items()
+               if result.error is None}
+    table = cpuid_table.get_cpuid_table()
+    reader = msr_reader.get_msr_reader()
+    msrs = []
+    if isinstance(reader, msr_reader.CachingMsrReader):
+        msrs = [[msr, cpu, value] for (msr, cpu), value in sorted(reader.values.items())]
+    try:
+        kernel_messages = [message for message in host_probes.read_kernel_messages()
+                           if KERNEL_MESSAGE_FILTER in message]
+    except OSError:
+        kernel_messages = None
+    return {
+        'version': CACHE_VERSION,
+        'boot_id': host_probes.read_boot_id(),
+        'sources': get_modification_times(get_source_paths(results)),
+        'commands': [list(result) for result in results.values()],
+        'cpuid': {'cpus': table.cpus, 'sockets': table.sockets,
+                  'rows': table.get_rows()} if table.cpus else None,
+        'msrs': msrs,
+        'kernel_messages': kernel_messages,
+        'kernel_configs': kernel_config.get_cached_configs()
+    }
+
+
+def save_facts(path:str = DEFAULT_CACHE_PATH):
+    '''
+    Write the facts of this run to the cache file.
+    The file is written next to its final path and renamed over it,
+    so a run reading it at the same time never sees a partial file.
+    Raises OSError if it can't be written.
+    '''
+    facts = get_facts()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o755, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(facts, cache_file)
+        os.replace(temporary_path, path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
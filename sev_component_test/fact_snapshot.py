@@ -0,0 +1,397 @@
+'''
+Fact snapshots: every raw fact a run read on a host (cpuid leaves, MSR values, SEV
+platform status structures, host probe answers such as os-release and OVMF paths, and
+the output of the version commands) written to one versioned JSON file.
+The evaluator runs the same checks against snapshots instead of the host, on a process
+pool, so a whole fleet can be triaged again from one machine when the minimum versions
+change. Nothing is read from the machine running the evaluation and no command is started.
+'''
+import ctypes
+import errno
+import functools
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import sev_api
+import command_runner
+import cpuid_table
+import host_probes
+import ioctl
+import msr_reader
+from message_printing import print_overall_result
+
+# Changes when the format of the snapshot file changes
+SNAPSHOT_VERSION = 1
+# Host probes whose answers are recorded, every probe a check uses
+RECORDED_PROBES = ('read_os_release', 'get_kernel_release', 'get_virtualization_type',
+                   'read_kernel_messages', 'read_kernel_events', 'read_kernel_config',
+                   'get_online_cpus', 'path_exists', 'find_files')
+# Answers of filesystem probes a snapshot has no record of, other probes raise OSError
+UNRECORDED_ANSWERS = {'path_exists': False, 'find_files': []}
+# MSRs read on every cpu when the snapshot is taken, even if no check read them
+SNAPSHOT_MSRS = (msr_reader.MSR_SYSCFG, msr_reader.MSR_RMP_BASE, msr_reader.MSR_RMP_END)
+# Status commands recorded, replayed by SnapshotSevBackend
+SNAPSHOT_COMMANDS = {ioctl.SEVCommand.SEV_PLATFORM_STATUS: 'platform_status',
+                     ioctl.SEVCommand.SNP_PLATFORM_STATUS: 'snp_platform_status'}
+
+
+def encode_error(err:OSError) -> list:
+    '''
+    Encode an OSError as [errno, message, filename] so it can be raised again later.
+    '''
+    if err.errno is None:
+        return [None, str(err), None]
+    return [err.errno, err.strerror, err.filename]
+
+
+def decode_error(error:list) -> OSError:
+    '''
+    Rebuild an OSError encoded by encode_error.
+    '''
+    error_number, message, filename = error
+    if error_number is None:
+        return OSError(message)
+    if filename is None:
+        return OSError(error_number, message)
+    return OSError(error_number, message, filename)
+
+
+class RecordingMsrReader(msr_reader.CachingMsrReader):
+    '''
+    MSR reader keeping every value it read and every error it got.
+    '''
+    def __init__(self, values:dict = None, max_workers:int = 16):
+        super().__init__(values, max_workers)
+        # (msr, cpu): encoded OSError
+        self.errors = {}
+
+    def read(self, msr:int, cpu:int = 0) -> int:
+        try:
+            return super().read(msr, cpu)
+        except OSError as err:
+            self.errors[(msr, cpu)] = encode_error(err)
+            raise
+
+
+class ReplayMsrReader(msr_reader.MsrReader):
+    '''
+    MSR reader answering from the values and errors of a snapshot, MSRs are never read.
+    '''
+    def __init__(self, values:dict, errors:dict):
+        super().__init__()
+        self.values = values
+        self.errors = errors
+
+    def read(self, msr:int, cpu:int = 0) -> int:
+        if (msr, cpu) in self.values:
+            return self.values[(msr, cpu)]
+        if (msr, cpu) in self.errors:
+            raise decode_error(self.errors[(msr, cpu)])
+        raise OSError(errno.ENODATA, f"MSR {msr:#x} of cpu {cpu} not in the snapshot")
+
+    def read_matrix(self, msrs, cpus=None) -> dict:
+        if cpus is None:
+            # The cpus of the snapshot's host, not the ones of this machine
+            cpus = host_probes.get_probes().get_online_cpus()
+        # Values are in memory, no need for the reading threads
+        matrix = {}
+        errors = {}
+        for cpu in cpus:
+            try:
+                matrix[cpu] = self.read_set(msrs, cpu)
+            except OSError as err:
+                errors[cpu] = err
+        return msr_reader.check_matrix(matrix, errors)
+
+
+class SnapshotSevBackend:
+    '''
+    Device backend for ioctl.SevDevice answering the status commands with the
+    structures or errors recorded in a snapshot.
+    '''
+    def __init__(self, statuses:dict):
+        self.statuses = statuses
+
+    def open(self, path:str) -> int:
+        '''
+        Open the replayed device, errors are raised by the commands.
+        '''
+        return 0
+
+    def close(self, handle:int):
+        '''
+        Close the replayed device, nothing to release.
+        '''
+
+    def ioctl(self, handle:int, request:int, command:ioctl.SEVIssueCommand):
+        '''
+        Copy the recorded structure of a command, or raise the recorded error.
+        '''
+        name = SNAPSHOT_COMMANDS.get(ioctl.SEVCommand(command.cmd))
+        answer = self.statuses.get(name)
+        if answer is None:
+            raise OSError(errno.ENODATA, f"{ioctl.SEVCommand(command.cmd).name} not in the snapshot")
+        if 'error' in answer:
+            raise decode_error(answer['error'])
+        data = bytes.fromhex(answer['data'])
+        ctypes.memmove(command.data, data, len(data))
+
+
+class FactRecorder:
+    '''
+    Records the raw facts read by the checks, see get_snapshot. The host probe answers
+    are recorded by the functions in probes, given to the checks as host probe
+    replacements (sev_api.run_checks or a CheckScheduler), the host_probes module is never
+    changed. base_probes replaces host_probes functions for the recorded probes, as
+    name: function. The MSR values are recorded once start is called.
+    '''
+    def __init__(self, base_probes:dict = None):
+        # Probe name: {JSON encoded arguments: {'value': answer} or {'error': encoded OSError}}
+        self.answers = {name: {} for name in RECORDED_PROBES}
+        self._lock = threading.Lock()
+        base = host_probes.Probes(base_probes)
+        self.probes = {name: self._record(name, getattr(base, name)) for name in RECORDED_PROBES}
+
+    def _record(self, name:str, probe):
+        '''
+        Wrap a host probe so its answers are recorded.
+        '''
+        def recorded_probe(*args):
+            key = json.dumps(args)
+            try:
+                answer = probe(*args)
+            except OSError as err:
+                with self._lock:
+                    self.answers[name][key] = {'error': encode_error(err)}
+                raise
+            with self._lock:
+                self.answers[name][key] = {'value': answer}
+            return answer
+        return recorded_probe
+
+    def start(self):
+        '''
+        Start recording the MSR values, the ones already known (from the fact cache) are kept.
+        '''
+        reader = msr_reader.get_msr_reader()
+        if not isinstance(reader, RecordingMsrReader):
+            values = reader.values if isinstance(reader, msr_reader.CachingMsrReader) else None
+            msr_reader.set_msr_reader(RecordingMsrReader(values))
+
+    def get_snapshot(self) -> dict:
+        '''
+        Get every fact recorded since start. The platform status, the cpuid leaves
+        and the MSRs SNAPSHOT_MSRS are read if no check did, so every snapshot has them.
+        '''
+        reader = msr_reader.get_msr_reader()
+        # The online cpus are recorded too
+        with host_probes.using_probes(host_probes.Probes(self.probes)):
+            try:
+                reader.read_matrix(SNAPSHOT_MSRS)
+            except OSError:
+                pass
+            table = cpuid_table.get_cpuid_table()
+        device = ioctl.get_sev_device()
+        statuses = {}
+        for command, name in SNAPSHOT_COMMANDS.items():
+            try:
+                status = (device.platform_status() if command == ioctl.SEVCommand.SEV_PLATFORM_STATUS
+                          else device.snp_platform_status())
+                statuses[name] = {'data': bytes(status).hex()}
+            except OSError as err:
+                statuses[name] = {'error': encode_error(err)}
+        try:
+            boot_id = host_probes.read_boot_id()
+        except OSError:
+            boot_id = None
+        with self._lock:
+            answers = {name: dict(probe_answers) for name, probe_answers in self.answers.items()}
+        return {
+            'version': SNAPSHOT_VERSION,
+            'host': socket.gethostname(),
+            'taken_at': time.time(),
+            'boot_id': boot_id,
+            'probes': answers,
+            'commands': [list(result) for result in command_runner.get_results().values()],
+            'cpuid': {'cpus': table.cpus, 'sockets': table.sockets,
+                      'rows': table.get_rows()} if table.cpus else None,
+            'msrs': [[msr, cpu, value] for (msr, cpu), value in
+                     sorted(getattr(reader, 'values', {}).items())],
+            'msr_errors': [[msr, cpu, error] for (msr, cpu), error in
+                           sorted(getattr(reader, 'errors', {}).items())],
+            'sev': statuses
+        }
+
+    def save(self, path:str):
+        '''
+        Write the snapshot to a file, renamed over its final path once complete.
+        Raises OSError if it can't be written.
+        '''
+        snapshot = self.get_snapshot()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.replace(temporary_path, path)
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+
+
+def load_snapshot(path:str) -> dict:
+    '''
+    Read a snapshot file. Raises OSError if it can't be read and ValueError
+    if it's not a snapshot of a supported version.
+    '''
+    with open(path, 'r', encoding='utf-8') as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} fact snapshot")
+    return snapshot
+
+
+def _replay_probe(name:str, answers:dict):
+    '''
+    Make a host probe answering from recorded answers.
+    '''
+    def replayed_probe(*args):
+        answer = answers.get(json.dumps(args))
+        if answer is None:
+            if name in UNRECORDED_ANSWERS:
+                return UNRECORDED_ANSWERS[name]
+            raise OSError(errno.ENODATA, f"{name} not in the snapshot")
+        if 'error' in answer:
+            raise decode_error(answer['error'])
+        return answer['value']
+    return replayed_probe
+
+
+def replay_snapshot(snapshot:dict) -> dict:
+    '''
+    Make the checks of this process read the facts of a snapshot: command results,
+    cpuid leaves, MSRs and SEV platform status. Returns the host probe replacements
+    to give to sev_api.run_checks. Commands the snapshot has no result for must not run,
+    see command_runner.set_offline.
+    '''
+    command_runner.clear_results()
+    command_runner.add_results(command_runner.CommandResult(*result)
+                               for result in snapshot['commands'])
+    cpuid = snapshot['cpuid'] or {'cpus': [], 'sockets': [], 'rows': {}}
+    rows = {int(cpu): [tuple(registers) if registers else None for registers in leaves]
+            for cpu, leaves in cpuid['rows'].items()}
+    cpuid_table.set_cpuid_table(cpuid_table.CpuidTable(cpuid['cpus'], cpuid['sockets'], rows))
+    msr_reader.set_msr_reader(ReplayMsrReader(
+        {(msr, cpu): value for msr, cpu, value in snapshot['msrs']},
+        {(msr, cpu): error for msr, cpu, error in snapshot['msr_errors']}))
+    ioctl.set_sev_device(ioctl.SevDevice(backend=SnapshotSevBackend(snapshot['sev'])))
+    return {name: _replay_probe(name, snapshot['probes'].get(name, {}))
+            for name in RECORDED_PROBES}
+
+
+def evaluate_snapshot(path:str, features = sev_api.DEFAULT_FEATURES, enablement:bool = False,
+                      test_cpu:bool = False) -> dict:
+    '''
+    Run the checks against the facts of one snapshot file.
+    Returns a dictionary with the snapshot path, its host, the overall and per
+    feature results, the failed check results, and the error if it couldn't be read.
+    '''
+    evaluation = {'snapshot': path, 'host': None, 'passed': None, 'features': {},
+                  'failures': [], 'error': None}
+    try:
+        snapshot = load_snapshot(path)
+        evaluation['host'] = snapshot.get('host')
+        probes = replay_snapshot(snapshot)
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        evaluation['error'] = str(err)
+        return evaluation
+    check_run = sev_api.run_checks(features, enablement=enablement, test_cpu=test_cpu, probes=probes)
+    evaluation['passed'] = check_run.passed
+    evaluation['features'] = check_run.features
+    evaluation['failures'] = [result.as_dict() for result in check_run.get_failures()]
+    return evaluation
+
+
+def find_snapshots(paths) -> list:
+    '''
+    Expand directories into the .json snapshot files they contain.
+    '''
+    snapshots = []
+    for path in paths:
+        if os.path.isdir(path):
+            snapshots += sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.endswith('.json'))
+        else:
+            snapshots.append(path)
+    return snapshots
+
+
+def evaluate_snapshots(paths, features = sev_api.DEFAULT_FEATURES, enablement:bool = False,
+                       test_cpu:bool = False, workers:int = None):
+    '''
+    Evaluate snapshot files on a pool of worker processes, yields the evaluation of
+    every snapshot in order. workers is the number of processes, the number of cpus
+    by default. With one worker the snapshots are evaluated in this process.
+    '''
+    paths = list(paths)
+    evaluate = functools.partial(evaluate_snapshot, features=features,
+                                 enablement=enablement, test_cpu=test_cpu)
+    if workers == 1:
+        command_runner.set_offline(True)
+        try:
+            for path in paths:
+                yield evaluate(path)
+        finally:
+            # Forget the replayed facts, the next checks read this host again
+            command_runner.set_offline(False)
+            command_runner.clear_results()
+            cpuid_table.set_cpuid_table(None)
+            msr_reader.set_msr_reader(None)
+            ioctl.set_sev_device(None)
+        return
+    workers = workers or os.cpu_count() or 1
+    # Big enough chunks that the pool overhead stays small next to the checks
+    chunk_size = max(1, min(64, len(paths) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=command_runner.set_offline,
+                             initargs=(True,)) as pool:
+        yield from pool.map(evaluate, paths, chunksize=chunk_size)
+
+
+def evaluate(paths, features = sev_api.DEFAULT_FEATURES, enablement:bool = False,
+             test_cpu:bool = False, workers:int = None, output = None,
+             non_verbose:bool = False) -> int:
+    '''
+    Evaluate snapshot files and directories, print the hosts that did not pass and a summary.
+    Every evaluation is also written to output as a JSON line.
+    Returns the program exit code: 0 if every host passed, 1 otherwise.
+    '''
+    start = time.monotonic()
+    counts = {'passed': 0, 'failed': 0, 'unreadable': 0}
+    for evaluation in evaluate_snapshots(find_snapshots(paths), features, enablement,
+                                         test_cpu, workers):
+        if output is not None:
+            output.write(json.dumps(evaluation) + '\n')
+        if evaluation['error'] is not None:
+            counts['unreadable'] += 1
+            if not non_verbose:
+                print(f"- {evaluation['snapshot']}: {evaluation['error']}")
+        elif evaluation['passed']:
+            counts['passed'] += 1
+        else:
+            counts['failed'] += 1
+            if not non_verbose:
+                failed = [feature for feature, passed in evaluation['features'].items()
+                          if passed is not True]
+                print_overall_result(f"- {evaluation['host']} ({evaluation['snapshot']}): "
+                                     f"{', '.join(failed)}", evaluation['passed'])
+    if not non_verbose:
+        print(f"\nEvaluated {sum(counts.values())} snapshots in "
+              f"{time.monotonic() - start:.2f} seconds: {counts['passed']} passed, "
+              f"{counts['failed']} did not pass, {counts['unreadable']} could not be read.")
+    return 0 if counts['failed'] == counts['unreadable'] == 0 else 1
@@ -0,0 +1,151 @@
+'''
+Check groups of every feature the component test can check, in the order they are reported.
+Shared by the command line tool and the library entry point in sev_api.
+'''
+import datetime
+import check_scheduler
+import component_tests
+import ovmf_functions
+import snp_component_tests
+
+# The OVMF check can scan the whole filesystem, give it the scan timeout on top of the default
+OVMF_CHECK_TIMEOUT = ovmf_functions.FIND_FV_TIMEOUT + check_scheduler.DEFAULT_CHECK_TIMEOUT
+
+
+def get_system_support_group():
+    '''
+    Checks that query the system capabilites and inform if the
+    system can or cannot run SEV features.
+    '''
+    return check_scheduler.CheckGroup('SYSTEM SUPPORT', "\nQuerying for system capabilities:", [
+        check_scheduler.Check(component_tests.find_cpuid_support, ['SEV']),
+        check_scheduler.Check(component_tests.check_virtualization),
+        check_scheduler.Check(component_tests.check_sme_enablement)
+    ], feature='SYSTEM')
+
+
+def get_sme_group():
+    '''
+    Checks that inform if the current system setup can run SME.
+    '''
+    return check_scheduler.CheckGroup(
+        'SME COMPONENT TEST', "\nComparing Host OS componenets to known SME requirements:", [
+            check_scheduler.Check(component_tests.find_cpuid_support, ['SME']),
+            check_scheduler.Check(component_tests.find_tsme_enablement),
+            check_scheduler.Check(component_tests.check_kernel_config, ['SME'])
+        ], feature='SME')
+
+
+def get_sev_group(system_os, enablement, test_cpu):
+    '''
+    Checks that inform if the current system setup can run SEV.
+    '''
+    # Tests to be run
+    running_tests = [
+        check_scheduler.Check(component_tests.validate_cpu_model, ["SEV"]),
+        check_scheduler.Check(component_tests.find_cpuid_support, ["SEV"]),
+        check_scheduler.Check(component_tests.find_asid_count, ["SEV"]),
+        check_scheduler.Check(component_tests.check_linux_distribution),
+        check_scheduler.Check(component_tests.check_kernel, ['SEV']),
+        check_scheduler.Check(component_tests.check_kernel_config, ['SEV']),
+        check_scheduler.Check(component_tests.check_if_sev_init),
+        check_scheduler.Check(component_tests.check_kernel_messages, ['SEV']),
+    ]
+
+    if test_cpu:
+        del running_tests[0]
+
+    # Package tests, ignore if enablment flag is on
+    if not enablement:
+        running_tests += [
+            check_scheduler.Check(component_tests.find_libvirt_support),
+            check_scheduler.Check(component_tests.find_qemu_support, [system_os, 'SEV']),
+            check_scheduler.Check(component_tests.test_all_ovmf_paths,
+                                  [system_os, datetime.date(2018, 7, 6)],
+                                  timeout=OVMF_CHECK_TIMEOUT)
+        ]
+
+    return check_scheduler.CheckGroup(
+        'SEV COMPONENT TEST',
+        "\nComparing Host OS componenets to known SEV minimum versions:", running_tests,
+        feature='SEV')
+
+
+def get_sev_es_group(system_os, enablement, test_cpu):
+    '''
+    Checks that inform if the current system setup can run SEV-ES.
+    '''
+    running_tests = [
+        check_scheduler.Check(component_tests.validate_cpu_model, ["SEV-ES"]),
+        check_scheduler.Check(component_tests.find_cpuid_support, ['SEV-ES']),
+        check_scheduler.Check(component_tests.check_kernel, ['SEV-ES']),
+        check_scheduler.Check(component_tests.check_kernel_config, ['SEV-ES']),
+        check_scheduler.Check(component_tests.find_asid_count, ['SEV-ES']),
+        check_scheduler.Check(component_tests.check_if_sev_es_init),
+    ]
+
+    if test_cpu:
+        del running_tests[0]
+
+    if not enablement:
+        running_tests += [
+            check_scheduler.Check(component_tests.find_libvirt_support),
+            check_scheduler.Check(component_tests.find_qemu_support, [system_os, 'SEV-ES']),
+            check_scheduler.Check(component_tests.test_all_ovmf_paths,
+                                  [system_os, datetime.date(2020, 11, 1)],
+                                  timeout=OVMF_CHECK_TIMEOUT)
+        ]
+
+    return check_scheduler.CheckGroup(
+        'SEV-ES COMPONENT TEST',
+        "\nComparing Host OS componenets to known SEV-ES minimum versions:", running_tests,
+        feature='SEV-ES')
+
+
+def get_sev_snp_group(test_cpu):
+    '''
+    Checks that inform if the current system setup can run SEV-SNP.
+    The SNP initialization checks only run once the SNP enablement checks pass.
+    '''
+    running_tests = [
+        check_scheduler.Check(component_tests.validate_cpu_model, ["SEV-SNP"]),
+        check_scheduler.Check(component_tests.find_cpuid_support, ['SEV-SNP']),
+        check_scheduler.Check(snp_component_tests.check_if_snp_enabled),
+        check_scheduler.Check(snp_component_tests.check_fw_version_for_snp),
+        check_scheduler.Check(snp_component_tests.find_iommu_enablement)
+    ]
+
+    if test_cpu:
+        del running_tests[0]
+
+    snp_tests = [
+        check_scheduler.Check(test, depends_on=running_tests) for test in (
+            snp_component_tests.check_snp_init,
+            snp_component_tests.check_rmp_init,
+            snp_component_tests.get_rmp_address,
+            snp_component_tests.compare_tcb_versions)
+    ]
+    # Reported whether the enablement checks pass or not
+    snp_tests += [check_scheduler.Check(component_tests.check_kernel_config, ['SEV-SNP']),
+                  check_scheduler.Check(component_tests.check_kernel_messages, ['SEV-SNP'])]
+
+    return check_scheduler.CheckGroup(
+        'SEV-SNP COMPONENT TEST',
+        "\nComparing Host OS componenets to known SEV-SNP minimum versions:",
+        running_tests + snp_tests, feature='SEV-SNP')
+
+
+def get_feature_groups(system_os, feature_tests, enablement, test_cpu):
+    '''
+    Get the check groups for the requested features, in the order they are reported.
+    SEV is always tested, SEV-ES is tested for SEV-ES and SEV-SNP.
+    '''
+    groups = [get_system_support_group()]
+    if 'sme' in feature_tests:
+        groups.append(get_sme_group())
+    groups.append(get_sev_group(system_os, enablement, test_cpu))
+    if 'sev-es' in feature_tests or 'sev-snp' in feature_tests:
+        groups.append(get_sev_es_group(system_os, enablement, test_cpu))
+    if 'sev-snp' in feature_tests:
+        groups.append(get_sev_snp_group(test_cpu))
+    return groups
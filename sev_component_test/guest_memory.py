@@ -0,0 +1,493 @@
+'''
+Guest RAM of a running QEMU VM in the host process. The QEMU command line says which
+RAM regions the guest has: one per memory-backend object (NUMA nodes, DIMMs) and the
+main RAM block of -m when no backend holds it. /proc/PID/maps says where they are mapped.
+Each region is matched with a writable mapping of its size and kind (anonymous, memfd or
+a file under its mem-path), so padding, guard pages and other mappings of the same size
+are not taken for guest RAM. The regions found are kept in an interval index.
+
+Full scans of the guest memory are split in shards of at most SHARD_SIZE of one region.
+/proc/PID/numa_maps tells which host NUMA node holds the pages of each region, and every
+shard is read by a worker pinned to the cpus of that node, so each node's memory is
+read through its own memory channels instead of across the fabric.
+'''
+import bisect
+import itertools
+import json
+import os
+import re
+import shlex
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import host_probes
+import memory_reader
+import tracing
+
+# Size of the guest RAM when the command line has no -m
+DEFAULT_RAM_SIZE = 128 * 1048576
+# Name QEMU gives the main RAM block on x86 machines
+MAIN_RAM_NAME = 'pc.ram'
+# A mapping can be larger than its region by up to this, rounded up to the backend page size
+ALIGNMENT_SLACK = 2 * 1048576
+# Memory backend kinds, from the QOM type memory-backend-<kind>
+BACKEND_KINDS = ('ram', 'file', 'memfd')
+# Size with an optional K, M, G, T, P or E suffix, as QEMU parses it
+_SIZE = re.compile(r'(\d+(?:\.\d+)?)\s*([kmgtpe]?)b?', re.IGNORECASE)
+# Power of 1024 of every size suffix
+_SIZE_SHIFTS = {'': 0, 'k': 10, 'm': 20, 'g': 30, 't': 40, 'p': 50, 'e': 60}
+# Path of mappings of deleted files, the memory of memfd and hugetlbfs backends
+_DELETED = ' (deleted)'
+# Cpus of a host NUMA node
+NODE_CPULIST_PATH = '/sys/devices/system/node/node{node}/cpulist'
+# Largest part of a region one worker scans
+SHARD_SIZE = 1024 ** 3
+# Most workers scanning the memory of one host node
+MAX_NODE_WORKERS = 8
+# Bytes a scanning worker reads at a time
+SCAN_CHUNK = 4 * 1048576
+# Pages on a node (N0=512) and their size in a /proc/PID/numa_maps line
+_NODE_PAGES = re.compile(r' N(\d+)=(\d+)')
+_KERNEL_PAGE_SIZE = re.compile(r' kernelpagesize_kB=(\d+)')
+
+# One RAM region of the guest from the command line. kind is ram, file or memfd,
+# mem_path the file or directory of file backends.
+MemoryBackend = namedtuple('MemoryBackend', ['name', 'kind', 'size', 'mem_path'])
+# One RAM region of the guest found in the host process, end excluded
+GuestRegion = namedtuple('GuestRegion', ['name', 'start', 'end', 'path'])
+# Part of a region scanned by one worker, node is the host node holding it or None
+Shard = namedtuple('Shard', ['region', 'start', 'end', 'node'])
+
+
+def parse_size(text:str, default_suffix:str = '') -> int:
+    '''
+    Parse a QEMU size (4G, 2048M, 1073741824) into bytes.
+    default_suffix is used for plain numbers, -m takes them as MiB.
+    Raises ValueError for anything else.
+    '''
+    match = _SIZE.fullmatch(str(text).strip())
+    if not match:
+        raise ValueError(f"invalid size {text!r}")
+    suffix = (match[2] or default_suffix).lower()
+    return int(float(match[1]) * (1 << _SIZE_SHIFTS[suffix]))
+
+
+def parse_options(text:str, implied_key:str) -> dict:
+    '''
+    Parse a QEMU option string (value,key=value,...) into a dictionary, the first value
+    without a key goes to implied_key. The JSON form ({"key": value}) is also accepted.
+    '''
+    if text.startswith('{'):
+        return json.loads(text)
+    options = {}
+    # ,, is an escaped comma inside a value
+    for index, option in enumerate(text.replace(',,', '\0').split(',')):
+        option = option.replace('\0', ',')
+        if '=' in option:
+            key, value = option.split('=', 1)
+            options[key] = value
+        elif index == 0 and option:
+            options[implied_key] = option
+    return options
+
+
+def get_memory_backends(argv) -> list:
+    '''
+    Get the RAM regions of a guest from its QEMU arguments, in command line order.
+    The main RAM block is first when it's not held by a memory backend.
+    Raises ValueError if a size can't be parsed.
+    '''
+    ram_size = DEFAULT_RAM_SIZE
+    mem_path = None
+    # Main RAM held by backends, through -numa node,memdev= or -machine memory-backend=
+    ram_in_backends = False
+    backends = []
+    arguments = iter(argv[1:])
+    for argument in arguments:
+        # Both -option and --option are accepted
+        option = '-' + argument.lstrip('-') if argument.startswith('-') else None
+        if option not in ('-m', '-object', '-numa', '-machine', '-M', '-mem-path'):
+            continue
+        value = next(arguments, '')
+        if option == '-m':
+            # Only the initial RAM is mapped, slots and maxmem are for DIMMs added later
+            size = parse_options(value, 'size').get('size')
+            if size is not None:
+                ram_size = parse_size(size, 'M')
+        elif option == '-mem-path':
+            mem_path = value
+        elif option == '-object':
+            options = parse_options(value, 'qom-type')
+            kind = options.get('qom-type', '')[len('memory-backend-'):]
+            if options.get('qom-type', '').startswith('memory-backend-') and kind in BACKEND_KINDS:
+                backends.append(MemoryBackend(options.get('id', ''), kind,
+                                              parse_size(options.get('size', 0)),
+                                              options.get('mem-path')))
+        elif option == '-numa':
+            ram_in_backends |= 'memdev' in parse_options(value, 'type')
+        else:
+            ram_in_backends |= 'memory-backend' in parse_options(value, 'type')
+    if not ram_in_backends:
+        backends.insert(0, MemoryBackend(MAIN_RAM_NAME, 'file' if mem_path else 'ram',
+                                         ram_size, mem_path))
+    return backends
+
+
+def is_backend_mapping(entry:memory_reader.MapEntry, backend:MemoryBackend) -> bool:
+    '''
+    Check if a mapping is of the kind a memory backend uses: anonymous (or shared anonymous)
+    memory for ram, a memfd for memfd and a file in its mem-path for file backends.
+    '''
+    path = entry.path[:-len(_DELETED)] if entry.path.endswith(_DELETED) else entry.path
+    if backend.kind == 'ram':
+        return path in ('', '/dev/zero') or path.startswith('/memfd:')
+    if backend.kind == 'memfd':
+        return path.startswith('/memfd:')
+    mem_path = (backend.mem_path or '').rstrip('/')
+    return bool(mem_path) and (path == mem_path or path.startswith(mem_path + '/'))
+
+
+def get_extents(entries) -> list:
+    '''
+    Join the writable mappings that follow each other in memory and in the same file,
+    a region the kernel split in several entries (after mprotect, madvise or mlock on
+    part of it) is then seen whole. Returns MapEntry tuples in address order.
+    '''
+    extents = []
+    for entry in entries:
+        if entry.permissions[:2] != 'rw':
+            continue
+        last = extents[-1] if extents else None
+        if (last is not None and last.end == entry.start and last.path == entry.path
+                and last.inode == entry.inode and last.permissions == entry.permissions
+                and (not entry.inode or last.offset + last.end - last.start == entry.offset)):
+            extents[-1] = last._replace(end=entry.end)
+        else:
+            extents.append(entry)
+    return extents
+
+
+class IntervalIndex:
+    '''
+    Address intervals (anything with start and end, end excluded) that don't overlap,
+    sorted by start and looked up with a binary search.
+    '''
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals, key=lambda interval: interval.start)
+        self.starts = [interval.start for interval in self.intervals]
+
+    def find(self, address:int):
+        '''
+        Get the interval holding an address, None if there is none.
+        '''
+        index = bisect.bisect_right(self.starts, address) - 1
+        if index >= 0 and address < self.intervals[index].end:
+            return self.intervals[index]
+        return None
+
+    def get_overlapping(self, start:int, end:int) -> list:
+        '''
+        Get the intervals overlapping [start, end), in address order.
+        '''
+        index = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        overlapping = []
+        for interval in self.intervals[index:]:
+            if interval.start >= end:
+                break
+            if interval.end > start:
+                overlapping.append(interval)
+        return overlapping
+
+    def __iter__(self):
+        return iter(self.intervals)
+
+    def __len__(self):
+        return len(self.intervals)
+
+
+class GuestMemory(IntervalIndex):
+    '''
+    RAM regions of a guest found in its host process, as an interval index of GuestRegion.
+    missing has the backends no mapping was found for, nodes the host NUMA node holding
+    most of each region (by name) once locate_nodes was called.
+    '''
+    def __init__(self, regions, missing = ()):
+        super().__init__(regions)
+        self.missing = list(missing)
+        self.nodes = {}
+
+    @property
+    def size(self) -> int:
+        '''
+        Bytes of guest RAM found.
+        '''
+        return sum(region.end - region.start for region in self.intervals)
+
+
+def match_regions(entries, backends) -> GuestMemory:
+    '''
+    Find the mapping of every memory backend among the /proc/PID/maps entries.
+    A backend takes the first unused writable mapping of its kind with its exact size,
+    or else the smallest one at most ALIGNMENT_SLACK larger.
+    '''
+    extents = get_extents(entries)
+    # Mappings by size then address, the candidates of a backend are one slice of it
+    by_size = sorted((extent.end - extent.start, index) for index, extent in enumerate(extents))
+    used = set()
+    regions = []
+    missing = []
+    for backend in backends:
+        first = bisect.bisect_left(by_size, (backend.size, -1))
+        last = bisect.bisect_right(by_size, (backend.size + ALIGNMENT_SLACK, len(extents)))
+        found = next((index for _, index in by_size[first:last]
+                      if index not in used and is_backend_mapping(extents[index], backend)), None)
+        if found is None:
+            missing.append(backend)
+            continue
+        used.add(found)
+        regions.append(GuestRegion(backend.name, extents[found].start,
+                                   extents[found].start + backend.size, extents[found].path))
+    return GuestMemory(regions, missing)
+
+
+def read_argv(pid:str, vm_command:str = None) -> list:
+    '''
+    Get the arguments a process was started with from /proc/PID/cmdline, or split from
+    its command (as ps prints it) when that can't be read.
+    Raises OSError if neither is available.
+    '''
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as cmdline:
+            return cmdline.read().decode('utf-8', errors='replace').split('\0')[:-1]
+    except OSError:
+        if vm_command is None:
+            raise
+        return shlex.split(vm_command)
+
+
+def read_maps(pid:str) -> list:
+    '''
+    Read the /proc/PID/maps entries of a process, with sudo if it's not readable
+    (see memory_reader.get_sudo).
+    Raises OSError if it can't be read.
+    '''
+    try:
+        with open(f'/proc/{pid}/maps', 'r', encoding='utf-8', errors='replace') as maps:
+            return memory_reader.parse_maps(maps.read())
+    except PermissionError:
+        try:
+            maps = tracing.run(f'{memory_reader.get_sudo()} cat /proc/{pid}/maps', shell=True,
+                               check=True, capture_output=True,
+                               timeout=memory_reader.MEMORY_READ_TIMEOUT)
+        except subprocess.TimeoutExpired as err:
+            raise OSError(f"could not read /proc/{pid}/maps: timed out") from err
+        except subprocess.CalledProcessError as err:
+            raise PermissionError(f"could not read /proc/{pid}/maps: "
+                                  + err.stderr.decode('utf-8').strip()) from err
+        return memory_reader.parse_maps(maps.stdout.decode('utf-8'))
+
+
+def find_guest_ram(pid:str, vm_command:str = None) -> GuestMemory:
+    '''
+    Find every RAM region of a running QEMU guest in its host process.
+    Raises OSError if the process can't be read, ValueError if its command line can't be parsed.
+    '''
+    return match_regions(read_maps(pid), get_memory_backends(read_argv(pid, vm_command)))
+
+
+def parse_numa_maps(numa_maps) -> dict:
+    '''
+    Parse a /proc/PID/numa_maps file, as text or lines, into
+    mapping start address: {node: bytes of the mapping on that node}.
+    '''
+    if isinstance(numa_maps, str):
+        numa_maps = numa_maps.splitlines()
+    placement = {}
+    for line in numa_maps:
+        nodes = _NODE_PAGES.findall(line)
+        if not nodes:
+            continue
+        page_size = _KERNEL_PAGE_SIZE.search(line)
+        page_size = int(page_size[1]) * 1024 if page_size else memory_reader.PAGE_SIZE
+        placement[int(line.split(' ', 1)[0], 16)] = {
+            int(node): int(pages) * page_size for node, pages in nodes}
+    return placement
+
+
+def get_region_nodes(guest:GuestMemory, placement:dict) -> dict:
+    '''
+    Add up the bytes of each region on each node from the numa_maps placement,
+    as region name: {node: bytes}. A region split in several mappings has one numa_maps
+    line per mapping, each is found in the region index from its start address.
+    '''
+    region_nodes = {region.name: {} for region in guest}
+    for start, nodes in placement.items():
+        region = guest.find(start)
+        if region is None:
+            continue
+        for node, size in nodes.items():
+            region_nodes[region.name][node] = region_nodes[region.name].get(node, 0) + size
+    return region_nodes
+
+
+def locate_nodes(pid:str, guest:GuestMemory) -> dict:
+    '''
+    Find the host node holding most of each region of a guest and keep it in guest.nodes.
+    Regions with no resident page, or all regions when numa_maps can't be read,
+    have no node.
+    '''
+    try:
+        with open(f'/proc/{pid}/numa_maps', 'r', encoding='utf-8') as numa_maps:
+            placement = parse_numa_maps(numa_maps.read())
+    # Kernel without NUMA support, or not allowed to read it
+    except OSError:
+        placement = {}
+    guest.nodes = {name: max(nodes, key=nodes.get)
+                   for name, nodes in get_region_nodes(guest, placement).items() if nodes}
+    return guest.nodes
+
+
+def read_node_cpus(node:int) -> set:
+    '''
+    Get the cpus of a host node this process is allowed to run on,
+    empty if the node has none or its cpu list can't be read.
+    '''
+    try:
+        with open(NODE_CPULIST_PATH.format(node=node), 'r', encoding='utf-8') as cpulist:
+            cpus = set(host_probes.parse_cpu_list(cpulist.read()))
+    except OSError:
+        return set()
+    return cpus & os.sched_getaffinity(0)
+
+
+def get_shards(guest:GuestMemory, shard_size:int = SHARD_SIZE) -> list:
+    '''
+    Split the regions of a guest in shards of at most shard_size bytes, in address order,
+    each with the node of its region.
+    '''
+    return [Shard(region, start, min(start + shard_size, region.end), guest.nodes.get(region.name))
+            for region in guest for start in range(region.start, region.end, shard_size)]
+
+
+def _pin_worker(cpus:set):
+    '''
+    Keep a worker thread on the given cpus, it runs anywhere if that's not allowed.
+    '''
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError:
+        pass
+
+
+def _run_shard(work, shard:Shard):
+    '''
+    Call work(shard) in a worker, recorded as one shard span.
+    '''
+    with tracing.span(f'{shard.region.name} {shard.start:#x}', 'shard', node=shard.node,
+                      size=shard.end - shard.start):
+        return work(shard)
+
+
+def run_sharded(shards, work) -> list:
+    '''
+    Call work(shard) for every shard, in one thread pool per host node whose threads are
+    pinned to the cpus of that node. Shards without a node, or on a node without cpus,
+    go to a pool that is not pinned. Every shard is traced as a shard span.
+    Returns the results in shard order, the first exception raised by a worker is raised again.
+    '''
+    pools = {}
+    futures = []
+    try:
+        for shard in shards:
+            cpus = read_node_cpus(shard.node) if shard.node is not None else set()
+            key = frozenset(cpus)
+            if key not in pools:
+                workers = min(len(cpus or os.sched_getaffinity(0)), MAX_NODE_WORKERS)
+                pools[key] = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=f'node{shard.node}-scan',
+                    initializer=_pin_worker if cpus else None, initargs=(cpus,) if cpus else ())
+            futures.append(pools[key].submit(_run_shard, work, shard))
+        return [future.result() for future in futures]
+    finally:
+        # Shards not started yet are dropped when one failed (shutdown's cancel_futures
+        # needs Python 3.9)
+        for future in futures:
+            future.cancel()
+        for pool in pools.values():
+            pool.shutdown()
+
+
+def read_guest_residency(pid:str, guest:GuestMemory,
+                         shard_size:int = SHARD_SIZE) -> memory_reader.ResidencySet:
+    '''
+    Read which pages of every guest RAM region are resident, one shard per pinned worker.
+    Raises OSError if the pagemap can't be read.
+    '''
+    shards = get_shards(guest, shard_size)
+    residencies = run_sharded(
+        shards, lambda shard: memory_reader.read_region_residency(pid, shard.start, shard.end))
+    # The shards of a region follow each other, their pages are joined back
+    return memory_reader.ResidencySet(
+        memory_reader.Residency.join(region.start, (residency for _, residency in parts))
+        for region, parts in itertools.groupby(zip(shards, residencies),
+                                               key=lambda part: part[0].region))
+
+
+def sample_guest_memory(pid:str, guest:GuestMemory, pages:int = memory_reader.SAMPLE_PAGES,
+                        rng = None) -> bytearray:
+    '''
+    Read pages picked at random among the resident pages of every guest RAM region, in
+    address order, as one buffer. Only the pagemap entries of candidate pages are read,
+    the whole pagemap is only read when too few candidates were resident.
+    Raises OSError if the memory can't be read.
+    '''
+    addresses = memory_reader.probe_resident_pages(
+        pid, [(region.start, region.end) for region in guest], pages, rng)
+    # Little of the memory is resident, pick among the resident pages of the full pagemap
+    if len(addresses) < pages:
+        addresses = read_guest_residency(pid, guest).sample(pages, rng)
+    with memory_reader.ProcessMemory(pid) as memory:
+        return memory.read_pages(addresses)
+
+
+def read_chunks(memory:memory_reader.ProcessMemory, ranges, chunk_size:int = SCAN_CHUNK):
+    '''
+    Read (address, length) ranges chunk_size bytes at a time into one reused buffer.
+    Yields a view of each chunk read, only valid until the next one is read.
+    '''
+    buffer = bytearray(chunk_size)
+    with memoryview(buffer) as view:
+        batch = []
+        length = 0
+        for address, size in ranges:
+            while size:
+                piece = min(size, chunk_size - length)
+                batch.append((address, piece))
+                length += piece
+                address += piece
+                size -= piece
+                if length == chunk_size:
+                    memory.read_ranges(batch, buffer)
+                    yield view
+                    batch, length = [], 0
+        if batch:
+            memory.read_ranges(batch, buffer)
+            yield view[:length]
+
+
+def scan_guest_memory(pid:str, guest:GuestMemory, scan, shard_size:int = SHARD_SIZE,
+                      chunk_size:int = SCAN_CHUNK) -> list:
+    '''
+    Read all the resident memory of a guest, one shard per worker pinned to the node
+    holding it (see locate_nodes). scan(shard, chunks) is called in the worker with an
+    iterator over the shard's resident memory, see read_chunks.
+    Returns (shard, what scan returned) for every shard in address order.
+    Raises OSError if the memory can't be read.
+    '''
+    def scan_shard(shard):
+        residency = memory_reader.read_region_residency(pid, shard.start, shard.end)
+        with memory_reader.ProcessMemory(pid) as memory:
+            return scan(shard, read_chunks(memory, residency.get_resident_ranges(), chunk_size))
+
+    shards = get_shards(guest, shard_size)
+    return list(zip(shards, run_sharded(shards, scan_shard)))
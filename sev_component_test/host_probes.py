@@ -0,0 +1,310 @@
+'''
+Native host probes. Read system facts straight from procfs, sysfs and /etc
+instead of starting shell pipelines, so a full check run does not fork for them.
+'''
+import contextlib
+import contextvars
+import errno
+import os
+import shlex
+import struct
+
+# Locations of the os-release file, in the order given by the os-release spec
+OS_RELEASE_PATHS = ["/etc/os-release", "/usr/lib/os-release"]
+# Directory where the kvm_amd module exposes its parameters
+KVM_AMD_PARAMETERS = "/sys/module/kvm_amd/parameters/"
+# Random id generated by the kernel at every boot
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+# ELF notes of the running kernel image
+KERNEL_NOTES_PATH = "/sys/kernel/notes"
+# Type of the ELF note holding the build ID, from <elf.h>
+NT_GNU_BUILD_ID = 3
+
+
+def parse_os_release(text:str) -> dict:
+    '''
+    Parse the contents of an os-release file into a dictionary.
+    Follows the os-release spec: blank lines and comments are ignored,
+    values can be quoted and use shell style escapes.
+    '''
+    fields = {}
+    for line in text.splitlines():
+        line = line.strip()
+        # Skip comments and empty lines
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        # Unquote and unescape the value the same way a shell would
+        try:
+            split_value = shlex.split(value)
+        except ValueError:
+            continue
+        fields[key.strip()] = ' '.join(split_value)
+    return fields
+
+
+def read_os_release() -> dict:
+    '''
+    Read the first os-release file found in the system.
+    Raise OSError if no os-release file can be read.
+    '''
+    for path in OS_RELEASE_PATHS:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as os_release:
+                return parse_os_release(os_release.read())
+    raise OSError("no os-release file found in " + ", ".join(OS_RELEASE_PATHS))
+
+
+def get_kernel_release() -> str:
+    '''
+    Get the running kernel release string (same value as uname -r).
+    '''
+    return os.uname().release
+
+
+def read_boot_id() -> str:
+    '''
+    Get the random id the kernel generated for this boot.
+    Raise OSError if it can't be read.
+    '''
+    with open(BOOT_ID_PATH, 'r', encoding='utf-8') as boot_id:
+        return boot_id.read().strip()
+
+
+def parse_build_id(notes:bytes):
+    '''
+    Find the GNU build ID in a list of ELF notes, as a hex string.
+    Returns None if there is no build ID note.
+    '''
+    offset = 0
+    while offset + 12 <= len(notes):
+        # Note header: name size, description size, type, then both padded to 4 bytes
+        name_size, description_size, note_type = struct.unpack_from('<III', notes, offset)
+        offset += 12
+        name = notes[offset:offset + name_size]
+        offset += (name_size + 3) & ~3
+        description = notes[offset:offset + description_size]
+        offset += (description_size + 3) & ~3
+        if note_type == NT_GNU_BUILD_ID and name == b'GNU\0':
+            return description.hex()
+    return None
+
+
+def read_kernel_build_id() -> str:
+    '''
+    Get the build ID of the running kernel image, it changes with every kernel build.
+    Raise OSError if it can't be read.
+    '''
+    with open(KERNEL_NOTES_PATH, 'rb') as notes:
+        build_id = parse_build_id(notes.read())
+    if build_id is None:
+        raise OSError(errno.ENOENT, "no build ID note", KERNEL_NOTES_PATH)
+    return build_id
+
+
+def parse_cpuinfo_flags(text:str) -> set:
+    '''
+    Get the set of CPU flags listed in the contents of /proc/cpuinfo.
+    Only the first processor entry is looked at.
+    '''
+    for line in text.splitlines():
+        if line.startswith('flags'):
+            return set(line.split(':', 1)[1].split())
+    return set()
+
+
+def get_cpu_flags() -> set:
+    '''
+    Read the CPU flags for the system from /proc/cpuinfo.
+    '''
+    with open('/proc/cpuinfo', 'r', encoding='utf-8') as cpuinfo:
+        return parse_cpuinfo_flags(cpuinfo.read())
+
+
+def get_virtualization_type():
+    '''
+    Get the hardware virtualization type available in the system, the same value
+    lscpu prints in its Virtualization field. Returns None if not available.
+    '''
+    flags = get_cpu_flags()
+    if 'svm' in flags:
+        return 'AMD-V'
+    if 'vmx' in flags:
+        return 'VT-x'
+    return None
+
+
+def read_kvm_amd_parameter(parameter:str):
+    '''
+    Read a kvm_amd module parameter (sev, sev_es, sev_snp...).
+    Returns None if the module is not loaded or the parameter does not exist.
+    '''
+    try:
+        with open(KVM_AMD_PARAMETERS + parameter, 'r', encoding='utf-8') as param:
+            return param.read().strip()
+    except OSError:
+        return None
+
+
+def is_kvm_amd_parameter_enabled(parameter:str) -> bool:
+    '''
+    Check if a boolean kvm_amd module parameter is turned on.
+    '''
+    return read_kvm_amd_parameter(parameter) in ('Y', 'y', '1')
+
+
+def parse_cpu_list(cpu_list:str) -> list:
+    '''
+    Expand a sysfs cpu list (0-3,8,10-11) into a list of cpu numbers.
+    '''
+    cpus = []
+    for cpu_range in cpu_list.strip().split(','):
+        if not cpu_range:
+            continue
+        if '-' in cpu_range:
+            first, last = cpu_range.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(cpu_range))
+    return cpus
+
+
+def get_online_cpus() -> list:
+    '''
+    Get the list of online logical cpus from /sys/devices/system/cpu/online.
+    Fall back to the cpus the process can run on if sysfs is not available.
+    '''
+    try:
+        with open('/sys/devices/system/cpu/online', 'r', encoding='utf-8') as online:
+            return parse_cpu_list(online.read())
+    except OSError:
+        return sorted(os.sched_getaffinity(0))
+
+
+# Kernel messages given with set_kernel_messages, None to read them from the kernel log
+_kernel_messages = None
+
+
+def set_kernel_messages(messages):
+    '''
+    Answer read_kernel_messages with the given messages, for example the ones the fact
+    cache kept from an earlier run of this boot. Passing None reads the kernel log again.
+    '''
+    global _kernel_messages
+    _kernel_messages = list(messages) if messages is not None else None
+
+
+def read_kernel_messages() -> list:
+    '''
+    Get the messages about memory encryption and SEV logged by the kernel in this boot,
+    in order. They come from the shared kernel log reader, which only reads the records
+    /dev/kmsg got since its last read, unless set_kernel_messages gave them.
+    Raise OSError if /dev/kmsg can't be read.
+    '''
+    if _kernel_messages is not None:
+        return list(_kernel_messages)
+    import kernel_log # pylint: disable=import-outside-toplevel
+    return [event.message for event in kernel_log.get_kernel_log().get_events()]
+
+
+def read_kernel_events() -> list:
+    '''
+    Get the classified kernel messages of this boot as
+    (sequence, timestamp, category, severity, message) tuples, see kernel_log.
+    Raise OSError if /dev/kmsg can't be read.
+    '''
+    import kernel_log # pylint: disable=import-outside-toplevel
+    return [tuple(event) for event in kernel_log.get_kernel_log().get_events()]
+
+
+def read_kernel_config(names) -> dict:
+    '''
+    Get the values of some options of the running kernel config ('y', 'm', 'n', a string
+    or None for options the config doesn't have). Parsed from /proc/config.gz or
+    /boot/config-<release> once per kernel build, see kernel_config.
+    Raise OSError if no config file can be read.
+    '''
+    import kernel_config # pylint: disable=import-outside-toplevel
+    return kernel_config.get_kernel_config(names)
+
+
+def path_exists(path:str) -> bool:
+    '''
+    Check if a file or directory exists.
+    '''
+    return os.path.exists(path)
+
+
+def find_files(top:str, name:str) -> list:
+    '''
+    Find every file with the given name under a directory, as a list of paths.
+    '''
+    return [os.path.join(directory, name) for directory, _, files in os.walk(top)
+            if name in files]
+
+
+def format_cpu_list(cpus) -> str:
+    '''
+    Compress a list of cpu numbers into the sysfs cpu list format (0-3,8,10-11).
+    '''
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else f'{first}-{last}'
+                    for first, last in ranges)
+
+
+class Probes:
+    '''
+    The host probes a check run uses: the functions of this module, with some of them
+    replaced by the functions in overrides (name: function).
+    Raises ValueError if an override is not a probe of this module.
+    '''
+    def __init__(self, overrides:dict = None):
+        self.overrides = dict(overrides or {})
+        for name in self.overrides:
+            if name.startswith('_') or not callable(globals().get(name)) or\
+                    isinstance(globals()[name], type):
+                raise ValueError(f"Unknown host probe: {name}")
+
+    def __getattr__(self, name:str):
+        if name in self.overrides:
+            return self.overrides[name]
+        # Looked up at every call, probes recorded or replayed by a fact snapshot are used
+        try:
+            return globals()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+# Probes of the running check, set by using_probes in the thread running it
+_current_probes = contextvars.ContextVar('host_probes', default=None)
+# Probes used outside of using_probes
+_default_probes = Probes()
+
+
+def get_probes() -> Probes:
+    '''
+    Get the host probes of the current check run, the functions of this module
+    when the run gave none.
+    '''
+    return _current_probes.get() or _default_probes
+
+
+@contextlib.contextmanager
+def using_probes(probes:Probes):
+    '''
+    Use the given probes in this thread until the block ends, None keeps the current ones.
+    Other threads, even running at the same time, are not affected.
+    '''
+    if probes is None:
+        yield
+        return
+    token = _current_probes.set(probes)
+    try:
+        yield
+    finally:
+        _current_probes.reset(token)
@@ -3,9 +3,14 @@ IOCTL function library to use platform status command.
 '''
 import fcntl
 import ctypes
+import os
 import struct
+import threading
+import time
+from collections import deque
 from enum import IntEnum
 from message_printing import print_warning_message
+import tracing
 
 
 # Defining constants for IOCTL functions
@@ -109,24 +114,197 @@ class SevSnpPlatformSatus(ctypes.Structure):
                 ('tcb_version', ctypes.c_uint64),
                 ('reported_tcb', ctypes.c_uint64)]
 
+class SevGetId2(ctypes.Structure):
+    '''
+    Structure for the sev get id2 command
+    '''
+    _pack_ = 1
+    _fields_ = [('address', ctypes.c_uint64),
+                ('length', ctypes.c_uint32)]
+
+# Size of the chip id returned by SEV_GET_ID2
+SEV_CHIP_ID_LENGTH = 64
+
 SEV_IOC_TYPE: ctypes.c_char = 'S'
 
 SEV_ISSUE_CMD = iowr(ord('S'), 0x0, struct.calcsize('=IQI'))
 
+class FcntlBackend:
+    '''
+    Device backend that talks to the real /dev/sev through fcntl.ioctl.
+    '''
+    def open(self, path:str) -> int:
+        '''
+        Open the device, returns the handle used for the other calls.
+        '''
+        return os.open(path, os.O_RDWR)
+
+    def ioctl(self, handle:int, request:int, command:SEVIssueCommand):
+        '''
+        Issue an ioctl request on the device. Raises OSError if it fails.
+        '''
+        fcntl.ioctl(handle, request, command)
+
+    def close(self, handle:int):
+        '''
+        Close the device.
+        '''
+        os.close(handle)
+
+
+# Commands whose time is kept by a SevDevice, the oldest are dropped first
+MAX_TIMINGS = 1000
+
+
+class SevDevice:
+    '''
+    Session on /dev/sev. The device stays open until close() is called and the
+    command buffers are allocated once and reused for every command.
+    Platform status results are cached, optionally for cache_ttl seconds only,
+    and the time the last MAX_TIMINGS firmware commands took is kept in timings.
+    The backend can be swapped (for example for the sev_emulator) to run without hardware.
+    '''
+    def __init__(self, path:str = "/dev/sev", cache_ttl = None, backend = None):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        # Backend used to reach the device, the real device by default
+        self.backend = backend if backend is not None else FcntlBackend()
+        # (command name, seconds, firmware error code) of the last commands issued,
+        # bounded so a long running server or benchmark doesn't grow it forever
+        self.timings = deque(maxlen=MAX_TIMINGS)
+        self._fd = None
+        self._lock = threading.Lock()
+        self._command = SEVIssueCommand()
+        self._buffers = {
+            SEVCommand.SEV_PLATFORM_STATUS: SevPlatformStatus(),
+            SEVCommand.SNP_PLATFORM_STATUS: SevSnpPlatformSatus(),
+            SEVCommand.SEV_GET_ID2: SevGetId2()
+        }
+        self._chip_id = ctypes.create_string_buffer(SEV_CHIP_ID_LENGTH)
+        # Command: (time read, copy of the result)
+        self._cache = {}
+
+    def open(self):
+        '''
+        Open the device if it isn't open already.
+        '''
+        if self._fd is None:
+            self._fd = self.backend.open(self.path)
+
+    def close(self):
+        '''
+        Close the device and forget the cached results.
+        '''
+        with self._lock:
+            if self._fd is not None:
+                self.backend.close(self._fd)
+                self._fd = None
+            self._cache.clear()
+
+    def issue_command(self, command:SEVCommand, data:ctypes.Structure) -> int:
+        '''
+        Issue one SEV command with the given data structure.
+        Returns the firmware error code, raises OSError if the ioctl fails.
+        '''
+        self.open()
+        self._command.cmd = command
+        self._command.data = ctypes.addressof(data)
+        self._command.error = 0
+        start = time.perf_counter()
+        try:
+            with tracing.span(command.name, 'ioctl', bytes=ctypes.sizeof(data)):
+                self.backend.ioctl(self._fd, SEV_ISSUE_CMD, self._command)
+        finally:
+            self.timings.append((command.name, time.perf_counter() - start, self._command.error))
+        return self._command.error
+
+    def _cached_status(self, command:SEVCommand, refresh:bool):
+        '''
+        Get a status command result, from the cache if it's still valid.
+        '''
+        with self._lock:
+            if not refresh and command in self._cache:
+                read_time, result = self._cache[command]
+                if self.cache_ttl is None or time.monotonic() - read_time < self.cache_ttl:
+                    return result
+            data = self._buffers[command]
+            ctypes.memset(ctypes.addressof(data), 0, ctypes.sizeof(data))
+            try:
+                self.issue_command(command, data)
+            except OSError as err:
+                if self._command.error:
+                    raise OSError(err.errno, f"{err.strerror} (firmware error {self._command.error})") from err
+                raise
+            # Keep a copy, the buffer is reused by the next command
+            result = type(data).from_buffer_copy(data)
+            self._cache[command] = (time.monotonic(), result)
+            return result
+
+    def platform_status(self, refresh:bool = False) -> SevPlatformStatus:
+        '''
+        Get the SEV_PLATFORM_STATUS result. Raises OSError if the command fails.
+        '''
+        return self._cached_status(SEVCommand.SEV_PLATFORM_STATUS, refresh)
+
+    def snp_platform_status(self, refresh:bool = False) -> SevSnpPlatformSatus:
+        '''
+        Get the SNP_PLATFORM_STATUS result. Raises OSError if the command fails.
+        '''
+        return self._cached_status(SEVCommand.SNP_PLATFORM_STATUS, refresh)
+
+    def get_id2(self) -> bytes:
+        '''
+        Get the chip id with SEV_GET_ID2. Results are not cached.
+        Raises OSError if the command fails.
+        '''
+        with self._lock:
+            id_data = self._buffers[SEVCommand.SEV_GET_ID2]
+            id_data.address = ctypes.addressof(self._chip_id)
+            id_data.length = ctypes.sizeof(self._chip_id)
+            try:
+                self.issue_command(SEVCommand.SEV_GET_ID2, id_data)
+            except OSError:
+                # Firmware reports the length it needs when the buffer is too small
+                if id_data.length <= ctypes.sizeof(self._chip_id):
+                    raise
+                self._chip_id = ctypes.create_string_buffer(id_data.length)
+                id_data.address = ctypes.addressof(self._chip_id)
+                self.issue_command(SEVCommand.SEV_GET_ID2, id_data)
+            return self._chip_id.raw[:id_data.length]
+
+
+_device = None
+_device_lock = threading.Lock()
+
+def get_sev_device() -> SevDevice:
+    '''
+    Get the /dev/sev session shared by every check in this run.
+    '''
+    global _device
+    with _device_lock:
+        if _device is None:
+            _device = SevDevice()
+        return _device
+
+def set_sev_device(device):
+    '''
+    Replace the shared /dev/sev session, for example with one using the emulator backend.
+    Passing None goes back to the real device the next time it's needed.
+    '''
+    global _device
+    with _device_lock:
+        if _device is not None and _device is not device:
+            _device.close()
+        _device = device
+
 def run_sev_platform_status():
     '''
     IOCTL call to the SEV_PLATFORM_STATUS api.
     Will return a SEV_platform_status structure with the current system's information.
+    The firmware is only queried once per run, later calls get the cached result.
     '''
-    dev_sev: str = "/dev/sev"
     try:
-        with open(dev_sev, 'wb') as fd:
-            sev_data: SevPlatformStatus = SevPlatformStatus()
-            sev_args: SEVIssueCommand = SEVIssueCommand(
-                SEVCommand.SEV_PLATFORM_STATUS, ctypes.addressof(sev_data))
-            sev_ioctl_return = fcntl.ioctl(fd, SEV_ISSUE_CMD, sev_args)
-            if sev_ioctl_return == 0:
-                return sev_data
+        return get_sev_device().platform_status()
     except OSError as err:
         print_warning_message("SEV_PLATFORM_STATUS", str(err))
 
@@ -134,15 +312,9 @@ def run_snp_platform_status():
     '''
     IOCTL call to the SNP_PLATFORM_STATUS abi.
     Will return a SNP_platform_status structure with the current system's information.
+    The firmware is only queried once per run, later calls get the cached result.
     '''
-    dev_sev: str = "/dev/sev"
     try:
-        with open(dev_sev, 'wb') as fd:
-            snp_data: SevSnpPlatformSatus = SevSnpPlatformSatus()
-            snp_args: SEVIssueCommand = SEVIssueCommand(
-                SEVCommand.SNP_PLATFORM_STATUS, ctypes.addressof(snp_data))
-            snp_ioctl_return = fcntl.ioctl(fd, SEV_ISSUE_CMD, snp_args)
-            if snp_ioctl_return == 0:
-                return snp_data
+        return get_sev_device().snp_platform_status()
     except OSError as err:
         print_warning_message("SNP_PLATFORM_STATUS", str(err))
@@ -0,0 +1,132 @@
+'''
+Kernel config options the memory encryption features need. The config of the running
+kernel is streamed from /proc/config.gz (or /boot/config-<release> when the kernel
+doesn't expose it) and only the options the checks look at are kept, reading stops
+once all of them were found. The options read are kept by kernel build ID, so
+later checks, and runs using the fact cache, don't parse the config again until
+another kernel is booted.
+'''
+import gzip
+import threading
+import host_probes
+
+# Config of the running kernel, when built with CONFIG_IKCONFIG_PROC
+PROC_CONFIG_PATH = '/proc/config.gz'
+# Config installed with the kernel image by the distro packages
+BOOT_CONFIG_PATH = '/boot/config-{release}'
+# Options each feature needs in the host kernel, built in or as modules
+REQUIRED_OPTIONS = {
+    'SME': ('CONFIG_AMD_MEM_ENCRYPT',),
+    'SEV': ('CONFIG_AMD_MEM_ENCRYPT', 'CONFIG_KVM_AMD_SEV', 'CONFIG_CRYPTO_DEV_CCP_DD',
+            'CONFIG_CRYPTO_DEV_SP_PSP'),
+    'SEV-ES': ('CONFIG_AMD_MEM_ENCRYPT', 'CONFIG_KVM_AMD_SEV', 'CONFIG_CRYPTO_DEV_CCP_DD',
+               'CONFIG_CRYPTO_DEV_SP_PSP'),
+    'SEV-SNP': ('CONFIG_AMD_MEM_ENCRYPT', 'CONFIG_KVM_AMD_SEV', 'CONFIG_CRYPTO_DEV_CCP_DD',
+                'CONFIG_CRYPTO_DEV_SP_PSP', 'CONFIG_AMD_IOMMU'),
+}
+# Every option a check looks at, read together in one pass
+ALL_OPTIONS = tuple(sorted({name for names in REQUIRED_OPTIONS.values() for name in names}))
+# Suffix of the lines of options turned off
+NOT_SET = ' is not set'
+
+# Build ID: {option: value} of the options read for that kernel
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+def parse_config(lines, names) -> dict:
+    '''
+    Get the values of the given options from the lines of a kernel config,
+    'n' for options that are not set. Stops reading once every option was found,
+    options the config doesn't have are left out.
+    '''
+    wanted = set(names)
+    options = {}
+    for line in lines:
+        line = line.strip()
+        if line.startswith('# CONFIG_') and line.endswith(NOT_SET):
+            name, value = line[2:-len(NOT_SET)], 'n'
+        elif line.startswith('CONFIG_') and '=' in line:
+            name, value = line.split('=', 1)
+            value = value.strip('"')
+        else:
+            continue
+        if name in wanted:
+            options[name] = value
+            wanted.discard(name)
+            if not wanted:
+                break
+    return options
+
+
+def get_config_paths() -> list:
+    '''
+    Get the config files of the running kernel, in the order they are tried.
+    '''
+    return [PROC_CONFIG_PATH,
+            BOOT_CONFIG_PATH.format(release=host_probes.get_probes().get_kernel_release())]
+
+
+def read_config(names) -> dict:
+    '''
+    Read the values of the given options from the first config file of the running
+    kernel found, None for options the config doesn't have.
+    Raise OSError if no config file can be read.
+    '''
+    errors = []
+    for path in get_config_paths():
+        try:
+            # Decompressed as it's read, the rest of the archive is never inflated
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8', errors='replace') as config:
+                options = parse_config(config, names)
+            return {name: options.get(name) for name in names}
+        # Missing, not readable or a corrupt archive, try the next file
+        except (OSError, EOFError) as err:
+            errors.append(f"{path}: {err}")
+    raise OSError("no kernel config found (" + "; ".join(errors) + ")")
+
+
+def get_kernel_config(names) -> dict:
+    '''
+    Get the values of the given options for the running kernel, see read_config.
+    The config is only read when this kernel build has no value for one of the options,
+    and then every option a check needs is read.
+    '''
+    try:
+        build_id = host_probes.get_probes().read_kernel_build_id()
+    # Without a build ID nothing is kept, the config is read every time
+    except OSError:
+        build_id = None
+    with _configs_lock:
+        cached = _configs.get(build_id, {})
+        if build_id is None or not all(name in cached for name in names):
+            cached = read_config(sorted(set(names) | set(ALL_OPTIONS)))
+            if build_id is not None:
+                _configs.setdefault(build_id, {}).update(cached)
+        return {name: cached[name] for name in names}
+
+
+def get_cached_configs() -> dict:
+    '''
+    Get the options read so far, as build ID: {option: value}.
+    '''
+    with _configs_lock:
+        return {build_id: dict(options) for build_id, options in _configs.items()}
+
+
+def add_cached_configs(configs:dict):
+    '''
+    Keep options read earlier, for example by another run, as build ID: {option: value}.
+    '''
+    with _configs_lock:
+        for build_id, options in configs.items():
+            _configs.setdefault(build_id, {}).update(options)
+
+
+def clear_cached_configs():
+    '''
+    Forget the options read so far.
+    '''
+    with _configs_lock:
+        _configs.clear()
@@ -0,0 +1,256 @@
+'''
+Streaming kernel log reader. /dev/kmsg stays open and every call reads only the records
+logged since the previous one, so each message is read once and the ring buffer is never
+scanned again. Messages about memory encryption and the SEV firmware (SME, ccp/PSP, SEV,
+SNP, RMP) are classified as they are read and kept, the others are dropped.
+The sequence number of the last record read and the kept messages can be saved to a state
+file, a later run of the same boot only classifies the records logged after it.
+'''
+import errno
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+import host_probes
+from message_printing import print_warning_message
+
+# Kernel log device, one record per read
+KMSG_PATH = '/dev/kmsg'
+# Default state file, see KernelLog.save
+DEFAULT_STATE_PATH = '/var/lib/sev-component-test/kernel-log.json'
+# Changes when the format of the state file changes
+STATE_VERSION = 1
+# Largest record /dev/kmsg returns
+MAX_RECORD_SIZE = 8192
+# First messages of each category always kept: the boot messages (SME active, SEV API
+# version, SNP_INIT) some checks look for
+BOOT_EVENTS = 100
+# Later messages kept in each category, the oldest are dropped first, so a flood of
+# RMP faults doesn't push the SME or SEV messages out
+MAX_EVENTS = 1000
+
+# One classified message. timestamp is in microseconds since boot,
+# category is sme, sev, snp, firmware or rmp and severity info or error.
+KernelEvent = namedtuple('KernelEvent', ['sequence', 'timestamp', 'category', 'severity', 'message'])
+
+# (pattern, category, severity), the first pattern found in a message classifies it
+CLASSIFIERS = [
+    # RMP faults and the RMP entries dumped with them
+    (re.compile(r'\bRMP\b.*\b(fault|violation|mismatch)|RMP entry|\b(RMPUPDATE|PSMASH|RMPADJUST)\b.*fail',
+                re.IGNORECASE), 'rmp', 'error'),
+    # SNP_INIT and SNP firmware errors
+    (re.compile(r'(SEV-SNP|\bSNP).*\b(fail(ed|ure)?|error|timed out)\b', re.IGNORECASE),
+     'snp', 'error'),
+    # ccp/PSP driver and SEV firmware errors: INIT failures, command timeouts, PSP not reachable
+    (re.compile(r'\b(sev|psp|ccp)\b.*\b(fail(ed|ure)?|error|timed out|unable)\b', re.IGNORECASE),
+     'firmware', 'error'),
+    (re.compile(r'SEV-SNP|\bSNP\b|\bRMP\b'), 'snp', 'info'),
+    (re.compile(r'\bSEV(-ES)?\b|\b(ccp|psp)\b', re.IGNORECASE), 'sev', 'info'),
+    # Same match the TSME check always used
+    (re.compile(r'SME'), 'sme', 'info'),
+]
+
+
+def classify(message:str):
+    '''
+    Get the (category, severity) of a message, None if it's not about memory encryption or SEV.
+    '''
+    for pattern, category, severity in CLASSIFIERS:
+        if pattern.search(message):
+            return category, severity
+    return None
+
+
+def parse_record(record:bytes):
+    '''
+    Parse a /dev/kmsg record "priority,sequence,timestamp,flags;message".
+    Returns (sequence, timestamp, message), the key=value lines after the message are dropped.
+    '''
+    header_end = record.find(b';')
+    fields = record[:header_end].split(b',')
+    message = record[header_end + 1:].split(b'\n', 1)[0]
+    return int(fields[1]), int(fields[2]), message.decode('utf-8', errors='replace')
+
+
+class KernelLog:
+    '''
+    Kernel log read once, record by record. events are the classified messages of this
+    boot, lost the number of records overwritten before they could be read.
+    Each category keeps its first BOOT_EVENTS and its last MAX_EVENTS events.
+    With a state_path, the state saved by an earlier run of this boot is loaded.
+    '''
+    def __init__(self, state_path:str = None, path:str = KMSG_PATH):
+        self.path = path
+        self.state_path = state_path
+        # Classified events of each category, in sequence order
+        self._events = {}
+        # Sequence number of the last record read, -1 before the first one
+        self.sequence = -1
+        self.lost = 0
+        self._fd = None
+        self._lock = threading.Lock()
+        if state_path is not None:
+            self._load_state()
+
+    def _load_state(self):
+        '''
+        Continue after the last record an earlier run of this boot read.
+        '''
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as state_file:
+                state = json.load(state_file)
+            if (state.get('version') != STATE_VERSION
+                    or state.get('boot_id') != host_probes.read_boot_id()):
+                return
+            self.sequence = state['sequence']
+            self._add_events([KernelEvent(*event) for event in state['events']])
+        # No state yet, unreadable or from another version
+        except (OSError, ValueError, KeyError, TypeError):
+            self.sequence = -1
+            self._events = {}
+
+    def _add_events(self, events:list):
+        '''
+        Keep new events, dropping the oldest events after the boot ones of their category.
+        '''
+        for event in events:
+            self._events.setdefault(event.category, []).append(event)
+        for category_events in self._events.values():
+            dropped = len(category_events) - BOOT_EVENTS - MAX_EVENTS
+            if dropped > 0:
+                del category_events[BOOT_EVENTS:BOOT_EVENTS + dropped]
+
+    @property
+    def events(self) -> list:
+        '''
+        Every kept event, in sequence order.
+        '''
+        return sorted((event for category_events in list(self._events.values())
+                       for event in category_events), key=lambda event: event.sequence)
+
+    def fileno(self) -> int:
+        '''
+        /dev/kmsg file descriptor, readable when new records were logged.
+        Raises OSError if it can't be opened.
+        '''
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+        return self._fd
+
+    def read_new(self) -> list:
+        '''
+        Read the records logged since the last call, returns the new classified events.
+        Records an earlier run already read are skipped from their header.
+        Raises OSError if the log can't be read.
+        '''
+        new_events = []
+        with self._lock:
+            kmsg = self.fileno()
+            while True:
+                try:
+                    record = os.read(kmsg, MAX_RECORD_SIZE)
+                # Reached the end of the log
+                except BlockingIOError:
+                    break
+                # Records were overwritten before being read, the next read gets the oldest left
+                except OSError as err:
+                    if err.errno == errno.EPIPE:
+                        continue
+                    raise
+                if not record:
+                    break
+                sequence, timestamp, message = parse_record(record)
+                if sequence <= self.sequence:
+                    continue
+                if self.sequence >= 0 and sequence > self.sequence + 1:
+                    self.lost += sequence - self.sequence - 1
+                self.sequence = sequence
+                classification = classify(message)
+                if classification is not None:
+                    new_events.append(KernelEvent(sequence, timestamp, *classification, message))
+            self._add_events(new_events)
+        return new_events
+
+    def get_events(self, categories = None, severity:str = None) -> list:
+        '''
+        Get the classified events of this boot, optionally of some categories or one severity.
+        New records are read first.
+        '''
+        self.read_new()
+        with self._lock:
+            events = self.events
+        return [event for event in events
+                if (categories is None or event.category in categories)
+                and (severity is None or event.severity == severity)]
+
+    def save(self, path:str = None):
+        '''
+        Write the sequence number and the events to the state file, renamed over it
+        once complete. Raises OSError if it can't be written.
+        '''
+        path = path or self.state_path
+        with self._lock:
+            state = {'version': STATE_VERSION, 'boot_id': host_probes.read_boot_id(),
+                     'sequence': self.sequence, 'events': [list(event) for event in self.events]}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as state_file:
+                json.dump(state, state_file)
+            os.replace(temporary_path, path)
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+
+    def close(self):
+        '''
+        Close /dev/kmsg, the next read opens it again and skips what was already read.
+        '''
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+_kernel_log = None
+_kernel_log_lock = threading.Lock()
+
+
+def get_kernel_log() -> KernelLog:
+    '''
+    Get the kernel log reader shared by the checks and the watcher.
+    '''
+    global _kernel_log
+    with _kernel_log_lock:
+        if _kernel_log is None:
+            _kernel_log = KernelLog()
+        return _kernel_log
+
+
+def set_kernel_log(kernel_log:KernelLog):
+    '''
+    Replace the shared kernel log reader, for example with one keeping its state in a file.
+    Passing None starts a new reader the next time it's needed.
+    '''
+    global _kernel_log
+    with _kernel_log_lock:
+        if _kernel_log is not None and _kernel_log is not kernel_log:
+            _kernel_log.close()
+        _kernel_log = kernel_log
+
+
+def save_kernel_log():
+    '''
+    Save the state of the shared kernel log reader if it has a state file.
+    '''
+    log = _kernel_log
+    if log is None or log.state_path is None:
+        return
+    try:
+        log.save()
+    except OSError as err:
+        print_warning_message("Kernel log", f"could not save {log.state_path}: {err}")
@@ -3,8 +3,10 @@ Functions required to print and test the memory of VMs being run in the host sys
 '''
 import string
 import subprocess
+import tracing
 from re import sub
 import memory_reader
+import guest_memory
 import encryption_test
 
 def create_vm_dictionary(available_vms) -> dict:
@@ -48,9 +50,9 @@ def get_virtual_machines(system_os:string):
     qemu_command = qemu_command_list.get(system_os, "[q]emu")
 
     try:
-        ps_read = subprocess.run('ps axo pid,command',
+        ps_read = tracing.run('ps axo pid,command',
                                  shell=True, check=True, capture_output=True)
-        grep_qemu = subprocess.run(
+        grep_qemu = tracing.run(
             'egrep ' + qemu_command, input=ps_read.stdout, shell=True, check=True, capture_output=True)
         # Loop to get available VMs and their PIDs, put them into the dictionary.
         found_vms = grep_qemu.stdout.decode('utf-8').split('\n')
@@ -81,6 +83,24 @@ def find_virtual_machine(vm_command:string, available_vms:dict) -> string:
     return False
 
 
+def find_ram_addresses(vm_command:string, pid:string):
+    '''
+    Find the host addresses of the largest RAM region of a VM (NUMA node, memfd or
+    file backend, or main RAM), as the top and bottom hex addresses that the
+    memory_reader dd functions take. Returns empty strings if not found.
+    '''
+    try:
+        guest = guest_memory.find_guest_ram(pid, vm_command)
+    except (OSError, ValueError) as err:
+        print("Could not find the VM memory in host system. Error returned: " + str(err))
+        return '', ''
+    # VM memory not found in the host system
+    if not guest:
+        return '', ''
+    region = max(guest, key=lambda region: region.end - region.start)
+    return f'{region.start:x}', f'{region.end:x}'
+
+
 def setup_memory_for_testing(vm_command:string, pid:string):
     '''
     With the command used to launch the VM and the PID corresponding to the VM, grab a page of its memory and then
@@ -89,15 +109,85 @@ def setup_memory_for_testing(vm_command:string, pid:string):
     # Will contain memory
     memory = None
 
-    # Find the size of the memory (Eg QEMU -m 2048 M)
-    mem_size = memory_reader.get_memory_size(vm_command)
-    # With the memory size found, find the top and bottom adresses corresponding to the VMs memory pages in the host system
-    top_address, bot_address = memory_reader.find_ram_specific_memory(
-        pid, mem_size)
+    # Find the top and bottom adresses of the VMs memory pages in the host system,
+    # from its memory backends (Eg QEMU -m 2048M or -object memory-backend-ram,size=2G)
+    top_address, bot_address = find_ram_addresses(vm_command, pid)
+    # VM memory not found in the host system
+    if not top_address:
+        return None
     # Grab one page of memory for testing
     memory = memory_reader.read_one_memory_page_for_testing(
         pid, top_address, bot_address)
-    return memory.stdout
+    return memory.stdout if memory is not None else None
+
+
+def sample_memory_for_testing(vm_command:string, pid:string,
+                              pages:int = memory_reader.SAMPLE_PAGES, coverage:bool = False):
+    '''
+    With the command used to launch the VM and the PID corresponding to the VM, read pages
+    picked at random in the resident memory of all its RAM regions with one system call.
+    Returns the pages, the residency of the VM memory (None unless coverage) and its RAM regions.
+    Raises OSError if the memory can't be read directly, ValueError if it was not found.
+    '''
+    # Every RAM region of the VM (NUMA nodes, DIMMs, main RAM) in the host process
+    guest = guest_memory.find_guest_ram(pid, vm_command)
+    if not guest:
+        raise ValueError("no guest RAM found for VM " + str(pid))
+    # Only the pagemap entries of the sampled pages are read
+    if not coverage:
+        return guest_memory.sample_guest_memory(pid, guest, pages), None, guest
+    # The pagemap of each region is read from the host node holding it
+    guest_memory.locate_nodes(pid, guest)
+    # Which pages the guest populated, the others are zeros on the host
+    residency = guest_memory.read_guest_residency(pid, guest)
+    return memory_reader.sample_memory_pages(pid, residency, pages), residency, guest
+
+
+def read_memory_for_testing(vm_command:string, pid:string, non_verbose:bool = True):
+    '''
+    Get memory of a VM for the entropy test: pages sampled from its resident memory,
+    or one page read with sudo dd when its memory can't be found or read directly or
+    has no resident page. Returns None if no memory could be read. Prints how much of the VM memory is resident unless non_verbose,
+    and of each RAM region when there are several.
+    '''
+    try:
+        memory, residency, guest = sample_memory_for_testing(vm_command, pid,
+                                                             coverage=not non_verbose)
+    # Not allowed to read the VM memory directly, memory not found, the VM exited or a
+    # read failed: try one page with sudo dd
+    except (OSError, ValueError) as err:
+        if not non_verbose:
+            print("Could not sample the VM memory directly (" + str(err) + "), reading one page with dd")
+        return setup_memory_for_testing(vm_command, pid)
+    if residency is not None:
+        print("Memory coverage: " + memory_reader.format_coverage(residency))
+        if len(guest) > 1:
+            # The regions and their residencies are both in address order
+            for region, region_residency in zip(guest, residency.residencies):
+                node = guest.nodes.get(region.name)
+                print(f"  {region.name}" + (f" (node {node})" if node is not None else "")
+                      + ": " + memory_reader.format_coverage(region_residency))
+    if not memory:
+        return setup_memory_for_testing(vm_command, pid)
+    return memory
+
+
+def get_vm_entropies(system_os:string) -> dict:
+    '''
+    Entropy of a sample of the resident memory of every running VM, as PID: bits per byte.
+    VMs whose memory can't be read are left out.
+    '''
+    entropies = {}
+    available_vms = get_virtual_machines(system_os) or {}
+    for pid, vm_command in available_vms.items():
+        try:
+            memory = read_memory_for_testing(vm_command, pid)
+        # Memory could not be found or read, or the VM stopped
+        except (AttributeError, ValueError, OSError):
+            continue
+        if memory:
+            entropies[pid] = encryption_test.entropy_encryption_test(memory)
+    return entropies
 
 
 def set_up_memory_for_printing(vm_command:string, pid:string):
@@ -106,15 +196,16 @@ def set_up_memory_for_printing(vm_command:string, pid:string):
     grab a page of its memory and return it for printing.
     Unlike setupMemoryforTesting,
     no formatting is necessary since the memory is just being printed, not analyzed.
+    Returns None if the memory could not be found.
     '''
     # Will contain memory
     memory = None
 
-    # Find the size of the memory (Eg QEMU -m 2048 M)
-    mem_size = memory_reader.get_memory_size(vm_command)
-    # With the memory size found, find the top and bottom adresses corresponding to the VMs memory
-    top_addr, bot_addr = memory_reader.find_ram_specific_memory(
-        pid, mem_size)
+    # Find the top and bottom adresses of the VMs memory from its memory backends
+    top_addr, bot_addr = find_ram_addresses(vm_command, pid)
+    # VM memory not found in the host system
+    if not top_addr:
+        return None
     # Grab one page of memory for printing
     memory = memory_reader.read_one_memory_page_for_printing(
         pid, top_addr, bot_addr)
@@ -126,7 +217,7 @@ def set_up_memory_for_printing(vm_command:string, pid:string):
 def test_virtual_machine(tested_vm:string, available_vms:dict, non_verbose:bool):
     '''
     For a given Virtual machine,
-    perform the entropy encryption test in one page of its memory and return results.
+    perform the entropy encryption test on a sample of its memory and return results.
     '''
     # Will turn False if test fails or VM was not found
     test_pass = True
@@ -142,8 +233,13 @@ def test_virtual_machine(tested_vm:string, available_vms:dict, non_verbose:bool)
             print(tested_vm)
             print('')
             print("Testing virtual machine " + vm_pid + " for encryption")
-        # Get 1 formatted page of memory for testing
-        vm_memory = setup_memory_for_testing(tested_vm, vm_pid)
+        # Get a sample of the resident memory for testing
+        vm_memory = read_memory_for_testing(tested_vm, vm_pid, non_verbose)
+        # No memory could be read, the test can't pass
+        if not vm_memory:
+            if not non_verbose:
+                print("Could not read the memory of Virtual Machine " + vm_pid + ".")
+            return False
         # Perform test on the memory
         entropy_value = encryption_test.entropy_encryption_test(
             vm_memory)
@@ -269,6 +365,10 @@ def print_vm_memory(tested_vm,available_vms):
         print("Printing one page of memory for VM: " + vm_pid)
         #Get the memory contents
         vm_memory = set_up_memory_for_printing(tested_vm, vm_pid)
+        #Memory could not be found or read
+        if vm_memory is None:
+            print("Could not read the memory of VM: " + vm_pid)
+            return
         #For each line in the memory page, print its contents
         print(vm_memory.stdout.decode('utf-8'))
      #PID was not found, so assusming VM was either not launched or there was a user input error
@@ -1,6 +1,549 @@
 '''Functions that allow the program to access a VM's memory in the host system'''
+import array
+import bisect
+import ctypes
+import errno
+import itertools
+import os
+import random
+import re
+import select
 import string
 import subprocess
+import sys
+from collections import namedtuple
+import command_runner
+import tracing
+
+# Seconds a memory read can take before it's given up on
+MEMORY_READ_TIMEOUT = 60
+# Size of one page of guest memory
+PAGE_SIZE = 4096
+# Most iovecs process_vm_readv takes in one call (UIO_MAXIOV)
+IOV_MAX = 1024
+# Pages of a VM's memory read for the entropy test
+SAMPLE_PAGES = 64
+# Candidate pages whose pagemap entry is read for every sampled page, see probe_resident_pages
+SAMPLE_ATTEMPTS = 16
+# Size of one /proc/PID/pagemap entry
+PAGEMAP_ENTRY_SIZE = 8
+# pagemap entries read per system call
+PAGEMAP_BATCH = 65536
+# Page states of a Residency
+PAGE_UNTOUCHED = 0
+PAGE_RESIDENT = 1
+PAGE_SWAPPED = 2
+# Byte of a pagemap entry holding the present (bit 63) and swapped (bit 62) flags
+_PAGEMAP_FLAGS_BYTE = PAGEMAP_ENTRY_SIZE - 1 if sys.byteorder == 'little' else 0
+# Present (bit 63) and swapped (bit 62) flags in that byte
+_PAGEMAP_PRESENT = 0x80
+_PAGEMAP_SWAPPED = 0x40
+# Flag bytes of the pages that are not swapped, deleted to find the swapped ones
+_NOT_SWAPPED = bytes(flags for flags in range(256)
+                     if not flags & _PAGEMAP_SWAPPED or flags & _PAGEMAP_PRESENT)
+# Turn one byte per page into the characters of a binary number, see _pack_bits
+_PRESENT_BITS = bytes(b'1'[0] if flags & _PAGEMAP_PRESENT else b'0'[0] for flags in range(256))
+_SWAPPED_BITS = bytes(b'1'[0] if flags & _PAGEMAP_SWAPPED and not flags & _PAGEMAP_PRESENT
+                      else b'0'[0] for flags in range(256))
+_RESIDENT_STATE_BITS = bytes(b'1'[0] if state == PAGE_RESIDENT else b'0'[0]
+                             for state in range(256))
+_SWAPPED_STATE_BITS = bytes(b'1'[0] if state == PAGE_SWAPPED else b'0'[0] for state in range(256))
+# Bitmap bytes with every bit set, or a byte with some bits set
+_BITMAP_RUN = re.compile(b'\xff+|[^\x00\xff]')
+# (first, end) bits of the runs of set bits in every byte value, most significant bit first
+_BYTE_RUNS = [[(match.start(), match.end()) for match in re.finditer('1+', f'{value:08b}')]
+              for value in range(256)]
+# Bitmap bytes counted at once
+_COUNT_CHUNK = 1 << 16
+# start-end permissions offset device inode path of a /proc/PID/maps line
+MAPS_LINE = re.compile(r'^([0-9a-f]+)-([0-9a-f]+) (\S+) ([0-9a-f]+) \S+ (\d+) *(.*)$',
+                       re.MULTILINE)
+
+# One /proc/PID/maps entry, addresses and offset as integers
+MapEntry = namedtuple('MapEntry', ['start', 'end', 'permissions', 'offset', 'inode', 'path'])
+
+
+class IoVec(ctypes.Structure):
+    '''
+    struct iovec from <sys/uio.h>.
+    '''
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+def _get_process_vm_readv():
+    '''
+    Get the libc process_vm_readv function, None if libc doesn't have it.
+    '''
+    function = getattr(ctypes.CDLL(None, use_errno=True), 'process_vm_readv', None)
+    if function is not None:
+        function.restype = ctypes.c_ssize_t
+        function.argtypes = [ctypes.c_int, ctypes.POINTER(IoVec), ctypes.c_ulong,
+                             ctypes.POINTER(IoVec), ctypes.c_ulong, ctypes.c_ulong]
+    return function
+
+
+_process_vm_readv = _get_process_vm_readv()
+
+
+class ProcessMemory:
+    '''
+    Memory of a running process, read without starting dd. A scattered set of pages is
+    read into one buffer with a single process_vm_readv call (up to IOV_MAX pages),
+    or with pread on /proc/PID/mem when process_vm_readv is missing or not allowed.
+    A pidfd taken when opening tells if the process exited during a read,
+    so the memory of another process reusing the PID is never returned.
+    '''
+    def __init__(self, pid):
+        self.pid = int(pid)
+        # Turns false once process_vm_readv failed for a reason retrying won't fix
+        self.use_readv = _process_vm_readv is not None
+        self._mem = None
+        self._pidfd = None
+        try:
+            self._pidfd = os.pidfd_open(self.pid)
+        # No pidfd support, /proc/PID/mem keeps the memory of the opened process instead
+        except OSError as err:
+            if err.errno != errno.ENOSYS:
+                raise
+            self.use_readv = False
+
+    def check_alive(self):
+        '''
+        Raise ProcessLookupError if the process exited since it was opened.
+        '''
+        if self._pidfd is not None and select.select([self._pidfd], [], [], 0)[0]:
+            raise ProcessLookupError(errno.ESRCH, f"process {self.pid} exited")
+
+    def _readv(self, addresses:list, sizes:array.array, buffer:bytearray) -> int:
+        '''
+        Read the ranges with process_vm_readv, IOV_MAX ranges per call.
+        Returns the number of ranges read, the reading stops at the first range that failed.
+        '''
+        local_buffer = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+        base = ctypes.addressof(local_buffer)
+        done = 0
+        offset = 0
+        try:
+            while done < len(addresses):
+                batch = addresses[done:done + IOV_MAX]
+                batch_sizes = sizes[done:done + IOV_MAX]
+                length = sum(batch_sizes)
+                # The ranges land next to each other, one local iovec covers them all
+                local = IoVec(base + offset, length)
+                # Remote iovecs packed as (address, size) pairs, no Python object per range
+                pairs = array.array('Q', bytes(ctypes.sizeof(IoVec) * len(batch)))
+                pairs[0::2] = array.array('Q', batch)
+                pairs[1::2] = batch_sizes
+                remote = (IoVec * len(batch)).from_buffer(pairs)
+                count = _process_vm_readv(self.pid, ctypes.byref(local), 1, remote, len(batch), 0)
+                del remote
+                if count < 0:
+                    error = ctypes.get_errno()
+                    # The first range of the batch is not mapped, pread reports where
+                    if error == errno.EFAULT:
+                        return done
+                    raise OSError(error, os.strerror(error))
+                if count == length:
+                    done += len(batch)
+                    offset += length
+                    continue
+                # Partial reads stop at the end of a range
+                for size in batch_sizes:
+                    if count < size:
+                        break
+                    count -= size
+                    done += 1
+                return done
+            return done
+        finally:
+            del local_buffer
+
+    def _pread(self, addresses:list, sizes:array.array, view:memoryview):
+        '''
+        Read the ranges one by one from /proc/PID/mem.
+        '''
+        if self._mem is None:
+            self._mem = os.open(f'/proc/{self.pid}/mem', os.O_RDONLY | os.O_CLOEXEC)
+        offset = 0
+        for address, size in zip(addresses, sizes):
+            if os.preadv(self._mem, [view[offset:offset + size]], address) != size:
+                self.check_alive()
+                raise OSError(errno.EIO, f"short read of process {self.pid} memory at "
+                              f"{address:#x}")
+            offset += size
+
+    def _read(self, addresses:list, sizes:array.array, buffer:bytearray) -> bytearray:
+        '''
+        Read the ranges one after the other in the buffer.
+        '''
+        done = 0
+        with tracing.span(f'read process {self.pid} memory', 'memory', ranges=len(addresses),
+                          bytes=sum(sizes)) as read_span:
+            if self.use_readv:
+                try:
+                    done = self._readv(addresses, sizes, buffer)
+                except OSError as err:
+                    if err.errno == errno.ESRCH:
+                        raise ProcessLookupError(errno.ESRCH,
+                                                 f"process {self.pid} exited") from err
+                    # Denied by ptrace rules or seccomp, /proc/PID/mem may still be readable
+                    self.use_readv = False
+            # Ranges read with process_vm_readv, the others were read with pread
+            read_span.set('readv_ranges', done)
+            if done < len(addresses):
+                with memoryview(buffer) as view:
+                    self._pread(addresses[done:], sizes[done:], view[sum(sizes[:done]):])
+            self.check_alive()
+        return buffer
+
+    def read_pages(self, addresses, size:int = PAGE_SIZE, buffer:bytearray = None) -> bytearray:
+        '''
+        Read size bytes at each address, one after the other in a single buffer.
+        A preallocated buffer of len(addresses) * size bytes can be given to reuse it.
+        Raises OSError if a page can't be read, ProcessLookupError if the process exited.
+        '''
+        addresses = list(addresses)
+        if buffer is None:
+            buffer = bytearray(len(addresses) * size)
+        return self._read(addresses, array.array('Q', [size]) * len(addresses), buffer)
+
+    def read_ranges(self, ranges, buffer:bytearray = None) -> bytearray:
+        '''
+        Read (address, length) ranges one after the other in a single buffer,
+        see read_pages.
+        '''
+        ranges = list(ranges)
+        sizes = array.array('Q', [length for _, length in ranges])
+        if buffer is None:
+            buffer = bytearray(sum(sizes))
+        return self._read([address for address, _ in ranges], sizes, buffer)
+
+    def close(self):
+        '''
+        Close the pidfd and /proc/PID/mem.
+        '''
+        for descriptor in (self._pidfd, self._mem):
+            if descriptor is not None:
+                os.close(descriptor)
+        self._pidfd = self._mem = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def _pack_bits(flags:bytes, table:bytes) -> bytes:
+    '''
+    Pack one byte per page into a bitmap, page N in bit 7 - N % 8 of byte N // 8.
+    table turns each byte into the character '1' or '0'.
+    '''
+    # The first page is the first digit of a binary number, padded to whole bytes
+    bits = flags.translate(table) + b'0' * (-len(flags) % 8)
+    return int(bits or b'0', 2).to_bytes(len(bits) // 8, 'big')
+
+
+def _count_bits(bitmap:bytes) -> int:
+    '''
+    Number of bits set in a bitmap.
+    '''
+    return sum(bin(int.from_bytes(bitmap[offset:offset + _COUNT_CHUNK], 'little')).count('1')
+               for offset in range(0, len(bitmap), _COUNT_CHUNK))
+
+
+def _get_bit_runs(bitmap:bytes) -> list:
+    '''
+    (first, end) of every run of set bits in a bitmap. Full bytes are skipped over
+    together, so a mostly set or mostly clear bitmap only takes a few steps.
+    '''
+    runs = []
+    for match in _BITMAP_RUN.finditer(bitmap):
+        offset = match.start() * 8
+        byte_runs = ([(0, (match.end() - match.start()) * 8)] if bitmap[match.start()] == 0xff
+                     else _BYTE_RUNS[bitmap[match.start()]])
+        for first, end in byte_runs:
+            # Continues the run ending where it starts
+            if runs and runs[-1][1] == offset + first:
+                runs[-1] = (runs[-1][0], offset + end)
+            else:
+                runs.append((offset + first, offset + end))
+    return runs
+
+
+class Residency:
+    '''
+    Residency of the pages of a mapping, read from /proc/PID/pagemap. resident and swapped
+    are bitmaps with one bit per page (page N in bit 7 - N % 8 of byte N // 8): set in resident
+    for pages in RAM and in swapped for pages in swap. Pages in neither were never
+    populated and only read as zeros.
+    '''
+    def __init__(self, start:int, pages:int, resident:bytes, swapped:bytes):
+        self.start = start
+        self.pages = pages
+        self.resident = resident
+        self.swapped = swapped
+
+    @classmethod
+    def from_states(cls, start:int, states:bytes):
+        '''
+        Build the residency of a mapping from one PAGE_* state per page.
+        '''
+        return cls(start, len(states), _pack_bits(states, _RESIDENT_STATE_BITS),
+                   _pack_bits(states, _SWAPPED_STATE_BITS))
+
+    @classmethod
+    def join(cls, start:int, residencies):
+        '''
+        Join the residencies of mappings following each other into one.
+        '''
+        residencies = list(residencies)
+        pages = sum(residency.pages for residency in residencies)
+        # Bitmaps of whole bytes are put one after the other
+        if all(residency.pages % 8 == 0 for residency in residencies[:-1]):
+            return cls(start, pages, b''.join(residency.resident for residency in residencies),
+                       b''.join(residency.swapped for residency in residencies))
+        resident = swapped = 0
+        for residency in residencies:
+            padding = len(residency.resident) * 8 - residency.pages
+            resident = resident << residency.pages |\
+                int.from_bytes(residency.resident, 'big') >> padding
+            swapped = swapped << residency.pages | int.from_bytes(residency.swapped, 'big') >> padding
+        padding = -pages % 8
+        size = (pages + 7) // 8
+        return cls(start, pages, (resident << padding).to_bytes(size, 'big'),
+                   (swapped << padding).to_bytes(size, 'big'))
+
+    def count(self, state:int) -> int:
+        '''
+        Number of pages in a state.
+        '''
+        if state == PAGE_RESIDENT:
+            return _count_bits(self.resident)
+        if state == PAGE_SWAPPED:
+            return _count_bits(self.swapped)
+        return self.pages - _count_bits(self.resident) - _count_bits(self.swapped)
+
+    def is_resident(self, index:int) -> bool:
+        '''
+        True if a page of the mapping is resident.
+        '''
+        return bool(self.resident[index >> 3] & 0x80 >> (index & 7))
+
+    def get_resident_runs(self) -> list:
+        '''
+        (first, end) page indexes of every run of resident pages.
+        '''
+        return _get_bit_runs(self.resident)
+
+    def get_resident_indexes(self) -> list:
+        '''
+        Index of every resident page in the mapping.
+        '''
+        return [index for first, end in self.get_resident_runs() for index in range(first, end)]
+
+    def get_resident_ranges(self) -> list:
+        '''
+        (address, length) of every run of resident pages.
+        '''
+        return [(self.start + first * PAGE_SIZE, (end - first) * PAGE_SIZE)
+                for first, end in self.get_resident_runs()]
+
+    def sample(self, pages:int, rng:random.Random = None) -> list:
+        '''
+        Pick up to pages resident pages at random, get their addresses in order.
+        '''
+        rng = rng or random.Random()
+        resident = self.count(PAGE_RESIDENT)
+        wanted = min(pages, resident)
+        # Mostly resident mapping: draw pages and keep the resident ones, no run list
+        if resident * 4 >= self.pages and wanted * 4 <= resident:
+            chosen = set()
+            while len(chosen) < wanted:
+                index = rng.randrange(self.pages)
+                if self.is_resident(index):
+                    chosen.add(index)
+        else:
+            # Draw ranks among the resident pages and find the run holding each
+            runs = self.get_resident_runs()
+            ends = list(itertools.accumulate(end - first for first, end in runs))
+            chosen = set()
+            for rank in rng.sample(range(resident), wanted):
+                run = bisect.bisect_right(ends, rank)
+                chosen.add(runs[run][1] - (ends[run] - rank))
+        return [self.start + index * PAGE_SIZE for index in sorted(chosen)]
+
+    def get_coverage(self) -> dict:
+        '''
+        Bytes of the mapping resident, swapped and untouched.
+        '''
+        return {'resident': self.count(PAGE_RESIDENT) * PAGE_SIZE,
+                'swapped': self.count(PAGE_SWAPPED) * PAGE_SIZE,
+                'untouched': self.count(PAGE_UNTOUCHED) * PAGE_SIZE}
+
+
+class ResidencySet:
+    '''
+    Residency of several mappings taken as one, like the memory backends of a NUMA guest.
+    Has the same methods as Residency, the mappings are kept in address order.
+    '''
+    def __init__(self, residencies):
+        self.residencies = sorted(residencies, key=lambda residency: residency.start)
+
+    @property
+    def pages(self) -> int:
+        '''
+        Number of pages in all the mappings.
+        '''
+        return sum(residency.pages for residency in self.residencies)
+
+    def count(self, state:int) -> int:
+        '''
+        Number of pages in a state.
+        '''
+        return sum(residency.count(state) for residency in self.residencies)
+
+    def get_resident_ranges(self) -> list:
+        '''
+        (address, length) of every run of resident pages.
+        '''
+        return [resident_range for residency in self.residencies
+                for resident_range in residency.get_resident_ranges()]
+
+    def sample(self, pages:int, rng:random.Random = None) -> list:
+        '''
+        Pick up to pages resident pages at random among all the mappings, get their
+        addresses in order. Every resident page has the same chance to be picked.
+        '''
+        rng = rng or random.Random()
+        counts = list(itertools.accumulate(residency.count(PAGE_RESIDENT)
+                                           for residency in self.residencies))
+        if not counts:
+            return []
+        # Draw which resident pages are read, then how many fall in each mapping
+        wanted = [0] * len(counts)
+        for rank in rng.sample(range(counts[-1]), min(pages, counts[-1])):
+            wanted[bisect.bisect_right(counts, rank)] += 1
+        return [address for residency, count in zip(self.residencies, wanted) if count
+                for address in residency.sample(count, rng)]
+
+    def get_coverage(self) -> dict:
+        '''
+        Bytes of the mappings resident, swapped and untouched.
+        '''
+        coverage = dict.fromkeys(('resident', 'swapped', 'untouched'), 0)
+        for residency in self.residencies:
+            for state, size in residency.get_coverage().items():
+                coverage[state] += size
+        return coverage
+
+
+def read_region_residency(pid:string, start:int, end:int) -> Residency:
+    '''
+    Read which pages between two addresses are resident. The pagemap entries are read
+    PAGEMAP_BATCH at a time into one packed array of 64-bit entries, and only their
+    present and swapped bits are kept.
+    Raises OSError if the pagemap can't be read.
+    '''
+    pages = (end - start) // PAGE_SIZE
+    entries = array.array('Q', bytes(PAGEMAP_ENTRY_SIZE * min(pages, PAGEMAP_BATCH)))
+    entry_bytes = memoryview(entries).cast('B')
+    resident = bytearray()
+    swapped = bytearray()
+    with tracing.span(f'pagemap {pid} {start:#x}', 'pagemap', pages=pages,
+                      bytes=pages * PAGEMAP_ENTRY_SIZE),\
+            open(f'/proc/{pid}/pagemap', 'rb', buffering=0) as pagemap:
+        for first in range(0, pages, PAGEMAP_BATCH):
+            count = min(PAGEMAP_BATCH, pages - first)
+            batch = entry_bytes[:count * PAGEMAP_ENTRY_SIZE]
+            offset = (start // PAGE_SIZE + first) * PAGEMAP_ENTRY_SIZE
+            if os.preadv(pagemap.fileno(), [batch], offset) != len(batch):
+                raise OSError(errno.EIO, f"short read of process {pid} pagemap")
+            # The present and swapped flags share a byte of each entry, batches are
+            # whole bytes of the bitmaps
+            flags = bytes(batch[_PAGEMAP_FLAGS_BYTE::PAGEMAP_ENTRY_SIZE])
+            resident += _pack_bits(flags, _PRESENT_BITS)
+            # Most batches have no page in swap
+            if flags.translate(None, _NOT_SWAPPED):
+                swapped += _pack_bits(flags, _SWAPPED_BITS)
+            else:
+                swapped += bytes((count + 7) // 8)
+    return Residency(start, pages, bytes(resident), bytes(swapped))
+
+
+def probe_resident_pages(pid:string, ranges, pages:int = SAMPLE_PAGES,
+                         rng:random.Random = None, attempts:int = None) -> list:
+    '''
+    Pick up to pages resident pages at random in (start, end) address ranges, reading
+    only the pagemap entries of the candidate pages drawn instead of the whole pagemap.
+    Every resident page has the same chance to be picked. Gives up after attempts
+    candidates (SAMPLE_ATTEMPTS per page by default), so fewer pages are found when
+    little of the memory is resident. Returns the addresses in order.
+    Raises OSError if the pagemap can't be read.
+    '''
+    rng = rng or random.Random()
+    ranges = sorted(ranges)
+    ends = list(itertools.accumulate((end - start) // PAGE_SIZE for start, end in ranges))
+    total = ends[-1] if ends else 0
+    attempts = min(pages * SAMPLE_ATTEMPTS if attempts is None else attempts, total)
+    chosen = []
+    with tracing.span(f'pagemap probe {pid}', 'pagemap') as probe_span,\
+            open(f'/proc/{pid}/pagemap', 'rb', buffering=0) as pagemap:
+        # Candidates are drawn without replacement among all the pages of the ranges
+        candidates = 0
+        for rank in rng.sample(range(total), attempts):
+            candidates += 1
+            index = bisect.bisect_right(ends, rank)
+            address = ranges[index][0] + (rank - (ends[index - 1] if index else 0)) * PAGE_SIZE
+            entry = os.pread(pagemap.fileno(), PAGEMAP_ENTRY_SIZE,
+                             address // PAGE_SIZE * PAGEMAP_ENTRY_SIZE)
+            if len(entry) != PAGEMAP_ENTRY_SIZE:
+                raise OSError(errno.EIO, f"short read of process {pid} pagemap")
+            if entry[_PAGEMAP_FLAGS_BYTE] & _PAGEMAP_PRESENT:
+                chosen.append(address)
+                if len(chosen) == pages:
+                    break
+        probe_span.set('pages', candidates)
+        probe_span.set('bytes', candidates * PAGEMAP_ENTRY_SIZE)
+    return sorted(chosen)
+
+
+def read_residency(pid:string, top_address:string, bot_address:string) -> Residency:
+    '''
+    Read which pages between the addresses found by find_ram_specific_memory are resident,
+    see read_region_residency.
+    '''
+    return read_region_residency(pid, hex_to_decimal(top_address), hex_to_decimal(bot_address))
+
+
+def format_coverage(residency:Residency) -> str:
+    '''
+    Describe how much of a mapping is resident, swapped and untouched.
+    '''
+    coverage = residency.get_coverage()
+    total = residency.pages * PAGE_SIZE
+    return ", ".join(f"{size // 1048576} MiB {state} ({size / total if total else 0:.0%})"
+                     for state, size in coverage.items()) + f" of {total // 1048576} MiB"
+
+
+def sample_memory_pages(pid:string, residency:Residency, pages:int = SAMPLE_PAGES,
+                        rng:random.Random = None) -> bytearray:
+    '''
+    Read pages picked at random among the resident pages of a mapping, in address
+    order, as one buffer. Untouched pages are never read, they would only be zeros.
+    Raises OSError if the memory can't be read.
+    '''
+    with ProcessMemory(pid) as memory:
+        return memory.read_pages(residency.sample(pages, rng))
+
+
+def read_resident_memory(pid:string, residency:Residency) -> bytearray:
+    '''
+    Read every resident page of a mapping as one buffer, in address order.
+    Raises OSError if the memory can't be read.
+    '''
+    with ProcessMemory(pid) as memory:
+        return memory.read_ranges(residency.get_resident_ranges())
 
 
 def hex_to_decimal(hex_num:string) -> int:
@@ -55,39 +598,62 @@ def get_memory_size(line:string) -> string:
     return str(memory_size_integer)
 
 
+def parse_maps(maps) -> list:
+    '''
+    Parse a /proc/PID/maps file, as text or lines, into MapEntry tuples in address order.
+    Lines that are not mappings, like the empty one at the end, are skipped.
+    '''
+    if not isinstance(maps, str):
+        maps = '\n'.join(maps)
+    # One pass of the pattern over the whole file, the fields come out as strings
+    return [MapEntry(int(start, 16), int(end, 16), permissions, int(offset, 16), int(inode),
+                     path.rstrip())
+            for start, end, permissions, offset, inode, path in MAPS_LINE.findall(maps)]
+
+
+def find_ram_in_maps(maps_lines, machine_memory:string):
+    '''
+    Find the mapping of a VM's memory in the lines of its /proc/PID/maps file,
+    the first mapping with the same size as the VM memory.
+    Returns the top and bottom addresses, empty strings if not found.
+    '''
+    machine_memory = int(machine_memory)
+    for line in maps_lines:
+        # Empty lines, like the one after the last mapping, don't match
+        match = MAPS_LINE.match(line)
+        if match and int(match[2], 16) - int(match[1], 16) == machine_memory:
+            return match[1], match[2]
+    # Return empty string if VM memory address not found
+    return '', ''
+
+
+def get_sudo() -> str:
+    '''
+    Get the sudo command for the memory reads. sudo can only ask for a password when
+    someone is at the terminal and no deadline is running, otherwise sudo -n fails
+    right away instead of waiting for a password that never comes.
+    '''
+    if command_runner.get_deadline() is not None or not sys.stdin or not sys.stdin.isatty():
+        return 'sudo -n'
+    return 'sudo'
+
+
 def find_ram_specific_memory(pid:string, machine_memory:string) -> string:
     '''
     Using a VM's PID and memory size, find its memory contents in the host system. 
     '''
     try:
         # Command to map the PID memory
-        vm_memory_raw = subprocess.run(
-            'sudo cat /proc/' + pid + '/maps', shell=True, check=True, capture_output=True)
-        top_address = ''
-        bot_address = ''
-        vm_memory = vm_memory_raw.stdout.decode("utf-8").split('\n')
-        # Loop to find the top and bottom addresses of the VMs memory
-        for line in vm_memory:
-            curr_num = ''
-            for char in line:
-                if char == '-':
-                    top_address = curr_num
-                    curr_num = ''
-                elif char == ' ':
-                    bot_address = curr_num
-                    break
-                else:
-                    curr_num += char
-            num_1 = hex_to_decimal(top_address)
-            num_2 = hex_to_decimal(bot_address)
-            memory_size = num_2 - num_1
-            # If addresses found match the size of VM memory, return those addresses
-            if memory_size != int(machine_memory):
-                top_address, bot_address = '', ''
-            else:
-                break
-        # Return empty string if VM memory address not found
-        return top_address, bot_address
+        vm_memory_raw = tracing.run(
+            get_sudo() + ' cat /proc/' + pid + '/maps', shell=True, check=True, capture_output=True,
+            timeout=MEMORY_READ_TIMEOUT)
+        return find_ram_in_maps(vm_memory_raw.stdout.decode("utf-8").split('\n'), machine_memory)
+    # Without a terminal sudo -n fails instead of waiting for a password,
+    # the timeout catches anything else hanging
+    except subprocess.TimeoutExpired:
+        print("Could not find the VM memory in host system. Error returned: timed out after "
+              + str(MEMORY_READ_TIMEOUT) + " seconds")
+        return '', ''
     except (subprocess.CalledProcessError) as err:
         print("Could not find the VM memory in host system. Error returned: " +
               err.stderr.decode("utf-8").strip())
@@ -105,11 +671,17 @@ def read_entire_memory(pid:string, top_address:string, bot_address:string):
         num_2 = hex_to_decimal(bot_address)
         skip_num = num_1 // 4096
         count_num = (num_2 - num_1) // 4096
+        sudo = get_sudo()
         try:
             # Return VM memory content
-            memory_page = subprocess.run('sudo dd if=/proc/' + pid + '/mem bs=4096 skip=' + str(
-                skip_num) + ' count=' + str(count_num), shell=True, check=True, capture_output=True)
+            memory_page = tracing.run(sudo + ' dd if=/proc/' + pid + '/mem bs=4096 skip=' + str(
+                skip_num) + ' count=' + str(count_num), shell=True, check=True, capture_output=True,
+                timeout=MEMORY_READ_TIMEOUT)
             return memory_page
+        except subprocess.TimeoutExpired:
+            print("Could not read the VM memory in host system. Error returned: timed out after "
+                  + str(MEMORY_READ_TIMEOUT) + " seconds")
+            return None
         except (subprocess.CalledProcessError) as err:
             print("Could not read the VM memory in host system. Error returned: " +
                   err.stderr.decode("utf-8").strip())
@@ -127,11 +699,17 @@ def read_one_memory_page_for_testing(pid:string, top_address:string, bot_address
     if top_address or not bot_address:
         num_1 = hex_to_decimal(top_address)
         skip_num = num_1 // 4096
+        sudo = get_sudo()
         try:
             # Return VM memory content
-            memory_page = subprocess.run('sudo dd if=/proc/' + pid + '/mem bs=4096 skip=' + str(
-                skip_num) + ' count=1', shell=True, check=True, capture_output=True)
+            memory_page = tracing.run(sudo + ' dd if=/proc/' + pid + '/mem bs=4096 skip=' + str(
+                skip_num) + ' count=1', shell=True, check=True, capture_output=True,
+                timeout=MEMORY_READ_TIMEOUT)
             return memory_page
+        except subprocess.TimeoutExpired:
+            print("Could not read the VM memory in host system. Error returned: timed out after "
+                  + str(MEMORY_READ_TIMEOUT) + " seconds")
+            return None
         except (subprocess.CalledProcessError) as err:
             print("Could not read the VM memory in host system. Error returned: " +
                   err.stderr.decode("utf-8").strip())
@@ -149,13 +727,20 @@ def read_one_memory_page_for_printing(pid:string, top_address:string, bot_addres
     if top_address or not bot_address:
         num_1 = hex_to_decimal(top_address)
         skip_num = num_1 // 4096
+        sudo = get_sudo()
         try:
             # Get memory using sudo dd, format it for printing by using hexdump
-            memory_page = subprocess.run('sudo dd if=/proc/' + pid + '/mem bs=4096 skip=' + str(
-                skip_num) + ' count=1', shell=True, check=True, capture_output=True)
-            hex_dump = subprocess.run(
-                "hexdump -C", input=memory_page.stdout, shell=True, check=True, capture_output=True)
+            memory_page = tracing.run(sudo + ' dd if=/proc/' + pid + '/mem bs=4096 skip=' + str(
+                skip_num) + ' count=1', shell=True, check=True, capture_output=True,
+                timeout=MEMORY_READ_TIMEOUT)
+            hex_dump = tracing.run(
+                "hexdump -C", input=memory_page.stdout, shell=True, check=True, capture_output=True,
+                timeout=MEMORY_READ_TIMEOUT)
             return hex_dump
+        except subprocess.TimeoutExpired:
+            print("Could not read the VM memory in host system. Error returned: timed out after "
+                  + str(MEMORY_READ_TIMEOUT) + " seconds")
+            return None
         except (subprocess.CalledProcessError) as err:
             print("Could not read the VM memory in host system. Error returned: " +
                   err.stderr.decode("utf-8").strip())
@@ -1,6 +1,12 @@
 '''
 Functions to print test results.
 '''
+import contextlib
+import threading
+
+# Warnings raised while capture_warnings is active in a thread are collected here
+_capture = threading.local()
+
 def print_test_result(component, command, found, expectation, result):
     '''
     Format in which test results will be printed.
@@ -34,15 +40,46 @@ def print_overall_result(test, result):
         'green': '\033[32m',
         'yellow': '\033[93m'
     }
-    if result:
+    if result is None:
+        # Some checks didn't finish in time, the result is unknown
+        print(test + colors['yellow'] + " TIMEOUT" + colors['reset'])
+    elif result:
         print(test + colors['green'] + " PASS" + colors['reset'])
     else:
         print(test + colors['red'] + " FAIL" + colors['reset'])
 
+def print_timeout_result(check, duration):
+    '''
+    Result of a check that did not finish in its time budget or before the deadline.
+    '''
+    yellow = '\033[93m'
+    reset_color = '\033[0m'
+    print("- " + check + " did not finish after " + format(duration, '.1f')
+          + " seconds" + yellow + " TIMEOUT" + reset_color)
+
+@contextlib.contextmanager
+def capture_warnings():
+    '''
+    Collect the warnings printed by the current thread instead of printing them,
+    so checks running concurrently can have their warnings printed in order later.
+    Yields the list (component, warning) tuples are added to.
+    '''
+    messages = []
+    _capture.messages = messages
+    try:
+        yield messages
+    finally:
+        _capture.messages = None
+
 def print_warning_message(component, warning):
     '''
     Warning message when a test runs into an error and the test can't be performed.
     '''
+    # Warning is being captured, it will be printed later
+    messages = getattr(_capture, 'messages', None)
+    if messages is not None:
+        messages.append((component, warning))
+        return
     yellow = '\033[93m'
     reset_color = '\033[0m'
     # Test can't be run due to certain set-ups in the system
@@ -0,0 +1,167 @@
+'''
+Batched MSR reader. Keeps the /dev/cpu/N/msr files open for the whole run
+and reads sets of MSRs from every cpu in parallel.
+'''
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import host_probes
+import tracing
+
+# SYSCFG MSR, bit 23 is memory encryption enable, bit 24 is SNP enable
+MSR_SYSCFG = 0xC0010010
+# RMP table base and end address MSRs
+MSR_RMP_BASE = 0xC0010132
+MSR_RMP_END = 0xC0010133
+
+
+class MsrReadError(OSError):
+    '''
+    An MSR could not be read on some cpus. cpus lists them, matrix has the values
+    of the cpus that were read.
+    '''
+    def __init__(self, errors:dict, matrix:dict):
+        self.cpus = sorted(errors)
+        self.matrix = matrix
+        first_error = errors[self.cpus[0]]
+        super().__init__(first_error.errno, f"{first_error.strerror or first_error} on cpus "
+                         f"{host_probes.format_cpu_list(self.cpus)}")
+
+
+def check_matrix(matrix:dict, errors:dict) -> dict:
+    '''
+    Get an MSR matrix if every cpu was read, errors has the OSError of every cpu that wasn't.
+    Raises MsrReadError if some cpus could not be read.
+    '''
+    if errors:
+        raise MsrReadError(errors, matrix)
+    return matrix
+
+
+class MsrReader:
+    '''
+    Reader for model specific registers. File descriptors are opened the first time
+    a cpu is read and kept open until close() is called.
+    '''
+    def __init__(self, max_workers:int = 16):
+        self._fds = {}
+        self._lock = threading.Lock()
+        self._max_workers = max_workers
+
+    def _get_fd(self, cpu:int) -> int:
+        '''
+        Get the open msr file for a cpu, opening it if needed.
+        '''
+        with self._lock:
+            if cpu not in self._fds:
+                self._fds[cpu] = os.open(f'/dev/cpu/{cpu}/msr', os.O_RDONLY)
+            return self._fds[cpu]
+
+    def read(self, msr:int, cpu:int = 0) -> int:
+        '''
+        Read one MSR on one cpu. Raises OSError if the MSR can't be read.
+        '''
+        with tracing.span(f'rdmsr {msr:#x}', 'msr', cpu=cpu, bytes=8):
+            # The file offset selects the MSR
+            return struct.unpack('Q', os.pread(self._get_fd(cpu), 8, msr))[0]
+
+    def read_set(self, msrs, cpu:int = 0) -> tuple:
+        '''
+        Read a set of MSRs on one cpu, values are returned in the same order.
+        '''
+        return tuple(self.read(msr, cpu) for msr in msrs)
+
+    def read_matrix(self, msrs, cpus=None) -> dict:
+        '''
+        Read a set of MSRs on every cpu in parallel.
+        Returns a dictionary of cpu: tuple of values in the same order as msrs.
+        Raises MsrReadError if the MSRs can't be read on some cpus, every cpu is still tried.
+        '''
+        if cpus is None:
+            cpus = host_probes.get_probes().get_online_cpus()
+        msrs = tuple(msrs)
+        matrix = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(cpus)) or 1) as pool:
+            futures = {cpu: pool.submit(self.read_set, msrs, cpu) for cpu in cpus}
+            for cpu, future in futures.items():
+                try:
+                    matrix[cpu] = future.result()
+                except OSError as err:
+                    errors[cpu] = err
+        return check_matrix(matrix, errors)
+
+    def close(self):
+        '''
+        Close every open msr file.
+        '''
+        with self._lock:
+            for msr_fd in self._fds.values():
+                os.close(msr_fd)
+            self._fds.clear()
+
+
+class CachingMsrReader(MsrReader):
+    '''
+    MSR reader keeping every value it read, so they can be saved in the fact cache.
+    values starts it with the (msr, cpu): value pairs read by an earlier run,
+    those are not read again.
+    '''
+    def __init__(self, values:dict = None, max_workers:int = 16):
+        super().__init__(max_workers)
+        self.values = dict(values or {})
+
+    def read(self, msr:int, cpu:int = 0) -> int:
+        value = self.values.get((msr, cpu))
+        if value is None:
+            value = super().read(msr, cpu)
+            self.values[(msr, cpu)] = value
+        return value
+
+    def read_matrix(self, msrs, cpus=None) -> dict:
+        if cpus is None:
+            cpus = host_probes.get_probes().get_online_cpus()
+        msrs = tuple(msrs)
+        # Every value known, no need for the reading threads
+        if all((msr, cpu) in self.values for msr in msrs for cpu in cpus):
+            return {cpu: tuple(self.values[(msr, cpu)] for msr in msrs) for cpu in cpus}
+        return super().read_matrix(msrs, cpus)
+
+
+def group_cpus_by_value(matrix:dict, index:int, mask:int = 0xFFFFFFFFFFFFFFFF) -> dict:
+    '''
+    Group the cpus of an MSR matrix by the (masked) value found for one MSR.
+    Returns a dictionary of value: list of cpus.
+    '''
+    groups = {}
+    for cpu, values in sorted(matrix.items()):
+        groups.setdefault(values[index] & mask, []).append(cpu)
+    return groups
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_msr_reader() -> MsrReader:
+    '''
+    Get the MSR reader shared by all the checks in this run.
+    '''
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            _reader = MsrReader()
+        return _reader
+
+
+def set_msr_reader(reader:MsrReader):
+    '''
+    Replace the shared MSR reader, for example with a CachingMsrReader.
+    Passing None opens a new reader the next time it's needed.
+    '''
+    global _reader
+    with _reader_lock:
+        if _reader is not None and _reader is not reader:
+            _reader.close()
+        _reader = reader
@@ -1,8 +1,10 @@
 '''Functions used for OVMF testing. Used by component test and by auto vm test'''
-import subprocess
+import shlex
 import re
 import datetime
-import os
+import command_runner
+import host_probes
+import tracing
 from message_printing import print_warning_message
 
 def get_ovmf_version(console_string):
@@ -97,6 +99,26 @@ def convert_ovmf_version_to_date(ovmf_version):
         return False
 
 
+# Command list to find the default OVMF package for a given distro
+OVMF_PACKAGE_COMMANDS = {
+    'ubuntu': 'dpkg --list', 'debian': 'dpkg --list',
+    'fedora': 'rpm -q edk2-ovmf', 'rhel': 'rpm -q edk2-ovmf',
+    'opensuse-tumbleweed': 'rpm -q ovmf', 'opensuse-leap': 'rpm -q qemu-ovmf-x86_64',
+    'centos': 'rpm -q edk2-ovmf'}
+
+# Command to find all paths containing FV from root, and how long it can take
+FIND_FV_COMMAND = ['find', '/', '-xdev', '-type', 'd', '-name', 'FV']
+FIND_FV_TIMEOUT = 300
+
+
+def get_default_ovmf_command(system_os):
+    '''
+    Get the command used to find the default OVMF package for a given distro.
+    If distro not in the list use a default rpm -q edk2-ovmf command.
+    '''
+    return OVMF_PACKAGE_COMMANDS.get(system_os, "rpm -q edk2-ovmf")
+
+
 def get_default_ovmf_path(system_os):
     '''
     Get the path were the default version of OVMF
@@ -104,13 +126,6 @@ def get_default_ovmf_path(system_os):
     Also get its version and version date.
     '''
 
-    # Command list for given distro
-    command_list = {
-        'ubuntu': 'dpkg --list', 'debian': 'dpkg --list',
-        'fedora': 'rpm -q edk2-ovmf', 'rhel': 'rpm -q edk2-ovmf',
-        'opensuse-tumbleweed': 'rpm -q ovmf', 'opensuse-leap': 'rpm -q qemu-ovmf-x86_64',
-        'centos': 'rpm -q edk2-ovmf'}
-
     # Where the package path is expected to be stored
     default_path = None
     if system_os in ("opensuse-tumbleweed", "opensuse-leap"):
@@ -118,39 +133,36 @@ def get_default_ovmf_path(system_os):
     else:
         for possible_path in ["OVMF_VARS.fd", "OVMF_VARS_4M.fd" 
                               "OVMF_CODE.fd", "OVMF_CODE_4M.fd", "OVMF.fd"]:
-            if os.path.exists("/usr/share/OVMF/" + possible_path):
+            if host_probes.get_probes().path_exists("/usr/share/OVMF/" + possible_path):
                 default_path = "/usr/share/OVMF/" + possible_path
                 break
     # Date corresponding to the default OVMF version
     version_date = None
 
     # If distro not in the list use a default rpm -q edk2-ovmf command
-    command = command_list.get(system_os, "rpm -q edk2-ovmf")
+    command = get_default_ovmf_command(system_os)
 
-    try:
-        # Find default package form distro
-        ovmf_version_read = subprocess.run(
-            command, shell=True, check=True, capture_output=True)
-        grep_ovmf_read = subprocess.run("grep ovmf", shell=True,
-                                        input=ovmf_version_read.stdout, check=True, capture_output=True)
-        # Call to get default package version
-        ovmf_version = get_ovmf_version(
-            grep_ovmf_read.stdout.decode("utf-8").strip())
-        # Call to get deafualt package commit date
-        version_date = convert_ovmf_version_to_date(ovmf_version)
-        # Return results
-        return command, default_path, ovmf_version, version_date
-
-    # Error with the subprocess command
-    except (subprocess.CalledProcessError) as err:
-        if not err.stdout.decode("utf-8").strip():
+    # Find default package form distro
+    ovmf_version_read = command_runner.run_command(shlex.split(command))
+    ovmf_lines = [line for line in ovmf_version_read.stdout.split('\n') if 'ovmf' in line]
+
+    # Error with the command or package not found
+    if ovmf_version_read.returncode != 0 or not ovmf_lines:
+        if not ovmf_version_read.stdout.strip() or not ovmf_lines:
             print_warning_message(
                 'Finding default ovmf package', 'OVMF not installed')
         else:
             print_warning_message('Finding default ovmf package',
-                                  err.stderr.decode("utf-8").strip())
+                                  command_runner.get_error_message(ovmf_version_read))
         return command, False, False, False
 
+    # Call to get default package version
+    ovmf_version = get_ovmf_version('\n'.join(ovmf_lines).strip())
+    # Call to get deafualt package commit date
+    version_date = convert_ovmf_version_to_date(ovmf_version)
+    # Return results
+    return command, default_path, ovmf_version, version_date
+
 
 def get_built_ovmf_paths():
     '''
@@ -158,53 +170,76 @@ def get_built_ovmf_paths():
     '''
     # Paths found
     paths = []
-    try:
-        # Command to find all paths containing FV from root
-        subprocess_paths = subprocess.run("find / -xdev -type d -name FV",
-                                          shell=True, check=True, capture_output=True)
-        all_fv_paths = subprocess_paths.stdout.decode("utf-8").split('\n')
-        all_fv_paths.remove('')
-        for path in all_fv_paths:
-            # From found path, get path to OVMF_VARS.fd
-            ovmf_path = subprocess.run("find " + path + " -name OVMF_VARS.fd",
-                                       shell=True, check=True, capture_output=True)
-            ovmf_path = ovmf_path.stdout.decode("utf-8").strip()
-            # Put found paths into path list
-            if ovmf_path:
-                paths.append(ovmf_path)
-        # Return paths
-        return paths
-    # Error with the subprocess command
-    except (subprocess.CalledProcessError) as err:
+    # Command to find all paths containing FV from root
+    fv_paths_read = command_runner.run_command(FIND_FV_COMMAND, FIND_FV_TIMEOUT)
+    # Error with the find command
+    if fv_paths_read.returncode is None or (fv_paths_read.returncode != 0
+                                            and not fv_paths_read.stdout):
         print_warning_message('Finding built ovmf paths',
-                              err.stderr.decode("utf-8").strip())
+                              command_runner.get_error_message(fv_paths_read))
         return False
+    for path in fv_paths_read.stdout.split('\n'):
+        if not path:
+            continue
+        # From found path, get path to OVMF_VARS.fd
+        with tracing.span('walk ' + path, 'filesystem'):
+            paths += host_probes.get_probes().find_files(path, 'OVMF_VARS.fd')
+    # Return paths
+    return paths
 
 
-def get_commit_date(path):
+def get_git_directory(path):
     '''
-    Get the commit date for an externally built OVMF
+    Get the git directory of the source tree an OVMF build path belongs to.
+    Returns None if the path is not inside a Build directory.
     '''
     # Split the path string into a listh of files
     directory = path.split('/')
     directory.remove('')
-    git_path = '/'
-    if 'Build' in directory:
-        git_path = '/'.join(directory[0:directory.index('Build')]) + '/'
-    else:
+    if 'Build' not in directory:
+        return None
+    return '/' + '/'.join(directory[0:directory.index('Build')]) + '/.git'
+
+
+def get_commit_date_command(git_directory):
+    '''
+    Command used to get the git summary from which we can get the commit date.
+    '''
+    return ['git', '--git-dir', git_directory, 'show', '-s']
+
+
+def prefetch_commit_dates(paths):
+    '''
+    Run the git commands for every built OVMF path at the same time.
+    '''
+    git_directories = [get_git_directory(path) for path in paths or []]
+    command_runner.run_commands([get_commit_date_command(git_directory)
+                                 for git_directory in git_directories if git_directory])
+
+
+def get_commit_date(path):
+    '''
+    Get the commit date for an externally built OVMF
+    '''
+    git_directory = get_git_directory(path)
+    if not git_directory:
         print_warning_message('Getting commit date for build path',
                               'Could not find Build in path')
         return False
 
+    # Command to get git summary from which we can get the commit date
+    git_argv = get_commit_date_command(git_directory)
+    git_command = command_runner.format_command(git_argv)
+    git_summary = command_runner.run_command(git_argv)
+    date_lines = [line for line in git_summary.stdout.split('\n') if 'Date' in line]
+    # Error with the git command
+    if git_summary.returncode != 0 or not date_lines:
+        print_warning_message('Finding built path commit date',
+                              command_runner.get_error_message(git_summary))
+        return False, False
+
     try:
-        # Command to get git summary from which we can get the commit date
-        git_command = "git --git-dir /" + git_path + ".git show"
-        git_summary = subprocess.run(
-            git_command, shell=True, check=True, capture_output=True)
-        git_date_raw = subprocess.run("grep Date", input=git_summary.stdout,
-                                      shell=True, check=True, capture_output=True)
-        git_date = git_date_raw.stdout.decode("utf-8").strip()
-        git_date = re.sub(' +', ' ', git_date)
+        git_date = re.sub(' +', ' ', date_lines[0].strip())
         date_array = git_date.split(' ')
         # Get commit date as a date object with time
         datetime_object = datetime.datetime.strptime(date_array[2], "%b")
@@ -215,12 +250,7 @@ def get_commit_date(path):
 
         # return the git commit date as the version date
         return version_date, git_command
-    # Error with the subprocess command
-    except (subprocess.CalledProcessError) as err:
-        print_warning_message('Finding built path commit date',
-                              err.stderr.decode("utf-8").strip())
-        return False, False
-    except TypeError:
+    except (TypeError, ValueError, IndexError):
         print_warning_message('Finding built path commit date',
                               'Could not convert path into a datetime object')
         return False, False
@@ -0,0 +1,227 @@
+'''
+Prometheus node_exporter textfile exporter.
+Turn the results of a component test run, the SEV platform status and the memory
+entropy of the running VMs into gauges, and write them in the text exposition format.
+The file is written next to its final path and renamed over it, so node_exporter
+never reads a half written file.
+'''
+import os
+import time
+import component_tests
+import ioctl
+import local_vm_test
+from check_results import ResultSink, Status
+
+# Bit offset of each TCB_VERSION component in the 64 bit TCB value
+TCB_COMPONENTS = (('bootloader', 0), ('tee', 8), ('snp', 48), ('microcode', 56))
+
+
+class MetricFamily:
+    '''
+    One metric name with its help text, type and samples.
+    '''
+    def __init__(self, name:str, help_text:str, metric_type:str = 'gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        # (labels dictionary, value)
+        self.samples = []
+
+    def add(self, value, **labels):
+        '''
+        Add a sample with the given labels.
+        '''
+        self.samples.append((labels, value))
+
+
+def escape_label_value(value) -> str:
+    '''
+    Escape a label value for the text exposition format.
+    '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value) -> str:
+    '''
+    Format a sample value, booleans are written as 1 and 0.
+    '''
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def format_metrics(families:list) -> str:
+    '''
+    Format metric families in the Prometheus text exposition format.
+    Families without samples are left out.
+    '''
+    lines = []
+    for family in families:
+        if not family.samples:
+            continue
+        lines.append(f"# HELP {family.name} {family.help_text}")
+        lines.append(f"# TYPE {family.name} {family.metric_type}")
+        for labels, value in family.samples:
+            label_text = ','.join(f'{key}="{escape_label_value(label)}"'
+                                  for key, label in labels.items())
+            name = f"{family.name}{{{label_text}}}" if label_text else family.name
+            lines.append(f"{name} {format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+class CheckMetricsSink(ResultSink):
+    '''
+    Result sink that keeps the check and group results for the exporter.
+    '''
+    def __init__(self):
+        self.results = []
+        # group feature: True, False or None if checks timed out
+        self.features = {}
+
+    def add_result(self, result):
+        self.results.append(result)
+
+    def end_group(self, group, passed):
+        self.features[group.feature] = passed
+
+
+def get_check_metrics(sink:CheckMetricsSink) -> list:
+    '''
+    Gauges for every check and feature result.
+    Checks reporting the same component and command several times (OVMF paths)
+    pass if any of them passed.
+    '''
+    passed = MetricFamily('sev_component_check_passed',
+                          "1 if the component check passed, 0 otherwise.")
+    timed_out = MetricFamily('sev_component_check_timed_out',
+                             "1 if the component check did not finish in time.")
+    duration = MetricFamily('sev_component_check_duration_seconds',
+                            "Seconds the component check took.")
+    checks = {}
+    for result in sink.results:
+        key = (result.feature, result.component, result.command)
+        best = checks.get(key)
+        if best is None or (result.passed and not best.passed):
+            checks[key] = result
+    for (feature, component, command), result in checks.items():
+        labels = {'feature': feature, 'component': component, 'command': command}
+        passed.add(result.passed, **labels)
+        timed_out.add(result.status == Status.TIMEOUT, **labels)
+        duration.add(round(result.duration, 6), **labels)
+
+    feature_passed = MetricFamily('sev_component_feature_passed',
+                                  "1 if every check of the feature passed, 0 otherwise.")
+    feature_timed_out = MetricFamily('sev_component_feature_timed_out',
+                                     "1 if checks of the feature did not finish in time.")
+    for feature, result in sink.features.items():
+        feature_passed.add(result is True, feature=feature)
+        feature_timed_out.add(result is None, feature=feature)
+    return [passed, timed_out, duration, feature_passed, feature_timed_out]
+
+
+def split_tcb(tcb:int) -> dict:
+    '''
+    Split a TCB_VERSION value into its security patch levels.
+    '''
+    return {name: (tcb >> offset) & 0xFF for name, offset in TCB_COMPONENTS}
+
+
+def get_platform_metrics(device:ioctl.SevDevice) -> list:
+    '''
+    Gauges for the SEV firmware, the ASIDs and the SNP TCB.
+    Commands that fail leave their gauges out.
+    '''
+    asids = MetricFamily('sev_asids', "ASIDs the processor provides, by type.")
+    guests = MetricFamily('sev_guests', "Encrypted guests currently running (firmware guest_count).")
+    free = MetricFamily('sev_asids_free', "ASIDs not used by a running guest.")
+    firmware = MetricFamily('sev_firmware_info', "SEV firmware API version and build.")
+    state = MetricFamily('sev_platform_state', "SEV and SNP platform state.")
+    tcb = MetricFamily('sev_snp_tcb', "SNP TCB security patch levels.")
+    tcb_match = MetricFamily('sev_snp_tcb_matches',
+                             "1 if the current TCB matches the reported TCB.")
+
+    asid_counts = component_tests.get_asid_counts()
+    if asid_counts:
+        asids.add(asid_counts[0], type='sev')
+        asids.add(asid_counts[1], type='sev-es')
+
+    try:
+        # Guest count changes between runs, always ask the firmware
+        status = device.platform_status(refresh=True)
+        guests.add(status.guest_count)
+        if asid_counts:
+            free.add(max(sum(asid_counts) - status.guest_count, 0))
+        firmware.add(1, api_version=f"{status.api_major}.{status.api_minor}", build=status.build)
+        state.add(status.state, platform='sev')
+    except OSError:
+        pass
+
+    try:
+        snp_status = device.snp_platform_status(refresh=True)
+        state.add(snp_status.state, platform='snp')
+        for tcb_name, value in (('current', snp_status.tcb_version),
+                                ('reported', snp_status.reported_tcb)):
+            for component, level in split_tcb(value).items():
+                tcb.add(level, tcb=tcb_name, component=component)
+        tcb_match.add(snp_status.tcb_version == snp_status.reported_tcb)
+    except OSError:
+        pass
+    return [asids, guests, free, firmware, state, tcb, tcb_match]
+
+
+def get_vm_entropy_metrics(system_os:str) -> list:
+    '''
+    Entropy of the pages sampled from the resident memory of every running VM (one page
+    when only the dd fallback works), encrypted guests are close to 8.
+    VMs whose memory can't be read are left out.
+    '''
+    entropy = MetricFamily('sev_vm_memory_entropy_bits',
+                           "Shannon entropy in bits per byte of the pages sampled from the "
+                           "resident VM memory.")
+    for pid, value in local_vm_test.get_vm_entropies(system_os).items():
+        entropy.add(value, pid=pid)
+    return [entropy]
+
+
+def collect_metrics(sink:CheckMetricsSink, system_os:str, include_entropy:bool = True,
+                    run_duration:float = None, device:ioctl.SevDevice = None) -> list:
+    '''
+    Collect every metric family for one run.
+    '''
+    families = get_check_metrics(sink)
+    families += get_platform_metrics(device or ioctl.get_sev_device())
+    if include_entropy:
+        families += get_vm_entropy_metrics(system_os)
+    last_run = MetricFamily('sev_component_test_last_run_timestamp_seconds',
+                            "Unix time the component test finished.")
+    last_run.add(round(time.time(), 3))
+    families.append(last_run)
+    if run_duration is not None:
+        duration = MetricFamily('sev_component_test_run_duration_seconds',
+                                "Seconds the component test run took.")
+        duration.add(round(run_duration, 6))
+        families.append(duration)
+    return families
+
+
+def write_textfile(path:str, families:list):
+    '''
+    Write the metrics to a textfile collector file.
+    The file is written to a temporary file in the same directory and renamed over
+    the final path, node_exporter only picks up *.prom files.
+    '''
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, 'w', encoding='utf-8') as textfile:
+            textfile.write(format_metrics(families))
+            textfile.flush()
+            os.fsync(textfile.fileno())
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except OSError:
+        # Don't leave temporary files behind in the collector directory
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
@@ -0,0 +1,345 @@
+'''
+Fleet results store. Every run is appended to a local SQLite database: host, time,
+the status and duration of every check, the SEV firmware and SNP TCB versions and the
+memory entropy of the running VMs. The database is in WAL mode, so the runs of this host
+don't block the readers, and indexed for the fleet queries: hosts failing a feature since
+a date, TCB mismatches and check duration regressions. WAL needs every connection on the
+same host and doesn't work over a network filesystem, so each host keeps its own database,
+and the queries run on the copies gathered on one collector host.
+'''
+import datetime
+import os
+import re
+import socket
+import sqlite3
+import time
+import encryption_test
+import ioctl
+from check_results import ResultSink, Status
+from message_printing import print_warning_message
+
+# Default database file
+DEFAULT_DATABASE_PATH = '/var/lib/sev-component-test/results.db'
+# Changes when the tables change, kept in the user_version pragma
+SCHEMA_VERSION = 1
+# Seconds a writer waits for another one to finish its transaction
+BUSY_TIMEOUT = 30.0
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL,
+    passed INTEGER,
+    api_version TEXT,
+    firmware_build INTEGER,
+    tcb_version INTEGER,
+    reported_tcb INTEGER
+);
+CREATE TABLE IF NOT EXISTS features (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    feature TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (run_id, feature)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checks (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    feature TEXT NOT NULL,
+    component TEXT NOT NULL,
+    command TEXT,
+    found TEXT,
+    expected TEXT,
+    status TEXT NOT NULL,
+    duration REAL
+);
+CREATE TABLE IF NOT EXISTS vm_entropy (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    pid INTEGER NOT NULL,
+    entropy REAL NOT NULL,
+    encrypted INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_host_started ON runs(host, started_at);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started_at);
+CREATE INDEX IF NOT EXISTS features_status ON features(feature, status);
+CREATE INDEX IF NOT EXISTS checks_run ON checks(run_id);
+CREATE INDEX IF NOT EXISTS checks_component ON checks(feature, component, command);
+CREATE INDEX IF NOT EXISTS vm_entropy_run ON vm_entropy(run_id);
+'''
+# Check comparing the current and reported TCB, see snp_component_tests.compare_tcb_versions
+TCB_CHECK_COMPONENT = "Comparing TCB versions"
+# Recent average duration over the earlier one from which a check is reported as regressed
+REGRESSION_RATIO = 1.5
+# Smallest increase in seconds reported as a regression, shorter checks are noise
+MIN_REGRESSION_SECONDS = 0.001
+# Queries the --query flag runs
+QUERIES = ('failing', 'tcb', 'regressions')
+
+
+def connect(path:str = DEFAULT_DATABASE_PATH) -> sqlite3.Connection:
+    '''
+    Open the database, creating it and its tables the first time.
+    Transactions are started explicitly, see record_run.
+    Raises sqlite3.Error if it can't be opened.
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as err:
+            raise sqlite3.OperationalError(str(err)) from err
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    # Readers don't block the writers, and a commit is one append to the log
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+        connection.executescript(SCHEMA)
+        connection.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+    return connection
+
+
+def get_platform_versions(device:ioctl.SevDevice) -> dict:
+    '''
+    Get the firmware version and the SNP TCB versions the checks read, None when unknown.
+    '''
+    versions = {'api_version': None, 'firmware_build': None,
+                'tcb_version': None, 'reported_tcb': None}
+    try:
+        status = device.platform_status()
+        versions['api_version'] = f"{status.api_major}.{status.api_minor}"
+        versions['firmware_build'] = status.build
+    except OSError:
+        pass
+    try:
+        snp_status = device.snp_platform_status()
+        versions['tcb_version'] = snp_status.tcb_version
+        versions['reported_tcb'] = snp_status.reported_tcb
+    except OSError:
+        pass
+    return versions
+
+
+def record_run(connection:sqlite3.Connection, host:str, started_at:float, duration:float,
+               results:list, features:dict, versions:dict, entropies:dict = None) -> int:
+    '''
+    Append one run in a single transaction. features maps the feature names to True,
+    False or None for timeouts, entropies maps VM PIDs to their memory entropy.
+    Returns the id of the run.
+    '''
+    # Same as the program exit code: failed, timed out or passed
+    passed = False if False in features.values() else None if None in features.values() else True
+    # Taking the write lock first, a concurrent writer waits instead of failing on upgrade
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        run_id = connection.execute(
+            'INSERT INTO runs (host, started_at, duration, passed, api_version, firmware_build, '
+            'tcb_version, reported_tcb) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (host, started_at, duration, passed, versions.get('api_version'),
+             versions.get('firmware_build'), versions.get('tcb_version'),
+             versions.get('reported_tcb'))).lastrowid
+        connection.executemany(
+            'INSERT INTO features (run_id, feature, status) VALUES (?, ?, ?)',
+            [(run_id, feature, (Status.TIMEOUT if result is None else
+                                Status.PASS if result else Status.FAIL).name)
+             for feature, result in features.items()])
+        connection.executemany(
+            'INSERT INTO checks (run_id, feature, component, command, found, expected, status, '
+            'duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(run_id, result.feature, result.component, result.command, str(result.found),
+              str(result.expected), result.status.name, result.duration) for result in results])
+        connection.executemany(
+            'INSERT INTO vm_entropy (run_id, pid, entropy, encrypted) VALUES (?, ?, ?, ?)',
+            [(run_id, int(pid), entropy, entropy >= encryption_test.ENCRYPTED_ENTROPY)
+             for pid, entropy in (entropies or {}).items()])
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    return run_id
+
+
+class ResultsStoreSink(ResultSink):
+    '''
+    Result sink appending the run to the results database when it's closed, with the
+    platform versions of device and, if system_os is given, the entropy of the running VMs.
+    '''
+    def __init__(self, path:str = DEFAULT_DATABASE_PATH, system_os:str = None,
+                 device:ioctl.SevDevice = None, host:str = None):
+        # Open now, so a database that can't be written is reported before the checks run
+        self.connection = connect(path)
+        self.system_os = system_os
+        self.device = device
+        self.host = host or socket.gethostname()
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self.results = []
+        self.features = {}
+
+    def add_result(self, result):
+        self.results.append(result)
+
+    def end_group(self, group, passed):
+        self.features[group.feature] = passed
+
+    def close(self):
+        entropies = None
+        if self.system_os is not None:
+            import local_vm_test # pylint: disable=import-outside-toplevel
+            entropies = local_vm_test.get_vm_entropies(self.system_os)
+        try:
+            record_run(self.connection, self.host, self.started_at,
+                       time.monotonic() - self._start, self.results, self.features,
+                       get_platform_versions(self.device or ioctl.get_sev_device()), entropies)
+        # Database locked for too long or disk full, the run itself is not affected
+        except sqlite3.Error as err:
+            print_warning_message("Results store", str(err))
+        finally:
+            self.connection.close()
+
+
+def parse_since(text:str) -> float:
+    '''
+    Parse a point in time given as a date (2024-05-01), a date and time
+    (2024-05-01T12:00) or a time ago (30m, 12h, 7d). Returns a Unix time.
+    Raises ValueError if the text is none of these.
+    '''
+    relative = re.fullmatch(r'(\d+(?:\.\d+)?)([mhd])', text.strip())
+    if relative:
+        seconds = float(relative.group(1)) * {'m': 60, 'h': 3600, 'd': 86400}[relative.group(2)]
+        return time.time() - seconds
+    return datetime.datetime.fromisoformat(text.strip()).timestamp()
+
+
+def find_failing_hosts(connection:sqlite3.Connection, features, since:float) -> list:
+    '''
+    Hosts with runs since the given time in which any of the features did not pass.
+    Every row has the host, the number of such runs, the first and last of them
+    and the status of the feature in the latest run of the host.
+    '''
+    placeholders = ', '.join('?' * len(features))
+    return connection.execute(f'''
+        SELECT runs.host, features.feature, COUNT(*) AS failed_runs,
+               MIN(runs.started_at) AS first_failure, MAX(runs.started_at) AS last_failure,
+               (SELECT latest_features.status FROM runs AS latest
+                JOIN features AS latest_features ON latest_features.run_id = latest.id
+                WHERE latest.host = runs.host AND latest_features.feature = features.feature
+                ORDER BY latest.started_at DESC LIMIT 1) AS latest_status
+        FROM features JOIN runs ON runs.id = features.run_id
+        WHERE features.feature IN ({placeholders}) AND features.status != 'PASS'
+              AND runs.started_at >= ?
+        GROUP BY runs.host, features.feature
+        ORDER BY runs.host, features.feature''', (*features, since)).fetchall()
+
+
+def find_tcb_mismatches(connection:sqlite3.Connection, since:float) -> list:
+    '''
+    Latest run since the given time of every host whose current SNP TCB is not the
+    reported one, or whose TCB version check did not pass.
+    '''
+    return connection.execute('''
+        SELECT runs.host, runs.started_at, runs.tcb_version, runs.reported_tcb,
+               checks.status AS check_status, checks.found
+        FROM runs
+        JOIN (SELECT host, MAX(started_at) AS started_at FROM runs
+              WHERE started_at >= ? GROUP BY host) AS latest
+            ON latest.host = runs.host AND latest.started_at = runs.started_at
+        LEFT JOIN checks ON checks.run_id = runs.id AND checks.component = ?
+        WHERE runs.tcb_version != runs.reported_tcb
+              OR checks.status IN ('FAIL', 'TIMEOUT')
+        ORDER BY runs.host''', (since, TCB_CHECK_COMPONENT)).fetchall()
+
+
+def get_tcb_versions(connection:sqlite3.Connection, since:float) -> list:
+    '''
+    Number of hosts running each current SNP TCB version in their latest run since the given time.
+    '''
+    return connection.execute('''
+        SELECT runs.tcb_version, COUNT(*) AS hosts FROM runs
+        JOIN (SELECT host, MAX(started_at) AS started_at FROM runs
+              WHERE started_at >= ? GROUP BY host) AS latest
+            ON latest.host = runs.host AND latest.started_at = runs.started_at
+        WHERE runs.tcb_version IS NOT NULL
+        GROUP BY runs.tcb_version ORDER BY hosts DESC, runs.tcb_version''', (since,)).fetchall()
+
+
+def find_duration_regressions(connection:sqlite3.Connection, since:float,
+                              ratio:float = REGRESSION_RATIO) -> list:
+    '''
+    Checks whose average duration in the runs since the given time is at least ratio times
+    their average duration in the earlier runs, largest increase first.
+    '''
+    return connection.execute('''
+        SELECT checks.feature, checks.component, checks.command,
+               AVG(CASE WHEN runs.started_at < ? THEN checks.duration END) AS before,
+               AVG(CASE WHEN runs.started_at >= ? THEN checks.duration END) AS recent,
+               COUNT(CASE WHEN runs.started_at >= ? THEN 1 END) AS recent_runs
+        FROM checks JOIN runs ON runs.id = checks.run_id
+        WHERE checks.status != 'SKIPPED'
+        GROUP BY checks.feature, checks.component, checks.command
+        HAVING before > 0 AND recent >= before * ? AND recent - before >= ?
+        ORDER BY recent / before DESC''',
+        (since, since, since, ratio, MIN_REGRESSION_SECONDS)).fetchall()
+
+
+def format_time(timestamp:float) -> str:
+    '''
+    Format a Unix time for the query output.
+    '''
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+def format_tcb(tcb) -> str:
+    '''
+    Format a TCB version, unknown ones as a dash.
+    '''
+    return '-' if tcb is None else f"{tcb:#018x}"
+
+
+def run_query(path:str, query_name:str, since:str, features) -> int:
+    '''
+    Print the answer of one query: failing (hosts failing any of the features since a
+    time), tcb (TCB mismatches across the fleet) or regressions (check duration
+    regressions since a time). Returns the program exit code.
+    '''
+    try:
+        since_time = parse_since(since)
+    except ValueError:
+        print(f"Invalid time {since}, use a date (2024-05-01) or a time ago (12h, 7d).")
+        return 1
+    if not os.path.exists(path):
+        print(f"No results database at {path}.")
+        return 1
+    try:
+        connection = connect(path)
+    except sqlite3.Error as err:
+        print_warning_message("Results store", str(err))
+        return 1
+    try:
+        if query_name == 'failing':
+            rows = find_failing_hosts(connection, [feature.upper() for feature in features],
+                                      since_time)
+            for row in rows:
+                print(f"{row['host']:<32} {row['feature']:<8} {row['failed_runs']:>5} runs "
+                      f"{format_time(row['first_failure'])} - {format_time(row['last_failure'])}"
+                      f"  latest {row['latest_status']}")
+            print(f"{len({row['host'] for row in rows})} hosts did not pass since "
+                  f"{format_time(since_time)}.")
+        elif query_name == 'tcb':
+            rows = find_tcb_mismatches(connection, since_time)
+            for row in rows:
+                print(f"{row['host']:<32} current {format_tcb(row['tcb_version'])} "
+                      f"reported {format_tcb(row['reported_tcb'])}"
+                      f"  check {row['check_status'] or '-'}")
+            print(f"{len(rows)} hosts with a TCB mismatch. Current TCB versions in the fleet:")
+            for row in get_tcb_versions(connection, since_time):
+                print(f"  {format_tcb(row['tcb_version'])} {row['hosts']:>6} hosts")
+        else:
+            rows = find_duration_regressions(connection, since_time)
+            for row in rows:
+                print(f"{row['feature']:<8} {row['component']:<48} {row['before'] * 1000:9.3f} ms"
+                      f" -> {row['recent'] * 1000:9.3f} ms ({row['recent_runs']} runs)")
+            print(f"{len(rows)} checks at least {REGRESSION_RATIO}x slower since "
+                  f"{format_time(since_time)}.")
+    finally:
+        connection.close()
+    return 0
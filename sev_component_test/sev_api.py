@@ -0,0 +1,126 @@
+'''
+Library entry point, run the component checks in-process and get the results back
+instead of printed output. Only the modules the checks need are imported, the virtual
+machine tests, the benchmark and the exporters are not loaded.
+    from sev_component_test import run_checks
+    run = run_checks(features=['sev', 'sev-snp'], enablement=True)
+    run.passed, run.features['SEV'], [result.as_dict() for result in run.results]
+'''
+import threading
+import time
+import check_scheduler
+import command_runner
+import component_tests
+import host_probes
+import ioctl
+from check_results import ResultSink, Status
+from feature_groups import get_feature_groups
+from message_printing import capture_warnings
+
+# Features checked when none are given, the same as the command line tool
+DEFAULT_FEATURES = ('sev', 'sev-es', 'sev-snp')
+# Features that can be checked
+FEATURES = ('sme', 'sev', 'sev-es', 'sev-snp')
+
+# The SEV device and the command deadline are shared by the whole process,
+# runs from different threads wait for each other
+_run_lock = threading.Lock()
+
+
+class CheckRun(ResultSink):
+    '''
+    Results of one run_checks call.
+    results has a CheckResult for every check in the order they were reported,
+    features the result of every feature checked: True if every check passed,
+    False if any failed and None if none failed but some timed out.
+    warnings has a (feature, component, warning) tuple for every check that could not
+    be performed properly.
+    '''
+    def __init__(self):
+        self.results = []
+        self.features = {}
+        self.warnings = []
+        self.duration = 0.0
+        # Check key: CheckOutcome of every check that finished, see run_checks reuse
+        self.outcomes = {}
+
+    def add_warning(self, group, component:str, warning:str):
+        self.warnings.append((group.feature, component, warning))
+
+    def add_result(self, result):
+        self.results.append(result)
+
+    def end_group(self, group, passed):
+        self.features[group.feature] = passed
+
+    @property
+    def passed(self):
+        '''
+        True if every feature passed, False if any failed, None if checks timed out.
+        '''
+        if False in self.features.values():
+            return False
+        if None in self.features.values():
+            return None
+        return True
+
+    def get_failures(self) -> list:
+        '''
+        Get the results of the checks that did not pass, skipped checks are left out.
+        '''
+        return [result for result in self.results
+                if result.status in (Status.FAIL, Status.TIMEOUT)]
+
+
+def run_checks(features = DEFAULT_FEATURES, system_os:str = None, enablement:bool = False,
+               test_cpu:bool = False, stop_failure:bool = False,
+               check_timeout:float = check_scheduler.DEFAULT_CHECK_TIMEOUT,
+               deadline:float = None, probes:dict = None, device:ioctl.SevDevice = None,
+               sinks = (), refresh:bool = False, reuse:dict = None) -> CheckRun:
+    '''
+    Run the component checks of the given features and return their results, nothing is printed.
+    system_os is found from os-release when not given. enablement skips the package
+    checks, the only ones starting external commands. deadline is a number of seconds
+    after which every unfinished check times out.
+    probes replaces host_probes functions for the checks of this run, as name: function,
+    other callers of host_probes are not affected.
+    device replaces the shared /dev/sev session for this and the following runs,
+    for example with one using the sev_emulator backend.
+    External command results are kept between runs, refresh runs the commands again.
+    reuse takes the outcomes of an earlier run for the checks that don't need to run again.
+    The results are also reported to every sink in sinks.
+    '''
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown features: {', '.join(sorted(unknown))}")
+    # Given to the checks of this run only, the host_probes module is never changed
+    run_probes = host_probes.Probes(probes) if probes else None
+
+    check_run = CheckRun()
+    with _run_lock:
+        start = time.monotonic()
+        if device is not None:
+            ioctl.set_sev_device(device)
+        if refresh:
+            command_runner.clear_results()
+        run_deadline = None if deadline is None else start + deadline
+        command_runner.set_deadline(run_deadline)
+        try:
+            # Warnings from outside the checks are kept without a feature
+            with capture_warnings() as warnings, host_probes.using_probes(run_probes):
+                if system_os is None:
+                    system_os, _ = component_tests.get_linux_distro()
+                # Start the external version probes together before the package checks need them
+                if not enablement:
+                    component_tests.prefetch_version_probes(system_os)
+            check_run.warnings += [('', component, warning) for component, warning in warnings]
+            groups = get_feature_groups(system_os, features, enablement, test_cpu)
+            scheduler = check_scheduler.CheckScheduler(
+                groups, check_timeout=check_timeout, deadline=run_deadline, reuse=reuse,
+                probes=run_probes)
+            scheduler.run(True, stop_failure, sinks=[check_run] + list(sinks), tty=False)
+            check_run.outcomes = scheduler.get_outcomes()
+        finally:
+            command_runner.set_deadline(None)
+            check_run.duration = time.monotonic() - start
+    return check_run
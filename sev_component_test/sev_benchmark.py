@@ -0,0 +1,190 @@
+'''
+SEV firmware command latency benchmark.
+Issue platform status commands in a tight loop, from one thread and from several
+threads at once, and report the latency distribution and throughput.
+'''
+import threading
+import time
+from array import array
+import ioctl
+from message_printing import print_warning_message
+
+# Percentiles printed in the latency distribution
+REPORTED_PERCENTILES = (50.0, 75.0, 90.0, 99.0, 99.9, 100.0)
+
+
+class LatencyHistogram:
+    '''
+    HDR style histogram for latencies in nanoseconds.
+    Small values get one bucket each, bigger values are bucketed by power of two with
+    every power of two split in linear buckets, so each value keeps a fixed relative precision.
+    '''
+    def __init__(self, sub_bucket_bits:int = 7, max_magnitude:int = 40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_buckets = 1 << sub_bucket_bits
+        self.half_buckets = self.sub_buckets // 2
+        self.counts = array('Q', bytes(8 * (self.sub_buckets + max_magnitude * self.half_buckets)))
+        self.total_count = 0
+        self.min_value = None
+        self.max_value = 0
+
+    def _index(self, value:int) -> int:
+        '''
+        Get the bucket index for a value.
+        Values below sub_buckets get their own bucket, bigger values are shifted
+        down to their top sub_bucket_bits bits.
+        '''
+        magnitude = value.bit_length() - self.sub_bucket_bits
+        if magnitude <= 0:
+            return value
+        return (self.sub_buckets + (magnitude - 1) * self.half_buckets
+                + (value >> magnitude) - self.half_buckets)
+
+    def _value_at(self, index:int) -> int:
+        '''
+        Get the highest value that falls in a bucket.
+        '''
+        if index < self.sub_buckets:
+            return index
+        magnitude, sub_bucket = divmod(index - self.sub_buckets, self.half_buckets)
+        return ((sub_bucket + self.half_buckets + 1) << (magnitude + 1)) - 1
+
+    def record(self, value:int):
+        '''
+        Record one latency value.
+        '''
+        index = min(self._index(value), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.total_count += 1
+        self.max_value = max(self.max_value, value)
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+
+    def merge(self, other):
+        '''
+        Add the values recorded in another histogram with the same layout.
+        '''
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total_count += other.total_count
+        self.max_value = max(self.max_value, other.max_value)
+        if other.min_value is not None and (self.min_value is None
+                                            or other.min_value < self.min_value):
+            self.min_value = other.min_value
+
+    def percentile(self, percentile:float) -> int:
+        '''
+        Get the value at the given percentile (0-100).
+        '''
+        if not self.total_count:
+            return 0
+        if percentile >= 100.0:
+            return self.max_value
+        wanted = max(int(percentile / 100.0 * self.total_count + 0.5), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(self._value_at(index), self.max_value)
+        return self.max_value
+
+
+def benchmark_command(device:ioctl.SevDevice, command:str, iterations:int,
+                      histogram:LatencyHistogram):
+    '''
+    Issue one command iterations times on a device and record every latency.
+    Returns the number of commands that failed.
+    '''
+    # Command functions, status commands always skip the cache
+    command_functions = {
+        'SEV_PLATFORM_STATUS': lambda: device.platform_status(refresh=True),
+        'SNP_PLATFORM_STATUS': lambda: device.snp_platform_status(refresh=True),
+        'SEV_GET_ID2': device.get_id2
+    }
+    run_command = command_functions[command]
+    failures = 0
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        try:
+            run_command()
+        except OSError:
+            failures += 1
+            continue
+        histogram.record(time.perf_counter_ns() - start)
+    return failures
+
+
+def run_command_benchmark(command:str, iterations:int, threads:int, device_factory=ioctl.SevDevice):
+    '''
+    Run the benchmark for one command with the given amount of threads.
+    Every thread uses its own /dev/sev session.
+    Returns the merged histogram, the number of failures and the elapsed seconds.
+    '''
+    histograms = [LatencyHistogram() for _ in range(threads)]
+    failures = [0] * threads
+    devices = [device_factory() for _ in range(threads)]
+
+    def worker(thread_number):
+        failures[thread_number] = benchmark_command(
+            devices[thread_number], command, iterations, histograms[thread_number])
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for device in devices:
+        device.close()
+
+    histogram = histograms[0]
+    for other in histograms[1:]:
+        histogram.merge(other)
+    return histogram, sum(failures), elapsed
+
+
+def print_benchmark_result(command:str, threads:int, histogram:LatencyHistogram,
+                           failures:int, elapsed:float):
+    '''
+    Print the latency distribution and throughput for one benchmark run.
+    '''
+    throughput = histogram.total_count / elapsed if elapsed else 0.0
+    print(f"\n{command} with {threads} thread(s): {histogram.total_count} calls "
+          f"in {elapsed:.3f} s ({throughput:.1f} calls/s), {failures} failed")
+    if not histogram.total_count:
+        return
+    print(f"  min {histogram.min_value / 1000:.1f} us  "
+          f"p50 {histogram.percentile(50) / 1000:.1f} us  "
+          f"p99 {histogram.percentile(99) / 1000:.1f} us  "
+          f"max {histogram.max_value / 1000:.1f} us")
+    print("  Percentile    Latency (us)")
+    for percentile in REPORTED_PERCENTILES:
+        print(f"  {percentile:>10.3f}    {histogram.percentile(percentile) / 1000:>12.1f}")
+
+
+def run_sev_benchmark(iterations:int, threads:int, include_get_id:bool,
+                      non_verbose:bool, device_factory=ioctl.SevDevice) -> bool:
+    '''
+    Benchmark the SEV firmware status commands, first from one thread
+    and then from the requested number of threads.
+    Returns False if any command failed.
+    '''
+    commands = ['SEV_PLATFORM_STATUS', 'SNP_PLATFORM_STATUS']
+    if include_get_id:
+        commands.append('SEV_GET_ID2')
+
+    all_pass = True
+    for command in commands:
+        for thread_count in sorted({1, threads}):
+            histogram, failures, elapsed = run_command_benchmark(
+                command, iterations, thread_count, device_factory)
+            if failures:
+                all_pass = False
+                if not histogram.total_count:
+                    print_warning_message(command + " benchmark", "every command failed")
+            if not non_verbose:
+                print_benchmark_result(command, thread_count, histogram, failures, elapsed)
+    return all_pass
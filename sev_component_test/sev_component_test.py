@@ -13,39 +13,136 @@ Use --autotest flag to launch automatic VM encryption test on the tiny VM provid
 Use --nonVerbose flag to run program without any prints
 Use --enablement flag to only test for SEV enablment on the system (ignore package support)
 Use --testcpu flag when testing with unreleased or test cpus to skip public domain knowledge tests.
+Use --benchmark flag to measure SEV firmware command latency instead of running the checks.
+Use --emulatesev flag to use an in-process /dev/sev emulator instead of the real device.
+Use --deadline flag to give up on every check still running after the given number of seconds.
+Use --checktimeout flag to change the number of seconds a single check can run.
+Use --jsonl, --junit or --binary flags to also write the check results to a file ('-' for stdout).
+Use --profile flag to print where the run spent its time, --trace to write a Chrome trace file.
+Use --prometheus flag to write the results and SEV platform metrics to a node_exporter textfile.
+Use --serve flag to keep running and answer check and placement queries on a Unix socket.
+Use --factcache flag to reuse the facts that don't change until reboot from an earlier run.
+Use --watch flag to keep running and check again whenever a package, OVMF or SEV setting changes.
+Use --snapshot flag to write every raw fact the run read to a file, --evaluate to run
+the checks against snapshot files of other hosts instead of this one.
+Use --resultsdb flag to append the run to a SQLite results database, --query to ask it
+for the hosts failing a feature, TCB mismatches or check duration regressions.
+Use --kernellog flag to read only the kernel messages logged since the last run of this boot.
 Will return 1 if any of the desired tests fails, will return 0 if all the desired tests pass.
+Will return 2 if no test failed but some checks timed out.
 '''
 import argparse
-import datetime
 import sys
+import time
 import component_tests
-import snp_component_tests
-import local_vm_test
-import auto_vm_test
-
-from message_printing import print_overall_result, print_test_result
-
-parser = argparse.ArgumentParser(
-    description="Raise flags for different test functionalities.")
-parser.add_argument("-s", "--stopfailure", help="Stop test at failure.",
-                    action="store_true")
-parser.add_argument("-t", "--test", nargs='+', help="Specify features to test for.",
-                    default=['sev', 'sev-es', 'sev-snp'])
-parser.add_argument("-tl", "--testlocal", nargs='?', help="Run test local functionality.",
-                    default="not raised")
-parser.add_argument("-pl", "--printlocal", nargs='?', help="Run print local functionality.",
-                    default="not raised")
-parser.add_argument("-at", "--autotest", nargs='?',
-                    help="Run automatic encryption test functionality.",
-                    default="not raised")
-parser.add_argument("-nv", "--nonverbose", help="Run test with no print statements.",
-                    action="store_true")
-parser.add_argument("-e", "--enablement",
-                    help="Run test to only check for enablement (ignore package support)",
-                    action="store_true")
-parser.add_argument("-tcpu", "--testcpu",
-                    help="Skip public domain knowledge tests when using test cpus",
-                    action="store_true")
+import ioctl
+from message_printing import print_warning_message
+import check_scheduler
+import check_results
+import command_runner
+import host_probes
+import tracing
+from feature_groups import (get_system_support_group, get_sme_group, get_sev_group,
+                            get_sev_es_group, get_sev_snp_group, get_feature_groups)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    '''
+    Build the command line parser, only when the tool is run from the command line.
+    '''
+    parser = argparse.ArgumentParser(
+        description="Raise flags for different test functionalities.")
+    parser.add_argument("-s", "--stopfailure", help="Stop test at failure.",
+                        action="store_true")
+    parser.add_argument("-t", "--test", nargs='+', help="Specify features to test for.",
+                        default=['sev', 'sev-es', 'sev-snp'])
+    parser.add_argument("-tl", "--testlocal", nargs='?', help="Run test local functionality.",
+                        default="not raised")
+    parser.add_argument("-pl", "--printlocal", nargs='?', help="Run print local functionality.",
+                        default="not raised")
+    parser.add_argument("-at", "--autotest", nargs='?',
+                        help="Run automatic encryption test functionality.",
+                        default="not raised")
+    parser.add_argument("-nv", "--nonverbose", help="Run test with no print statements.",
+                        action="store_true")
+    parser.add_argument("-e", "--enablement",
+                        help="Run test to only check for enablement (ignore package support)",
+                        action="store_true")
+    parser.add_argument("-tcpu", "--testcpu",
+                        help="Skip public domain knowledge tests when using test cpus",
+                        action="store_true")
+    parser.add_argument("-b", "--benchmark", nargs='?', type=int, const=1000,
+                        help="Benchmark SEV firmware command latency (iterations per thread).")
+    parser.add_argument("-bt", "--benchmarkthreads", type=int, default=4,
+                        help="Number of concurrent threads used by the benchmark.")
+    parser.add_argument("-bid", "--benchmarkgetid", action="store_true",
+                        help="Also benchmark the SEV_GET_ID2 command.")
+    parser.add_argument("--emulatesev", action="store_true",
+                        help="Use an in-process /dev/sev emulator instead of the real device (testing only).")
+    parser.add_argument("-d", "--deadline", type=float,
+                        help="Report every check still running after this many seconds as TIMEOUT.")
+    parser.add_argument("-ct", "--checktimeout", type=float,
+                        default=check_scheduler.DEFAULT_CHECK_TIMEOUT,
+                        help="Number of seconds a single check can run before it's reported as TIMEOUT.")
+    parser.add_argument("-oj", "--jsonl",
+                        help="Write the check results as JSON Lines to this file ('-' for stdout).")
+    parser.add_argument("-ox", "--junit",
+                        help="Write the check results as JUnit XML to this file ('-' for stdout).")
+    parser.add_argument("-ob", "--binary",
+                        help="Write the check results as compact binary records to this file "
+                        "('-' for stdout).")
+    parser.add_argument("-p", "--profile", action="store_true",
+                        help="Print a summary of the operations that took the most time.")
+    parser.add_argument("-tr", "--trace",
+                        help="Write a Chrome trace-event JSON file of the run.")
+    parser.add_argument("-pm", "--prometheus",
+                        help="Write the check results and SEV platform metrics to this "
+                        "node_exporter textfile (.prom).")
+    parser.add_argument("-fc", "--factcache", nargs='?',
+                        const='/var/cache/sev-component-test/facts.json',
+                        help="Reuse the facts that only change at reboot or package changes from "
+                        "this cache file, and update it (default: %(const)s). Not available with "
+                        "--serve or --watch.")
+    parser.add_argument("-sv", "--serve", nargs='?', const='/run/sev-component-test.sock',
+                        help="Keep running and answer check and placement queries on this "
+                        "Unix socket (default: %(const)s).")
+    parser.add_argument("-ri", "--refreshinterval", type=float, default=5.0,
+                        help="Seconds between two reads of the SEV platform status in server mode.")
+    parser.add_argument("-w", "--watch", action='store_true',
+                        help="Keep running and run again the checks whose inputs changed "
+                        "(packages, OVMF files, kvm_amd parameters, /dev/sev, reboot).")
+    parser.add_argument("-sn", "--snapshot",
+                        help="Write every raw fact read by the run to this snapshot file. Not "
+                        "available with --serve or --watch.")
+    parser.add_argument("-ev", "--evaluate", nargs='+',
+                        help="Run the checks against these snapshot files (or directories of "
+                        "them) instead of this host. --jsonl writes one evaluation per line.")
+    parser.add_argument("-ew", "--evaluateworkers", type=int,
+                        help="Number of processes evaluating snapshots (default: number of cpus).")
+    parser.add_argument("-db", "--resultsdb", nargs='?',
+                        const='/var/lib/sev-component-test/results.db',
+                        help="Append the run to this SQLite results database, or the database "
+                        "--query reads (default: %(const)s).")
+    parser.add_argument("-q", "--query", choices=('failing', 'tcb', 'regressions'),
+                        help="Query the results database instead of running the checks: hosts "
+                        "failing the --test features, SNP TCB mismatches or check duration "
+                        "regressions, since --since.")
+    parser.add_argument("--since", default='7d',
+                        help="Start of the queried period, a date (2024-05-01) or a time ago "
+                        "(12h, 7d). Default: %(default)s.")
+    parser.add_argument("-kl", "--kernellog", nargs='?',
+                        const='/var/lib/sev-component-test/kernel-log.json',
+                        help="Keep the kernel log position and the SEV kernel messages in this "
+                        "state file, later runs of the boot only read the new messages "
+                        "(default: %(const)s).")
+    return parser
+
+
+def run_group(group, non_verbose, stop_failure):
+    '''
+    Run the checks of a single group and print their results.
+    '''
+    return check_scheduler.CheckScheduler([group]).run(non_verbose, stop_failure)[group.name]
 
 
 def check_system_support_test(non_verbose, stop_failure):
@@ -53,33 +150,7 @@ def check_system_support_test(non_verbose, stop_failure):
     Run the existing system support checks that query the system capabilites and informs if the
     system can or cannot run SEV features.
     '''
-
-    # Dont't print if nonVerbose raised
-    if not non_verbose:
-        print("\nQuerying for system capabilities:")
-
-    # Will turn false if any check fails
-    pass_check = True
-    # Tests to be run
-    running_tests = {
-        component_tests.find_cpuid_support: ['SEV'],
-        component_tests.check_virtualization: (),
-        component_tests.check_sme_enablement: ()
-    }
-
-    for test, components in running_tests.items():
-        current_component, current_command, current_found_result,\
-            current_expectation, current_test_result = test(*components)
-        if not non_verbose:
-            print_test_result(current_component, current_command,
-                              current_found_result, current_expectation, current_test_result)
-        if not current_test_result and not stop_failure:
-            pass_check = False
-        # Test failed, stop failure not enabled.
-        elif not current_test_result and stop_failure:
-            pass_check = False
-            break
-    return pass_check
+    return run_group(get_system_support_group(), non_verbose, stop_failure)
 
 
 def run_sme_test(non_verbose, stop_failure):
@@ -87,31 +158,7 @@ def run_sme_test(non_verbose, stop_failure):
     Run the existing OS checks that query the system capabilites,
     and informs if the current system setup can run SME.
     '''
-
-    if not non_verbose:
-        print("\nComparing Host OS componenets to known SME requirements:")
-
-    # Will turn false if any check fails
-    pass_check = True
-
-    running_tests = {
-        component_tests.find_cpuid_support: ['SME'],
-        component_tests.find_tsme_enablement: []
-    }
-
-    for test, components in running_tests.items():
-        current_component, current_command, current_found_result,\
-            current_expectation, current_test_result = test(*components)
-        if not non_verbose:
-            print_test_result(current_component, current_command,
-                              current_found_result, current_expectation, current_test_result)
-        if not current_test_result and not stop_failure:
-            pass_check = False
-        # Test failed, stop failure not enabled.
-        elif not current_test_result and stop_failure:
-            pass_check = False
-            break
-    return pass_check
+    return run_group(get_sme_group(), non_verbose, stop_failure)
 
 
 def run_sev_test(non_verbose, system_os, stop_failure, enablement, test_cpu):
@@ -119,54 +166,7 @@ def run_sev_test(non_verbose, system_os, stop_failure, enablement, test_cpu):
     Run the existing OS checks that query the system capabilites,
     and informs if the current system setup can run SEV.
     '''
-
-    if not non_verbose:
-        print("\nComparing Host OS componenets to known SEV minimum versions:")
-
-    # Will turn false if any check fails
-    pass_check = True
-    # Tests to be run
-    running_tests = {
-        component_tests.validate_cpu_model: ["SEV"],
-        component_tests.find_cpuid_support: ["SEV"],
-        component_tests.find_asid_count: ["SEV"],
-        component_tests.check_linux_distribution: [],
-        component_tests.check_kernel: ['SEV'],
-        component_tests.check_if_sev_init: [],
-    }
-
-    if test_cpu:
-        del running_tests[component_tests.validate_cpu_model]
-
-    # Package tests, ignore if enablment flag is on
-    if not enablement:
-        running_tests[component_tests.find_libvirt_support] = []
-        running_tests[component_tests.find_qemu_support] = [system_os, 'SEV']
-        running_tests[component_tests.test_all_ovmf_paths] = [system_os, datetime.date(2018, 7, 6)]
-
-    #Run all tests
-    for test, components in running_tests.items():
-        if test == component_tests.test_all_ovmf_paths:
-            current_test_result, ovmf_paths = test(*components)
-            if not non_verbose:
-                for path in ovmf_paths:
-                    print_test_result(*path.values())
-        else:
-            current_component, current_command, current_found_result,\
-                current_expectation, current_test_result = test(*components)
-            if not non_verbose:
-                print_test_result(current_component, current_command,
-                                  current_found_result, current_expectation, current_test_result)
-
-        # Stop running checks immediately if the test fails and the stopfailure flag is enabled.
-        if not current_test_result and not stop_failure:
-            pass_check = False
-        # Test failed, stop failure enabled.
-        elif not current_test_result and stop_failure:
-            pass_check = False
-            break
-
-    return pass_check
+    return run_group(get_sev_group(system_os, enablement, test_cpu), non_verbose, stop_failure)
 
 
 def run_sev_es_test(non_verbose, system_os, stop_failure, enablement, test_cpu):
@@ -174,168 +174,81 @@ def run_sev_es_test(non_verbose, system_os, stop_failure, enablement, test_cpu):
     Run the existing OS checks that query the system capabilites,
     and informs if the current system setup can run SEV-ES.
     '''
-    # if not nonVerbose:
-    print("\nComparing Host OS componenets to known SEV-ES minimum versions:")
-
-    # Will turn false if any check fails
-    pass_check = True
-
-    running_tests = {
-        component_tests.validate_cpu_model: ["SEV-ES"],
-        component_tests.find_cpuid_support: ['SEV-ES'],
-        component_tests.check_kernel: ['SEV-ES'],
-        component_tests.find_asid_count: ['SEV-ES'],
-        component_tests.check_if_sev_es_init: [],
-    }
+    return run_group(get_sev_es_group(system_os, enablement, test_cpu), non_verbose, stop_failure)
 
-    if test_cpu:
-        del running_tests[component_tests.validate_cpu_model]
-
-    if not enablement:
-        running_tests[component_tests.find_libvirt_support] = []
-        running_tests[component_tests.find_qemu_support] = [system_os, 'SEV-ES']
-        running_tests[component_tests.test_all_ovmf_paths] = [system_os, datetime.date(2020, 11, 1)]
-
-    for test, components in running_tests.items():
-        if test == component_tests.test_all_ovmf_paths:
-            current_test_result, ovmf_paths = test(*components)
-            if not non_verbose:
-                for path in ovmf_paths:
-                    print_test_result(*path.values())
-        else:
-            current_component, current_command, current_found_result,\
-                current_expectation, current_test_result = test(*components)
-            if not non_verbose:
-                print_test_result(current_component, current_command,
-                                  current_found_result, current_expectation, current_test_result)
-
-        # Stop running checks immediately if the test fails and the stopfailure flag is enabled.
-        if not current_test_result and not stop_failure:
-            pass_check = False
-        # Test failed, stop failure enabled.
-        elif not current_test_result and stop_failure:
-            pass_check = False
-            break
-
-    return pass_check
 
 def run_sev_snp_test(non_verbose, stop_failure, test_cpu):
     '''
     Run the existing OS checks that query the system capabilites,
     and informs if the current system setup can run SEV-SNP.
     '''
-    # if not nonVerbose:
-    print("\nComparing Host OS componenets to known SEV-SNP minimum versions:")
-
-    running_tests = {
-        component_tests.validate_cpu_model: ["SEV-SNP"],
-        component_tests.find_cpuid_support: ['SEV-SNP'],
-        snp_component_tests.check_if_snp_enabled: [],
-        snp_component_tests.check_fw_version_for_snp: [],
-        snp_component_tests.find_iommu_enablement: []
-    }
-
-    if test_cpu:
-        del running_tests[component_tests.validate_cpu_model]
-
-    snp_tests = {
-        snp_component_tests.check_snp_init : [],
-        snp_component_tests.check_rmp_init : [],
-        snp_component_tests.get_rmp_address: [],
-        snp_component_tests.compare_tcb_versions : []
-    }
-  
-    # Will turn false if any check fails
-    pass_check = True
-
-    for test, components in running_tests.items():
-        current_component, current_command, current_found_result,\
-            current_expectation, current_test_result = test(*components)
-        if not non_verbose:
-            print_test_result(current_component, current_command,
-                                current_found_result, current_expectation, current_test_result)
-
-        # Stop running checks immediately if the test fails and the stopfailure flag is enabled.
-        if not current_test_result and not stop_failure:
-            pass_check = False
-        # Test failed, stop failure enabled.
-        elif not current_test_result and stop_failure:
-            pass_check = False
-            break
-    
-    if pass_check:
-        for test, components in snp_tests.items():
-            current_component, current_command, current_found_result,\
-            current_expectation, current_test_result = test(*components)
-            if not non_verbose:
-                print_test_result(current_component, current_command,
-                                    current_found_result, current_expectation, current_test_result)
-
-            # Stop running checks immediately if the test fails and the stopfailure flag is enabled.
-            if not current_test_result and not stop_failure:
-                pass_check = False
-            # Test failed, stop failure enabled.
-            elif not current_test_result and stop_failure:
-                pass_check = False
-                break
-
-    return pass_check
-
-
-def run_component_tests(non_verbose, system_os, stop_failure, feature_tests, enablement, test_cpu):
+    return run_group(get_sev_snp_group(test_cpu), non_verbose, stop_failure)
+
+
+def run_component_tests(non_verbose, system_os, stop_failure, feature_tests, enablement, test_cpu,
+                        check_timeout = check_scheduler.DEFAULT_CHECK_TIMEOUT, deadline = None,
+                        sinks = (), probes:host_probes.Probes = None):
     '''
     Function to run all of the current tests,
     will return the result of each individual system test,
-    and if all tests passed or not.
+    and if all tests passed or not (None if nothing failed but some checks timed out).
+    All the checks of the requested features run together, shared checks run only once.
+    check_timeout is the time budget of a check and deadline the time.monotonic() value
+    after which every unfinished check times out.
+    The results are also reported to every sink in sinks.
+    probes are the host_probes.Probes the checks use, the module functions if None.
     '''
-    # If all the tested features passed
-    all_tests_pass = False
-
-    # Tests to be run are added here
-    tests = {}
-    # Test results are added here
-    results = {}
-    # System support test result
-    tests[check_system_support_test] = [non_verbose, stop_failure,'SYSTEM SUPPORT']
-    results['SYSTEM SUPPORT'] = False
-
-    # SME enabled
-    if set(['sme']).intersection(set(feature_tests)):
-        tests[run_sme_test] = [non_verbose, stop_failure,'SME COMPONENT TEST']
-        results['SME COMPONENT TEST'] = False
-    else:
-        results['SME COMPONENT TEST'] = True
-
-    # SEV test result
-    tests[run_sev_test] = [non_verbose, system_os, stop_failure, enablement, test_cpu, 'SEV COMPONENT TEST']
-    results['SEV COMPONENT TEST'] = False
-
-    # SEV-ES enabled
-    if set(['sev-es']).intersection(set(feature_tests)) or set(['sev-snp']).intersection(set(feature_tests)):
-        tests[run_sev_es_test] = [non_verbose, system_os, stop_failure, enablement, test_cpu, 'SEV-ES COMPONENT TEST']
-        results['SEV-ES COMPONENT TEST'] = False
-    else:
-        results['SEV-ES COMPONENT TEST'] = True
-
-    # SEV-SNP enabled
-    if set(['sev-snp']).intersection(set(feature_tests)):
-        tests[run_sev_snp_test] = [non_verbose, stop_failure, test_cpu, 'SEV-SNP COMPONENT TEST']
-        results['SEV-SNP COMPONENT TEST'] = False
-    else:
-        results['SEV-SNP COMPONENT TEST'] = True
-
-    for test, test_description in tests.items():
-        test_args = test_description[:-1]
-        results[test_description[-1]] = test(*test_args)
-        if not non_verbose:
-            print_overall_result(
-                test_description[-1], results[test_description[-1]])
-    if False not in results.values():
-        all_tests_pass = True
+    # Start the external version probes together before the package checks need them
+    if not enablement:
+        with host_probes.using_probes(probes):
+            component_tests.prefetch_version_probes(system_os)
+
+    # Run every requested group, results are printed in group order
+    groups = get_feature_groups(system_os, feature_tests, enablement, test_cpu)
+    results = check_scheduler.CheckScheduler(
+        groups, check_timeout=check_timeout, deadline=deadline, probes=probes).run(
+            non_verbose, stop_failure, print_overall=True, sinks=sinks)
+
+    # Features that were not requested count as passing
+    all_tests_pass = True
+    if False in results.values():
+        all_tests_pass = False
+    elif None in results.values():
+        all_tests_pass = None
 
     return all_tests_pass, results['SEV COMPONENT TEST']
 
 
+def open_result_sinks(args) -> list:
+    '''
+    Create the result sinks requested with the output flags.
+    Returns a list of (sink, file) pairs, file is None when writing to stdout.
+    '''
+    sinks = []
+    for path, sink_class, binary in ((args.jsonl, check_results.JsonLinesSink, False),
+                                     (args.junit, check_results.JUnitSink, False),
+                                     (args.binary, check_results.BinarySink, True)):
+        if path is None:
+            continue
+        if path == '-':
+            sinks.append((sink_class(sys.stdout.buffer if binary else sys.stdout), None))
+        else:
+            # pylint: disable=consider-using-with
+            result_file = open(path, 'wb') if binary else open(path, 'w', encoding='utf-8')
+            sinks.append((sink_class(result_file), result_file))
+    return sinks
+
+
+def close_result_sinks(sinks:list):
+    '''
+    Finish every result sink and close its file.
+    '''
+    for sink, result_file in sinks:
+        sink.close()
+        if result_file is not None:
+            result_file.close()
+
+
 def main():
     '''
     Run the system check tests, then run any extra tests raised by the flags.
@@ -350,9 +263,120 @@ def main():
     Use --nonVerbose flag to run program without any prints
     Use --enablement flag to only test for SEV enablment on the system (ignore package support)
     Use --testcpu flag when testing with unreleased or test cpus to skip public domain knowledge tests.
+    Use --benchmark flag to measure SEV firmware command latency instead of running the checks.
+    Use --emulatesev flag to use an in-process /dev/sev emulator instead of the real device.
+    Use --deadline flag to give up on every check still running after the given number of seconds.
+    Use --checktimeout flag to change the number of seconds a single check can run.
+    Use --jsonl, --junit or --binary flags to also write the check results to a file ('-' for stdout).
+    Use --profile flag to print where the run spent its time, --trace to write a Chrome trace file.
+    Use --prometheus flag to write the results and SEV platform metrics to a node_exporter textfile.
+    Use --serve flag to keep running and answer check and placement queries on a Unix socket.
+    Use --factcache flag to reuse the facts that don't change until reboot from an earlier run.
+    Use --watch flag to keep running and check again whenever a package, OVMF or SEV setting changes.
+    Use --snapshot flag to write every raw fact the run read to a file, --evaluate to run
+    the checks against snapshot files of other hosts instead of this one.
+    Use --resultsdb flag to append the run to a SQLite results database, --query to ask it
+    for the hosts failing a feature, TCB mismatches or check duration regressions.
+    Use --kernellog flag to read only the kernel messages logged since the last run of this boot.
     Will return 1 if any of the desired tests fails, will return 0 if all the desired tests pass.
+    Will return 2 if no test failed but some checks timed out.
     '''
+    parser = get_parser()
     args = parser.parse_args()
+
+    # The fact cache and the snapshot are only saved at the end of a single run,
+    # the long running modes never get there
+    for flag, mode in (('--serve', args.serve is not None), ('--watch', args.watch)):
+        if mode and (args.factcache or args.snapshot):
+            parser.error(f"--factcache and --snapshot can't be used with {flag}")
+    # The result outputs and --stopfailure only apply to a single run too
+    single_run_flags = [flag for flag, value in (('--jsonl', args.jsonl), ('--junit', args.junit),
+                                                 ('--binary', args.binary),
+                                                 ('--prometheus', args.prometheus),
+                                                 ('--resultsdb', args.resultsdb),
+                                                 ('--stopfailure', args.stopfailure))
+                        if value]
+    for flag, mode in (('--serve', args.serve is not None), ('--watch', args.watch)):
+        if mode and single_run_flags:
+            parser.error(f"{', '.join(single_run_flags)} can't be used with {flag}")
+
+    # Record where the time goes if profiling was requested
+    if args.profile or args.trace:
+        tracing.enable_tracing()
+    try:
+        return run_requested_tests(args)
+    finally:
+        if args.trace:
+            tracing.write_chrome_trace(args.trace)
+        if args.profile:
+            tracing.print_summary()
+
+
+def run_requested_tests(args) -> int:
+    '''
+    Run the tests requested by the command line flags.
+    Returns the program exit code.
+    '''
+    run_start = time.monotonic()
+
+    # Hard limit for the run, external commands are stopped at it too
+    deadline = None
+    if args.deadline is not None:
+        deadline = time.monotonic() + args.deadline
+        command_runner.set_deadline(deadline)
+
+    # Device sessions used for SEV commands, real /dev/sev unless emulation was requested
+    device_factory = ioctl.SevDevice
+    if args.emulatesev:
+        import sev_emulator # pylint: disable=import-outside-toplevel
+        emulated_backend = sev_emulator.install_emulated_device()
+        device_factory = lambda: ioctl.SevDevice(backend=emulated_backend)
+
+    # Benchmark mode, only measure firmware command latency
+    if args.benchmark is not None:
+        import sev_benchmark # pylint: disable=import-outside-toplevel
+        if not args.nonverbose:
+            print("\nRunning SEV firmware command latency benchmark:")
+        if sev_benchmark.run_sev_benchmark(args.benchmark, args.benchmarkthreads,
+                                           args.benchmarkgetid, args.nonverbose, device_factory):
+            return 0
+        return 1
+
+    # Query mode, answer from the results database
+    if args.query:
+        import results_store # pylint: disable=import-outside-toplevel
+        return results_store.run_query(args.resultsdb or results_store.DEFAULT_DATABASE_PATH,
+                                       args.query, args.since, args.test)
+
+    # Evaluation mode, check snapshots of other hosts
+    if args.evaluate:
+        import fact_snapshot # pylint: disable=import-outside-toplevel
+        output = None
+        if args.jsonl:
+            # pylint: disable=consider-using-with
+            output = sys.stdout if args.jsonl == '-' else open(args.jsonl, 'w', encoding='utf-8')
+        try:
+            return fact_snapshot.evaluate(args.evaluate, args.test, args.enablement, args.testcpu,
+                                          args.evaluateworkers, output, args.nonverbose)
+        finally:
+            if output not in (None, sys.stdout):
+                output.close()
+
+    # Kernel messages read from where an earlier run of this boot stopped
+    if args.kernellog:
+        import kernel_log # pylint: disable=import-outside-toplevel
+        kernel_log.set_kernel_log(kernel_log.KernelLog(args.kernellog))
+
+    # Server mode, answer queries until stopped
+    if args.serve is not None:
+        import check_server # pylint: disable=import-outside-toplevel
+        exit_code = check_server.serve(args.serve, args.refreshinterval, args.test,
+                                       args.enablement, args.testcpu, args.checktimeout,
+                                       args.nonverbose, args.watch)
+        if args.kernellog:
+            kernel_log.save_kernel_log()
+        return exit_code
+
     system_os, _ = component_tests.get_linux_distro()  # Global SYSTEMOS
     # Print explanation
     if not args.nonverbose:
@@ -363,26 +387,110 @@ def main():
     # Overall program result
     all_requested_tests_pass = True
 
-    component_test_pass, sev_pass = run_component_tests(args.nonverbose, system_os, args.stopfailure,args.test ,args.enablement, args.testcpu)
+    # Facts cached by an earlier run in this boot replace the probes
+    if args.factcache:
+        import fact_cache # pylint: disable=import-outside-toplevel
+        if fact_cache.load_facts(args.factcache) and not args.nonverbose:
+            print(f"Using the facts cached in {args.factcache}.")
+
+    # Record the raw facts read by the checks for the snapshot
+    probes = None
+    if args.snapshot:
+        import fact_snapshot # pylint: disable=import-outside-toplevel
+        fact_recorder = fact_snapshot.FactRecorder()
+        fact_recorder.start()
+        probes = host_probes.Probes(fact_recorder.probes)
+
+    # Watch mode, check again on every change until interrupted
+    if args.watch:
+        import change_watcher # pylint: disable=import-outside-toplevel
+        return change_watcher.watch_checks(args.test, system_os, args.enablement, args.testcpu,
+                                           args.checktimeout, args.nonverbose)
+
+    # Extra outputs for the check results
+    result_sinks = open_result_sinks(args)
+    metrics_sink = None
+    if args.prometheus:
+        import prometheus_exporter # pylint: disable=import-outside-toplevel
+        metrics_sink = prometheus_exporter.CheckMetricsSink()
+        result_sinks.append((metrics_sink, None))
+    if args.resultsdb:
+        import results_store # pylint: disable=import-outside-toplevel
+        try:
+            result_sinks.append((results_store.ResultsStoreSink(args.resultsdb, system_os), None))
+        except results_store.sqlite3.Error as err:
+            print_warning_message("Results store", str(err))
+    try:
+        with tracing.span('component tests', 'phase'):
+            component_test_pass, sev_pass = run_component_tests(args.nonverbose, system_os, args.stopfailure,args.test ,args.enablement, args.testcpu,
+                                                                args.checktimeout, deadline,
+                                                                [sink for sink, _ in result_sinks],
+                                                                probes)
+    finally:
+        close_result_sinks(result_sinks)
+
+    # Next runs start after the kernel messages this one read
+    if args.kernellog:
+        kernel_log.save_kernel_log()
+
+    # Keep the facts of this run for the next ones
+    if args.factcache:
+        try:
+            fact_cache.save_facts(args.factcache)
+        except OSError as err:
+            print_warning_message("Fact cache", str(err))
+
+    # Keep the raw facts of this host for offline evaluation
+    if args.snapshot:
+        try:
+            fact_recorder.save(args.snapshot)
+        except OSError as err:
+            print_warning_message("Fact snapshot", str(err))
+
+    # Export the results with the platform metrics for node_exporter
+    if metrics_sink is not None:
+        try:
+            prometheus_exporter.write_textfile(args.prometheus, prometheus_exporter.collect_metrics(
+                metrics_sink, system_os, run_duration=time.monotonic() - run_start))
+        except OSError as err:
+            print_warning_message("Prometheus textfile", str(err))
+            all_requested_tests_pass = False
 
     # If one of the desired system check fails, then overall test will return failure
-    if not component_test_pass:
+    if component_test_pass is False:
         all_requested_tests_pass = False
+    # Some checks timed out, unknown result unless something else fails
+    elif component_test_pass is None:
+        all_requested_tests_pass = None
+
+    # Out of time, the requested VM tests are not started
+    vm_tests_requested = (args.testlocal, args.printlocal, args.autotest) != ('not raised',) * 3
+    if vm_tests_requested and deadline is not None and time.monotonic() >= deadline:
+        if not args.nonverbose:
+            print("\nDeadline reached, virtual machine tests were not run.")
+        return 1 if all_requested_tests_pass is False else 2
     
+    # Modules of the virtual machine tests are only loaded when one of them is requested
+    if vm_tests_requested:
+        import local_vm_test # pylint: disable=import-outside-toplevel
+        import auto_vm_test # pylint: disable=import-outside-toplevel
+
     # Test local feature has been raised
     if args.testlocal != 'not raised':
         if not args.nonverbose:
             print("\nRunning local virtual machine encryption test:")
         # If one of the provided VMs fails the encryption test, overall test fails.
-        if not local_vm_test.run_local_vm_test(system_os, args.testlocal, args.nonverbose):
-            all_requested_tests_pass = False
+        with tracing.span('test local', 'phase'):
+            if not local_vm_test.run_local_vm_test(system_os, args.testlocal, args.nonverbose):
+                all_requested_tests_pass = False
 
     # Print local feature has been raised
     if args.printlocal != 'not raised':
         if not args.nonverbose:
             print("\nRunning local virtual machine memory printer:")
         # Print one page of memory for the provided VMs
-        local_vm_test.run_print_memory(system_os, args.printlocal, args.nonverbose)
+        with tracing.span('print local', 'phase'):
+            local_vm_test.run_print_memory(system_os, args.printlocal, args.nonverbose)
 
     # auto test feature has been raised
     if args.autotest != "not raised":
@@ -400,11 +508,9 @@ def main():
                 if not args.nonverbose:
                     print("\nRunning automatic test for VM encryption:")
                 # If no test is specified, run sev test
-                if args.autotest is None:
-                    auto_test_result =  auto_vm_test.automatic_vm_test(system_os, args.nonverbose,'sev')
-                # Run specified test
-                else:
-                    auto_test_result =  auto_vm_test.automatic_vm_test(system_os, args.nonverbose,args.autotest)
+                with tracing.span('auto test', 'phase'):
+                    auto_test_result =  auto_vm_test.automatic_vm_test(system_os, args.nonverbose,
+                                                                       args.autotest or 'sev')
         
         # Grab result
         all_requested_tests_pass = auto_test_result
@@ -412,6 +518,8 @@ def main():
     # Return program results
     if all_requested_tests_pass:
         return 0
+    if all_requested_tests_pass is None:
+        return 2
     return 1
 
 
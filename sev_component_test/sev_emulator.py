@@ -0,0 +1,141 @@
+'''
+In-process /dev/sev stand-in. Implements SEV_PLATFORM_STATUS, SNP_PLATFORM_STATUS
+and SEV_GET_ID2 with configurable platform state, so the ioctl module and the checks
+that use it can be tested and benchmarked without EPYC hardware or the ccp driver.
+'''
+import ctypes
+import errno
+import itertools
+import threading
+import time
+import ioctl
+
+# Firmware status codes returned in the error field of the command
+SEV_RET_SUCCESS = 0
+SEV_RET_INVALID_PLATFORM_STATE = 1
+SEV_RET_INVALID_LEN = 4
+
+
+class EmulatedSevBackend:
+    '''
+    Device backend for ioctl.SevDevice that answers SEV commands from configured values.
+    errors maps a SEVCommand to the firmware error code it should fail with,
+    open_error is the errno raised when opening the device (for example errno.ENOENT
+    to act like a system without the ccp driver) and latency is the number of seconds
+    every command takes. Commands are serialized like the real firmware does.
+    '''
+    def __init__(self, api_major:int = 1, api_minor:int = 55, build:int = 21,
+                 state:int = 1, config_es:int = 1, owner:int = 0,
+                 snp_state:int = 1, is_rmp_init:int = 1, mask_chip_id:int = 0,
+                 guest_count:int = 0, tcb_version:int = 0x1b00000000000004,
+                 reported_tcb:int = 0x1b00000000000004, chip_id:bytes = bytes(range(64)),
+                 errors = None, open_error = None, latency:float = 0.0):
+        self.api_major = api_major
+        self.api_minor = api_minor
+        self.build = build
+        self.state = state
+        self.config_es = config_es
+        self.owner = owner
+        self.snp_state = snp_state
+        self.is_rmp_init = is_rmp_init
+        self.mask_chip_id = mask_chip_id
+        self.guest_count = guest_count
+        self.tcb_version = tcb_version
+        self.reported_tcb = reported_tcb
+        self.chip_id = chip_id
+        self.errors = dict(errors or {})
+        self.open_error = open_error
+        self.latency = latency
+        # Number of times each command reached the emulated firmware
+        self.command_counts = {}
+        self._handles = itertools.count(1000)
+        self._firmware_lock = threading.Lock()
+
+    def open(self, path:str) -> int:
+        '''
+        Open the emulated device.
+        '''
+        if self.open_error is not None:
+            raise OSError(self.open_error, "emulated open failure", path)
+        return next(self._handles)
+
+    def close(self, handle:int):
+        '''
+        Close the emulated device, nothing to release.
+        '''
+
+    def ioctl(self, handle:int, request:int, command:ioctl.SEVIssueCommand):
+        '''
+        Handle one SEV_ISSUE_CMD request.
+        Raises OSError the same way the ccp driver does when a command fails.
+        '''
+        if request != ioctl.SEV_ISSUE_CMD:
+            raise OSError(errno.ENOTTY, "Inappropriate ioctl for device")
+        with self._firmware_lock:
+            if self.latency:
+                time.sleep(self.latency)
+            sev_command = ioctl.SEVCommand(command.cmd)
+            self.command_counts[sev_command] = self.command_counts.get(sev_command, 0) + 1
+            command.error = self.errors.get(sev_command, SEV_RET_SUCCESS)
+            if command.error:
+                raise OSError(errno.EIO, "Input/output error")
+
+            if sev_command == ioctl.SEVCommand.SEV_PLATFORM_STATUS:
+                self._platform_status(command.data)
+            elif sev_command == ioctl.SEVCommand.SNP_PLATFORM_STATUS:
+                self._snp_platform_status(command.data)
+            elif sev_command == ioctl.SEVCommand.SEV_GET_ID2:
+                self._get_id2(command)
+            else:
+                raise OSError(errno.EINVAL, "Invalid argument")
+
+    def _platform_status(self, address:int):
+        '''
+        Fill a SevPlatformStatus structure.
+        '''
+        status = ioctl.SevPlatformStatus.from_address(address)
+        status.api_major = self.api_major
+        status.api_minor = self.api_minor
+        status.state = self.state
+        status.owner = self.owner
+        status.config_es = self.config_es
+        status.build = self.build
+        status.guest_count = self.guest_count
+
+    def _snp_platform_status(self, address:int):
+        '''
+        Fill a SevSnpPlatformSatus structure.
+        '''
+        status = ioctl.SevSnpPlatformSatus.from_address(address)
+        status.api_major = self.api_major
+        status.api_minor = self.api_minor
+        status.state = self.snp_state
+        status.is_rmp_init = self.is_rmp_init
+        status.build_id = self.build
+        status.mask_chip_id = self.mask_chip_id
+        status.guest_count = self.guest_count
+        status.tcb_version = self.tcb_version
+        status.reported_tcb = self.reported_tcb
+
+    def _get_id2(self, command):
+        '''
+        Copy the chip id to the buffer given in a SevGetId2 structure.
+        If the buffer is too small, report the length needed.
+        '''
+        id_data = ioctl.SevGetId2.from_address(command.data)
+        if id_data.length < len(self.chip_id):
+            id_data.length = len(self.chip_id)
+            command.error = SEV_RET_INVALID_LEN
+            raise OSError(errno.EIO, "Input/output error")
+        ctypes.memmove(id_data.address, self.chip_id, len(self.chip_id))
+        id_data.length = len(self.chip_id)
+
+
+def install_emulated_device(**settings) -> EmulatedSevBackend:
+    '''
+    Make every check in this process use an emulated /dev/sev.
+    Returns the backend so its settings and command counts can be inspected.
+    '''
+    backend = EmulatedSevBackend(**settings)
+    ioctl.set_sev_device(ioctl.SevDevice(backend=backend))
+    return backend
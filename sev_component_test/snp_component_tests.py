@@ -1,10 +1,11 @@
 '''
 Component tests to test availability of SNP in a system.
 '''
-import os
 import ioctl
 from packaging import version
-from component_tests import readmsr
+import msr_reader
+import host_probes
+from component_tests import check_msr_bit_on_all_cpus
 from message_printing import print_warning_message
 
 def check_fw_version_for_snp():
@@ -52,16 +53,8 @@ def check_if_snp_enabled():
     command = "MSR 0xC0010010"
 
     try:
-        # Read the MSR and bit value 24
-        msr_value = readmsr(0xC0010010)
-        bin_value = bin(msr_value)[2:][::-1]
-        bin_value = bin_value.ljust(64, "0")
-        snp_val = bin_value[24]
-        # If bit value equals 1 then test passes
-        if int(snp_val) == 1:
-            test_result = True
-        # Result
-        found_result = "MSR 0xC0010010 bit 23 is " + str(snp_val)
+        # Read the MSR on every cpu, bit 24 has to be set on all of them
+        test_result, found_result = check_msr_bit_on_all_cpus(msr_reader.MSR_SYSCFG, 24)
         return component, command, found_result, expectation, test_result
     except OSError as err:
         # Could not read the msr, print a warning and return a failure
@@ -142,9 +135,14 @@ def get_rmp_address():
     command = "MSR 0xC0010132 - 0xC0010133"
 
     try:
-        # Read the msr for rmp addresses
-        rmp_base = readmsr(0xC0010132)
-        rmp_end = readmsr(0xC0010133)
+        # Read the msr for rmp addresses on every cpu
+        rmp_matrix = msr_reader.get_msr_reader().read_matrix(
+            [msr_reader.MSR_RMP_BASE, msr_reader.MSR_RMP_END])
+        rmp_ranges = {}
+        for cpu, rmp_range in sorted(rmp_matrix.items()):
+            rmp_ranges.setdefault(rmp_range, []).append(cpu)
+        rmp_base, rmp_end = next(iter(rmp_ranges))
+
         # If both are filled pass the test
         if rmp_base and rmp_end:
             test_result = True
@@ -152,7 +150,14 @@ def get_rmp_address():
         # Format the found result
         found_result = ("RMP table physical address range "
                         + str(hex(rmp_base)) + " - " + str(hex(rmp_end)))
-  
+
+        # Every cpu has to agree on the RMP table location
+        if len(rmp_ranges) > 1:
+            test_result = False
+            found_result = "RMP table address range differs across cpus: " + ", ".join(
+                hex(base) + " - " + hex(end) + " on cpus " + host_probes.format_cpu_list(cpus)
+                for (base, end), cpus in rmp_ranges.items())
+
         return component, command, found_result, expectation, test_result
     except OSError as err:
         # Could not read the msr, print a warning and return a failure
@@ -208,7 +213,7 @@ def find_iommu_enablement():
     command = "find /sys/kernel/iommu_groups/"
 
     # Check if path exists, if it does, IOMMU is probably enabled
-    if os.path.exists("/sys/kernel/iommu_groups/"):
+    if host_probes.get_probes().path_exists("/sys/kernel/iommu_groups/"):
         found_result = "/sys/kernel/iommu_groups/ exists"
         test_result = True
     else:
@@ -0,0 +1,231 @@
+'''
+Lightweight tracing for the hot paths of a run: checks, subprocess launches, ioctls,
+MSR and CPUID reads and guest memory reads. Spans record monotonic start and stop times
+and the bytes they read. The trace can be written as Chrome trace-event JSON
+(chrome://tracing, Perfetto) and summarized as a table of the top costs.
+Tracing is off unless enable_tracing is called, spans are then close to free.
+'''
+import itertools
+import json
+import os
+import subprocess
+import threading
+import time
+
+# Categories counted as process launches in the summary
+FORK_CATEGORIES = ('subprocess',)
+
+
+class _NullSpan:
+    '''
+    Span used when tracing is off, does nothing.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, key:str, value):
+        '''
+        Ignore a span argument.
+        '''
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    '''
+    One timed operation. Arguments like bytes read can be set while it runs.
+    Overlapping spans on one thread (asyncio tasks) are given an async id.
+    '''
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start', 'end', 'thread', 'async_id')
+
+    def __init__(self, tracer, name:str, category:str, args:dict, async_id = None):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0
+        self.end = 0
+        self.thread = 0
+        self.async_id = async_id
+
+    def __enter__(self):
+        self.thread = threading.get_ident()
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end = time.monotonic_ns()
+        if exc_info[0] is not None:
+            self.args['error'] = exc_info[0].__name__
+        self.tracer.add(self)
+        return False
+
+    def set(self, key:str, value):
+        '''
+        Set a span argument, for example the number of bytes read.
+        '''
+        self.args[key] = value
+
+    @property
+    def duration(self) -> int:
+        '''
+        Span duration in nanoseconds.
+        '''
+        return self.end - self.start
+
+
+class Tracer:
+    '''
+    Collects finished spans from every thread.
+    '''
+    def __init__(self):
+        self.spans = []
+        self.start = time.monotonic_ns()
+        self._lock = threading.Lock()
+        self._async_ids = itertools.count(1)
+
+    def span(self, name:str, category:str, args:dict, overlapping:bool = False) -> Span:
+        '''
+        Create a span, overlapping spans can run concurrently on the same thread.
+        '''
+        return Span(self, name, category, args,
+                    next(self._async_ids) if overlapping else None)
+
+    def add(self, span:Span):
+        '''
+        Keep a finished span.
+        '''
+        with self._lock:
+            self.spans.append(span)
+
+    def get_spans(self) -> list:
+        '''
+        Get a copy of the finished spans, ordered by start time.
+        '''
+        with self._lock:
+            return sorted(self.spans, key=lambda span: span.start)
+
+
+_tracer = None
+
+
+def enable_tracing() -> Tracer:
+    '''
+    Start recording spans in this process. Returns the tracer.
+    '''
+    global _tracer # pylint: disable=global-statement
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable_tracing():
+    '''
+    Stop recording spans and forget the ones recorded.
+    '''
+    global _tracer # pylint: disable=global-statement
+    _tracer = None
+
+
+def get_tracer():
+    '''
+    Get the active tracer, None if tracing is off.
+    '''
+    return _tracer
+
+
+def span(name:str, category:str, overlapping:bool = False, **args):
+    '''
+    Time the code in a with block as one span, does nothing if tracing is off.
+    overlapping is needed for spans that run concurrently on the same thread.
+    '''
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, category, args, overlapping)
+
+
+def run(command, **kwargs) -> subprocess.CompletedProcess:
+    '''
+    subprocess.run recorded as a subprocess span with the bytes it output.
+    '''
+    name = command if isinstance(command, str) else ' '.join(command)
+    with span(name, 'subprocess') as run_span:
+        completed = subprocess.run(command, **kwargs) # pylint: disable=subprocess-run-check
+        if isinstance(completed.stdout, bytes):
+            run_span.set('bytes', len(completed.stdout))
+        return completed
+
+
+def get_chrome_trace(tracer:Tracer) -> dict:
+    '''
+    Convert the recorded spans to the Chrome trace-event format, times in microseconds.
+    '''
+    pid = os.getpid()
+    thread_ids = {}
+    events = []
+    for recorded in tracer.get_spans():
+        # Small thread numbers are easier to read than thread idents
+        tid = thread_ids.setdefault(recorded.thread, len(thread_ids) + 1)
+        start = (recorded.start - tracer.start) / 1000
+        if recorded.async_id is None:
+            events.append({'name': recorded.name, 'cat': recorded.category, 'ph': 'X',
+                           'ts': start, 'dur': recorded.duration / 1000, 'pid': pid,
+                           'tid': tid, 'args': recorded.args})
+        else:
+            common = {'name': recorded.name, 'cat': recorded.category, 'id': recorded.async_id,
+                      'pid': pid, 'tid': tid}
+            events.append(dict(common, ph='b', ts=start, args=recorded.args))
+            events.append(dict(common, ph='e', ts=(recorded.end - tracer.start) / 1000))
+    events.sort(key=lambda event: event['ts'])
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path:str, tracer:Tracer = None):
+    '''
+    Write the recorded spans to a Chrome trace-event JSON file.
+    '''
+    tracer = tracer or _tracer
+    with open(path, 'w', encoding='utf-8') as trace_file:
+        json.dump(get_chrome_trace(tracer), trace_file, default=str)
+
+
+def summarize(tracer:Tracer) -> list:
+    '''
+    Aggregate the spans by category and name.
+    Returns a list of (category, name, calls, total ns, max ns, bytes) by total time.
+    '''
+    totals = {}
+    for recorded in tracer.get_spans():
+        key = (recorded.category, recorded.name)
+        calls, total, longest, read = totals.get(key, (0, 0, 0, 0))
+        totals[key] = (calls + 1, total + recorded.duration, max(longest, recorded.duration),
+                       read + recorded.args.get('bytes', 0))
+    return sorted(((category, name) + values for (category, name), values in totals.items()),
+                  key=lambda row: row[3], reverse=True)
+
+
+def print_summary(tracer:Tracer = None, top:int = 15):
+    '''
+    Print the operations that took the most time, the number of processes started
+    and the bytes read.
+    '''
+    tracer = tracer or _tracer
+    rows = summarize(tracer)
+    spans = tracer.get_spans()
+    wall = ((max(recorded.end for recorded in spans) - tracer.start) / 1e9) if spans else 0.0
+    forks = sum(1 for recorded in spans if recorded.category in FORK_CATEGORIES)
+    read = sum(recorded.args.get('bytes', 0) for recorded in spans)
+    print(f"\nProfile: {wall:.3f} s traced, {len(spans)} spans, "
+          f"{forks} processes started, {read} bytes read")
+    print(f"  {'Category':<10} {'Operation':<48} {'Calls':>6} {'Total ms':>10} "
+          f"{'Max ms':>9} {'Bytes':>10}")
+    for category, name, calls, total, longest, read in rows[:top]:
+        if len(name) > 48:
+            name = name[:45] + '...'
+        print(f"  {category:<10} {name:<48} {calls:>6} {total / 1e6:>10.2f} "
+              f"{longest / 1e6:>9.2f} {read:>10}")
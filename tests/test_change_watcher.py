@@ -0,0 +1,49 @@
+'''Testing for change_watcher functions'''
+from sev_component_test import change_watcher
+
+# Same module the watcher uses
+component_tests = change_watcher.sev_api.component_tests
+
+def test_change_watcher(tmp_path):
+    '''
+    Testing changes in watched directories are reported for their input
+    '''
+    packages = tmp_path / 'dpkg'
+    packages.mkdir()
+    firmware = tmp_path / 'OVMF'
+    # Kernel messages logged before the test are not changes
+    try:
+        change_watcher.kernel_log.get_kernel_log().read_new()
+    except OSError:
+        pass
+    watcher = change_watcher.ChangeWatcher(
+        [('packages', str(packages), ('status',)), ('ovmf', str(firmware), None)],
+        settle_time=0.05)
+    try:
+        assert watcher.wait(0.1) == set()
+        # Files the checks don't read are ignored
+        (packages / 'lock').write_text('', encoding='utf-8')
+        assert watcher.wait(0.2) == set()
+        (packages / 'status').write_text('Package: qemu\n', encoding='utf-8')
+        assert watcher.wait(5) == {'packages'}
+
+        # Directories missing at start are watched once they exist
+        firmware.mkdir()
+        assert watcher.poll_changes() == set()
+        (firmware / 'OVMF.fd').write_bytes(b'')
+        assert watcher.wait(5) == {'ovmf'}
+    finally:
+        watcher.close()
+
+def test_get_reusable_outcomes():
+    '''
+    Testing only the checks reading a changed input are run again
+    '''
+    outcomes = {(component_tests.test_all_ovmf_paths, ('SEV',)): 'ovmf',
+                (component_tests.find_qemu_support, ('ubuntu', 'SEV')): 'qemu',
+                (component_tests.check_if_sev_init, ()): 'sev'}
+
+    assert set(change_watcher.get_reusable_outcomes(outcomes, {'ovmf'}).values()) == {'qemu', 'sev'}
+    assert set(change_watcher.get_reusable_outcomes(outcomes, {'packages'}).values()) == {'sev'}
+    assert set(change_watcher.get_reusable_outcomes(outcomes, {'kvm_amd'}).values()) == {'ovmf', 'qemu'}
+    assert not change_watcher.get_reusable_outcomes(outcomes, {'boot'})
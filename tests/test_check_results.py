@@ -0,0 +1,103 @@
+'''Testing for check_results'''
+import io
+import json
+import xml.etree.ElementTree as ElementTree
+from sev_component_test import check_results
+
+class FakeGroup:
+    '''
+    Group with the attributes the sinks use
+    '''
+    name = 'SEV COMPONENT TEST'
+    header = None
+    feature = 'SEV'
+
+def get_results():
+    '''
+    Results of every status for one group
+    '''
+    return [
+        check_results.CheckResult.from_tuple(
+            ('Kernel', 'uname -r', '6.8.0', '4.16 minimum', True), 0.25, 'SEV', FakeGroup.name),
+        check_results.CheckResult.from_tuple(
+            ('QEMU version', 'qemu-system-x86_64 --version', 'EMPTY', '2.12 minimum', False),
+            1.5, 'SEV', FakeGroup.name),
+        check_results.CheckResult('find_libvirt_support', '', '', '',
+                                  check_results.Status.TIMEOUT, 60.0, 'SEV', FakeGroup.name)
+    ]
+
+def report(sink):
+    '''
+    Report the results of one group to a sink
+    '''
+    sink.start_group(FakeGroup)
+    sink.add_warning(FakeGroup, 'QEMU version', 'qemu not installed')
+    for result in get_results():
+        sink.add_result(result)
+    sink.end_group(FakeGroup, False)
+    sink.close()
+
+def test_check_result():
+    '''
+    Testing building results from check tuples
+    '''
+    passing, failing, timeout = get_results()
+    assert passing.passed and passing.status == check_results.Status.PASS
+    assert not failing.passed and failing.status == check_results.Status.FAIL
+    assert not timeout.passed
+    assert failing.as_tuple() == ('QEMU version', 'qemu-system-x86_64 --version', 'EMPTY',
+                                  '2.12 minimum', False)
+    assert not hasattr(passing, '__dict__')
+
+def test_json_lines_sink():
+    '''
+    Testing the JSON Lines output
+    '''
+    stream = io.StringIO()
+    report(check_results.JsonLinesSink(stream))
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [record['type'] for record in records] == [
+        'warning', 'result', 'result', 'result', 'group']
+    assert records[2]['status'] == 'FAIL' and records[2]['duration'] == 1.5
+    assert records[3]['status'] == 'TIMEOUT'
+    assert records[4]['status'] == 'FAIL'
+
+def test_junit_sink():
+    '''
+    Testing the JUnit XML output
+    '''
+    stream = io.StringIO()
+    report(check_results.JUnitSink(stream))
+    suite = ElementTree.fromstring(stream.getvalue()).find('testsuite')
+    assert suite.get('tests') == '3'
+    assert suite.get('failures') == '1'
+    assert suite.get('errors') == '1'
+    assert [case.get('name') for case in suite.findall('testcase')] == [
+        'Kernel', 'QEMU version', 'find_libvirt_support']
+    assert 'qemu not installed' in suite.find('system-err').text
+
+def test_binary_sink():
+    '''
+    Testing the binary output reads back to the same results
+    '''
+    stream = io.BytesIO()
+    report(check_results.BinarySink(stream))
+    stream.seek(0)
+    assert list(check_results.read_binary_results(stream)) == get_results()
+
+def test_binary_sink_large():
+    '''
+    Testing the binary output keeps typed values and more than 65536 strings
+    '''
+    results = [check_results.CheckResult.from_tuple(
+        (f'Component {number}', '', number, [1, True, None], True), 0.5, 'SEV', FakeGroup.name)
+               for number in range(70000)]
+    stream = io.BytesIO()
+    sink = check_results.BinarySink(stream)
+    for result in results:
+        sink.add_result(result)
+    sink.close()
+    stream.seek(0)
+    read_back = list(check_results.read_binary_results(stream))
+    assert read_back == results
+    assert read_back[-1].found == 69999 and read_back[-1].expected == [1, True, None]
@@ -0,0 +1,152 @@
+'''Testing for check_scheduler'''
+import threading
+import time
+from sev_component_test import check_scheduler
+
+# Same module the scheduler uses
+Status = check_scheduler.Status
+
+calls = []
+calls_lock = threading.Lock()
+
+def fake_check(name, passed, delay = 0.0):
+    '''
+    Check that records its calls and returns the given result
+    '''
+    time.sleep(delay)
+    with calls_lock:
+        calls.append(name)
+    return name, 'fake', 'found', 'expected', passed
+
+def setup_function():
+    '''
+    Clear recorded calls
+    '''
+    calls.clear()
+
+def test_shared_checks_run_once_in_order():
+    '''
+    Testing that shared checks run once and results keep group order
+    '''
+    shared = check_scheduler.Check(fake_check, ['shared', True])
+    groups = [
+        check_scheduler.CheckGroup('FIRST', None, [
+            check_scheduler.Check(fake_check, ['slow', True, 0.2]), shared]),
+        check_scheduler.CheckGroup('SECOND', None, [
+            check_scheduler.Check(fake_check, ['shared', True]),
+            check_scheduler.Check(fake_check, ['other', False])])
+    ]
+    scheduler = check_scheduler.CheckScheduler(groups)
+
+    assert scheduler.run(True, False) == {'FIRST': True, 'SECOND': False}
+    assert calls.count('shared') == 1
+    assert [(record.group, record.component) for record in scheduler.results] == [
+        ('FIRST', 'slow'), ('FIRST', 'shared'), ('SECOND', 'shared'), ('SECOND', 'other')]
+
+def test_dependencies_and_stop_failure():
+    '''
+    Testing that dependent checks are skipped and stop failure cancels pending checks
+    '''
+    enabled = check_scheduler.Check(fake_check, ['enabled', False])
+    gated = check_scheduler.Check(fake_check, ['gated', True], depends_on=[enabled])
+    groups = [check_scheduler.CheckGroup('GROUP', None, [
+        check_scheduler.Check(fake_check, ['first', False, 0.1]), enabled, gated])]
+    scheduler = check_scheduler.CheckScheduler(groups, max_workers=1)
+
+    assert scheduler.run(True, False) == {'GROUP': False}
+    assert 'gated' not in calls
+    assert [(record.component, record.status) for record in scheduler.results] == [
+        ('first', Status.FAIL), ('enabled', Status.FAIL), ('fake_check gated True', Status.SKIPPED)]
+
+    calls.clear()
+    later = check_scheduler.Check(fake_check, ['later', True], depends_on=[
+        check_scheduler.Check(fake_check, ['slow', True, 0.3])])
+    groups = [check_scheduler.CheckGroup('GROUP', None, [
+        check_scheduler.Check(fake_check, ['failing', False]), later])]
+    scheduler = check_scheduler.CheckScheduler(groups, max_workers=2)
+
+    assert scheduler.run(True, True) == {'GROUP': False}
+    time.sleep(0.4)
+    assert 'later' not in calls
+
+def broken_check(name):
+    '''
+    Check that raises an error
+    '''
+    raise OSError(f"{name} not readable")
+
+def test_check_errors():
+    '''
+    Testing that a check raising an error fails, its dependents are skipped and the run goes on
+    '''
+    broken = check_scheduler.Check(broken_check, ['/dev/sev'])
+    groups = [
+        check_scheduler.CheckGroup('GROUP', None, [
+            broken, check_scheduler.Check(fake_check, ['gated', True], depends_on=[broken]),
+            check_scheduler.Check(fake_check, ['after', True])]),
+        check_scheduler.CheckGroup('OTHER', None, [
+            check_scheduler.Check(fake_check, ['other', True])])
+    ]
+    scheduler = check_scheduler.CheckScheduler(groups)
+
+    assert scheduler.run(True, False) == {'GROUP': False, 'OTHER': True}
+    assert sorted(calls) == ['after', 'other']
+    assert [(record.component, record.status) for record in scheduler.results] == [
+        ('broken_check /dev/sev', Status.FAIL), ('fake_check gated True', Status.SKIPPED),
+        ('after', Status.PASS), ('other', Status.PASS)]
+    assert scheduler.results[0].found == 'OSError: /dev/sev not readable'
+    assert broken.key not in scheduler.get_outcomes()
+
+def test_timeouts_and_deadline():
+    '''
+    Testing that slow checks are reported as timeouts, neither passing nor failing
+    '''
+    slow = check_scheduler.Check(fake_check, ['slow', True, 1.0], timeout=0.1)
+    groups = [check_scheduler.CheckGroup('GROUP', None, [
+        check_scheduler.Check(fake_check, ['fast', True]), slow,
+        check_scheduler.Check(fake_check, ['gated', True], depends_on=[slow])])]
+    scheduler = check_scheduler.CheckScheduler(groups)
+
+    assert scheduler.run(True, False) == {'GROUP': None}
+    assert [record.status for record in scheduler.results] == [
+        Status.PASS, Status.TIMEOUT, Status.TIMEOUT]
+    assert scheduler.results[1].duration >= 0.1
+    assert 'gated' not in calls
+
+    groups = [check_scheduler.CheckGroup('GROUP', None, [
+        check_scheduler.Check(fake_check, ['failing', False]),
+        check_scheduler.Check(fake_check, ['slow', True, 1.0])])]
+    start = time.monotonic()
+    scheduler = check_scheduler.CheckScheduler(groups, deadline=start + 0.2)
+
+    assert scheduler.run(True, False) == {'GROUP': False}
+    assert time.monotonic() - start < 0.8
+    assert [record.status for record in scheduler.results] == [
+        Status.FAIL, Status.TIMEOUT]
+
+def test_reuse_outcomes():
+    '''
+    Testing that reused checks are not run again unless a check they depend on runs again
+    '''
+    def get_groups():
+        base = check_scheduler.Check(fake_check, ['base', True])
+        return [check_scheduler.CheckGroup('GROUP', None, [
+            base, check_scheduler.Check(fake_check, ['kept', True]),
+            check_scheduler.Check(fake_check, ['dependent', True], depends_on=[base])])]
+    first = check_scheduler.CheckScheduler(get_groups())
+    assert first.run(True, False) == {'GROUP': True}
+    outcomes = first.get_outcomes()
+    assert len(outcomes) == 3
+
+    calls.clear()
+    reuse = {key: outcome for key, outcome in outcomes.items() if key[1][0] != 'base'}
+    second = check_scheduler.CheckScheduler(get_groups(), reuse=reuse)
+    assert second.run(True, False) == {'GROUP': True}
+    assert sorted(calls) == ['base', 'dependent']
+    assert [record.component for record in second.results] == ['base', 'kept', 'dependent']
+
+    calls.clear()
+    third = check_scheduler.CheckScheduler(get_groups(), reuse=outcomes)
+    assert third.run(True, False) == {'GROUP': True}
+    assert not calls
+    assert len(third.results) == 3
@@ -0,0 +1,101 @@
+'''Testing for check_server functions'''
+import asyncio
+import os
+import threading
+import time
+from types import SimpleNamespace
+from sev_component_test import check_server
+from sev_component_test import sev_emulator
+
+def test_check_server(tmp_path):
+    '''
+    Testing the check server answers queries over its socket
+    '''
+    socket_path = str(tmp_path / 'sev.sock')
+    check_server.ioctl.set_sev_device(check_server.ioctl.SevDevice(
+        backend=sev_emulator.EmulatedSevBackend(guest_count=3)))
+    server = check_server.CheckServer(
+        socket_path, refresh_interval=0.05, features=['sev', 'sev-snp'], enablement=True,
+        probes={'read_os_release': lambda: {'ID': 'ubuntu', 'VERSION_ID': '22.04'}})
+    ready = threading.Event()
+    thread = threading.Thread(target=asyncio.run, args=(server.serve(ready.set),))
+    thread.start()
+    try:
+        assert ready.wait(30), "server did not start"
+        assert check_server.query({'query': 'ping'}, socket_path) == {'ok': True}
+
+        placement = check_server.query({'query': 'placement', 'feature': 'sev-snp'}, socket_path)
+        assert placement['ok'] and placement['feature'] == 'sev-snp'
+        assert placement['guest_count'] == 3, "guest count not read from the device"
+        assert placement['can_place'] == (not placement['reasons'])
+
+        status = check_server.query({'query': 'refresh'}, socket_path)
+        assert status['platform']['snp']['rmp_initialized'] is True
+        assert list(status['features']) == ['SYSTEM', 'SEV', 'SEV-ES', 'SEV-SNP']
+
+        checks = check_server.query({'query': 'checks', 'feature': 'SEV'}, socket_path)
+        assert checks['results'] and all(result['feature'] == 'SEV' for result in checks['results'])
+        # Placement feature names select the same checks
+        snp_checks = check_server.query({'query': 'checks', 'feature': 'sev-snp'}, socket_path)
+        assert snp_checks['results'] and all(result['feature'] == 'SEV-SNP'
+                                             for result in snp_checks['results'])
+        assert check_server.query({'query': 'placement', 'feature': 'SEV-SNP'}, socket_path)['ok']
+
+        assert not check_server.query({'query': 'placement', 'feature': 'tdx'}, socket_path)['ok']
+        assert not check_server.query({'query': 'shutdown'}, socket_path)['ok']
+    finally:
+        server.stop()
+        thread.join(30)
+        check_server.ioctl.set_sev_device(None)
+    assert not os.path.exists(socket_path), "socket not removed"
+
+def test_get_placement():
+    '''
+    Testing placement answers from the kept facts
+    '''
+    server = check_server.CheckServer()
+    server.platform = {'asids': {'sev': 10, 'sev-es': 4},
+                       'sev': {'state': 1, 'guest_count': 12},
+                       'snp': {'state': 0, 'rmp_initialized': False}}
+    server.refreshed_at = 0
+
+    assert server.get_free_asids() == 2
+    assert server.get_free_asids('sev-es') == 2
+    placement = server.get_placement('sev-snp')
+    assert not placement['can_place']
+    assert "SNP platform not initialized" in placement['reasons']
+    # No check results yet
+    assert "SEV-SNP checks did not pass" in placement['reasons']
+
+    server.platform['sev']['guest_count'] = 14
+    assert "No free ASID" in server.get_placement('sev')['reasons']
+
+def test_run_checks_overlapping():
+    '''
+    Testing overlapping check runs each reuse the outcomes of the run before them
+    '''
+    def check_sev():
+        pass
+    reuses = []
+    def run_checks(refresh=False, reuse=None, **arguments):
+        reuses.append(reuse)
+        run_number = len(reuses)
+        time.sleep(0.05)
+        return SimpleNamespace(outcomes={(check_sev, 'SEV'): run_number})
+
+    sev_api_run_checks = check_server.sev_api.run_checks
+    try:
+        check_server.sev_api.run_checks = run_checks
+        server = check_server.CheckServer()
+        server.run_checks()
+        threads = [threading.Thread(target=server.run_checks, args=(False, {'ovmf'}))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        # The second run reused the outcome of the first, not the startup one twice
+        assert reuses[1:] == [{(check_sev, 'SEV'): 1}, {(check_sev, 'SEV'): 2}]
+        assert server.check_run.outcomes == {(check_sev, 'SEV'): 3}
+    finally:
+        check_server.sev_api.run_checks = sev_api_run_checks
@@ -0,0 +1,99 @@
+'''Testing for command_runner functions'''
+import sys
+import threading
+import time
+from sev_component_test import command_runner
+
+def teardown_function():
+    '''
+    Forget command results between tests
+    '''
+    command_runner.clear_results()
+
+def test_run_commands():
+    '''
+    Testing run_commands output, missing binaries and timeouts
+    '''
+    echo_command = [sys.executable, '-c', 'print("libvirt 8.0.0")']
+    missing_command = ['sev-component-test-missing-binary', '-V']
+    slow_command = [sys.executable, '-c', 'import time; time.sleep(10)']
+
+    results = command_runner.run_commands(
+        [echo_command, missing_command, slow_command],
+        timeouts={tuple(slow_command): 0.5})
+
+    assert results[tuple(echo_command)].stdout.strip() == "libvirt 8.0.0"
+    assert results[tuple(echo_command)].returncode == 0
+    assert results[tuple(missing_command)].returncode is None
+    assert "sev-component-test-missing-binary" in command_runner.get_error_message(
+        results[tuple(missing_command)])
+    assert "timed out" in results[tuple(slow_command)].error
+
+def test_run_command_cached():
+    '''
+    Testing that a command only runs once per process
+    '''
+    counter_command = [sys.executable, '-c', 'import time; print(time.monotonic_ns())']
+
+    first = command_runner.run_command(counter_command)
+    second = command_runner.run_command(counter_command)
+
+    assert first is second
+
+def test_run_commands_deadline():
+    '''
+    Testing that commands are stopped at the deadline and not started after it
+    '''
+    command_runner.set_deadline(time.monotonic() + 0.2)
+    try:
+        slow_result = command_runner.run_command(["sleep", "5"])
+        late_result = command_runner.run_command(["echo", "late"])
+    finally:
+        command_runner.set_deadline(None)
+    assert "timed out" in slow_result.error
+    assert "deadline reached" in late_result.error
+    assert command_runner.run_command(["echo", "late"]).stdout.strip() == "late"
+
+def test_run_command_concurrent():
+    '''
+    Testing that threads asking for the same command at the same time share one run
+    '''
+    slow_command = [sys.executable, '-c',
+                    'import time; time.sleep(0.3); print(time.monotonic_ns())']
+    barrier = threading.Barrier(4)
+    results = []
+    def run():
+        barrier.wait()
+        results.append(command_runner.run_command(slow_command))
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4
+    assert all(result is results[0] for result in results)
+    assert results[0].returncode == 0
+    assert not command_runner._in_flight # pylint: disable=protected-access
+
+def test_run_command_cleared_while_waiting():
+    '''
+    Testing that a thread waiting for another thread's run gets its result after clear_results
+    '''
+    slow_command = [sys.executable, '-c',
+                    'import time; time.sleep(0.4); print(time.monotonic_ns())']
+    results = {}
+    def run(name):
+        results[name] = command_runner.run_command(slow_command)
+    first = threading.Thread(target=run, args=('first',))
+    first.start()
+    while tuple(slow_command) not in command_runner._in_flight: # pylint: disable=protected-access
+        time.sleep(0.01)
+    waiter = threading.Thread(target=run, args=('waiter',))
+    waiter.start()
+    time.sleep(0.1)
+    command_runner.clear_results()
+    first.join()
+    command_runner.clear_results()
+    waiter.join()
+    assert results['waiter'] is results['first']
+    assert results['first'].returncode == 0
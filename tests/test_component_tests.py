@@ -30,3 +30,34 @@ def test_get_version_num():
         "get_version_test did not format the version correctly"
     assert component_tests.get_version_num(version_test_5) == "5.11.0",\
         "get_version_test did not format the version correctly"
+
+def test_check_kernel_messages():
+    '''
+    Testing kernel errors fail the check of their feature only
+    '''
+    read_kernel_events = component_tests.host_probes.read_kernel_events
+    try:
+        component_tests.host_probes.read_kernel_events = lambda: [
+            (7, 1500, 'sev', 'info', "ccp 0000:22:00.1: SEV API:1.55 build:21"),
+            (9, 2500, 'rmp', 'error', "SEV-SNP: RMP fault at 0x1000")]
+        _, _, found, _, passed = component_tests.check_kernel_messages('SEV')
+        assert passed and found == "NONE"
+        _, _, found, _, passed = component_tests.check_kernel_messages('SEV-SNP')
+        assert not passed and found == "1 errors, last: SEV-SNP: RMP fault at 0x1000"
+    finally:
+        component_tests.host_probes.read_kernel_events = read_kernel_events
+
+def test_check_kernel_config():
+    '''
+    Testing options turned off or missing fail the kernel config check
+    '''
+    read_kernel_config = component_tests.host_probes.read_kernel_config
+    try:
+        component_tests.host_probes.read_kernel_config = lambda names: dict(
+            {name: 'y' for name in names}, CONFIG_AMD_IOMMU='n')
+        _, _, found, _, passed = component_tests.check_kernel_config('SEV')
+        assert passed and found == "all set"
+        _, _, found, _, passed = component_tests.check_kernel_config('SEV-SNP')
+        assert not passed and found == "CONFIG_AMD_IOMMU=n"
+    finally:
+        component_tests.host_probes.read_kernel_config = read_kernel_config
@@ -0,0 +1,39 @@
+'''Testing for cpuid_table functions'''
+from sev_component_test import cpuid_table
+
+def test_get_bits():
+    '''
+    Testing for get_bits
+    '''
+    assert cpuid_table.get_bits(0xF0000000, 28, 31) == 0xF, "Top nibble not decoded"
+    assert cpuid_table.get_bits(0b101100, 2, 4) == 0b011, "Middle bits not decoded"
+    assert cpuid_table.is_bit_set(0b10, 1), "Bit 1 should be set"
+    assert not cpuid_table.is_bit_set(0b10, 0), "Bit 0 should not be set"
+
+def test_decode_family_model():
+    '''
+    Testing for decode_family_model
+    '''
+    milan_eax = 0x00A00F11
+    genoa_eax = 0x00A10F11
+
+    assert cpuid_table.decode_family_model(milan_eax) == (25, 1), "Milan not decoded correctly"
+    assert cpuid_table.decode_family_model(genoa_eax) == (25, 17), "Genoa not decoded correctly"
+
+def test_cpuid_table_heterogeneity():
+    '''
+    Testing the CpuidTable lookups and heterogeneity report
+    '''
+    uniform_leaves = [(0, 0, 0, 0)] * len(cpuid_table.CPUID_LEAVES)
+    sev_index = cpuid_table.CPUID_LEAVES.index(0x8000001f)
+    different_leaves = list(uniform_leaves)
+    different_leaves[sev_index] = (0x1, 0x2f, 509, 100)
+    uniform_leaves = list(uniform_leaves)
+    uniform_leaves[sev_index] = (0x1b, 0x2f, 509, 100)
+
+    table = cpuid_table.CpuidTable([0, 1], [0, 1], {0: uniform_leaves, 1: different_leaves})
+
+    assert table.get(0x8000001f, 'eax') == 0x1b, "Default cpu lookup failed"
+    assert table.get(0x8000001f, 'eax', 1) == 0x1, "Per cpu lookup failed"
+    assert table.get(0x12345678, 'eax') is None, "Unknown leaf should not be found"
+    assert table.find_heterogeneity() == [(0x8000001f, 'eax', {0x1b: [0], 0x1: [1]})]
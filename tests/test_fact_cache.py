@@ -0,0 +1,82 @@
+'''Testing for fact_cache functions'''
+import json
+import os
+from sev_component_test import fact_cache
+
+# Same modules the fact cache uses
+command_runner = fact_cache.command_runner
+cpuid_table = fact_cache.cpuid_table
+msr_reader = fact_cache.msr_reader
+host_probes = fact_cache.host_probes
+
+def reset_facts():
+    '''
+    Forget every fact of the process
+    '''
+    command_runner.clear_results()
+    cpuid_table.set_cpuid_table(None)
+    msr_reader.set_msr_reader(None)
+    host_probes.set_kernel_messages(None)
+
+def test_fact_cache(tmp_path):
+    '''
+    Testing facts saved by a run are loaded by the next one until a source changes
+    '''
+    cache_path = str(tmp_path / 'cache' / 'facts.json')
+    fv_directory = tmp_path / 'edk2' / 'Build' / 'FV'
+    fv_directory.mkdir(parents=True)
+    try:
+        reset_facts()
+        command_runner.add_results([
+            command_runner.CommandResult(fact_cache.ovmf_functions.FIND_FV_COMMAND, 0,
+                                         str(fv_directory) + '\n', '', None),
+            command_runner.CommandResult(['virsh', '-V'], None, '', '', 'virsh: not found')])
+        cpuid_table.set_cpuid_table(cpuid_table.CpuidTable(
+            [0, 1], [0, 0], {0: [(1, 2, 3, 4)] + [None] * 5, 1: [(1, 2, 3, 4)] + [None] * 5}))
+        msr_reader.set_msr_reader(msr_reader.CachingMsrReader({(msr_reader.MSR_SYSCFG, 0): 1 << 23}))
+        host_probes.set_kernel_messages(["Linux version 6.8.0",
+                                         "AMD Memory Encryption Features active: SME"])
+        fact_cache.save_facts(cache_path)
+
+        reset_facts()
+        assert fact_cache.load_facts(cache_path), "valid cache not loaded"
+        results = command_runner.get_results()
+        assert results[tuple(fact_cache.ovmf_functions.FIND_FV_COMMAND)].stdout.strip() ==\
+            str(fv_directory)
+        # Commands that failed are run again
+        assert ('virsh', '-V') not in results
+        assert cpuid_table.get_cpuid_table().get(0x0, 'ecx', 1) == 3
+        assert msr_reader.get_msr_reader().read(msr_reader.MSR_SYSCFG, 0) == 1 << 23
+        assert host_probes.read_kernel_messages() == ["AMD Memory Encryption Features active: SME"]
+
+        # A new build in the scanned directory makes the cache stale
+        stat = os.stat(fv_directory)
+        os.utime(fv_directory, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        reset_facts()
+        assert not fact_cache.load_facts(cache_path), "stale cache loaded"
+        assert isinstance(msr_reader.get_msr_reader(), msr_reader.CachingMsrReader)
+    finally:
+        reset_facts()
+
+def test_fact_cache_other_boot(tmp_path):
+    '''
+    Testing facts cached in another boot or by another version are not loaded
+    '''
+    cache_path = tmp_path / 'facts.json'
+    try:
+        fact_cache.kernel_config.clear_cached_configs()
+        for facts in ({'version': fact_cache.CACHE_VERSION, 'boot_id': 'another boot',
+                       'sources': {},
+                       'kernel_configs': {'build-1': {'CONFIG_KVM_AMD_SEV': 'y'}}},
+                      {'version': 0, 'boot_id': host_probes.read_boot_id(), 'sources': {}}):
+            cache_path.write_text(json.dumps(facts), encoding='utf-8')
+            assert not fact_cache.load_facts(str(cache_path))
+        cache_path.write_text('not json', encoding='utf-8')
+        assert not fact_cache.load_facts(str(cache_path))
+        assert not fact_cache.load_facts(str(tmp_path / 'missing.json'))
+        # Kernel config options stay valid for their kernel build
+        assert fact_cache.kernel_config.get_cached_configs() ==\
+            {'build-1': {'CONFIG_KVM_AMD_SEV': 'y'}}
+    finally:
+        fact_cache.kernel_config.clear_cached_configs()
+        reset_facts()
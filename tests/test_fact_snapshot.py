@@ -0,0 +1,74 @@
+'''Testing for fact_snapshot functions'''
+import json
+from sev_component_test import fact_snapshot
+from sev_component_test import sev_emulator
+
+# Same modules the snapshots use
+host_probes = fact_snapshot.host_probes
+ioctl = fact_snapshot.ioctl
+command_runner = fact_snapshot.command_runner
+
+FEATURES = ['sev', 'sev-es', 'sev-snp']
+
+def test_snapshot_evaluation(tmp_path):
+    '''
+    Testing a snapshot evaluated offline gives the results of the run that took it
+    '''
+    snapshot_path = str(tmp_path / 'host.json')
+    read_os_release = host_probes.read_os_release
+    recorder = fact_snapshot.FactRecorder(
+        {'read_os_release': lambda: {'ID': 'ubuntu', 'VERSION_ID': '22.04'}})
+    try:
+        recorder.start()
+        live = fact_snapshot.sev_api.run_checks(
+            FEATURES, enablement=True, probes=recorder.probes,
+            device=ioctl.SevDevice(backend=sev_emulator.EmulatedSevBackend(guest_count=2)))
+        recorder.save(snapshot_path)
+    finally:
+        ioctl.set_sev_device(None)
+    # Recorded without changing the module
+    assert host_probes.read_os_release is read_os_release
+
+    snapshot = fact_snapshot.load_snapshot(snapshot_path)
+    assert snapshot['probes']['read_os_release']['[]']['value']['ID'] == 'ubuntu'
+    assert 'data' in snapshot['sev']['snp_platform_status']
+
+    (tmp_path / 'broken.json').write_text('{"version": 0}', encoding='utf-8')
+    evaluations = list(fact_snapshot.evaluate_snapshots(
+        fact_snapshot.find_snapshots([str(tmp_path)]), FEATURES, enablement=True, workers=1))
+    assert [evaluation['snapshot'] for evaluation in evaluations] == [
+        str(tmp_path / 'broken.json'), snapshot_path]
+    assert evaluations[0]['error']
+    assert evaluations[1]['features'] == live.features
+    assert [failure['component'] for failure in evaluations[1]['failures']] ==\
+        [result.component for result in live.get_failures()]
+
+    # Worker processes give the same evaluation
+    pooled = list(fact_snapshot.evaluate_snapshots([snapshot_path] * 3, FEATURES,
+                                                   enablement=True, workers=2))
+    assert [json.dumps(evaluation['features']) for evaluation in pooled] ==\
+        [json.dumps(live.features)] * 3
+
+def test_replay_snapshot_cpus():
+    '''
+    Testing replayed MSRs are checked on the cpus of the snapshot, not the local ones
+    '''
+    cpus = list(range(64))
+    reader = fact_snapshot.ReplayMsrReader(
+        {(fact_snapshot.msr_reader.MSR_SYSCFG, cpu): 1 << 23 for cpu in cpus}, {})
+    assert host_probes.get_online_cpus() != cpus
+    with host_probes.using_probes(host_probes.Probes({'get_online_cpus': lambda: cpus})):
+        matrix = reader.read_matrix([fact_snapshot.msr_reader.MSR_SYSCFG])
+    assert sorted(matrix) == cpus
+
+def test_offline_commands():
+    '''
+    Testing commands without a kept result are not run offline
+    '''
+    command_runner.set_offline(True)
+    try:
+        result = command_runner.run_command(['true'])
+    finally:
+        command_runner.set_offline(False)
+    assert result.returncode is None and 'offline' in result.error
+    assert ('true',) not in command_runner.get_results()
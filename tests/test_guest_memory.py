@@ -0,0 +1,175 @@
+'''Testing for guest_memory functions'''
+import ctypes
+import mmap
+import os
+import random
+import pytest
+from sev_component_test import guest_memory
+
+# Same module guest_memory reads the memory with
+memory_reader = guest_memory.memory_reader
+
+GIB = 1024 ** 3
+
+# Two NUMA nodes on hugetlbfs and memfd, a DIMM and -m with room for more
+NUMA_ARGV = [
+    'qemu-system-x86_64', '-enable-kvm', '-machine', 'q35,memory-encryption=sev0',
+    '-m', '4G,slots=4,maxmem=16G',
+    '-object', 'memory-backend-file,id=mem0,size=2G,mem-path=/dev/hugepages,share=on',
+    '-object', '{"qom-type": "memory-backend-memfd", "id": "mem1", "size": 2147483648}',
+    '-numa', 'node,nodeid=0,memdev=mem0', '-numa', 'node,nodeid=1,memdev=mem1',
+    '-object', 'memory-backend-ram,id=dimm0,size=1G',
+    '-device', 'pc-dimm,id=d0,memdev=dimm0', '-nographic']
+
+NUMA_MAPS = [
+    "55d0c0000000-55d0c0a00000 r-xp 00000000 08:01 1234 /usr/bin/qemu-system-x86_64",
+    # Padding QEMU reserves around a block to align it
+    "7f0000000000-7f0000200000 ---p 00000000 00:00 0",
+    "7f0000200000-7f0080200000 rw-s 00000000 00:0f 41 /dev/hugepages/qemu_back_mem.mem0.Xa1 (deleted)",
+    "7f0080200000-7f0080201000 ---p 00000000 00:00 0",
+    # Same size as mem1 but anonymous, not a memfd
+    "7f1000000000-7f1080000000 rw-p 00000000 00:00 0",
+    # mem1 split in two entries by an madvise on its first half
+    "7f2000000000-7f2040000000 rw-s 00000000 00:01 2050 /memfd:memory-backend-memfd (deleted)",
+    "7f2040000000-7f2080000000 rw-s 40000000 00:01 2050 /memfd:memory-backend-memfd (deleted)",
+    # dimm0, rounded up by 2 MiB
+    "7f3000000000-7f3040200000 rw-p 00000000 00:00 0",
+    "7ffd00000000-7ffd00021000 rw-p 00000000 00:00 0 [stack]",
+    ""]
+
+
+def test_parse_size():
+    '''
+    Testing QEMU sizes are parsed with their suffix or the default one
+    '''
+    assert guest_memory.parse_size('4G') == 4 * GIB
+    assert guest_memory.parse_size('2048', 'M') == 2 * GIB
+    assert guest_memory.parse_size('1.5k') == 1536
+    assert guest_memory.parse_size(4096) == 4096
+    with pytest.raises(ValueError):
+        guest_memory.parse_size('lots')
+    assert guest_memory.parse_options('node,memdev=m0,mem-path=/a,,b', 'type') ==\
+        {'type': 'node', 'memdev': 'm0', 'mem-path': '/a,b'}
+
+def test_get_memory_backends():
+    '''
+    Testing the RAM regions of a guest are read from its QEMU arguments
+    '''
+    assert guest_memory.get_memory_backends(NUMA_ARGV) == [
+        ('mem0', 'file', 2 * GIB, '/dev/hugepages'), ('mem1', 'memfd', 2 * GIB, None),
+        ('dimm0', 'ram', GIB, None)]
+    # Without backends the main RAM block is the only region
+    assert guest_memory.get_memory_backends(['qemu-kvm', '-m', '2048', '-smp', '4']) ==\
+        [('pc.ram', 'ram', 2 * GIB, None)]
+    assert guest_memory.get_memory_backends(['qemu-kvm', '--mem-path', '/hugepages']) ==\
+        [('pc.ram', 'file', 128 * 1024 ** 2, '/hugepages')]
+    assert guest_memory.get_memory_backends(
+        ['qemu', '-machine', 'q35,memory-backend=pc.ram', '-m', '1G',
+         '-object', 'memory-backend-memfd,id=pc.ram,size=1G']) == [('pc.ram', 'memfd', GIB, None)]
+
+def test_match_regions():
+    '''
+    Testing every backend is matched with a mapping of its size and kind
+    '''
+    entries = memory_reader.parse_maps(NUMA_MAPS)
+    guest = guest_memory.match_regions(entries, guest_memory.get_memory_backends(NUMA_ARGV))
+    assert [(region.name, region.start, region.end) for region in guest] == [
+        ('mem0', 0x7f0000200000, 0x7f0080200000), ('mem1', 0x7f2000000000, 0x7f2080000000),
+        ('dimm0', 0x7f3000000000, 0x7f3040000000)]
+    assert guest.size == 5 * GIB and not guest.missing
+    assert guest.find(0x7f2060000000).name == 'mem1'
+    assert guest.find(0x7f1000000000) is None
+    assert [region.name for region in guest.get_overlapping(0x7f0000000000, 0x7f2000000001)] ==\
+        ['mem0', 'mem1']
+    # A backend without a mapping is reported
+    guest = guest_memory.match_regions(
+        entries, [guest_memory.MemoryBackend('mem2', 'memfd', 4 * GIB, None)])
+    assert not guest and [backend.name for backend in guest.missing] == ['mem2']
+
+def test_region_nodes():
+    '''
+    Testing each region is placed on the host node holding most of its pages
+    '''
+    placement = guest_memory.parse_numa_maps(
+        "7f0000200000 bind:0 file=/dev/hugepages/qemu_back_mem.mem0.Xa1 huge dirty=700 N0=700 "
+        "kernelpagesize_kB=2048\n"
+        "7f2000000000 default file=/memfd:memory-backend-memfd\\040(deleted) dirty=20 N0=4 N1=16 "
+        "kernelpagesize_kB=4\n"
+        "7f2040000000 default file=/memfd:memory-backend-memfd\\040(deleted) dirty=90 N1=90 "
+        "kernelpagesize_kB=4\n"
+        "7f3000000000 default anon=0\n"
+        "7ffd00000000 default stack anon=3 dirty=3 N0=3 kernelpagesize_kB=4\n")
+    assert placement[0x7f0000200000] == {0: 700 * 2 * 1024 ** 2}
+    assert placement[0x7f2000000000] == {0: 4 * 4096, 1: 16 * 4096}
+    guest = guest_memory.match_regions(memory_reader.parse_maps(NUMA_MAPS),
+                                       guest_memory.get_memory_backends(NUMA_ARGV))
+    # The two mappings of mem1 are added up, dimm0 has no page yet
+    assert guest_memory.get_region_nodes(guest, placement) == {
+        'mem0': {0: 700 * 2 * 1024 ** 2}, 'mem1': {0: 4 * 4096, 1: 106 * 4096}, 'dimm0': {}}
+    guest.nodes = {'mem0': 0, 'mem1': 1}
+    shards = guest_memory.get_shards(guest, 3 * GIB // 2)
+    assert [(shard.region.name, shard.end - shard.start, shard.node) for shard in shards] == [
+        ('mem0', 3 * GIB // 2, 0), ('mem0', GIB // 2, 0), ('mem1', 3 * GIB // 2, 1),
+        ('mem1', GIB // 2, 1), ('dimm0', GIB, None)]
+
+def test_run_sharded():
+    '''
+    Testing shards run on the cpus of their node and the results keep the shard order
+    '''
+    region = guest_memory.GuestRegion('mem0', 0, 8 * 4096, '')
+    shards = [guest_memory.Shard(region, index * 4096, (index + 1) * 4096, index % 2 or None)
+              for index in range(8)]
+    results = guest_memory.run_sharded(shards, lambda shard: (shard.start, os.sched_getaffinity(0)))
+    assert [start for start, _ in results] == [shard.start for shard in shards]
+    for shard, (_, cpus) in zip(shards, results):
+        if shard.node is not None and guest_memory.read_node_cpus(shard.node):
+            assert cpus == guest_memory.read_node_cpus(shard.node)
+    # The caller keeps its own cpus
+    assert os.sched_getaffinity(0) == results[0][1]
+
+    def fail(shard):
+        raise OSError(f"can't read {shard.start:#x}")
+    with pytest.raises(OSError):
+        guest_memory.run_sharded(shards, fail)
+
+def test_scan_guest_memory():
+    '''
+    Testing two regions read in shards give the same residency and memory as one pass
+    '''
+    memory = mmap.mmap(-1, 32 * memory_reader.PAGE_SIZE)
+    base = ctypes.addressof(ctypes.c_char.from_buffer(memory))
+    touched = [0, 1, 2, 7, 16, 17, 30]
+    for index in touched:
+        memory[index * 4096:(index + 1) * 4096] = bytes([index]) * 4096
+    guest = guest_memory.GuestMemory([
+        guest_memory.GuestRegion('mem1', base + 16 * 4096, base + 32 * 4096, ''),
+        guest_memory.GuestRegion('mem0', base, base + 16 * 4096, '')])
+    guest_memory.locate_nodes(os.getpid(), guest)
+    residency = guest_memory.read_guest_residency(os.getpid(), guest, shard_size=5 * 4096)
+    assert [part.pages for part in residency.residencies] == [16, 16]
+    assert residency.get_resident_ranges() ==\
+        memory_reader.read_residency(os.getpid(), f"{base:x}", f"{base + 32 * 4096:x}")\
+        .get_resident_ranges()
+    # Sampled pages come from the resident pages of every region
+    sample = guest_memory.sample_guest_memory(os.getpid(), guest, 4, random.Random(1))
+    assert len(sample) == 4 * 4096
+    assert {sample[page * 4096] for page in range(4)} <= set(touched)
+
+    def scan(shard, chunks):
+        return b''.join(bytes(chunk) for chunk in chunks)
+    tracer = guest_memory.tracing.enable_tracing()
+    try:
+        scanned = guest_memory.scan_guest_memory(os.getpid(), guest, scan, shard_size=8 * 4096,
+                                                 chunk_size=2 * 4096)
+        # Every shard is traced, with the memory read in it
+        spans = tracer.get_spans()
+        assert [span.args['size'] for span in spans if span.category == 'shard'] == [8 * 4096] * 4
+        assert sum(span.args['bytes'] for span in spans if span.category == 'memory') ==\
+            len(touched) * 4096
+    finally:
+        guest_memory.tracing.disable_tracing()
+    assert [shard.region.name for shard, _ in scanned] == ['mem0', 'mem0', 'mem1', 'mem1']
+    assert b''.join(data for _, data in scanned) ==\
+        b''.join(bytes([index]) * 4096 for index in touched)
+    del scanned
+    memory.close()
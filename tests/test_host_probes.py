@@ -0,0 +1,55 @@
+'''Testing for host_probes functions'''
+from sev_component_test import host_probes
+
+def test_parse_os_release():
+    '''
+    Testing for parse_os_release
+    '''
+    test_os_release = (
+        '# comment line\n'
+        'NAME="Ubuntu"\n'
+        'VERSION_ID="22.04"\n'
+        'ID=ubuntu\n'
+        'ID_LIKE=debian\n'
+        '\n'
+        "PRETTY_NAME='Ubuntu 22.04 \"Jammy\"'\n")
+    fields = host_probes.parse_os_release(test_os_release)
+
+    assert fields['ID'] == 'ubuntu', "ID was not parsed correctly"
+    assert fields['VERSION_ID'] == '22.04', "Quoted VERSION_ID was not unquoted"
+    assert fields['PRETTY_NAME'] == 'Ubuntu 22.04 "Jammy"', "Single quoted value was not unquoted"
+    assert 'comment line' not in ' '.join(fields), "Comment line was parsed"
+
+def test_parse_cpuinfo_flags():
+    '''
+    Testing for parse_cpuinfo_flags
+    '''
+    test_cpuinfo = "processor\t: 0\nflags\t\t: fpu vme svm sme sev\nbugs\t\t: sysret_ss_attrs\n"
+
+    assert host_probes.parse_cpuinfo_flags(test_cpuinfo) == {'fpu', 'vme', 'svm', 'sme', 'sev'}
+    assert host_probes.parse_cpuinfo_flags("processor\t: 0\n") == set()
+
+def test_parse_cpu_list():
+    '''
+    Testing for parse_cpu_list
+    '''
+    assert host_probes.parse_cpu_list("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert host_probes.parse_cpu_list("0") == [0]
+
+def test_format_cpu_list():
+    '''
+    Testing for format_cpu_list
+    '''
+    assert host_probes.format_cpu_list([0, 1, 2, 3, 8, 10, 11]) == "0-3,8,10-11"
+    assert host_probes.format_cpu_list([5]) == "5"
+
+def test_parse_build_id():
+    '''
+    Testing for parse_build_id
+    '''
+    build_id = bytes(range(20))
+    notes = (b'\x06\x00\x00\x00\x04\x00\x00\x00\x01\x01\x00\x00Linux\x00\x00\x00\x00\x00\x00\x00'
+             b'\x04\x00\x00\x00\x14\x00\x00\x00\x03\x00\x00\x00GNU\x00' + build_id)
+
+    assert host_probes.parse_build_id(notes) == build_id.hex()
+    assert host_probes.parse_build_id(notes[:24]) is None
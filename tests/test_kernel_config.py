@@ -0,0 +1,63 @@
+'''Testing for kernel_config functions'''
+import gzip
+from sev_component_test import kernel_config
+
+# Same module the kernel config reader uses
+host_probes = kernel_config.host_probes
+
+CONFIG = ("#\n# Automatically generated file; DO NOT EDIT.\n#\n"
+          "CONFIG_AMD_MEM_ENCRYPT=y\n"
+          "CONFIG_KVM_AMD_SEV=y\n"
+          "CONFIG_CRYPTO_DEV_CCP_DD=m\n"
+          "CONFIG_CRYPTO_DEV_SP_PSP=y\n"
+          "# CONFIG_AMD_IOMMU is not set\n"
+          'CONFIG_LOCALVERSION="-sev"\n')
+
+def test_parse_config():
+    '''
+    Testing options are parsed and reading stops once they were all found
+    '''
+    lines = iter(CONFIG.splitlines())
+    assert kernel_config.parse_config(lines, ['CONFIG_KVM_AMD_SEV', 'CONFIG_AMD_MEM_ENCRYPT']) ==\
+        {'CONFIG_KVM_AMD_SEV': 'y', 'CONFIG_AMD_MEM_ENCRYPT': 'y'}
+    assert next(lines) == "CONFIG_CRYPTO_DEV_CCP_DD=m", "lines read after the last option"
+    assert kernel_config.parse_config(CONFIG.splitlines(),
+                                      ['CONFIG_AMD_IOMMU', 'CONFIG_LOCALVERSION', 'CONFIG_KVM']) ==\
+        {'CONFIG_AMD_IOMMU': 'n', 'CONFIG_LOCALVERSION': '-sev'}
+
+def test_kernel_config(tmp_path):
+    '''
+    Testing the config is read from /proc/config.gz or /boot and kept by kernel build ID
+    '''
+    proc_config = tmp_path / 'config.gz'
+    with gzip.open(proc_config, 'wt', encoding='utf-8') as config:
+        config.write(CONFIG)
+    boot_config = tmp_path / 'config-{release}'
+    saved = (kernel_config.PROC_CONFIG_PATH, kernel_config.BOOT_CONFIG_PATH,
+             host_probes.read_kernel_build_id)
+    try:
+        kernel_config.clear_cached_configs()
+        kernel_config.PROC_CONFIG_PATH = str(proc_config)
+        kernel_config.BOOT_CONFIG_PATH = str(boot_config)
+        host_probes.read_kernel_build_id = lambda: 'build-1'
+        assert kernel_config.get_kernel_config(kernel_config.REQUIRED_OPTIONS['SEV-SNP']) ==\
+            {'CONFIG_AMD_MEM_ENCRYPT': 'y', 'CONFIG_KVM_AMD_SEV': 'y',
+             'CONFIG_CRYPTO_DEV_CCP_DD': 'm', 'CONFIG_CRYPTO_DEV_SP_PSP': 'y',
+             'CONFIG_AMD_IOMMU': 'n'}
+
+        # The same kernel build is answered from memory
+        proc_config.unlink()
+        assert kernel_config.get_kernel_config(['CONFIG_AMD_MEM_ENCRYPT']) ==\
+            {'CONFIG_AMD_MEM_ENCRYPT': 'y'}
+        assert kernel_config.get_cached_configs()['build-1']['CONFIG_AMD_IOMMU'] == 'n'
+
+        # Another build reads the config in /boot when /proc has none
+        host_probes.read_kernel_build_id = lambda: 'build-2'
+        (tmp_path / f'config-{host_probes.get_kernel_release()}').write_text(
+            "CONFIG_AMD_MEM_ENCRYPT=y\n", encoding='utf-8')
+        assert kernel_config.get_kernel_config(['CONFIG_AMD_MEM_ENCRYPT', 'CONFIG_AMD_IOMMU']) ==\
+            {'CONFIG_AMD_MEM_ENCRYPT': 'y', 'CONFIG_AMD_IOMMU': None}
+    finally:
+        (kernel_config.PROC_CONFIG_PATH, kernel_config.BOOT_CONFIG_PATH,
+         host_probes.read_kernel_build_id) = saved
+        kernel_config.clear_cached_configs()
@@ -0,0 +1,126 @@
+'''Testing for kernel_log functions'''
+import socket
+from sev_component_test import change_watcher, kernel_log
+
+# Same module the kernel log reader uses
+host_probes = kernel_log.host_probes
+
+
+class SocketKernelLog(kernel_log.KernelLog):
+    '''
+    Kernel log reading records from a socket, one record per read like /dev/kmsg.
+    '''
+    def __init__(self, state_path = None):
+        super().__init__(state_path)
+        self.kmsg, self.writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.kmsg.setblocking(False)
+
+    def log(self, sequence:int, message:str):
+        '''
+        Log a record the way the kernel formats it.
+        '''
+        self.writer.send(f"3,{sequence},{sequence * 1000},-;{message}\n SUBSYSTEM=pci\n".encode())
+
+    def fileno(self):
+        return self.kmsg.fileno()
+
+    def close(self):
+        self.kmsg.close()
+        self.writer.close()
+
+
+def test_classify():
+    '''
+    Testing SEV, firmware, SNP and RMP kernel messages are classified
+    '''
+    assert kernel_log.classify("ccp 0000:22:00.1: SEV firmware update successful") ==\
+        ('sev', 'info')
+    assert kernel_log.classify("ccp 0000:22:00.1: sev command 0x1 timed out, disabling PSP") ==\
+        ('firmware', 'error')
+    assert kernel_log.classify("ccp 0000:22:00.1: SEV-SNP: failed to INIT rc -5, error 0x3") ==\
+        ('snp', 'error')
+    assert kernel_log.classify("SEV-SNP: RMP fault at gpa 0x1000, RMP entry: asid 5") ==\
+        ('rmp', 'error')
+    assert kernel_log.classify("AMD Memory Encryption Features active: SME") == ('sme', 'info')
+    assert kernel_log.classify("e1000e: eth0 NIC Link is Up") is None
+    assert kernel_log.parse_record(b"6,42,1500,-;ccp: SEV API:1.55\n DEVICE=+pci\n") ==\
+        (42, 1500, "ccp: SEV API:1.55")
+
+def test_kernel_log(tmp_path):
+    '''
+    Testing records are read once and a saved log continues after the last record read
+    '''
+    state_path = str(tmp_path / 'kernel-log.json')
+    log = SocketKernelLog(state_path)
+    try:
+        log.log(1, "Linux version 6.8.0")
+        log.log(2, "ccp 0000:22:00.1: SEV API:1.55 build:21")
+        assert [event.sequence for event in log.read_new()] == [2]
+        assert not log.read_new()
+        # Records lost to the ring buffer are counted
+        log.log(5, "ccp 0000:22:00.1: SEV-SNP: failed to INIT rc -5")
+        assert [event.category for event in log.get_events(severity='error')] == ['snp']
+        assert log.lost == 2
+        log.save()
+    finally:
+        log.close()
+
+    # Reading from the start of the ring again skips what the saved log already read
+    log = SocketKernelLog(state_path)
+    try:
+        assert log.sequence == 5
+        for sequence in range(1, 7):
+            log.log(sequence, "SEV: RMP fault at 0x1000")
+        assert [event.sequence for event in log.read_new()] == [6]
+        assert [event.sequence for event in log.get_events(('snp', 'rmp'))] == [5, 6]
+    finally:
+        log.close()
+
+    # A log saved in another boot is ignored
+    read_boot_id = host_probes.read_boot_id
+    try:
+        host_probes.read_boot_id = lambda: 'other boot'
+        log = SocketKernelLog(state_path)
+        log.close()
+        assert log.sequence == -1 and not log.events
+    finally:
+        host_probes.read_boot_id = read_boot_id
+
+def test_kernel_log_watch():
+    '''
+    Testing new SEV kernel messages wake the watcher, other messages don't
+    '''
+    log = SocketKernelLog()
+    watcher = change_watcher.ChangeWatcher([], settle_time=0.05, log=log)
+    try:
+        log.log(1, "e1000e: eth0 NIC Link is Up")
+        assert watcher.wait(0.1) == set()
+        log.log(2, "ccp 0000:22:00.1: sev command 0x1 timed out, disabling PSP")
+        assert watcher.wait(1.0) == {'kernel_log'}
+        assert [event.message for event in watcher.kernel_events] ==\
+            ["ccp 0000:22:00.1: sev command 0x1 timed out, disabling PSP"]
+        assert change_watcher.INPUT_CHECKS['kernel_log'] ==\
+            ('check_kernel_messages', 'find_tsme_enablement')
+    finally:
+        watcher.close()
+        log.close()
+
+def test_kernel_log_bounded():
+    '''
+    Testing a flood of messages in one category doesn't drop the boot messages
+    '''
+    boot_events, max_events = kernel_log.BOOT_EVENTS, kernel_log.MAX_EVENTS
+    log = SocketKernelLog()
+    try:
+        kernel_log.BOOT_EVENTS, kernel_log.MAX_EVENTS = 2, 3
+        log.log(1, "AMD Memory Encryption Features active: SME")
+        for sequence in range(2, 12):
+            log.log(sequence, "SEV-SNP: RMP fault at gpa 0x1000")
+        assert len(log.read_new()) == 11
+        assert [event.sequence for event in log.get_events(('sme',))] == [1]
+        # The first and the last RMP faults are kept
+        assert [event.sequence for event in log.get_events(('rmp',))] == [2, 3, 9, 10, 11]
+        assert [event.sequence for event in log.events] == [1, 2, 3, 9, 10, 11]
+    finally:
+        kernel_log.BOOT_EVENTS, kernel_log.MAX_EVENTS = boot_events, max_events
+        log.close()
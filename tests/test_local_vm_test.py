@@ -1,5 +1,6 @@
 '''Testing for local_vm_test functions'''
 from sev_component_test import local_vm_test
+from sev_component_test import guest_memory
 
 
 def test_create_vm_dictionary():
@@ -32,3 +33,46 @@ def test_find_virtual_machine():
     expected_pid = '5634'
 
     assert local_vm_test.find_virtual_machine(test_command,example_dictionary) == expected_pid
+
+def test_read_memory_for_testing_fallback():
+    '''
+    Testing the memory is read with dd when sampling it directly fails
+    '''
+    sample_memory = local_vm_test.sample_memory_for_testing
+    setup_memory = local_vm_test.setup_memory_for_testing
+    errors = [ValueError("no guest RAM found for VM 1234"), ProcessLookupError(3, "exited"),
+              OSError(5, "short read"), PermissionError(1, "denied")]
+    try:
+        local_vm_test.setup_memory_for_testing = lambda vm_command, pid: b'page'
+        for error in errors:
+            def fail(vm_command, pid, coverage=False, error=error):
+                raise error
+            local_vm_test.sample_memory_for_testing = fail
+            assert local_vm_test.read_memory_for_testing('qemu-kvm -m 2G', '1234', False) == b'page'
+        # Nothing could be read, the VM test fails instead of crashing
+        local_vm_test.setup_memory_for_testing = lambda vm_command, pid: None
+        assert local_vm_test.test_virtual_machine(
+            'qemu-kvm -m 2G', {'1234': 'qemu-kvm -m 2G'}, True) is False
+    finally:
+        local_vm_test.sample_memory_for_testing = sample_memory
+        local_vm_test.setup_memory_for_testing = setup_memory
+
+def test_find_ram_addresses():
+    '''
+    Testing the dd addresses come from the largest guest RAM region
+    '''
+    find_guest_ram = local_vm_test.guest_memory.find_guest_ram
+    regions = [guest_memory.GuestRegion('node0', 0x7f0000000000, 0x7f0040000000, ''),
+               guest_memory.GuestRegion('node1', 0x7f1000000000, 0x7f1080000000, '/dev/hugepages/vm')]
+    try:
+        local_vm_test.guest_memory.find_guest_ram = lambda pid, vm_command: guest_memory.GuestMemory(regions)
+        assert local_vm_test.find_ram_addresses('qemu-kvm -numa node,memdev=m1', '1234') == \
+            ('7f1000000000', '7f1080000000')
+        # No guest RAM found, nothing to read
+        def fail(pid, vm_command):
+            raise ValueError("no guest RAM found for VM 1234")
+        local_vm_test.guest_memory.find_guest_ram = fail
+        assert local_vm_test.find_ram_addresses('qemu-kvm', '1234') == ('', '')
+        assert local_vm_test.set_up_memory_for_printing('qemu-kvm', '1234') is None
+    finally:
+        local_vm_test.guest_memory.find_guest_ram = find_guest_ram
@@ -1,4 +1,10 @@
 '''Testing for memory_reader functions'''
+import ctypes
+import mmap
+import os
+import random
+import subprocess
+import pytest
 from sev_component_test import memory_reader
 
 def test_hex_to_decimal():
@@ -49,4 +55,200 @@ def test_get_memory_size():
     assert memory_reader.get_memory_size(test_string_3) == result_string_3,\
         "The correct amount of bytes was not retrieved from the test string"
     assert memory_reader.get_memory_size(test_string_4) == result_string_4,\
-        "The correct amount of bytes was not retrieved from the test string"
\ No newline at end of file
+        "The correct amount of bytes was not retrieved from the test string"
+def test_find_ram_in_maps():
+    '''
+    Testing for find_ram_in_maps
+    '''
+    maps_lines = [
+        "55d0c0000000-55d0c0001000 r--p 00000000 08:01 1234 /usr/bin/qemu-system-x86_64",
+        "7f0000000000-7f0080000000 rw-s 00000000 00:01 2050 /memfd:pc.ram (deleted)",
+        "7f0080000000-7f0080001000 rw-p 00000000 00:00 0",
+        ""
+    ]
+    assert memory_reader.find_ram_in_maps(maps_lines, str(2 * 1024 ** 3)) ==\
+        ("7f0000000000", "7f0080000000"), "guest RAM mapping not found"
+    assert memory_reader.find_ram_in_maps(maps_lines, str(4 * 1024 ** 3)) == ('', ''),\
+        "mapping found for a memory size not mapped"
+
+def get_pages(count:int):
+    '''
+    Get a buffer of count pages of random bytes and the address of every page
+    '''
+    memory = bytearray(os.urandom(count * memory_reader.PAGE_SIZE))
+    base = ctypes.addressof((ctypes.c_char * len(memory)).from_buffer(memory))
+    return memory, [base + index * memory_reader.PAGE_SIZE for index in range(count)]
+
+def test_process_memory():
+    '''
+    Testing scattered pages are read in order with process_vm_readv and with /proc/PID/mem
+    '''
+    memory, addresses = get_pages(8)
+    expected = memory[3 * 4096:4 * 4096] + memory[0:4096] + memory[6 * 4096:7 * 4096]
+    with memory_reader.ProcessMemory(os.getpid()) as process_memory:
+        assert process_memory.read_pages([addresses[3], addresses[0], addresses[6]]) == expected
+        process_memory.use_readv = False
+        buffer = bytearray(len(expected))
+        assert process_memory.read_pages([addresses[3], addresses[0], addresses[6]],
+                                         buffer=buffer) is buffer
+        assert buffer == expected
+        # Unmapped pages are reported
+        with pytest.raises(OSError):
+            process_memory.read_pages([addresses[0], 4096])
+
+def test_process_memory_exited():
+    '''
+    Testing a process that exited is never read, even if its PID is reused
+    '''
+    with subprocess.Popen(['sleep', '30']) as process:
+        process_memory = memory_reader.ProcessMemory(process.pid)
+        try:
+            process.kill()
+            process.wait()
+            with pytest.raises(ProcessLookupError):
+                process_memory.read_pages([0x400000])
+        finally:
+            process_memory.close()
+
+def test_read_residency():
+    '''
+    Testing only the pages a process touched are resident, sampled and scanned
+    '''
+    memory = mmap.mmap(-1, 16 * memory_reader.PAGE_SIZE)
+    base = ctypes.addressof(ctypes.c_char.from_buffer(memory))
+    touched = [1, 2, 3, 9, 15]
+    for index in touched:
+        memory[index * 4096:(index + 1) * 4096] = bytes([index]) * 4096
+    tracer = memory_reader.tracing.enable_tracing()
+    try:
+        residency = memory_reader.read_residency(os.getpid(), f"{base:x}",
+                                                 f"{base + 16 * 4096:x}")
+        # The pagemap read is traced
+        assert [span.args['pages'] for span in tracer.get_spans()
+                if span.category == 'pagemap'] == [16]
+    finally:
+        memory_reader.tracing.disable_tracing()
+
+    assert residency.get_resident_indexes() == touched
+    assert residency.get_resident_ranges() == [(base + 4096, 3 * 4096), (base + 9 * 4096, 4096),
+                                               (base + 15 * 4096, 4096)]
+    assert residency.get_coverage() == {'resident': 5 * 4096, 'swapped': 0,
+                                        'untouched': 11 * 4096}
+    # Sampled pages are resident, in address order
+    sample = memory_reader.sample_memory_pages(os.getpid(), residency, 3, random.Random(1))
+    indexes = [sample[page * 4096] for page in range(3)]
+    assert indexes == sorted(indexes) and set(indexes) <= set(touched)
+    assert memory_reader.read_resident_memory(os.getpid(), residency) ==\
+        b''.join(bytes([index]) * 4096 for index in touched)
+    # Mostly resident mappings are sampled without listing the resident pages
+    dense = memory_reader.Residency.from_states(0, bytes([memory_reader.PAGE_RESIDENT]) * 1000)
+    addresses = dense.sample(10, random.Random(2))
+    assert len(set(addresses)) == 10 and addresses == sorted(addresses)
+    # Only the pagemap entries of the candidate pages are read
+    tracer = memory_reader.tracing.enable_tracing()
+    try:
+        probed = memory_reader.probe_resident_pages(
+            os.getpid(), [(base + 8 * 4096, base + 16 * 4096), (base, base + 8 * 4096)], 4,
+            random.Random(5))
+        spans = [span for span in tracer.get_spans() if span.category == 'pagemap']
+    finally:
+        memory_reader.tracing.disable_tracing()
+    assert len(probed) == 4 and probed == sorted(probed)
+    assert {(address - base) // 4096 for address in probed} <= set(touched)
+    assert spans[0].args['bytes'] == spans[0].args['pages'] * 8 <= 16 * 8
+    # Too few resident pages among the attempts
+    assert len(memory_reader.probe_resident_pages(os.getpid(), [(base, base + 16 * 4096)], 4,
+                                                  random.Random(6), attempts=2)) <= 2
+
+def test_residency_set():
+    '''
+    Testing several mappings are sampled and covered as one
+    '''
+    resident, untouched = memory_reader.PAGE_RESIDENT, memory_reader.PAGE_UNTOUCHED
+    residency = memory_reader.ResidencySet([
+        memory_reader.Residency.from_states(0x200000, bytes([resident, untouched]) * 4),
+        memory_reader.Residency.from_states(0x100000, bytes([untouched, resident, resident])),
+        memory_reader.Residency.from_states(0x300000, bytes([untouched]) * 2)])
+    assert residency.pages == 13 and residency.count(resident) == 6
+    assert residency.get_resident_ranges()[:2] == [(0x101000, 2 * 4096), (0x200000, 4096)]
+    assert residency.get_coverage() == {'resident': 6 * 4096, 'swapped': 0,
+                                        'untouched': 7 * 4096}
+    # Every resident page of every mapping is picked once
+    assert residency.sample(10, random.Random(3)) ==\
+        [0x101000, 0x102000, 0x200000, 0x202000, 0x204000, 0x206000]
+    assert len(residency.sample(2, random.Random(4))) == 2
+    assert not memory_reader.ResidencySet([]).sample(4)
+
+def test_process_memory_traced():
+    '''
+    Testing direct memory reads are recorded as memory spans
+    '''
+    memory, addresses = get_pages(4)
+    tracer = memory_reader.tracing.enable_tracing()
+    try:
+        with memory_reader.ProcessMemory(os.getpid()) as process_memory:
+            assert process_memory.read_pages(addresses[1:3]) == memory[4096:3 * 4096]
+        spans = [span for span in tracer.get_spans() if span.category == 'memory']
+        assert len(spans) == 1 and spans[0].args['bytes'] == 2 * 4096
+        assert spans[0].args['ranges'] == 2
+    finally:
+        memory_reader.tracing.disable_tracing()
+
+class FakeStdin:
+    '''
+    Standard input that is or isn't a terminal
+    '''
+    def __init__(self, tty):
+        self.tty = tty
+
+    def isatty(self):
+        '''
+        Whether the input is a terminal
+        '''
+        return self.tty
+
+def test_get_sudo():
+    '''
+    Testing sudo only asks for a password at a terminal without a deadline
+    '''
+    stdin = memory_reader.sys.stdin
+    try:
+        memory_reader.sys.stdin = FakeStdin(True)
+        assert memory_reader.get_sudo() == 'sudo'
+        memory_reader.command_runner.set_deadline(0)
+        assert memory_reader.get_sudo() == 'sudo -n'
+        memory_reader.command_runner.set_deadline(None)
+        memory_reader.sys.stdin = FakeStdin(False)
+        assert memory_reader.get_sudo() == 'sudo -n'
+        memory_reader.sys.stdin = None
+        assert memory_reader.get_sudo() == 'sudo -n'
+    finally:
+        memory_reader.sys.stdin = stdin
+        memory_reader.command_runner.set_deadline(None)
+
+def test_residency_bitmaps():
+    '''
+    Testing the residency keeps one bit per page and finds runs across bytes
+    '''
+    resident, swapped, untouched = (memory_reader.PAGE_RESIDENT, memory_reader.PAGE_SWAPPED,
+                                    memory_reader.PAGE_UNTOUCHED)
+    states = bytes([untouched] * 3 + [resident] * 20 + [swapped, resident, untouched] * 3
+                   + [resident] * 6)
+    residency = memory_reader.Residency.from_states(0, states)
+    assert len(residency.resident) == len(residency.swapped) == (len(states) + 7) // 8
+    assert residency.get_resident_runs() == [(3, 23), (24, 25), (27, 28), (30, 31), (32, 38)]
+    assert residency.get_resident_indexes() == [index for index, state in enumerate(states)
+                                                if state == resident]
+    assert residency.count(resident) == 29 and residency.count(swapped) == 3
+    assert residency.count(untouched) == 6
+    # Joined mappings, whole bitmap bytes or not
+    for split in (16, 13):
+        joined = memory_reader.Residency.join(0, [
+            memory_reader.Residency.from_states(0, states[:split]),
+            memory_reader.Residency.from_states(split * 4096, states[split:])])
+        assert joined.pages == len(states)
+        assert joined.resident == residency.resident and joined.swapped == residency.swapped
+    # Sparse mappings are sampled from the runs
+    sample = residency.sample(5, random.Random(7))
+    assert len(sample) == 5 and all(residency.is_resident(address // 4096)
+                                    for address in sample)
@@ -0,0 +1,39 @@
+'''Testing for msr_reader functions'''
+from sev_component_test import msr_reader
+
+def test_group_cpus_by_value():
+    '''
+    Testing for group_cpus_by_value
+    '''
+    syscfg_enabled = 1 << 23 | 1 << 24
+    syscfg_disabled = 1 << 23
+    test_matrix = {0: (syscfg_enabled,), 1: (syscfg_enabled,), 2: (syscfg_disabled,)}
+
+    assert msr_reader.group_cpus_by_value(test_matrix, 0, 1 << 23) == {1 << 23: [0, 1, 2]},\
+        "SME bit should be the same on every cpu"
+    assert msr_reader.group_cpus_by_value(test_matrix, 0, 1 << 24) == {1 << 24: [0, 1], 0: [2]},\
+        "SNP bit should differ on cpu 2"
+
+class PartialMsrReader(msr_reader.MsrReader):
+    '''
+    MSR reader that can't read some cpus
+    '''
+    def read(self, msr:int, cpu:int = 0) -> int:
+        if cpu in (3, 5):
+            raise PermissionError(13, "Permission denied")
+        return 1 << 23
+
+def test_read_matrix_unread_cpus():
+    '''
+    Testing that cpus that can't be read are reported instead of left out
+    '''
+    try:
+        PartialMsrReader().read_matrix([msr_reader.MSR_SYSCFG], range(8))
+    except msr_reader.MsrReadError as err:
+        assert err.cpus == [3, 5]
+        assert sorted(err.matrix) == [0, 1, 2, 4, 6, 7]
+        assert err.errno == 13 and "cpus 3,5" in str(err)
+    else:
+        assert False, "unread cpus should raise MsrReadError"
+    assert PartialMsrReader().read_matrix([msr_reader.MSR_SYSCFG], [0, 1]) ==\
+        {0: (1 << 23,), 1: (1 << 23,)}
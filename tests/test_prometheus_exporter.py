@@ -0,0 +1,70 @@
+'''Testing for prometheus_exporter'''
+import os
+from sev_component_test import prometheus_exporter, sev_emulator
+from sev_component_test.check_results import CheckResult
+
+class FakeGroup:
+    '''
+    Group with the attributes the sinks use
+    '''
+    name = 'SEV COMPONENT TEST'
+    feature = 'SEV'
+
+def test_format_metrics():
+    '''
+    Testing the text exposition format
+    '''
+    family = prometheus_exporter.MetricFamily('sev_test', "Test metric.")
+    family.add(True, component='OVMF "path"\nC:\\')
+    family.add(2.5)
+    empty = prometheus_exporter.MetricFamily('sev_empty', "No samples.")
+    assert prometheus_exporter.format_metrics([family, empty]) == (
+        '# HELP sev_test Test metric.\n'
+        '# TYPE sev_test gauge\n'
+        'sev_test{component="OVMF \\"path\\"\\nC:\\\\"} 1\n'
+        'sev_test 2.5\n')
+
+def test_check_metrics():
+    '''
+    Testing that repeated components pass if any of them passed
+    '''
+    sink = prometheus_exporter.CheckMetricsSink()
+    for found, passed in (('old build', False), ('new build', True)):
+        sink.add_result(CheckResult.from_tuple(
+            ('OMVF path install', 'dpkg --list', found, '2018-07-06', passed), 0.5, 'SEV'))
+    sink.end_group(FakeGroup, True)
+    passed, timed_out, _, feature_passed, _ = prometheus_exporter.get_check_metrics(sink)
+    assert passed.samples == [({'feature': 'SEV', 'component': 'OMVF path install',
+                                'command': 'dpkg --list'}, True)]
+    assert timed_out.samples[0][1] is False
+    assert feature_passed.samples == [({'feature': 'SEV'}, True)]
+
+def test_platform_metrics(monkeypatch):
+    '''
+    Testing the ASID, firmware and TCB gauges with the emulated firmware
+    '''
+    monkeypatch.setattr(prometheus_exporter.component_tests, 'get_asid_counts', lambda: (400, 99))
+    backend = sev_emulator.EmulatedSevBackend(guest_count=3, reported_tcb=0x1a00000000000003)
+    device = prometheus_exporter.ioctl.SevDevice(backend=backend)
+    text = prometheus_exporter.format_metrics(prometheus_exporter.get_platform_metrics(device))
+    assert 'sev_asids{type="sev"} 400\n' in text
+    assert 'sev_guests 3\n' in text
+    assert 'sev_asids_free 496\n' in text
+    assert 'sev_firmware_info{api_version="1.55",build="21"} 1\n' in text
+    assert 'sev_snp_tcb{tcb="current",component="microcode"} 27\n' in text
+    assert 'sev_snp_tcb{tcb="reported",component="bootloader"} 3\n' in text
+    assert 'sev_snp_tcb_matches 0\n' in text
+
+def test_write_textfile(tmp_path):
+    '''
+    Testing that the textfile is replaced without leaving temporary files
+    '''
+    path = str(tmp_path / 'sev.prom')
+    family = prometheus_exporter.MetricFamily('sev_guests', "Guests.")
+    family.add(1)
+    prometheus_exporter.write_textfile(path, [family])
+    family.samples = [({}, 2)]
+    prometheus_exporter.write_textfile(path, [family])
+    with open(path, encoding='utf-8') as textfile:
+        assert textfile.read().endswith('sev_guests 2\n')
+    assert os.listdir(tmp_path) == ['sev.prom']
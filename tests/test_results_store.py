@@ -0,0 +1,97 @@
+'''Testing for results_store functions'''
+import threading
+from sev_component_test import sev_api
+from sev_component_test import check_results
+from sev_component_test import results_store
+from sev_component_test import sev_emulator
+
+CheckResult = check_results.CheckResult
+Status = check_results.Status
+# Same module the store uses
+ioctl = results_store.ioctl
+
+DAY = 86400
+
+def get_results(snp_passed:bool, duration:float) -> list:
+    '''
+    Results of a run with a TCB check
+    '''
+    return [CheckResult('Kernel version', 'uname -r', '6.8', '5.19', Status.PASS, 0.010, 'SEV'),
+            CheckResult(results_store.TCB_CHECK_COMPONENT, 'SNP_PLATFORM_STATUS', 'x', 'y',
+                        Status.PASS if snp_passed else Status.FAIL, duration, 'SEV-SNP')]
+
+def record(connection, host:str, started_at:float, snp_passed:bool = True,
+           duration:float = 0.002, tcb:int = 0x1b04):
+    '''
+    Record a run of one host
+    '''
+    return results_store.record_run(
+        connection, host, started_at, 0.5, get_results(snp_passed, duration),
+        {'SEV': True, 'SEV-SNP': snp_passed},
+        {'api_version': '1.55', 'firmware_build': 21, 'tcb_version': tcb, 'reported_tcb': 0x1b04},
+        {'1234': 8})
+
+def test_queries(tmp_path):
+    '''
+    Testing the fleet queries answer from the recorded runs
+    '''
+    connection = results_store.connect(str(tmp_path / 'results.db'))
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    record(connection, 'host-a', 10 * DAY, snp_passed=False)
+    record(connection, 'host-a', 20 * DAY, snp_passed=False, tcb=0x1a04)
+    record(connection, 'host-b', 5 * DAY, snp_passed=False, duration=0.003)
+    record(connection, 'host-b', 20 * DAY, duration=0.050)
+
+    failing = results_store.find_failing_hosts(connection, ['SEV-SNP'], 8 * DAY)
+    assert [(row['host'], row['failed_runs'], row['latest_status']) for row in failing] == [
+        ('host-a', 2, 'FAIL')]
+    assert len(results_store.find_failing_hosts(connection, ['SEV-SNP'], 0)) == 2
+
+    mismatches = results_store.find_tcb_mismatches(connection, 0)
+    assert [(row['host'], row['tcb_version']) for row in mismatches] == [('host-a', 0x1a04)]
+    assert [tuple(row) for row in results_store.get_tcb_versions(connection, 0)] == [
+        (0x1a04, 1), (0x1b04, 1)]
+
+    regressions = results_store.find_duration_regressions(connection, 15 * DAY)
+    assert [row['component'] for row in regressions] == [results_store.TCB_CHECK_COMPONENT]
+    assert connection.execute('SELECT COUNT(*) FROM vm_entropy WHERE encrypted').fetchone()[0] == 4
+    connection.close()
+
+def test_concurrent_writers(tmp_path):
+    '''
+    Testing runs written at the same time from several connections are all kept
+    '''
+    path = str(tmp_path / 'results.db')
+    results_store.connect(path).close()
+    def write_runs(host):
+        connection = results_store.connect(path)
+        for index in range(20):
+            record(connection, host, index)
+        connection.close()
+    threads = [threading.Thread(target=write_runs, args=(f'host-{index}',)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    connection = results_store.connect(path)
+    assert connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0] == 80
+    assert connection.execute('SELECT COUNT(*) FROM checks').fetchone()[0] == 160
+    connection.close()
+
+def test_results_store_sink(tmp_path):
+    '''
+    Testing the sink records a run with the platform versions
+    '''
+    path = str(tmp_path / 'results.db')
+    device = ioctl.SevDevice(backend=sev_emulator.EmulatedSevBackend(build=30))
+    sink = results_store.ResultsStoreSink(path, host='host-c')
+    run = sev_api.run_checks(
+        ['sev'], enablement=True, device=device,
+        probes={'read_os_release': lambda: {'ID': 'ubuntu', 'VERSION_ID': '22.04'}}, sinks=[sink])
+    sink.close()
+    ioctl.set_sev_device(None)
+    connection = results_store.connect(path)
+    row = connection.execute('SELECT host, passed, firmware_build FROM runs').fetchone()
+    assert tuple(row) == ('host-c', run.passed, 30)
+    assert connection.execute('SELECT COUNT(*) FROM checks').fetchone()[0] == len(run.results)
+    connection.close()
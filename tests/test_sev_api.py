@@ -0,0 +1,126 @@
+'''Testing for the sev_api functions'''
+import threading
+import pytest
+from sev_component_test import sev_api
+from sev_component_test import sev_emulator
+
+def run_with_probes(virtualization, config_value):
+    '''
+    Run the SEV and SNP checks with an emulated SEV device and probes answering
+    the given virtualization type and value for every kernel config option
+    '''
+    device = sev_api.ioctl.SevDevice(backend=sev_emulator.EmulatedSevBackend())
+    try:
+        return sev_api.run_checks(
+            features=['sev', 'sev-snp'], enablement=True, device=device,
+            probes={'read_os_release': lambda: {'ID': 'ubuntu', 'VERSION_ID': '22.04'},
+                    'get_virtualization_type': lambda: virtualization,
+                    'read_kernel_config': lambda names: {name: config_value for name in names},
+                    'read_kernel_events': lambda: []})
+    finally:
+        sev_api.ioctl.set_sev_device(None)
+
+def get_statuses(check_run, components) -> dict:
+    '''
+    Get the status of the first result of each component
+    '''
+    statuses = {}
+    for result in check_run.results:
+        if result.component in components:
+            statuses.setdefault(result.component, result.status)
+    return statuses
+
+def test_run_checks():
+    '''
+    Testing run_checks with replaced probes and an emulated SEV device
+    '''
+    original_probe = sev_api.host_probes.read_os_release
+    components = ('Virtualization capabilities', 'Kernel config SEV', 'Kernel config SEV-SNP',
+                  'Kernel Log SEV Errors', 'Current OS distribution')
+    check_run = run_with_probes(None, 'n')
+
+    assert list(check_run.features) == ['SYSTEM', 'SEV', 'SEV-ES', 'SEV-SNP'],\
+        "features not checked in order"
+    # The injected probes fail their checks, so the run fails
+    assert check_run.passed is False
+    assert check_run.features['SYSTEM'] is False and check_run.features['SEV'] is False
+    failures = {result.component for result in check_run.get_failures()}
+    assert {'Virtualization capabilities', 'Kernel config SEV', 'Kernel config SEV-SNP'} <= failures
+    assert get_statuses(check_run, components) == {
+        'Virtualization capabilities': sev_api.Status.FAIL, 'Kernel config SEV': sev_api.Status.FAIL,
+        'Kernel config SEV-SNP': sev_api.Status.FAIL, 'Kernel Log SEV Errors': sev_api.Status.PASS,
+        'Current OS distribution': sev_api.Status.PASS}
+    distribution = [result for result in check_run.results
+                    if result.component == 'Current OS distribution']
+    assert distribution[0].found == 'ubuntu 22.04', "os-release probe not replaced"
+    # The emulated firmware reports SEV as initialized
+    sev_init = [result for result in check_run.results if result.component == 'SEV PLATFORM STATE']
+    assert sev_init and sev_init[0].passed, "emulated device not used"
+
+    # The same checks pass with probes answering what SEV needs
+    check_run = run_with_probes('AMD-V', 'y')
+    assert not {'Virtualization capabilities', 'Kernel config SEV', 'Kernel config SEV-SNP'} &\
+        {result.component for result in check_run.get_failures()}
+    assert set(get_statuses(check_run, components).values()) == {sev_api.Status.PASS}
+
+    # The host_probes module was never changed
+    assert sev_api.host_probes.read_os_release is original_probe, "probe replaced in the module"
+    assert sev_api.host_probes.get_probes().read_os_release is original_probe
+
+def test_using_probes():
+    '''
+    Testing probes given to one thread are not seen by another thread
+    '''
+    probes = sev_api.host_probes.Probes({'get_kernel_release': lambda: 'injected'})
+    started, release = threading.Event(), threading.Event()
+    seen = []
+
+    def check():
+        with sev_api.host_probes.using_probes(probes):
+            started.set()
+            release.wait(5)
+            seen.append(sev_api.host_probes.get_probes().get_kernel_release())
+    thread = threading.Thread(target=check)
+    thread.start()
+    started.wait(5)
+    assert sev_api.host_probes.get_probes().get_kernel_release() != 'injected'
+    release.set()
+    thread.join()
+    assert seen == ['injected']
+    assert probes.path_exists('/') is True
+    with pytest.raises(ValueError):
+        sev_api.host_probes.Probes({'Probes': lambda: None})
+
+def test_run_checks_errors():
+    '''
+    Testing run_checks with unknown features and probes
+    '''
+    with pytest.raises(ValueError):
+        sev_api.run_checks(features=['tdx'])
+    with pytest.raises(ValueError):
+        sev_api.run_checks(probes={'read_everything': lambda: None})
+
+def test_package_run_checks():
+    '''
+    Testing run_checks is available from the package
+    '''
+    import sev_component_test # pylint: disable=import-outside-toplevel
+    assert callable(sev_component_test.run_checks)
+    with pytest.raises(AttributeError):
+        sev_component_test.not_an_api_name # pylint: disable=pointless-statement
+
+def test_package_colliding_modules():
+    '''
+    Testing the package refuses to mix in a program's module of the same name
+    '''
+    import sys # pylint: disable=import-outside-toplevel
+    import types # pylint: disable=import-outside-toplevel
+    import sev_component_test # pylint: disable=import-outside-toplevel
+    tracing = sys.modules['tracing']
+    try:
+        sys.modules['tracing'] = types.ModuleType('tracing')
+        with pytest.raises(ImportError, match='tracing'):
+            sev_component_test.run_checks # pylint: disable=pointless-statement
+    finally:
+        sys.modules['tracing'] = tracing
+    assert callable(sev_component_test.run_checks)
@@ -0,0 +1,33 @@
+'''Testing for sev_benchmark functions'''
+from sev_component_test import sev_benchmark
+
+def test_latency_histogram():
+    '''
+    Testing LatencyHistogram percentiles
+    '''
+    histogram = sev_benchmark.LatencyHistogram()
+    for value in range(1, 1001):
+        histogram.record(value * 1000)
+
+    assert histogram.total_count == 1000
+    assert histogram.min_value == 1000
+    assert histogram.percentile(100) == 1000000
+    # Buckets keep about 1% precision
+    assert abs(histogram.percentile(50) - 500000) <= 500000 * 0.02
+    assert abs(histogram.percentile(99) - 990000) <= 990000 * 0.02
+
+def test_latency_histogram_merge():
+    '''
+    Testing LatencyHistogram merge
+    '''
+    first = sev_benchmark.LatencyHistogram()
+    second = sev_benchmark.LatencyHistogram()
+    for value in range(100):
+        first.record(value)
+        second.record(value + 100)
+    first.merge(second)
+
+    assert first.total_count == 200
+    assert first.min_value == 0
+    assert first.max_value == 199
+    assert first.percentile(50) == 99
@@ -0,0 +1,68 @@
+'''Testing the SEV checks against the emulated /dev/sev'''
+import errno
+from sev_component_test import sev_emulator, component_tests, snp_component_tests
+
+def teardown_function():
+    '''
+    Go back to the real device after every test
+    '''
+    sev_emulator.ioctl.set_sev_device(None)
+
+def test_sev_checks_with_emulator():
+    '''
+    Testing SEV and SNP status checks against a healthy emulated platform
+    '''
+    backend = sev_emulator.install_emulated_device(state=2, api_major=1, api_minor=55)
+
+    assert component_tests.check_if_sev_init()[2] == "2 (WORKING)"
+    assert component_tests.check_if_sev_init()[4]
+    assert snp_component_tests.check_fw_version_for_snp()[2] == "1.55"
+    assert snp_component_tests.check_snp_init()[4]
+    assert snp_component_tests.check_rmp_init()[4]
+    assert snp_component_tests.compare_tcb_versions()[4]
+    # Status commands only reach the firmware once
+    assert backend.command_counts == {
+        sev_emulator.ioctl.SEVCommand.SEV_PLATFORM_STATUS: 1,
+        sev_emulator.ioctl.SEVCommand.SNP_PLATFORM_STATUS: 1}
+
+def test_sev_checks_with_failures():
+    '''
+    Testing SEV and SNP checks against a misconfigured emulated platform
+    '''
+    sev_emulator.install_emulated_device(
+        state=0, reported_tcb=0x1, api_minor=49,
+        errors={sev_emulator.ioctl.SEVCommand.SNP_PLATFORM_STATUS:
+                sev_emulator.SEV_RET_INVALID_PLATFORM_STATE})
+
+    assert component_tests.check_if_sev_init()[2] == "0 (UNINIT)"
+    assert not snp_component_tests.check_fw_version_for_snp()[4]
+    assert snp_component_tests.check_snp_init()[2] == "IOCTL FAILED"
+
+def test_emulated_device_missing():
+    '''
+    Testing the checks when /dev/sev does not exist
+    '''
+    sev_emulator.install_emulated_device(open_error=errno.ENOENT)
+
+    assert component_tests.check_if_sev_init()[2] == "IOCTL FAILED"
+
+def test_emulated_get_id2():
+    '''
+    Testing SEV_GET_ID2 with a chip id bigger than the default buffer
+    '''
+    chip_id = bytes(range(80))
+    backend = sev_emulator.EmulatedSevBackend(chip_id=chip_id)
+    device = sev_emulator.ioctl.SevDevice(backend=backend)
+
+    assert device.get_id2() == chip_id
+    assert [timing[2] for timing in device.timings] == [sev_emulator.SEV_RET_INVALID_LEN, 0]
+
+def test_device_timings_bounded():
+    '''
+    Testing only the time of the last commands is kept
+    '''
+    device = sev_emulator.ioctl.SevDevice(backend=sev_emulator.EmulatedSevBackend())
+    for _ in range(sev_emulator.ioctl.MAX_TIMINGS + 10):
+        device.platform_status(refresh=True)
+    assert len(device.timings) == sev_emulator.ioctl.MAX_TIMINGS
+    device.close()
@@ -0,0 +1,45 @@
+'''Testing for tracing'''
+from sev_component_test import tracing
+
+def teardown_function():
+    '''
+    Turn tracing off between tests
+    '''
+    tracing.disable_tracing()
+
+def test_span_disabled():
+    '''
+    Testing that spans do nothing when tracing is off
+    '''
+    with tracing.span('rdmsr 0xc0010010', 'msr') as msr_span:
+        msr_span.set('bytes', 8)
+    assert tracing.get_tracer() is None
+
+def test_trace_and_summary(tmp_path, capsys):
+    '''
+    Testing recorded spans, the Chrome trace and the summary
+    '''
+    tracer = tracing.enable_tracing()
+    with tracing.span('check_kernel SEV', 'check'):
+        with tracing.span('rdmsr 0xc0010010', 'msr', cpu=0, bytes=8):
+            pass
+        with tracing.span('rdmsr 0xc0010010', 'msr', cpu=1, bytes=8):
+            pass
+    with tracing.span('echo', 'phase', overlapping=True):
+        tracing.run(['echo', 'hello'], capture_output=True, check=True)
+
+    rows = tracing.summarize(tracer)
+    msr_row = [row for row in rows if row[0] == 'msr'][0]
+    assert msr_row[2] == 2 and msr_row[5] == 16
+    assert [row for row in rows if row[1] == 'echo hello'][0][5] == 6
+
+    trace = tracing.get_chrome_trace(tracer)
+    phases = sorted(event['ph'] for event in trace['traceEvents'])
+    assert phases == ['X', 'X', 'X', 'X', 'b', 'e']
+    tracing.write_chrome_trace(str(tmp_path / 'trace.json'))
+    assert (tmp_path / 'trace.json').stat().st_size > 0
+
+    tracing.print_summary(top=3)
+    output = capsys.readouterr().out
+    assert '1 processes started' in output
+    assert 'check_kernel SEV' in output